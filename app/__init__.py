@@ -13,27 +13,75 @@ login_manager.login_view = 'login'
 # Create and configure the app
 app = Flask(__name__)
 
-# Configure the SQLite database
+# Configure the database (SQLite in the instance folder unless DATABASE_URL is set)
 app.config['SECRET_KEY'] = 'your-secret-key'  # Change this in production
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///forest_assessment.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///forest_assessment.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # Configure upload folder
 app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'static', 'uploads')
 
+# Processing pipeline: optional JSON ProcessingConfig (e.g. from calibration) and
+# the directory where per-assessment intermediates are cached for reprocessing
+app.config['PROCESSING_CONFIG'] = os.environ.get('PROCESSING_CONFIG')
+app.config['INTERMEDIATES_FOLDER'] = os.path.join(app.instance_path, 'intermediates')
+
+# Result label maps: 'png' (palettized) or 'webp' (lossless), and the PNG zlib level (0-9)
+app.config['RESULT_FORMAT'] = os.environ.get('RESULT_FORMAT', 'png')
+app.config['RESULT_COMPRESSION'] = int(os.environ.get('RESULT_COMPRESSION', '6'))
+
+# Media offload in production: X-Sendfile (Apache/lighttpd) or an nginx internal
+# location prefix for X-Accel-Redirect, so workers never stream image bytes
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
+app.config['MEDIA_X_ACCEL_PREFIX'] = os.environ.get('MEDIA_X_ACCEL_PREFIX')
+
+# JSON API: background processing threads, directories whose files clients may
+# submit by reference (os.pathsep-separated), and the largest batch accepted
+app.config['PROCESSING_WORKERS'] = int(os.environ.get('PROCESSING_WORKERS', '2'))
+# Worker processes for segmentation (frames handed over in shared memory); 0 runs it in-thread
+app.config['PROCESSING_PROCESSES'] = int(os.environ.get('PROCESSING_PROCESSES', '0'))
+# Memory the running jobs may hold together, in MB (estimated from image headers);
+# unset uses half of physical memory
+app.config['PROCESSING_MEMORY_BUDGET'] = int(os.environ.get('PROCESSING_MEMORY_BUDGET_MB', '0')) * 1024 * 1024 or None
+# Start the processing threads/processes at launch, each warmed on a synthetic
+# WIDTHxHEIGHT pair (set it to the usual capture size so pooled buffers fit)
+app.config['PROCESSING_PREFORK'] = os.environ.get('PROCESSING_PREFORK') == '1'
+app.config['PROCESSING_WARM_SIZE'] = os.environ.get('PROCESSING_WARM_SIZE', '1024x1024')
+app.config['API_IMPORT_ROOTS'] = [p for p in os.environ.get('API_IMPORT_ROOTS', '').split(os.pathsep) if p]
+app.config['API_BATCH_LIMIT'] = int(os.environ.get('API_BATCH_LIMIT', '100'))
+
+# Processes rendering DOCX/PDF reports (0 uses one per CPU)
+app.config['REPORT_PROCESSES'] = int(os.environ.get('REPORT_PROCESSES', '0'))
+
+# Seconds between background artifact GC passes (0 disables; see gc_artifacts.py for cron use)
+app.config['ARTIFACT_GC_INTERVAL'] = int(os.environ.get('ARTIFACT_GC_INTERVAL', '600'))
+
+# Rendered page cache: entries kept in memory per process, and an optional
+# directory shared by all processes (unset keeps the cache in memory only)
+app.config['PAGE_CACHE_SIZE'] = int(os.environ.get('PAGE_CACHE_SIZE', '256'))
+app.config['PAGE_CACHE_FOLDER'] = os.environ.get('PAGE_CACHE_FOLDER')
+
 # Initialize extensions with the app
 db.init_app(app)
 login_manager.init_app(app)
+from app.utils.page_cache import page_cache
+page_cache.init_app(app)
 
 # Create uploads directory if it doesn't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 # Import models to ensure they are registered with SQLAlchemy
-from app.models import User, Assessment
+from app.models import User, Assessment, DamagePatch, Capture, CaptureChange, Artifact, IdempotencyKey
 
 # Import routes
 from app import routes
 
+# JSON API and its background processing queue
+from app.api import api_bp
+from app.utils.jobs import JobQueue
+job_queue = JobQueue(app)
+app.register_blueprint(api_bp, url_prefix='/api')
+
 def create_app():
     # Import and register blueprints
     from app.routes.main import main_bp
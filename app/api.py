@@ -0,0 +1,491 @@
+"""
+JSON API for programmatic clients (e.g. the drone pipeline).
+
+Authentication is a session cookie or HTTP Basic (email:password). POST
+requests may carry an Idempotency-Key header: the first response is stored
+and replayed for retries with the same key, so a retried submission never
+creates a second assessment or job.
+
+    POST /api/assessments                   create {name, location, description, regions}
+    PUT  /api/assessments/<id>/regions      set ROI/exclusion polygons {roi, exclude} (null clears)
+    PUT  /api/assessments/<id>/georef       set the map transform {geotransform | world_file, epsg} (null clears)
+    POST /api/assessments/<id>/images       multipart pre_image/post_image, or JSON {pre_path, post_path}
+    POST /api/assessments/<id>/process      enqueue processing (JSON body: parameter overrides)
+    GET  /api/assessments/<id>?wait=30      status and results; long-polls while the job is pending
+    POST /api/batch                         create, attach and enqueue many pairs in one transaction
+    GET  /api/metrics                       buffer pool metrics of the processing workers, page cache hits
+    GET  /api/queue                         scheduler budgets and per-user queue wait times
+    GET  /api/grid/summary?bbox=...         damaged/vegetation hectares inside a map box, all assessments
+    GET  /api/grid/cells?bbox=...&level=N   grid cells with their damage index, as GeoJSON
+"""
+import json
+import os
+import time
+from functools import wraps
+
+from flask import Blueprint, current_app, jsonify, make_response, request, url_for
+from flask_login import current_user
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+
+from app import db
+from app.models import Assessment, IdempotencyKey, User
+from app.utils.artifacts import register_artifact, release_artifacts
+from app.utils.buffer_pool import pool_metrics
+from app.utils.georef import parse_georef
+from app.utils.grid_summary import (
+    DEFAULT_MAX_CELLS, LEVELS, cells_in_bbox, cells_to_geojson, choose_level, grid_update, summarize_bbox,
+)
+from app.utils.jobs import JOB_DONE, PENDING_STATES, frame_pool, mark_queued, refresh_grid
+from app.utils.media import copy_atomically, file_sha256, save_atomically
+from app.utils.page_cache import page_cache
+from app.utils.regions import parse_regions
+
+api_bp = Blueprint('api', __name__)
+
+# Longest accepted ?wait= for long-polling, in seconds
+MAX_WAIT = 60
+# Re-check interval while long-polling, for jobs finishing in another process
+POLL_INTERVAL = 1.0
+DEFAULT_BATCH_LIMIT = 100
+
+
+class ApiError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+@api_bp.errorhandler(ApiError)
+def handle_api_error(error):
+    return jsonify({'error': error.message}), error.status_code
+
+
+def api_login_required(view):
+    """Like login_required, but answers 401 JSON instead of redirecting to the login page."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            response = jsonify({'error': 'Authentication required'})
+            response.status_code = 401
+            response.headers['WWW-Authenticate'] = 'Basic realm="forest-assessment"'
+            return response
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def idempotent(view):
+    """
+    Replay the stored response of a request repeated with the same Idempotency-Key.
+
+    The key is reserved before the view runs, so a concurrent retry gets 409
+    instead of doing the work twice. Only successful responses are stored; a
+    failed request releases its key and can be retried.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+
+        record = IdempotencyKey(user_id=current_user.id, key=key[:255], endpoint=request.endpoint,
+                                status_code=0, response='')
+        db.session.add(record)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            stored = IdempotencyKey.query.filter_by(user_id=current_user.id, key=key[:255]).first()
+            if stored is None or stored.status_code == 0:
+                raise ApiError('A request with this Idempotency-Key is still in progress', 409)
+            if stored.endpoint != request.endpoint:
+                raise ApiError('Idempotency-Key was already used for a different request', 422)
+            response = make_response(stored.response, stored.status_code)
+            response.mimetype = 'application/json'
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except BaseException:
+            db.session.rollback()
+            db.session.delete(record)
+            db.session.commit()
+            raise
+        if 200 <= response.status_code < 300:
+            record.status_code = response.status_code
+            record.response = response.get_data(as_text=True)
+        else:
+            db.session.delete(record)
+        db.session.commit()
+        return response
+    return wrapper
+
+
+def _get_owned_assessment(assessment_id):
+    assessment = db.session.get(Assessment, assessment_id)
+    if assessment is None or assessment.user_id != current_user.id:
+        raise ApiError('Assessment not found', 404)
+    return assessment
+
+
+def _media(stored_path):
+    from app.routes import media_url
+    return media_url(stored_path) if stored_path else None
+
+
+def assessment_to_dict(assessment):
+    job = assessment.job or {}
+    if job.get('status'):
+        status = job['status']
+    elif assessment.processed:
+        status = JOB_DONE
+    elif assessment.pre_image and assessment.post_image:
+        status = 'uploaded'
+    else:
+        status = 'created'
+    data = {
+        'id': assessment.id,
+        'name': assessment.name,
+        'location': assessment.location,
+        'description': assessment.description,
+        'status': status,
+        'error': job.get('error'),
+        'created_at': assessment.created_at.isoformat() if assessment.created_at else None,
+        'url': url_for('api.get_assessment', assessment_id=assessment.id),
+        'images': {
+            'pre': _media(assessment.pre_image),
+            'post': _media(assessment.post_image),
+        },
+        'regions': assessment.regions,
+        'georef': assessment.georef,
+        'results': None,
+    }
+    if assessment.processed and status == JOB_DONE:
+        data['results'] = {
+            'forest_area_before': assessment.forest_area_before,
+            'forest_area_after': assessment.forest_area_after,
+            'damage_percentage': assessment.damage_percentage,
+            'class_statistics': assessment.class_statistics,
+            'damage_patches': assessment.damage_patches.count(),
+            'processed_date': assessment.processed_date.isoformat() if assessment.processed_date else None,
+            'processing_config': assessment.processing_config,
+            'label_maps': {
+                'pre': _media(assessment.pre_vis_path),
+                'post': _media(assessment.post_vis_path),
+                'change': _media(assessment.change_vis_path),
+            },
+            'damage_patches_url': url_for('assessment_patches', assessment_id=assessment.id),
+        }
+    return data
+
+
+def _import_roots():
+    return [os.path.realpath(root) for root in current_app.config.get('API_IMPORT_ROOTS') or []]
+
+
+def _import_by_reference(source, target):
+    """Copy a server-local file into the upload folder."""
+    source = os.path.realpath(source)
+    if not any(source.startswith(root + os.sep) for root in _import_roots()):
+        raise ApiError(f"Path is not under an allowed import root: {source}", 403)
+    if not os.path.isfile(source):
+        raise ApiError(f"File not found: {source}", 400)
+    copy_atomically(source, target)
+
+
+def _store_image(assessment, role, upload=None, source_path=None, written=None):
+    """Save one image of the pair (uploaded file or by-reference path); returns its absolute path."""
+    name = upload.filename if upload is not None else os.path.basename(source_path or '')
+    if not name:
+        raise ApiError(f"Missing {role} image", 400)
+    filename = secure_filename(f"{role}_{assessment.id}_{name}")
+    path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+    if upload is not None:
+        save_atomically(path, upload.save)
+    else:
+        _import_by_reference(source_path, path)
+    if written is not None:
+        written.append(path)
+    return path
+
+
+def _attach_pair(assessment, pre, post, written=None):
+    """
+    Store the pre/post pair of an assessment. `pre`/`post` are uploaded files or
+    by-reference paths. Caller commits.
+    """
+    paths = []
+    for role, item in (('pre', pre), ('post', post)):
+        if isinstance(item, str):
+            paths.append(_store_image(assessment, role, source_path=item, written=written))
+        else:
+            paths.append(_store_image(assessment, role, upload=item, written=written))
+    pre_path, post_path = paths
+    assessment.pre_image = 'uploads/' + os.path.basename(pre_path)
+    assessment.post_image = 'uploads/' + os.path.basename(post_path)
+    for path in paths:
+        register_artifact(path, 'upload', assessment.id, sha256=file_sha256(path))
+    release_artifacts(assessment.id, kinds=('upload',), keep_paths=paths)
+
+
+def _new_assessment(item):
+    if not item.get('name') or not item.get('location'):
+        raise ApiError('name and location are required', 400)
+    assessment = Assessment(
+        name=item['name'],
+        location=item['location'],
+        description=item.get('description'),
+        user_id=current_user.id
+    )
+    if item.get('regions'):
+        assessment.regions = _regions(item['regions'])
+    if item.get('georef'):
+        assessment.georef = _georef(item['georef'])
+    db.session.add(assessment)
+    return assessment
+
+
+def _regions(value):
+    try:
+        return parse_regions(value)
+    except ValueError as e:
+        raise ApiError(str(e), 400)
+
+
+def _georef(value):
+    try:
+        return parse_georef(value)
+    except ValueError as e:
+        raise ApiError(str(e), 400)
+
+
+def _bbox():
+    try:
+        min_x, min_y, max_x, max_y = (float(v) for v in request.args['bbox'].split(','))
+    except (KeyError, ValueError):
+        raise ApiError('bbox must be min_x,min_y,max_x,max_y in map coordinates', 400)
+    if max_x <= min_x or max_y <= min_y:
+        raise ApiError('bbox is empty', 400)
+    return min_x, min_y, max_x, max_y
+
+
+def _int_arg(name, default):
+    try:
+        return int(request.args.get(name, default))
+    except ValueError:
+        raise ApiError(f"{name} must be an integer", 400)
+
+
+def _overrides(value):
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise ApiError('Parameter overrides must be a JSON object', 400)
+    return value
+
+
+def _submit(assessment_ids):
+    queue = current_app.extensions['job_queue']
+    for assessment_id in assessment_ids:
+        queue.submit(assessment_id)
+
+
+@api_bp.route('/assessments', methods=['POST'])
+@api_login_required
+@idempotent
+def create_assessment():
+    assessment = _new_assessment(request.get_json(silent=True) or request.form)
+    db.session.commit()
+    response = jsonify(assessment_to_dict(assessment))
+    response.status_code = 201
+    response.headers['Location'] = url_for('api.get_assessment', assessment_id=assessment.id)
+    return response
+
+
+@api_bp.route('/assessments/<int:assessment_id>/images', methods=['POST'])
+@api_login_required
+@idempotent
+def upload_images(assessment_id):
+    assessment = _get_owned_assessment(assessment_id)
+    if (assessment.job or {}).get('status') in PENDING_STATES:
+        raise ApiError('Assessment is being processed', 409)
+    os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
+    if request.files:
+        pre, post = request.files.get('pre_image'), request.files.get('post_image')
+    else:
+        body = request.get_json(silent=True) or {}
+        pre, post = body.get('pre_path'), body.get('post_path')
+    if not pre or not post:
+        raise ApiError('Both pre and post images are required', 400)
+    _attach_pair(assessment, pre, post)
+    db.session.commit()
+    return jsonify(assessment_to_dict(assessment))
+
+
+@api_bp.route('/assessments/<int:assessment_id>/regions', methods=['PUT'])
+@api_login_required
+def set_regions(assessment_id):
+    """Replace the assessment's ROI/exclusion polygons; they apply from the next processing run."""
+    assessment = _get_owned_assessment(assessment_id)
+    if (assessment.job or {}).get('status') in PENDING_STATES:
+        raise ApiError('Assessment is being processed', 409)
+    assessment.regions = _regions(request.get_json(silent=True))
+    db.session.commit()
+    return jsonify(assessment_to_dict(assessment))
+
+
+@api_bp.route('/assessments/<int:assessment_id>/georef', methods=['PUT'])
+@api_login_required
+def set_georef(assessment_id):
+    """Replace the assessment's map transform; processed results move to the new cells of the site grid."""
+    assessment = _get_owned_assessment(assessment_id)
+    if (assessment.job or {}).get('status') in PENDING_STATES:
+        raise ApiError('Assessment is being processed', 409)
+    assessment.georef = _georef(request.get_json(silent=True))
+    with grid_update():
+        if assessment.processed:
+            refresh_grid(assessment)
+    return jsonify(assessment_to_dict(assessment))
+
+
+@api_bp.route('/assessments/<int:assessment_id>/process', methods=['POST'])
+@api_login_required
+@idempotent
+def process_assessment(assessment_id):
+    assessment = _get_owned_assessment(assessment_id)
+    if not assessment.pre_image or not assessment.post_image:
+        raise ApiError('Upload both pre and post images first', 409)
+    if (assessment.job or {}).get('status') not in PENDING_STATES:
+        mark_queued(assessment, _overrides(request.get_json(silent=True)))
+        db.session.commit()
+        _submit([assessment.id])
+    response = jsonify(assessment_to_dict(assessment))
+    response.status_code = 202
+    response.headers['Location'] = url_for('api.get_assessment', assessment_id=assessment.id)
+    return response
+
+
+@api_bp.route('/assessments/<int:assessment_id>', methods=['GET'])
+@api_login_required
+def get_assessment(assessment_id):
+    """Assessment status and results; with ?wait=N, waits up to N seconds for a pending job."""
+    assessment = _get_owned_assessment(assessment_id)
+    try:
+        wait = min(float(request.args.get('wait', 0)), MAX_WAIT)
+    except ValueError:
+        raise ApiError('wait must be a number of seconds', 400)
+    deadline = time.monotonic() + wait
+    queue = current_app.extensions['job_queue']
+    while (assessment.job or {}).get('status') in PENDING_STATES:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        queue.wait(min(remaining, POLL_INTERVAL))
+        db.session.refresh(assessment)
+    return jsonify(assessment_to_dict(assessment))
+
+
+@api_bp.route('/batch', methods=['POST'])
+@api_login_required
+@idempotent
+def batch_submit():
+    """
+    Create assessments for many image pairs and enqueue them, all in one transaction.
+
+    JSON body: {"items": [{name, location, description, pre_path, post_path, overrides}], "process": true}.
+    Multipart: an "items" form field with the same JSON, where items name their
+    uploaded parts with "pre_file"/"post_file" instead of paths.
+    """
+    if request.files or request.form:
+        try:
+            body = {'items': json.loads(request.form.get('items', '[]')),
+                    'process': request.form.get('process', 'true').lower() != 'false'}
+        except ValueError:
+            raise ApiError('items must be a JSON list', 400)
+    else:
+        body = request.get_json(silent=True) or {}
+    items = body.get('items')
+    if not isinstance(items, list) or not items:
+        raise ApiError('items must be a non-empty list', 400)
+    limit = current_app.config.get('API_BATCH_LIMIT', DEFAULT_BATCH_LIMIT)
+    if len(items) > limit:
+        raise ApiError(f"At most {limit} items per batch", 400)
+    process = body.get('process', True)
+
+    os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
+    written = []
+    try:
+        assessments = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                raise ApiError(f"Item {index} must be an object", 400)
+            assessment = _new_assessment(item)
+            db.session.flush()
+            pre = request.files.get(item['pre_file']) if item.get('pre_file') else item.get('pre_path')
+            post = request.files.get(item['post_file']) if item.get('post_file') else item.get('post_path')
+            if not pre or not post:
+                raise ApiError(f"Item {index} needs both pre and post images", 400)
+            _attach_pair(assessment, pre, post, written)
+            if process:
+                mark_queued(assessment, _overrides(item.get('overrides')))
+            assessments.append(assessment)
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        for path in written:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+    if process:
+        _submit([assessment.id for assessment in assessments])
+    response = jsonify({'items': [assessment_to_dict(assessment) for assessment in assessments]})
+    response.status_code = 202 if process else 201
+    return response
+
+
+@api_bp.route('/metrics', methods=['GET'])
+@api_login_required
+def metrics():
+    """Buffer pool hit rates and high-water marks of the job threads and frame pool workers, and page cache hit ratios."""
+    pool = frame_pool(current_app)
+    return jsonify({
+        'buffers': pool_metrics(),
+        'frame_pool': {str(pid): worker for pid, worker in pool.worker_metrics.items()} if pool else None,
+        'page_cache': page_cache.metrics(),
+    })
+
+
+@api_bp.route('/queue', methods=['GET'])
+@api_login_required
+def queue_stats():
+    """Budget use of the job scheduler and queue wait times, for every user (admins) or the caller."""
+    scheduler = current_app.extensions['job_queue'].scheduler
+    stats = scheduler.stats(None if current_user.role == 'admin' else {current_user.id})
+    names = dict(db.session.query(User.id, User.username).filter(User.id.in_(list(stats['users']))))
+    stats['users'] = {names.get(user_id, str(user_id)): user for user_id, user in stats['users'].items()}
+    return jsonify(stats)
+
+
+@api_bp.route('/grid/summary', methods=['GET'])
+@api_login_required
+def grid_summary():
+    """Areas (hectares) and damage index inside ?bbox= over every georeferenced assessment (?epsg=, ?max_cells=)."""
+    return jsonify(summarize_bbox(_bbox(), _int_arg('epsg', 0), max(1, _int_arg('max_cells', DEFAULT_MAX_CELLS))))
+
+
+@api_bp.route('/grid/cells', methods=['GET'])
+@api_login_required
+def grid_cells():
+    """
+    Grid cells intersecting ?bbox= as GeoJSON for heatmaps. ?level= (0 = finest)
+    defaults to the finest level with at most DEFAULT_MAX_CELLS cells in the box.
+    """
+    bbox = _bbox()
+    finest = choose_level(bbox, DEFAULT_MAX_CELLS)
+    level = _int_arg('level', finest)
+    if not finest <= level < LEVELS:
+        raise ApiError(f"level must be {finest}-{LEVELS - 1} for this bbox", 400)
+    return jsonify(cells_to_geojson(cells_in_bbox(bbox, level, _int_arg('epsg', 0))))
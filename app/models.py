@@ -8,6 +8,16 @@ import logging
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+@login_manager.request_loader
+def load_user_from_request(request):
+    # HTTP Basic credentials (email:password) for API clients without a session
+    auth = request.authorization
+    if auth and auth.type == 'basic' and auth.username:
+        user = User.query.filter_by(email=auth.username).first()
+        if user and user.check_password(auth.password or ''):
+            return user
+    return None
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
@@ -56,6 +66,12 @@ class Assessment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    damage_patches = db.relationship('DamagePatch', backref='assessment', lazy='dynamic',
+                                     cascade='all, delete-orphan')
+    captures = db.relationship('Capture', backref='assessment', lazy='dynamic',
+                               cascade='all, delete-orphan', order_by='Capture.sequence')
+    capture_changes = db.relationship('CaptureChange', backref='assessment', lazy='dynamic',
+                                      cascade='all, delete-orphan')
     
     def __repr__(self):
         return f"Assessment('{self.title}', '{self.location}', '{self.created_at}')"
@@ -155,4 +171,239 @@ class Assessment(db.Model):
         import json
         data = json.loads(self.additional_data or '{}')
         data['change_vis_path'] = value
-        self.additional_data = json.dumps(data) 
\ No newline at end of file
+        self.additional_data = json.dumps(data)
+    
+    # Versioned ProcessingConfig the current results were produced with
+    @property
+    def processing_config(self):
+        import json
+        return json.loads(self.additional_data or '{}').get('processing_config')
+        
+    @processing_config.setter
+    def processing_config(self, value):
+        import json
+        data = json.loads(self.additional_data or '{}')
+        data['processing_config'] = value
+        self.additional_data = json.dumps(data)
+    
+    # Per-class pixel percentages of the pre/post segmentations
+    @property
+    def class_statistics(self):
+        import json
+        return json.loads(self.additional_data or '{}').get('class_statistics')
+        
+    @class_statistics.setter
+    def class_statistics(self, value):
+        import json
+        data = json.loads(self.additional_data or '{}')
+        data['class_statistics'] = value
+        self.additional_data = json.dumps(data)
+    
+    # ROI/exclusion polygons in pixel coordinates: {'roi': [ring, ...], 'exclude': [ring, ...]}
+    @property
+    def regions(self):
+        import json
+        return json.loads(self.additional_data or '{}').get('regions')
+        
+    @regions.setter
+    def regions(self, value):
+        import json
+        data = json.loads(self.additional_data or '{}')
+        data['regions'] = value
+        self.additional_data = json.dumps(data)
+    
+    # Pixel-to-map transform: {'geotransform': [x0, px_w, rot, y0, rot, px_h], 'epsg': code}
+    @property
+    def georef(self):
+        import json
+        return json.loads(self.additional_data or '{}').get('georef')
+        
+    @georef.setter
+    def georef(self, value):
+        import json
+        data = json.loads(self.additional_data or '{}')
+        data['georef'] = value
+        self.additional_data = json.dumps(data)
+    
+    # Background processing job state: {'status': 'queued'|'running'|'done'|'failed', ...}
+    @property
+    def job(self):
+        import json
+        return json.loads(self.additional_data or '{}').get('job')
+        
+    @job.setter
+    def job(self, value):
+        import json
+        data = json.loads(self.additional_data or '{}')
+        data['job'] = value
+        self.additional_data = json.dumps(data)
+
+class DamagePatch(db.Model):
+    """A connected damaged region extracted from an assessment's change mask (pixel coordinates)."""
+    id = db.Column(db.Integer, primary_key=True)
+    assessment_id = db.Column(db.Integer, db.ForeignKey('assessment.id'), nullable=False)
+    area = db.Column(db.Integer, nullable=False)  # Pixels
+    perimeter = db.Column(db.Float, nullable=False)  # Pixel edges
+    centroid_x = db.Column(db.Float, nullable=False)
+    centroid_y = db.Column(db.Float, nullable=False)
+    # Inclusive bounding box
+    min_x = db.Column(db.Integer, nullable=False)
+    min_y = db.Column(db.Integer, nullable=False)
+    max_x = db.Column(db.Integer, nullable=False)
+    max_y = db.Column(db.Integer, nullable=False)
+    polygon = db.Column(db.Text, nullable=True)  # JSON polygon rings
+    
+    # Bounding-box index for window queries within an assessment
+    __table_args__ = (
+        db.Index('ix_damage_patch_bbox', 'assessment_id', 'min_x', 'max_x', 'min_y', 'max_y'),
+    )
+    
+    def __repr__(self):
+        return f"DamagePatch('{self.assessment_id}', '{self.area}')"
+    
+    @classmethod
+    def from_dict(cls, assessment_id, patch):
+        import json
+        return cls(
+            assessment_id=assessment_id,
+            area=patch['area'],
+            perimeter=patch['perimeter'],
+            centroid_x=patch['centroid_x'],
+            centroid_y=patch['centroid_y'],
+            min_x=patch['min_x'],
+            min_y=patch['min_y'],
+            max_x=patch['max_x'],
+            max_y=patch['max_y'],
+            polygon=json.dumps(patch['polygon']) if patch.get('polygon') else None
+        )
+    
+    @classmethod
+    def in_bbox(cls, assessment_id, min_x, min_y, max_x, max_y):
+        """Query patches whose bounding box intersects the given window."""
+        return cls.query.filter(
+            cls.assessment_id == assessment_id,
+            cls.min_x <= max_x, cls.max_x >= min_x,
+            cls.min_y <= max_y, cls.max_y >= min_y
+        )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'area': self.area,
+            'perimeter': self.perimeter,
+            'centroid_x': self.centroid_x,
+            'centroid_y': self.centroid_y,
+            'min_x': self.min_x,
+            'min_y': self.min_y,
+            'max_x': self.max_x,
+            'max_y': self.max_y,
+            'polygon': self.polygon
+        }
+
+class Capture(db.Model):
+    """One flight of a multi-temporal (series) assessment; its segmentation is cached once."""
+    id = db.Column(db.Integer, primary_key=True)
+    assessment_id = db.Column(db.Integer, db.ForeignKey('assessment.id'), nullable=False)
+    sequence = db.Column(db.Integer, nullable=False)  # 0 = baseline
+    image_path = db.Column(db.String(255), nullable=False)
+    captured_at = db.Column(db.Date, nullable=True)
+    mask_path = db.Column(db.String(255), nullable=True)  # Cached integer label map (.npz)
+    forest_area = db.Column(db.Float, nullable=True)  # Percentage
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('assessment_id', 'sequence', name='uq_capture_sequence'),
+    )
+    
+    def __repr__(self):
+        return f"Capture('{self.assessment_id}', '{self.sequence}')"
+
+class CaptureChange(db.Model):
+    """Change statistics between two captures, from their class transition matrix."""
+    id = db.Column(db.Integer, primary_key=True)
+    assessment_id = db.Column(db.Integer, db.ForeignKey('assessment.id'), nullable=False)
+    from_capture_id = db.Column(db.Integer, db.ForeignKey('capture.id'), nullable=False)
+    to_capture_id = db.Column(db.Integer, db.ForeignKey('capture.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # 'consecutive' or 'baseline'
+    transitions = db.Column(db.Text, nullable=False)  # JSON 6x6 pixel counts (rows: from, cols: to)
+    forest_area_before = db.Column(db.Float)  # Percentage
+    forest_area_after = db.Column(db.Float)   # Percentage
+    damage_percentage = db.Column(db.Float)   # Percentage of vegetation lost
+    recovery_percentage = db.Column(db.Float)  # Percentage of non-vegetation regained as vegetation
+    
+    from_capture = db.relationship('Capture', foreign_keys=[from_capture_id])
+    to_capture = db.relationship('Capture', foreign_keys=[to_capture_id])
+    
+    def __repr__(self):
+        return f"CaptureChange('{self.from_capture_id}', '{self.to_capture_id}', '{self.kind}')"
+
+class Artifact(db.Model):
+    """A file produced for an assessment; unreferenced (released) artifacts are deleted by the GC."""
+    id = db.Column(db.Integer, primary_key=True)
+    assessment_id = db.Column(db.Integer, db.ForeignKey('assessment.id'), nullable=True, index=True)
+    storage = db.Column(db.String(20), nullable=False, default='static')  # 'static' or 'instance' root
+    path = db.Column(db.String(255), nullable=False)  # Relative to the storage root, forward slashes
+    kind = db.Column(db.String(20), nullable=False)  # 'upload', 'visualization', 'intermediate'
+    size_bytes = db.Column(db.Integer, nullable=False, default=0)
+    sha256 = db.Column(db.String(64), nullable=True, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    released_at = db.Column(db.DateTime, nullable=True, index=True)  # Set once nothing references the file
+    
+    __table_args__ = (
+        db.UniqueConstraint('storage', 'path', name='uq_artifact_path'),
+    )
+    
+    def __repr__(self):
+        return f"Artifact('{self.storage}/{self.path}', '{self.kind}')"
+
+class IdempotencyKey(db.Model):
+    """Stored response of an API request made with an Idempotency-Key header, replayed on retries."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    endpoint = db.Column(db.String(100), nullable=False)
+    status_code = db.Column(db.Integer, nullable=False)
+    response = db.Column(db.Text, nullable=False)  # JSON body
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_key'),
+    )
+    
+    def __repr__(self):
+        return f"IdempotencyKey('{self.key}', '{self.endpoint}')"
+
+class GridContribution(db.Model):
+    """Areas one assessment adds to a base-level grid cell (square metres)."""
+    id = db.Column(db.Integer, primary_key=True)
+    assessment_id = db.Column(db.Integer, db.ForeignKey('assessment.id'), nullable=False, index=True)
+    epsg = db.Column(db.Integer, nullable=False, default=0)  # 0 when the CRS is unknown
+    ix = db.Column(db.Integer, nullable=False)
+    iy = db.Column(db.Integer, nullable=False)
+    valid_area = db.Column(db.Float, nullable=False, default=0.0)
+    vegetation_before = db.Column(db.Float, nullable=False, default=0.0)
+    vegetation_after = db.Column(db.Float, nullable=False, default=0.0)
+    damaged = db.Column(db.Float, nullable=False, default=0.0)
+    
+    def __repr__(self):
+        return f"GridContribution('{self.assessment_id}', '{self.ix}', '{self.iy}')"
+
+class GridCell(db.Model):
+    """Summed areas of all assessments in a grid cell; level L cells are 2**L base cells wide."""
+    id = db.Column(db.Integer, primary_key=True)
+    epsg = db.Column(db.Integer, nullable=False, default=0)
+    level = db.Column(db.Integer, nullable=False)
+    ix = db.Column(db.Integer, nullable=False)
+    iy = db.Column(db.Integer, nullable=False)
+    valid_area = db.Column(db.Float, nullable=False, default=0.0)
+    vegetation_before = db.Column(db.Float, nullable=False, default=0.0)
+    vegetation_after = db.Column(db.Float, nullable=False, default=0.0)
+    damaged = db.Column(db.Float, nullable=False, default=0.0)
+    
+    # Window queries select one level of one CRS by index ranges
+    __table_args__ = (
+        db.UniqueConstraint('epsg', 'level', 'ix', 'iy', name='uq_grid_cell'),
+    )
+    
+    def __repr__(self):
+        return f"GridCell('{self.level}', '{self.ix}', '{self.iy}')"
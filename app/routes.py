@@ -1,11 +1,32 @@
 from app import app, db
-from flask import render_template, url_for, flash, redirect, request, send_from_directory
+from flask import render_template, url_for, flash, redirect, request, send_file, jsonify, abort, Response
 from flask_login import login_user, current_user, logout_user, login_required
-from app.models import User, Assessment
+from app.models import User, Assessment, DamagePatch, Capture, CaptureChange
 from datetime import datetime
 import os
-from werkzeug.utils import secure_filename
-from app.utils.image_processing import process_images
+from werkzeug.utils import secure_filename, safe_join
+from app.utils.jobs import JOB_DONE, JOB_FAILED, PENDING_STATES, mark_queued
+from app.utils.damage_patches import patches_to_geojson
+from app.utils.grid_summary import grid_update, remove_assessment_grid
+from app.utils.pipeline_config import load_processing_config
+from app.utils.time_series import (
+    capture_mask_path, ensure_capture_labels, forest_cover, transition_matrix, transition_statistics
+)
+from app.utils.media import content_digest, copy_atomically, file_sha256, normalize_media_path, save_atomically
+from app.utils.artifacts import find_upload, register_artifact, release_artifacts
+from app.utils.image_io import data_size, image_size
+from app.utils.image_processing import estimate_damage
+from app.utils.regions import parse_regions, scale_regions
+from app.utils.scheduler import Ticket
+from app.utils.geotiff import EXPORT_LAYERS, export_layer
+from app.utils.reports import FORMATS, MIME_TYPES, build_archive, collect_report_data, render_one, report_jobs
+from app.utils.page_cache import assessment_scope, page_cache, user_scope
+from sqlalchemy import func
+import json
+import mimetypes
+import subprocess
+import cv2
+import numpy as np
 
 @app.route('/')
 @app.route('/home')
@@ -79,14 +100,23 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    assessments = Assessment.query.filter_by(user_id=current_user.id).all()
-    return render_template('dashboard.html', title='Dashboard', assessments=assessments)
+    return page_cache.render('dashboard.html', user_scope(current_user.id), _listing_version(), _user_assessments,
+                             title='Dashboard')
 
 @app.route('/assessments')
 @login_required
 def assessments():
-    assessments = Assessment.query.filter_by(user_id=current_user.id).all()
-    return render_template('assessments.html', title='My Assessments', assessments=assessments)
+    return page_cache.render('assessments.html', user_scope(current_user.id), _listing_version(), _user_assessments,
+                             title='My Assessments')
+
+def _user_assessments():
+    return {'assessments': Assessment.query.filter_by(user_id=current_user.id).all()}
+
+def _listing_version():
+    """Changes whenever one of the user's assessments is added, removed or updated."""
+    count, latest = db.session.query(func.count(Assessment.id), func.max(Assessment.updated_at)).filter(
+        Assessment.user_id == current_user.id).one()
+    return (current_user.id, current_user.username, count, latest)
 
 @app.route('/assessment/new', methods=['GET', 'POST'])
 @login_required
@@ -122,63 +152,141 @@ def assessment_upload(assessment_id):
         return redirect(url_for('assessments'))
     
     if request.method == 'POST':
-        # Check if the post request has the file part
-        if 'pre_image' not in request.files or 'post_image' not in request.files:
-            flash('Both pre and post typhoon images are required', 'danger')
-            return redirect(request.url)
-        
-        pre_image = request.files['pre_image']
-        post_image = request.files['post_image']
+        # Each image is a file part, or the SHA-256 of an upload the server already
+        # has (sent by the upload form's preflight instead of the file)
+        images = {}
+        for role in ('pre', 'post'):
+            upload = request.files.get(f'{role}_image')
+            digest = request.form.get(f'{role}_sha256', '').lower()
+            name = upload.filename if upload is not None and upload.filename else request.form.get(f'{role}_name', '')
+            if not name or not (upload is not None and upload.filename or digest):
+                flash('Both pre and post typhoon images are required', 'danger')
+                return redirect(request.url)
+            images[role] = (upload if upload is not None and upload.filename else None, digest, name)
         
-        # If user does not select file, browser also
-        # submit an empty part without filename
-        if pre_image.filename == '' or post_image.filename == '':
-            flash('No selected file', 'danger')
+        # Optional ROI/exclusion polygons (JSON, pixel coordinates)
+        try:
+            regions = parse_regions(request.form.get('regions', ''))
+        except ValueError as e:
+            flash(f'Invalid regions: {str(e)}', 'danger')
             return redirect(request.url)
         
-        if pre_image and post_image:
-            # Ensure upload folder exists
-            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-            
-            try:
-                # Save pre-typhoon image
-                pre_filename = secure_filename(f"pre_{assessment_id}_{pre_image.filename}")
-                pre_path = os.path.join(app.config['UPLOAD_FOLDER'], pre_filename)
-                pre_image.save(pre_path)
-                
-                # Verify the file was saved
-                if not os.path.exists(pre_path):
-                    flash('Failed to save pre-typhoon image. Please try again.', 'danger')
+        # Ensure upload folder exists
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        
+        try:
+            paths = []
+            for role, (upload, digest, name) in images.items():
+                path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(f"{role}_{assessment_id}_{name}"))
+                if upload is not None:
+                    save_atomically(path, upload.save)
+                    digest = file_sha256(path)
+                elif not _copy_upload(digest, path):
+                    flash(f'The {role}-typhoon image is no longer on the server. Please upload it again.', 'danger')
                     return redirect(request.url)
                 
-                # Save post-typhoon image
-                post_filename = secure_filename(f"post_{assessment_id}_{post_image.filename}")
-                post_path = os.path.join(app.config['UPLOAD_FOLDER'], post_filename)
-                post_image.save(post_path)
-                
                 # Verify the file was saved
-                if not os.path.exists(post_path):
-                    flash('Failed to save post-typhoon image. Please try again.', 'danger')
+                if not os.path.exists(path):
+                    flash(f'Failed to save {role}-typhoon image. Please try again.', 'danger')
                     return redirect(request.url)
-                
-                # Update assessment with image paths (forward slashes for URLs)
-                assessment.pre_image = 'uploads/' + pre_filename
-                assessment.post_image = 'uploads/' + post_filename
-                db.session.commit()
-                
-                app.logger.info(f"Images saved successfully: {pre_path} and {post_path}")
-                flash('Images uploaded successfully!', 'success')
-                return redirect(url_for('assessment_process', assessment_id=assessment_id))
+                paths.append((path, digest))
+            (pre_path, _), (post_path, _) = paths
             
-            except Exception as e:
-                import traceback
-                app.logger.error(f"Image upload error: {str(e)}")
-                app.logger.error(traceback.format_exc())
-                flash(f'Error uploading images: {str(e)}', 'danger')
-                return redirect(request.url)
+            # Update assessment with image paths (forward slashes for URLs)
+            assessment.pre_image = 'uploads/' + os.path.basename(pre_path)
+            assessment.post_image = 'uploads/' + os.path.basename(post_path)
+            assessment.regions = regions
+            
+            # Register the uploads; images they replace become garbage
+            for path, digest in paths:
+                register_artifact(path, 'upload', assessment.id, sha256=digest)
+            release_artifacts(assessment.id, kinds=('upload',), keep_paths=(pre_path, post_path))
+            db.session.commit()
+            
+            app.logger.info(f"Images saved successfully: {pre_path} and {post_path}")
+            flash('Images uploaded successfully!', 'success')
+            return redirect(url_for('assessment_process', assessment_id=assessment_id))
+        
+        except Exception as e:
+            import traceback
+            app.logger.error(f"Image upload error: {str(e)}")
+            app.logger.error(traceback.format_exc())
+            flash(f'Error uploading images: {str(e)}', 'danger')
+            return redirect(request.url)
     
     return render_template('upload_images.html', title='Upload Images', assessment=assessment)
 
+def _copy_upload(digest, path):
+    """
+    Copy the user's stored upload with this SHA-256 to `path`; False if there is none.
+    A copy rather than a hard link, so replacing one assessment's image never changes another's.
+    """
+    source = find_upload(digest, current_user.id) if len(digest) == 64 else None
+    if source is None:
+        return False
+    if os.path.abspath(source) != os.path.abspath(path):
+        copy_atomically(source, path)
+    return True
+
+@app.route('/blobs/<digest>')
+@login_required
+def blob_lookup(digest):
+    """Upload preflight: whether the user already uploaded a file with this SHA-256, and its size."""
+    path = find_upload(digest.lower(), current_user.id) if len(digest) == 64 else None
+    if path is None:
+        return jsonify({'exists': False}), 404
+    size = image_size(path)
+    return jsonify({'exists': True, 'bytes': os.path.getsize(path),
+                    'width': size[0] if size else None, 'height': size[1] if size else None})
+
+# Twice the PREVIEW_EDGE of the upload form (app/static/js/main.js): previews are small,
+# so an estimate never holds a processing slot for long
+MAX_PREVIEW_EDGE = 1024
+
+@app.route('/assessment/<int:assessment_id>/estimate', methods=['POST'])
+@login_required
+def assessment_estimate(assessment_id):
+    """
+    Quick damage estimate from downscaled previews (pre_preview/post_preview files)
+    sent before the full upload; `scale` is the preview size over the original.
+    Previews may be at most MAX_PREVIEW_EDGE pixels on a side, and the estimate
+    is admitted by the processing scheduler like any other run.
+    """
+    assessment = Assessment.query.get_or_404(assessment_id)
+    if assessment.user_id != current_user.id:
+        abort(403)
+    images = []
+    for name in ('pre_preview', 'post_preview'):
+        data = request.files[name].read() if name in request.files else b''
+        # Check the header first, so an oversized file is never decoded
+        size = data_size(data) if data else None
+        if size is not None and max(size) > MAX_PREVIEW_EDGE:
+            return jsonify({'error': f'{name} is larger than {MAX_PREVIEW_EDGE} pixels'}), 400
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) if data else None
+        if image is None:
+            return jsonify({'error': f'{name} is missing or not an image'}), 400
+        if max(image.shape[:2]) > MAX_PREVIEW_EDGE:
+            return jsonify({'error': f'{name} is larger than {MAX_PREVIEW_EDGE} pixels'}), 400
+        images.append(image)
+    try:
+        scale = float(request.form.get('scale', 1))
+        regions = parse_regions(request.form.get('regions', ''))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if regions and scale > 0:
+        regions = scale_regions(regions, scale)
+    
+    config = load_processing_config(app.config.get('PROCESSING_CONFIG'))
+    ticket = Ticket(current_user.id, current_user.role, images[0].shape[0] * images[0].shape[1],
+                    label=f"estimate {assessment_id}")
+    try:
+        estimate = app.extensions['job_queue'].scheduler.run(ticket, estimate_damage, images[0], images[1],
+                                                            config, regions)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    estimate.update(width=images[0].shape[1], height=images[0].shape[0])
+    return jsonify(estimate)
+
 @app.route('/assessment/<int:assessment_id>/process', methods=['GET', 'POST'])
 @login_required
 def assessment_process(assessment_id):
@@ -209,30 +317,36 @@ def assessment_process(assessment_id):
         flash(f'Post-typhoon image file not found at {post_image_path}. Please upload again.', 'danger')
         return redirect(url_for('assessment_upload', assessment_id=assessment_id))
     
-    try:
-        # Process images and get results
-        result_data = process_images(pre_image_path, post_image_path)
-        
-        # Update assessment with results
-        assessment.forest_area_before = result_data['forest_area_before']
-        assessment.forest_area_after = result_data['forest_area_after']
-        assessment.damage_percentage = result_data['damage_percentage']
-        assessment.pre_vis_path = result_data['pre_vis_path']
-        assessment.post_vis_path = result_data['post_vis_path']
-        assessment.change_vis_path = result_data['change_vis_path']
-        assessment.processed_date = datetime.now()
-        
+    # Queue processing like the API does, so the request returns at once;
+    # parameters posted with a reprocess request override the configured ones
+    if (assessment.job or {}).get('status') not in PENDING_STATES:
+        mark_queued(assessment, request.form.to_dict())
         db.session.commit()
-        
+        app.extensions['job_queue'].submit(assessment.id)
+    return redirect(url_for('assessment_status', assessment_id=assessment_id))
+
+@app.route('/assessment/<int:assessment_id>/status')
+@login_required
+def assessment_status(assessment_id):
+    assessment = Assessment.query.get_or_404(assessment_id)
+    
+    # Check if user owns this assessment
+    if assessment.user_id != current_user.id:
+        flash('You do not have permission to view this assessment', 'danger')
+        return redirect(url_for('assessments'))
+    
+    job = assessment.job or {}
+    if job.get('status') == JOB_DONE:
         flash('Assessment processed successfully', 'success')
         return redirect(url_for('assessment_view', assessment_id=assessment_id))
-    
-    except Exception as e:
-        import traceback
-        app.logger.error(f"Image processing error: {str(e)}")
-        app.logger.error(traceback.format_exc())
-        flash(f'Error processing images: {str(e)}', 'danger')
+    if job.get('status') == JOB_FAILED:
+        flash(f'Error processing images: {job.get("error")}', 'danger')
         return redirect(url_for('assessment_upload', assessment_id=assessment_id))
+    if job.get('status') not in PENDING_STATES:
+        return redirect(url_for('assessment_view' if assessment.processed else 'assessment_upload',
+                                assessment_id=assessment_id))
+    
+    return render_template('assessment_status.html', title='Processing', assessment=assessment, job=job)
 
 @app.route('/assessment/<int:assessment_id>/view')
 @login_required
@@ -249,20 +363,286 @@ def assessment_view(assessment_id):
         flash('This assessment has not been processed yet', 'warning')
         return redirect(url_for('assessment_upload', assessment_id=assessment_id))
     
-    # Log image paths for debugging
-    app.logger.info(f"Pre-image path: {assessment.pre_image}")
-    app.logger.info(f"Post-image path: {assessment.post_image}")
-    app.logger.info(f"Pre-vis path: {assessment.pre_vis_path}")
-    app.logger.info(f"Post-vis path: {assessment.post_vis_path}")
-    app.logger.info(f"Change-vis path: {assessment.change_vis_path}")
+    return page_cache.render('assessment_view.html', assessment_scope(assessment.id),
+                             (assessment.id, assessment.updated_at),
+                             title='Assessment Results', assessment=assessment)
+
+@app.route('/assessment/<int:assessment_id>/patches.geojson')
+@login_required
+def assessment_patches(assessment_id):
+    """Export damage patches as GeoJSON (pixel coordinates), optionally within ?bbox=min_x,min_y,max_x,max_y."""
+    assessment = Assessment.query.get_or_404(assessment_id)
+    
+    # Check if user owns this assessment
+    if assessment.user_id != current_user.id:
+        flash('You do not have permission to view this assessment', 'danger')
+        return redirect(url_for('assessments'))
+    
+    bbox = request.args.get('bbox')
+    if bbox:
+        try:
+            min_x, min_y, max_x, max_y = (int(float(v)) for v in bbox.split(','))
+        except ValueError:
+            return jsonify({'error': 'bbox must be min_x,min_y,max_x,max_y'}), 400
+        patches = DamagePatch.in_bbox(assessment.id, min_x, min_y, max_x, max_y)
+    else:
+        patches = assessment.damage_patches
+    
+    patches = patches.order_by(DamagePatch.area.desc()).all()
+    return jsonify(patches_to_geojson(patches))
+
+def _report_thumbnails():
+    return os.path.join(app.instance_path, 'thumbnails')
+
+@app.route('/assessment/<int:assessment_id>/report.<fmt>')
+@login_required
+def assessment_report(assessment_id, fmt):
+    """Download the assessment's report as DOCX or PDF, built from its stored results."""
+    assessment = Assessment.query.get_or_404(assessment_id)
+    
+    # Check if user owns this assessment
+    if assessment.user_id != current_user.id:
+        flash('You do not have permission to view this assessment', 'danger')
+        return redirect(url_for('assessments'))
+    if fmt not in FORMATS:
+        abort(404)
+    if not assessment.processed:
+        flash('This assessment has not been processed yet', 'warning')
+        return redirect(url_for('assessment_upload', assessment_id=assessment_id))
+    
+    items = collect_report_data([assessment], app.static_folder, _report_thumbnails())
+    try:
+        filename, content = render_one(report_jobs(items, fmt, per_typhoon=False)[0],
+                                       app.config['REPORT_PROCESSES'])
+    except (RuntimeError, ImportError, subprocess.SubprocessError, OSError) as e:
+        app.logger.error(f"Report rendering for assessment {assessment_id} failed: {str(e)}")
+        flash(f'Error rendering the report: {str(e)}', 'danger')
+        return redirect(url_for('assessment_view', assessment_id=assessment_id))
+    return Response(content, mimetype=MIME_TYPES[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/assessment/<int:assessment_id>/export/<layer>.tif')
+@login_required
+def assessment_geotiff(assessment_id, layer):
+    """
+    Download a result layer as a tiled GeoTIFF with overviews: 'pre' or 'post'
+    six-class labels, or 'change' codes (no data where masked).
+    """
+    assessment = Assessment.query.get_or_404(assessment_id)
+    
+    # Check if user owns this assessment
+    if assessment.user_id != current_user.id:
+        flash('You do not have permission to view this assessment', 'danger')
+        return redirect(url_for('assessments'))
+    if layer not in EXPORT_LAYERS or not assessment.processed:
+        abort(404)
+    stored = getattr(assessment, EXPORT_LAYERS[layer][0])
+    source = os.path.join(app.static_folder, *normalize_media_path(stored).split('/')) if stored else None
+    if not source or not os.path.exists(source):
+        abort(404)
+    
+    export_dir = os.path.join(app.instance_path, 'exports', f"assessment_{assessment.id}")
+    path = export_layer(layer, source, assessment.georef, export_dir)
+    register_artifact(path, 'export', assessment.id)
+    db.session.commit()
+    return send_file(path, mimetype='image/tiff', as_attachment=True, conditional=True,
+                     download_name=f"assessment_{assessment.id}_{layer}.tif")
+
+@app.route('/reports.zip')
+@login_required
+def reports_archive():
+    """
+    ZIP of reports for the user's processed assessments (?typhoon= limits them
+    to one typhoon, ?format=docx|pdf): one per assessment plus a summary per
+    typhoon, streamed while the rest are still rendering.
+    """
+    fmt = request.args.get('format', 'docx')
+    if fmt not in FORMATS:
+        abort(400)
+    query = Assessment.query.filter(Assessment.user_id == current_user.id, Assessment.damage_percentage.isnot(None))
+    if request.args.get('typhoon'):
+        query = query.filter_by(typhoon_name=request.args['typhoon'])
+    assessments = query.order_by(Assessment.typhoon_name, Assessment.id).all()
+    if not assessments:
+        flash('No processed assessments to report on', 'warning')
+        return redirect(url_for('assessments'))
+    
+    jobs = report_jobs(collect_report_data(assessments, app.static_folder, _report_thumbnails()), fmt)
+    return Response(build_archive(jobs, app.config['REPORT_PROCESSES']), mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename="reports.zip"'})
+
+@app.route('/assessment/<int:assessment_id>/delete', methods=['POST'])
+@login_required
+def assessment_delete(assessment_id):
+    """Delete an assessment; its files are released to the artifact GC rather than removed inline."""
+    assessment = Assessment.query.get_or_404(assessment_id)
+    
+    # Check if user owns this assessment
+    if assessment.user_id != current_user.id:
+        flash('You do not have permission to delete this assessment', 'danger')
+        return redirect(url_for('assessments'))
+    
+    release_artifacts(assessment.id, detach=True)
+    with grid_update():
+        remove_assessment_grid(assessment.id)
+        db.session.delete(assessment)
+    page_cache.invalidate_assessment(assessment_id, current_user.id)
+    
+    flash('Assessment deleted successfully', 'success')
+    return redirect(url_for('assessments'))
+
+def _capture_labels(capture, config, target_shape=None):
+    """Cached label map of a capture (segmenting it only if missing); keeps capture.mask_path current."""
+    cache_dir = os.path.join(app.config['INTERMEDIATES_FOLDER'], f"series_{capture.assessment_id}")
+    mask_path = capture_mask_path(cache_dir, capture.id, config)
+    image_path = os.path.join(app.root_path, 'static', capture.image_path)
+    labels = ensure_capture_labels(image_path, mask_path, config, target_shape)
+    register_artifact(mask_path, 'intermediate', capture.assessment_id)
+    capture.mask_path = os.path.relpath(mask_path, app.config['INTERMEDIATES_FOLDER']).replace('\\', '/')
+    return labels
+
+def _record_capture_change(assessment, from_capture, to_capture, kind, matrix):
+    stats = transition_statistics(matrix)
+    db.session.add(CaptureChange(
+        assessment_id=assessment.id,
+        from_capture_id=from_capture.id,
+        to_capture_id=to_capture.id,
+        kind=kind,
+        transitions=json.dumps(matrix.tolist()),
+        **stats
+    ))
+
+@app.route('/assessment/<int:assessment_id>/series', methods=['GET', 'POST'])
+@login_required
+def assessment_series(assessment_id):
+    """Multi-temporal monitoring: add flights to a site and compare each with the previous one and the baseline."""
+    assessment = Assessment.query.get_or_404(assessment_id)
+    
+    # Check if user owns this assessment
+    if assessment.user_id != current_user.id:
+        flash('You do not have permission to view this assessment', 'danger')
+        return redirect(url_for('assessments'))
+    
+    if request.method == 'POST':
+        image = request.files.get('capture_image')
+        if not image or image.filename == '':
+            flash('Please select a capture image', 'danger')
+            return redirect(request.url)
+        
+        captured_at = None
+        if request.form.get('captured_at'):
+            try:
+                captured_at = datetime.strptime(request.form['captured_at'], '%Y-%m-%d').date()
+            except ValueError:
+                flash('Capture date must be in YYYY-MM-DD format', 'danger')
+                return redirect(request.url)
+        
+        try:
+            previous_captures = assessment.captures.all()
+            sequence = previous_captures[-1].sequence + 1 if previous_captures else 0
+            
+            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+            filename = secure_filename(f"capture_{assessment_id}_{sequence}_{image.filename}")
+            image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            save_atomically(image_path, image.save)
+            register_artifact(image_path, 'upload', assessment.id, sha256=file_sha256(image_path))
+            
+            capture = Capture(assessment_id=assessment.id, sequence=sequence,
+                              image_path='uploads/' + filename, captured_at=captured_at)
+            db.session.add(capture)
+            db.session.flush()
+            
+            # Only the new flight is segmented; earlier label maps come from the cache
+            config = load_processing_config(app.config.get('PROCESSING_CONFIG'))
+            if not previous_captures:
+                labels = _capture_labels(capture, config)
+            else:
+                baseline, previous = previous_captures[0], previous_captures[-1]
+                baseline_labels = _capture_labels(baseline, config)
+                labels = _capture_labels(capture, config, baseline_labels.shape)
+                baseline_matrix = transition_matrix(baseline_labels, labels)
+                if previous is baseline:
+                    previous_matrix = baseline_matrix
+                else:
+                    previous_labels = _capture_labels(previous, config, baseline_labels.shape)
+                    previous_matrix = transition_matrix(previous_labels, labels)
+                _record_capture_change(assessment, previous, capture, 'consecutive', previous_matrix)
+                _record_capture_change(assessment, baseline, capture, 'baseline', baseline_matrix)
+            capture.forest_area = forest_cover(labels)
+            
+            db.session.commit()
+            flash('Capture added to the series', 'success')
+        except Exception as e:
+            import traceback
+            db.session.rollback()
+            app.logger.error(f"Capture processing error: {str(e)}")
+            app.logger.error(traceback.format_exc())
+            flash(f'Error processing capture: {str(e)}', 'danger')
+        return redirect(url_for('assessment_series', assessment_id=assessment_id))
     
-    return render_template('assessment_view.html', 
-                          title='Assessment Results',
-                          assessment=assessment)
+    captures = assessment.captures.all()
+    changes = assessment.capture_changes.join(CaptureChange.to_capture).order_by(Capture.sequence).all()
+    return render_template('assessment_series.html',
+                          title='Time Series',
+                          assessment=assessment,
+                          captures=captures,
+                          consecutive_changes=[c for c in changes if c.kind == 'consecutive'],
+                          baseline_changes=[c for c in changes if c.kind == 'baseline'])
 
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    """Serve uploaded files (filename only; path normalized for URLs)."""
+    """Old upload URLs: redirect to the content-hashed media URL of the file (filename only)."""
     # Use forward slashes and take basename so Windows paths don't break URLs
     filename = filename.replace('\\', '/').split('/')[-1]
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename) 
\ No newline at end of file
+    full_path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+    if not full_path or not os.path.isfile(full_path):
+        abort(404)
+    response = redirect(media_url(f"uploads/{filename}"))
+    # The target changes with the file's content
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# Media URLs embed a content hash, so responses never go stale and can be cached for a year
+MEDIA_MAX_AGE = 31536000
+
+@app.template_global()
+def media_url(stored_path):
+    """Content-hashed URL of an upload or result image (plain static URL if the file is missing)."""
+    path = normalize_media_path(stored_path)
+    if not path:
+        return None
+    full_path = safe_join(app.static_folder, path)
+    if not full_path or not os.path.isfile(full_path):
+        return url_for('static', filename=path)
+    return url_for('media', digest=content_digest(full_path), filename=path)
+
+@app.route('/media/<digest>/<path:filename>')
+def media(digest, filename):
+    """Serve an image by content hash: immutable caching, conditional GET, byte ranges and optional server offload."""
+    full_path = safe_join(app.static_folder, filename)
+    if not full_path or not os.path.isfile(full_path):
+        abort(404)
+    
+    current = content_digest(full_path)
+    if digest != current:
+        # The file changed since this URL was issued; point at the current version
+        response = redirect(url_for('media', digest=current, filename=filename))
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    
+    if digest in request.if_none_match:
+        response = app.response_class(status=304)
+        response.set_etag(digest)
+    elif app.config.get('MEDIA_X_ACCEL_PREFIX'):
+        # nginx serves the bytes (including ranges) from its internal location
+        response = app.response_class(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = app.config['MEDIA_X_ACCEL_PREFIX'].rstrip('/') + '/' + filename
+        response.set_etag(digest)
+    else:
+        # Handles Range requests and, with USE_X_SENDFILE, hands the file to the web server
+        response = send_file(full_path, conditional=True, etag=digest, max_age=MEDIA_MAX_AGE)
+    
+    response.cache_control.public = True
+    response.cache_control.max_age = MEDIA_MAX_AGE
+    response.cache_control.immutable = True
+    return response
@@ -29,7 +29,6 @@ document.addEventListener('DOMContentLoaded', function() {
         input.addEventListener('change', function(e) {
             const file = e.target.files[0];
             if (file) {
-                const reader = new FileReader();
                 const previewId = `${input.id}_preview`;
                 let previewElement = document.getElementById(previewId);
                 
@@ -40,21 +39,25 @@ document.addEventListener('DOMContentLoaded', function() {
                     input.parentNode.appendChild(previewElement);
                 }
                 
-                reader.onload = function(e) {
-                    previewElement.innerHTML = `
-                        <div class="card">
-                            <div class="card-body p-2">
-                                <img src="${e.target.result}" class="img-fluid" alt="Preview">
-                            </div>
+                // An object URL shows the file without reading it into a data: URL
+                const oldImage = previewElement.querySelector('img');
+                if (oldImage) {
+                    URL.revokeObjectURL(oldImage.src);
+                }
+                previewElement.innerHTML = `
+                    <div class="card">
+                        <div class="card-body p-2">
+                            <img src="${URL.createObjectURL(file)}" class="img-fluid" alt="Preview">
                         </div>
-                    `;
-                };
-                
-                reader.readAsDataURL(file);
+                    </div>
+                `;
             }
         });
     });
     
+    // Upload preflight: dedup by hash, dimension check and quick estimate
+    document.querySelectorAll('form[data-preflight]').forEach(initUploadPreflight);
+    
     // Confirm delete actions
     const deleteButtons = document.querySelectorAll('.btn-delete');
     deleteButtons.forEach(button => {
@@ -79,4 +82,231 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         });
     }
-}); 
\ No newline at end of file
+});
+
+// Upload preflight for the pre/post image form. Each chosen file is hashed
+// (SHA-256, in a Web Worker) and looked up on the server; files the server
+// already has are then sent as their hash instead of their bytes. Image
+// dimensions are compared before anything is transferred, and downscaled
+// previews can go first for a quick damage estimate while the full upload runs.
+
+// Longest preview edge in pixels
+const PREVIEW_EDGE = 512;
+
+let hashWorker = null;
+let hashRequests = 0;
+const hashCallbacks = {};
+
+function formatBytes(size) {
+    const units = ['B', 'KB', 'MB'];
+    for (const unit of units) {
+        if (size < 1024) {
+            return `${size.toFixed(1)} ${unit}`;
+        }
+        size /= 1024;
+    }
+    return `${size.toFixed(1)} GB`;
+}
+
+function hashFile(file, workerUrl, onProgress) {
+    if (!window.Worker) {
+        return Promise.reject(new Error('Web Workers are not supported'));
+    }
+    if (!hashWorker) {
+        hashWorker = new Worker(workerUrl);
+        hashWorker.onmessage = function(e) {
+            const callback = hashCallbacks[e.data.id];
+            if (callback) {
+                callback(e.data);
+            }
+        };
+    }
+    const id = ++hashRequests;
+    return new Promise((resolve, reject) => {
+        hashCallbacks[id] = function(message) {
+            if (message.progress !== undefined) {
+                onProgress(message.progress);
+                return;
+            }
+            delete hashCallbacks[id];
+            if (message.error) {
+                reject(new Error(message.error));
+            } else {
+                resolve(message.sha256);
+            }
+        };
+        hashWorker.postMessage({id: id, file: file});
+    });
+}
+
+// Decoded size and a downscaled JPEG preview of an image file; null when the
+// browser cannot decode the format (e.g. TIFF)
+function readImage(file) {
+    if (!window.createImageBitmap) {
+        return Promise.resolve(null);
+    }
+    return createImageBitmap(file).then(bitmap => {
+        const scale = Math.min(1, PREVIEW_EDGE / Math.max(bitmap.width, bitmap.height));
+        const canvas = document.createElement('canvas');
+        canvas.width = Math.max(1, Math.round(bitmap.width * scale));
+        canvas.height = Math.max(1, Math.round(bitmap.height * scale));
+        canvas.getContext('2d').drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+        const image = {width: bitmap.width, height: bitmap.height, scale: canvas.width / bitmap.width};
+        bitmap.close();
+        return new Promise(resolve => canvas.toBlob(blob => {
+            image.preview = blob;
+            resolve(image);
+        }, 'image/jpeg', 0.85));
+    }).catch(() => null);
+}
+
+function initUploadPreflight(form) {
+    const roles = ['pre', 'post'];
+    const files = {};
+    const submitButton = form.querySelector('button[type="submit"]');
+    
+    function checkDimensions() {
+        const warning = document.getElementById('dimension_warning');
+        const pre = files.pre && files.pre.image;
+        const post = files.post && files.post.image;
+        if (pre && post && (pre.width !== post.width || pre.height !== post.height)) {
+            warning.textContent = `The pre-typhoon image is ${pre.width}x${pre.height} pixels but the post-typhoon image is ` +
+                `${post.width}x${post.height}. The post image will be resized to match, so check that both cover the same area.`;
+            warning.classList.remove('d-none');
+        } else {
+            warning.classList.add('d-none');
+        }
+    }
+    
+    roles.forEach(role => {
+        const input = document.getElementById(`${role}_image`);
+        const note = document.getElementById(`${role}_image_preflight`);
+        input.addEventListener('change', function() {
+            const file = input.files[0];
+            const item = files[role] = {file: file, sha256: null, exists: false, image: null};
+            if (!file) {
+                note.textContent = '';
+                checkDimensions();
+                return;
+            }
+            note.textContent = 'Checking...';
+            item.ready = Promise.all([
+                hashFile(file, form.dataset.hashWorker, progress => {
+                    if (files[role] === item) {
+                        note.textContent = `Checking... ${Math.round(progress * 100)}%`;
+                    }
+                }).then(digest => {
+                    item.sha256 = digest;
+                    return fetch(form.dataset.blobUrl + digest, {credentials: 'same-origin'});
+                }).then(response => {
+                    item.exists = response.ok;
+                }).catch(() => {
+                    item.exists = false;
+                }),
+                readImage(file).then(image => {
+                    item.image = image;
+                })
+            ]).then(() => {
+                if (files[role] !== item) {
+                    return;
+                }
+                note.textContent = item.exists ?
+                    'Already on the server: it will not be uploaded again.' :
+                    `${formatBytes(file.size)} to upload.`;
+                checkDimensions();
+            });
+        });
+    });
+    
+    form.addEventListener('submit', function(e) {
+        if (!window.FormData || !window.XMLHttpRequest) {
+            return;
+        }
+        e.preventDefault();
+        submitButton.disabled = true;
+        const pending = roles.map(role => files[role] && files[role].ready).filter(Boolean);
+        Promise.all(pending).then(() => {
+            const data = new FormData(form);
+            roles.forEach(role => {
+                const item = files[role];
+                if (item && item.exists) {
+                    data.delete(`${role}_image`);
+                    data.append(`${role}_sha256`, item.sha256);
+                    data.append(`${role}_name`, item.file.name);
+                }
+            });
+            const quickEstimate = document.getElementById('quick_estimate');
+            if (quickEstimate && quickEstimate.checked) {
+                requestEstimate(form, files);
+            }
+            sendUpload(form, data);
+        });
+    });
+}
+
+function requestEstimate(form, files) {
+    const pre = files.pre && files.pre.image;
+    const post = files.post && files.post.image;
+    const result = document.getElementById('estimate_result');
+    if (!pre || !post || !pre.preview || !post.preview) {
+        return;
+    }
+    const data = new FormData();
+    data.append('pre_preview', pre.preview, 'pre_preview.jpg');
+    data.append('post_preview', post.preview, 'post_preview.jpg');
+    data.append('scale', pre.scale);
+    data.append('regions', form.querySelector('[name="regions"]').value);
+    result.textContent = 'Estimating damage from previews...';
+    result.classList.remove('d-none');
+    fetch(form.dataset.estimateUrl, {method: 'POST', body: data, credentials: 'same-origin'})
+        .then(response => response.json())
+        .then(estimate => {
+            if (estimate.error) {
+                result.textContent = `No quick estimate: ${estimate.error}`;
+                return;
+            }
+            result.textContent = `Quick estimate from previews: ${estimate.damage_percentage}% of the forest damaged ` +
+                `(forest cover ${estimate.forest_area_before}% before, ${estimate.forest_area_after}% after). ` +
+                'Full results follow once the images are uploaded and processed.';
+        })
+        .catch(() => result.classList.add('d-none'));
+}
+
+function sendUpload(form, data) {
+    const progress = document.getElementById('upload_progress');
+    const bar = progress.querySelector('.progress-bar');
+    const xhr = new XMLHttpRequest();
+    progress.classList.remove('d-none');
+    xhr.upload.onprogress = function(e) {
+        if (e.lengthComputable) {
+            const percent = Math.round(e.loaded / e.total * 100);
+            bar.style.width = `${percent}%`;
+            bar.textContent = `Uploading ${percent}%`;
+        }
+    };
+    xhr.upload.onload = function() {
+        bar.style.width = '100%';
+        bar.textContent = 'Processing...';
+    };
+    xhr.onload = function() {
+        // Redirects were followed; landing on this page again means the upload failed
+        if (xhr.responseURL && xhr.responseURL.split('?')[0] !== form.action.split('?')[0]) {
+            window.location = xhr.responseURL;
+            return;
+        }
+        const page = new DOMParser().parseFromString(xhr.responseText, 'text/html');
+        page.querySelectorAll('.alert-danger, .alert-warning').forEach(alert => {
+            alert.classList.add('alert-permanent');
+            form.parentNode.insertBefore(document.adoptNode(alert), form);
+        });
+        progress.classList.add('d-none');
+        form.querySelector('button[type="submit"]').disabled = false;
+    };
+    xhr.onerror = function() {
+        // Fall back to a plain form submission
+        progress.classList.add('d-none');
+        form.submit();
+    };
+    xhr.open('POST', form.action);
+    xhr.send(data);
+}
@@ -0,0 +1,228 @@
+"""
+Artifact registry and garbage collection for files on the uploads volume.
+
+Every file the app writes for an assessment (uploads, visualizations,
+cached intermediates) is registered in the Artifact table. Handlers never
+delete files themselves: when a file stops being referenced (reprocessing
+replaces a visualization, an assessment is deleted) its row is released,
+and a background collector deletes released files in batches. Reclaimable
+space is reported from the table, so nothing scans the directory per
+request.
+
+All functions need an application context.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func
+
+from app import db
+from app.models import Artifact, Assessment, Capture
+
+# Released files are kept this long before collection, so a page rendered just
+# before a reprocess can still load its images
+DEFAULT_GRACE_PERIOD = timedelta(minutes=10)
+DEFAULT_BATCH_SIZE = 200
+
+# Kinds whose files can be regenerated from uploads; retention policies may drop them
+INTERMEDIATE_KINDS = ('intermediate', 'thumbnail', 'export')
+
+
+def _root(storage):
+    if storage == 'instance':
+        return current_app.instance_path
+    return current_app.static_folder
+
+
+def _split(full_path):
+    """(storage, relative path) of an absolute path under the static or instance folder."""
+    full_path = os.path.abspath(full_path)
+    for storage in ('instance', 'static'):
+        root = os.path.abspath(_root(storage))
+        if full_path.startswith(root + os.sep):
+            return storage, os.path.relpath(full_path, root).replace('\\', '/')
+    raise ValueError(f"Artifact path {full_path} is outside the static and instance folders")
+
+
+def artifact_path(artifact):
+    return os.path.join(_root(artifact.storage), *artifact.path.split('/'))
+
+
+def register_artifact(full_path, kind, assessment_id, sha256=None):
+    """Record (or re-reference) a file as belonging to an assessment. Caller commits."""
+    storage, path = _split(full_path)
+    artifact = Artifact.query.filter_by(storage=storage, path=path).first()
+    if artifact is None:
+        artifact = Artifact(storage=storage, path=path)
+        db.session.add(artifact)
+    artifact.kind = kind
+    artifact.assessment_id = assessment_id
+    artifact.released_at = None
+    artifact.size_bytes = os.path.getsize(full_path) if os.path.exists(full_path) else 0
+    if sha256:
+        artifact.sha256 = sha256
+    return artifact
+
+
+def find_upload(sha256, user_id):
+    """Path of a live upload with this content hash in one of the user's assessments, or None."""
+    query = Artifact.query.join(Assessment, Artifact.assessment_id == Assessment.id).filter(
+        Artifact.sha256 == sha256, Artifact.kind == 'upload', Artifact.released_at.is_(None),
+        Assessment.user_id == user_id,
+    )
+    for artifact in query:
+        path = artifact_path(artifact)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def release_artifacts(assessment_id, kinds=None, keep_paths=(), directory=None, detach=False):
+    """
+    Mark an assessment's artifacts as unreferenced, except `keep_paths` (absolute
+    paths still in use), optionally only those under `directory`. Returns the
+    number released. Caller commits.
+
+    `detach` is for deleting the assessment: every one of its rows, including
+    those released earlier, drops its assessment_id so no row references the
+    deleted assessment while it waits for the GC.
+    """
+    keep = {_split(path) for path in keep_paths if path}
+    query = Artifact.query.filter(Artifact.assessment_id == assessment_id, Artifact.released_at.is_(None))
+    if kinds:
+        query = query.filter(Artifact.kind.in_(kinds))
+    if directory:
+        storage, prefix = _split(directory)
+        query = query.filter(Artifact.storage == storage, Artifact.path.startswith(prefix + '/', autoescape=True))
+    released = 0
+    now = datetime.utcnow()
+    for artifact in query:
+        if (artifact.storage, artifact.path) not in keep:
+            artifact.released_at = now
+            released += 1
+    if detach:
+        for artifact in Artifact.query.filter_by(assessment_id=assessment_id):
+            artifact.assessment_id = None
+    return released
+
+
+def _collectable(grace_period, drop_kinds=(), drop_after=None):
+    """Query of artifacts the GC may delete under the given retention policy."""
+    now = datetime.utcnow()
+    condition = Artifact.released_at <= now - grace_period
+    if drop_kinds:
+        # Retention policy: regenerable intermediates go after `drop_after` even if still referenced;
+        # metrics live in the database and are unaffected
+        cutoff = now - (drop_after or timedelta(0))
+        condition = condition | (Artifact.kind.in_(drop_kinds) & (Artifact.created_at <= cutoff))
+    return Artifact.query.filter(condition)
+
+
+def reclaimable_report(grace_period=DEFAULT_GRACE_PERIOD, drop_kinds=(), drop_after=None):
+    """Dry-run summary of what a GC pass would delete, by kind, computed from the registry."""
+    rows = (
+        _collectable(grace_period, drop_kinds, drop_after)
+        .with_entities(Artifact.kind, func.count(Artifact.id), func.coalesce(func.sum(Artifact.size_bytes), 0))
+        .group_by(Artifact.kind)
+        .all()
+    )
+    by_kind = {kind: {'files': count, 'bytes': int(size)} for kind, count, size in rows}
+    return {
+        'files': sum(item['files'] for item in by_kind.values()),
+        'bytes': sum(item['bytes'] for item in by_kind.values()),
+        'by_kind': by_kind,
+    }
+
+
+def collect_garbage(batch_size=DEFAULT_BATCH_SIZE, grace_period=DEFAULT_GRACE_PERIOD,
+                    drop_kinds=(), drop_after=None, max_batches=None):
+    """
+    Delete collectable files in batches, committing after each batch so a long pass
+    never holds a write lock for long. Returns (files deleted, bytes reclaimed).
+    """
+    deleted, reclaimed, batches = 0, 0, 0
+    while max_batches is None or batches < max_batches:
+        batch = (
+            _collectable(grace_period, drop_kinds, drop_after)
+            .order_by(Artifact.id).limit(batch_size).all()
+        )
+        if not batch:
+            break
+        for artifact in batch:
+            try:
+                os.remove(artifact_path(artifact))
+                reclaimed += artifact.size_bytes
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning(f"Could not delete artifact {artifact.path}: {e}")
+                continue
+            db.session.delete(artifact)
+            deleted += 1
+        db.session.commit()
+        batches += 1
+    return deleted, reclaimed
+
+
+def _referenced_paths():
+    """Static-relative paths still referenced by assessments and captures (used only when adopting)."""
+    from app.utils.media import normalize_media_path
+    referenced = set()
+    for assessment in Assessment.query.yield_per(500):
+        for path in (assessment.pre_image_path, assessment.post_image_path, assessment.pre_vis_path,
+                     assessment.post_vis_path, assessment.change_vis_path):
+            if path:
+                referenced.add(normalize_media_path(path))
+    for capture in Capture.query.yield_per(500):
+        referenced.add(normalize_media_path(capture.image_path))
+    return referenced
+
+
+def adopt_untracked_files():
+    """
+    One-off migration: register files in the upload folder that predate the registry.
+    Unreferenced ones (e.g. visualizations left behind by reprocessing) are registered
+    as released so the next GC pass reclaims them. Returns (adopted, released).
+    """
+    upload_dir = current_app.config['UPLOAD_FOLDER']
+    tracked = {path for (path,) in Artifact.query.filter_by(storage='static').with_entities(Artifact.path)}
+    referenced = _referenced_paths()
+    adopted = released = 0
+    now = datetime.utcnow()
+    for entry in os.scandir(upload_dir):
+        if not entry.is_file() or entry.name.startswith('.'):
+            continue
+        storage, path = _split(entry.path)
+        if path in tracked:
+            continue
+        kind = 'visualization' if '_vis_' in entry.name or entry.name.startswith('segmented_') else 'upload'
+        artifact = Artifact(storage=storage, path=path, kind=kind, size_bytes=entry.stat().st_size)
+        if path not in referenced:
+            artifact.released_at = now
+            released += 1
+        db.session.add(artifact)
+        adopted += 1
+    db.session.commit()
+    return adopted, released
+
+
+def start_background_gc(app, interval, **options):
+    """Run collect_garbage every `interval` seconds in a daemon thread."""
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    deleted, reclaimed = collect_garbage(**options)
+                    if deleted:
+                        app.logger.info(f"Artifact GC deleted {deleted} files ({reclaimed} bytes)")
+            except Exception as e:
+                app.logger.error(f"Artifact GC failed: {str(e)}")
+
+    thread = threading.Thread(target=run, name='artifact-gc', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,166 @@
+"""
+Reusable full-frame buffers for the processing workers.
+
+A job allocates dozens of frame-sized temporaries (masks, difference
+planes, label maps); back to back in a long-lived worker that churns the
+allocator and lets RSS creep up. Stages instead borrow arrays keyed by
+(shape, dtype) from the worker's BufferPool and return them when done,
+usually through a scope that returns everything borrowed in it on exit.
+Pools are per thread (see worker_pool), so borrowing takes no lock; the
+pooled bytes are capped and the least recently used sizes are dropped
+first. Each pool counts requests, hits and the high-water mark of bytes
+in use, and pool_metrics() sums them over the process.
+"""
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+# Bytes a pool keeps for reuse (frames of a 4000x3000 job fit several times over)
+DEFAULT_MAX_POOLED_BYTES = 512 * 1024 * 1024
+
+
+class BufferScope:
+    """
+    Borrows from a pool and returns everything on exit (dropped instead if the block raised).
+    Other frame memory living as long as the scope (e.g. shared-memory results) is
+    released through on_exit().
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._borrowed = []
+        self._callbacks = []
+
+    def borrow(self, shape, dtype, fill=None):
+        array = self.pool.borrow(shape, dtype, fill)
+        self._borrowed.append(array)
+        return array
+
+    def on_exit(self, callback):
+        """Call `callback()` when the scope ends (last registered first)."""
+        self._callbacks.append(callback)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in reversed(callbacks):
+            callback()
+        borrowed, self._borrowed = self._borrowed, []
+        if exc_type is None:
+            self.pool.give_back(*borrowed)
+        else:
+            # Arrays may still be referenced by work in flight (e.g. an encode); never recycle them
+            self.pool.forget(*borrowed)
+        return False
+
+
+class BufferPool:
+    """Free lists of arrays by (shape, dtype). Not thread-safe: use one pool per thread."""
+
+    def __init__(self, max_pooled_bytes=DEFAULT_MAX_POOLED_BYTES):
+        self.max_pooled_bytes = max_pooled_bytes
+        self._free = OrderedDict()
+        self._in_use = {}
+        self.requests = 0
+        self.hits = 0
+        self.pooled_bytes = 0
+        self.in_use_bytes = 0
+        self.high_water_bytes = 0
+
+    def borrow(self, shape, dtype, fill=None):
+        """An array of `shape` and `dtype`, uninitialised unless `fill` is given."""
+        key = (tuple(int(n) for n in np.atleast_1d(shape)), np.dtype(dtype).str)
+        self.requests += 1
+        free = self._free.get(key)
+        if free:
+            array = free.pop()
+            self._free.move_to_end(key)
+            self.pooled_bytes -= array.nbytes
+            self.hits += 1
+        else:
+            array = np.empty(key[0], dtype=key[1])
+        self._in_use[id(array)] = array.nbytes
+        self.in_use_bytes += array.nbytes
+        self.high_water_bytes = max(self.high_water_bytes, self.in_use_bytes)
+        if fill is not None:
+            array.fill(fill)
+        return array
+
+    def give_back(self, *arrays):
+        for array in arrays:
+            if self._in_use.pop(id(array), None) is None:
+                continue  # Not borrowed from this pool
+            self.in_use_bytes -= array.nbytes
+            key = (array.shape, array.dtype.str)
+            self._free.setdefault(key, []).append(array)
+            self._free.move_to_end(key)
+            self.pooled_bytes += array.nbytes
+        # Drop the least recently used sizes beyond the cap
+        while self.pooled_bytes > self.max_pooled_bytes and self._free:
+            key, free = next(iter(self._free.items()))
+            array = free.pop(0)
+            self.pooled_bytes -= array.nbytes
+            if not free:
+                del self._free[key]
+
+    def forget(self, *arrays):
+        """Stop tracking borrowed arrays without pooling them."""
+        for array in arrays:
+            nbytes = self._in_use.pop(id(array), None)
+            if nbytes is not None:
+                self.in_use_bytes -= nbytes
+
+    def scope(self):
+        return BufferScope(self)
+
+    def clear(self):
+        self._free.clear()
+        self.pooled_bytes = 0
+
+    def metrics(self):
+        return {
+            'requests': self.requests,
+            'hits': self.hits,
+            'hit_rate': round(self.hits / self.requests, 4) if self.requests else None,
+            'in_use_bytes': self.in_use_bytes,
+            'pooled_bytes': self.pooled_bytes,
+            'high_water_bytes': self.high_water_bytes,
+            'sizes': len(self._free),
+        }
+
+
+_local = threading.local()
+_pools = weakref.WeakValueDictionary()
+_pools_lock = threading.Lock()
+
+
+def worker_pool():
+    """BufferPool of the calling thread."""
+    pool = getattr(_local, 'pool', None)
+    if pool is None:
+        pool = _local.pool = BufferPool()
+        with _pools_lock:
+            _pools[threading.current_thread().name] = pool
+    return pool
+
+
+def pool_metrics():
+    """Metrics of every live thread pool in this process, plus their totals."""
+    with _pools_lock:
+        pools = dict(_pools)
+    per_thread = {name: pool.metrics() for name, pool in pools.items()}
+    requests = sum(m['requests'] for m in per_thread.values())
+    hits = sum(m['hits'] for m in per_thread.values())
+    return {
+        'requests': requests,
+        'hits': hits,
+        'hit_rate': round(hits / requests, 4) if requests else None,
+        'in_use_bytes': sum(m['in_use_bytes'] for m in per_thread.values()),
+        'pooled_bytes': sum(m['pooled_bytes'] for m in per_thread.values()),
+        'high_water_bytes': sum(m['high_water_bytes'] for m in per_thread.values()),
+        'threads': per_thread,
+    }
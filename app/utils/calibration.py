@@ -0,0 +1,179 @@
+"""
+Threshold calibration over a labelled sample set.
+
+A sample set is a directory with `images/` and `masks/` subdirectories; each
+mask shares its image's file stem and is painted in the manuscript HEX
+palette. Images named `<site>_pre` / `<site>_post` form a pre/post pair and
+additionally score the change-detection thresholds through the damage
+percentage error.
+
+The samples (images and decoded labels) are decoded once and placed in
+shared memory; candidate ProcessingConfigs from a grid or random search are
+then evaluated in parallel worker processes that only read those views.
+Pairs are scored through analyze_pair, the stages process_images runs
+(masking, normalization, every configured change metric), since most of
+those depend on the candidate's parameters.
+"""
+import itertools
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from app.utils.evaluation import (
+    CLASS_NAMES, IMAGE_EXTENSIONS, NUM_CLASSES, confusion_matrix, decode_label_map, find_sample_file,
+    iou_per_class, per_class_dict,
+)
+from app.utils.image_io import prefetch, read_image
+from app.utils.image_processing import analyze_pair, calculate_damage, perform_segmentation
+from app.utils.pipeline_config import DEFAULT_CONFIG, ProcessingConfig
+from app.utils.shared_arrays import SharedArrayPack, attach_arrays
+
+def load_sample_set(directory):
+    """
+    Decode a labelled sample set.
+
+    Returns:
+        (names, images, labels, pairs): BGR images, integer ground-truth labels
+        and (pre_index, post_index) tuples for every <site>_pre/<site>_post pair
+    """
+    image_dir = os.path.join(directory, 'images')
+    mask_dir = os.path.join(directory, 'masks')
+    names, images, labels = [], [], []
+    samples = []
+    for entry in sorted(os.listdir(image_dir)):
+        stem, ext = os.path.splitext(entry)
+        if ext.lower() not in IMAGE_EXTENSIONS:
+            continue
+        mask_path = find_sample_file(mask_dir, stem)
+        if mask_path is None:
+            raise ValueError(f"No ground-truth mask for sample '{stem}' in {mask_dir}")
+        samples.append((stem, os.path.join(image_dir, entry), mask_path))
+    # The next samples are decoded while the current mask is converted to labels
+    for (stem, _, _), (image, mask) in prefetch(samples, lambda sample: (read_image(sample[1]), read_image(sample[2]))):
+        if image is None or mask is None:
+            raise ValueError(f"Failed to decode sample '{stem}'")
+        if image.shape != mask.shape:
+            raise ValueError(f"Sample '{stem}': image {image.shape[:2]} and mask {mask.shape[:2]} differ in size")
+        names.append(stem)
+        images.append(image)
+        labels.append(decode_label_map(cv2.cvtColor(mask, cv2.COLOR_BGR2RGB)))
+
+    index = {name: i for i, name in enumerate(names)}
+    pairs = []
+    for name in names:
+        if name.endswith('_pre') and name[:-4] + '_post' in index:
+            pre, post = index[name], index[name[:-4] + '_post']
+            if images[pre].shape != images[post].shape:
+                raise ValueError(f"Pair '{name[:-4]}': pre and post images differ in size")
+            pairs.append((pre, post))
+    if not names:
+        raise ValueError(f"No samples found in {image_dir}")
+    return names, images, labels, pairs
+
+
+def grid_search_space(grid):
+    """Every combination of a {parameter: [values]} grid, as a list of parameter dicts."""
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def random_search_space(ranges, trials, seed=None):
+    """`trials` parameter dicts sampled uniformly from {parameter: (low, high)} ranges."""
+    rng = random.Random(seed)
+    types = {name: type(getattr(DEFAULT_CONFIG, name)) for name in ranges}
+    space = []
+    for _ in range(trials):
+        params = {}
+        for name, (low, high) in sorted(ranges.items()):
+            params[name] = rng.randint(int(low), int(high)) if types[name] is int else rng.uniform(low, high)
+        space.append(params)
+    return space
+
+
+# Worker-process state: shared-memory views of the sample set
+_worker = {}
+
+
+def _init_worker(descriptor, sample_count, pairs, true_damage, base_config):
+    shm, arrays = attach_arrays(descriptor)
+    _worker.update(shm=shm, arrays=arrays, sample_count=sample_count, pairs=pairs,
+                   true_damage=true_damage, base_config=base_config)
+
+
+def _evaluate(params):
+    """Score one parameter set against the shared sample set."""
+    arrays = _worker['arrays']
+    config = ProcessingConfig.from_dict(dict(_worker['base_config'], **params))
+    predictions = {}
+    damage_errors = []
+    for (pre, post), true_damage in zip(_worker['pairs'], _worker['true_damage']):
+        # Pairs are scored on the maps and damage processing would store
+        result = analyze_pair((arrays[f'image_{pre}'], arrays[f'image_{post}']), config)
+        predictions[pre], predictions[post] = result['segmented_pre'], result['refined_post']
+        damage_errors.append(abs(result['damage_percentage'] - true_damage))
+
+    matrix = np.zeros((NUM_CLASSES, NUM_CLASSES), dtype=np.int64)
+    for i in range(_worker['sample_count']):
+        predicted = predictions[i] if i in predictions else perform_segmentation(arrays[f'image_{i}'], config)
+        matrix += confusion_matrix(arrays[f'labels_{i}'], predicted)
+
+    iou = iou_per_class(matrix)
+    return {
+        'params': params,
+        'confusion_matrix': matrix.tolist(),
+        'iou': per_class_dict(iou),
+        'miou': round(float(np.nanmean(iou)), 4) if not np.all(np.isnan(iou)) else 0.0,
+        'damage_error': round(float(np.mean(damage_errors)), 4) if damage_errors else None,
+    }
+
+
+def _score(trial, damage_weight):
+    """Higher is better: mIoU penalised by the mean absolute damage error (as a fraction)."""
+    penalty = (trial['damage_error'] or 0.0) / 100.0
+    return trial['miou'] - damage_weight * penalty
+
+
+def calibrate(directory, search_space, workers=None, damage_weight=1.0, base_config=None):
+    """
+    Evaluate every parameter set of `search_space` against the sample set.
+
+    Returns:
+        report dict with the best ProcessingConfig (`best_config`), its trial
+        (confusion matrix, per-class IoU, damage error) and all trials ranked
+    """
+    base_config = (base_config or DEFAULT_CONFIG).to_dict()
+    names, images, labels, pairs = load_sample_set(directory)
+
+    arrays = {}
+    for i, (image, label) in enumerate(zip(images, labels)):
+        arrays[f'image_{i}'] = image
+        arrays[f'labels_{i}'] = label
+    true_damage = []
+    for pre, post in pairs:
+        true_damage.append(calculate_damage(labels[pre], labels[post])[2])
+    del images, labels
+
+    with SharedArrayPack(arrays) as pack:
+        del arrays
+        with ProcessPoolExecutor(
+            max_workers=workers or os.cpu_count(),
+            initializer=_init_worker,
+            initargs=(pack.descriptor, len(names), pairs, true_damage, base_config),
+        ) as executor:
+            trials = list(executor.map(_evaluate, search_space))
+
+    for trial in trials:
+        trial['score'] = round(_score(trial, damage_weight), 4)
+    trials.sort(key=lambda trial: trial['score'], reverse=True)
+    best = trials[0]
+    return {
+        'samples': len(names),
+        'pairs': len(pairs),
+        'classes': list(CLASS_NAMES),
+        'best_config': ProcessingConfig.from_dict(dict(base_config, **best['params'])),
+        'best': best,
+        'trials': trials,
+    }
@@ -0,0 +1,148 @@
+"""
+Change-detection kernels on uint8 planes.
+
+Difference planes are computed without widening: cv2.absdiff on the
+converted uint8 images, and the cyclic hue distance (OpenCV hue is 0-179,
+so 179 and 0 are neighbours) through a 256-entry lookup table applied to
+the hue absdiff. The damage mask is then evaluated in place and only where
+the pre image was vegetation: each metric contributes (plane, threshold)
+tests, and each test is thresholded into one reused scratch plane and
+OR-ed into the mask through cv2.bitwise_or with the pre-vegetation mask.
+Temporaries stay a few bytes per pixel, against more than 30 for the
+int32 arithmetic this replaces.
+
+Metrics (ProcessingConfig.change_metrics, comma separated):
+
+    hsv    hue, saturation and value shifts (hue/saturation/value_threshold)
+    lab    CIE76 colour difference in Lab (lab_delta_threshold)
+    index  drop of config.change_index (index_drop_threshold); also enabled
+           by setting change_index alone
+"""
+import cv2
+import numpy as np
+
+from app.utils.vegetation_indices import index_planes
+
+# Wrap-around hue distance by absolute hue difference (0-179); at most 90
+HUE_DISTANCE_LUT = np.array([min(d, 180 - d) if d <= 180 else 0 for d in range(256)], dtype=np.uint8)
+
+# OpenCV's 8-bit Lab stores L* scaled by 255/100 (a*, b* offset by 128)
+_L_SCALE = np.float32(100 / 255)
+
+
+def hsv_difference(pre_image, post_image, buffers=None):
+    """
+    Per-pixel absolute HSV differences between two BGR images as uint8 planes.
+    Hue distance accounts for wrap-around (179 and 0 are close), so it is at most 90.
+    With `buffers` (a BufferScope), the HSV images and planes are borrowed from it.
+    """
+    if buffers is None:
+        difference = cv2.absdiff(cv2.cvtColor(pre_image, cv2.COLOR_BGR2HSV),
+                                 cv2.cvtColor(post_image, cv2.COLOR_BGR2HSV))
+        h_diff, s_diff, v_diff = cv2.split(difference)
+    else:
+        pre_hsv = buffers.borrow(pre_image.shape, np.uint8)
+        post_hsv = buffers.borrow(pre_image.shape, np.uint8)
+        cv2.cvtColor(pre_image, cv2.COLOR_BGR2HSV, dst=pre_hsv)
+        cv2.cvtColor(post_image, cv2.COLOR_BGR2HSV, dst=post_hsv)
+        difference = cv2.absdiff(pre_hsv, post_hsv, dst=pre_hsv)
+        h_diff, s_diff, v_diff = (cv2.extractChannel(difference, channel, dst=buffers.borrow(pre_image.shape[:2], np.uint8))
+                                  for channel in range(3))
+    cv2.LUT(h_diff, HUE_DISTANCE_LUT, dst=h_diff)
+    return h_diff, s_diff, v_diff
+
+
+def lab_delta_e(pre_image, post_image):
+    """CIE76 colour difference between two BGR images, as a uint8 plane (saturating at 255)."""
+    difference = cv2.absdiff(cv2.cvtColor(pre_image, cv2.COLOR_BGR2LAB), cv2.cvtColor(post_image, cv2.COLOR_BGR2LAB))
+    dl, da, db = (plane.astype(np.float32) for plane in cv2.split(difference))
+    dl *= _L_SCALE
+    delta = cv2.magnitude(dl, da)
+    cv2.magnitude(delta, db, delta)
+    return cv2.convertScaleAbs(delta)
+
+
+def index_drop(pre_image, post_image, index):
+    """
+    Per-pixel decrease of a vegetation index from pre to post (uint8, fixed-range
+    quantization so both images share one scale).
+    """
+    pre = index_planes(pre_image, (index,), quantize='fixed')[index]
+    post = index_planes(post_image, (index,), quantize='fixed')[index]
+    # Saturating uint8 subtraction: increases clip to 0
+    return cv2.subtract(pre, post)
+
+
+def _hsv_tests(planes, config):
+    return [(planes['h'], config.hue_threshold), (planes['s'], config.saturation_threshold),
+            (planes['v'], config.value_threshold)]
+
+
+def _lab_tests(planes, config):
+    return [(planes['delta_e'], config.lab_delta_threshold)]
+
+
+def _index_tests(planes, config):
+    return [(planes['drop'], config.index_drop_threshold)]
+
+
+# Metric name -> (difference planes it reads, tests builder)
+METRICS = {
+    'hsv': (('h', 's', 'v'), _hsv_tests),
+    'lab': (('delta_e',), _lab_tests),
+    'index': (('drop',), _index_tests),
+}
+
+
+def parse_metrics(value):
+    """Metric names from a comma-separated string (order kept, duplicates dropped)."""
+    names = []
+    for name in (part.strip() for part in str(value or '').split(',')):
+        if name and name not in names:
+            names.append(name)
+    return tuple(names)
+
+
+def active_metrics(config):
+    """Metrics a config evaluates; a change_index adds 'index'."""
+    names = parse_metrics(config.change_metrics)
+    if config.change_index and 'index' not in names:
+        names += ('index',)
+    return names
+
+
+def required_planes(config):
+    return {plane for name in active_metrics(config) for plane in METRICS[name][0]}
+
+
+def change_tests(planes, config):
+    """(plane, threshold) pairs of every active metric; raises ValueError if a metric's planes are missing."""
+    tests = []
+    for name in active_metrics(config):
+        wanted, build = METRICS[name]
+        missing = [plane for plane in wanted if planes.get(plane) is None]
+        if missing:
+            raise ValueError(f"Change metric '{name}' needs the {', '.join(missing)} difference plane(s)")
+        tests.extend(build(planes, config))
+    return tests
+
+
+def change_mask(veg_pre, segmented_post, vegetation_class, tests, buffers=None):
+    """
+    Damage mask: pre-vegetation that is no longer vegetation in the post
+    segmentation, or whose difference planes exceed any test threshold.
+    Tests are evaluated only on pre-vegetation pixels.
+    """
+    def borrow(dtype):
+        return np.empty(veg_pre.shape, dtype=dtype) if buffers is None else buffers.borrow(veg_pre.shape, dtype)
+
+    change = np.not_equal(segmented_post, vegetation_class, out=borrow(np.bool_))
+    change &= veg_pre
+    if tests:
+        # 0/1 uint8 views of the bool masks, so the tests run as OpenCV masked kernels
+        change_u8, veg_pre_u8 = change.view(np.uint8), np.ascontiguousarray(veg_pre).view(np.uint8)
+        scratch = borrow(np.uint8)
+        for plane, threshold in tests:
+            cv2.threshold(plane, threshold, 1, cv2.THRESH_BINARY, dst=scratch)
+            cv2.bitwise_or(change_u8, scratch, dst=change_u8, mask=veg_pre_u8)
+    return change
@@ -0,0 +1,268 @@
+"""
+Damage patch extraction: individual connected blowdown regions from the
+change-detection mask.
+
+The mask is labelled tile by tile with cv2.connectedComponentsWithStats, so
+the int32 label image never exceeds one tile. Components that touch a tile
+seam are merged afterwards with a union-find over the seam strips, and the
+per-tile statistics (area, centroid, bounding box, perimeter) are additive so
+merging never revisits pixels. Polygons are traced only for the patches that
+survive the minimum-area filter, on a crop of their bounding box.
+"""
+import json
+
+import cv2
+import numpy as np
+
+from app.utils.scheduler import checkpoint
+from app.utils.tiling import DEFAULT_TILE_SIZE, iter_tiles, tile_grid
+
+# Patches smaller than this (in pixels) are treated as speckle and dropped
+DEFAULT_MIN_PATCH_AREA = 50
+
+# Douglas-Peucker tolerance (pixels) used when simplifying exported polygons
+DEFAULT_POLYGON_EPSILON = 1.0
+
+
+def _halo(mask, y0, y1, x0, x1):
+    """Return mask[y0-1:y1+1, x0-1:x1+1], zero-padded outside the image."""
+    height, width = mask.shape
+    top, bottom = max(y0 - 1, 0), min(y1 + 1, height)
+    left, right = max(x0 - 1, 0), min(x1 + 1, width)
+    return cv2.copyMakeBorder(
+        mask[top:bottom, left:right],
+        1 - (y0 - top), 1 - (bottom - y1), 1 - (x0 - left), 1 - (right - x1),
+        cv2.BORDER_CONSTANT, value=0,
+    )
+
+
+def _boundary_edges(halo):
+    """
+    Count, for every pixel of the tile inside `halo`, the 4-neighbours that are
+    background. Summed over a patch this is its crack-length perimeter, and it is
+    exact across tile seams because the halo carries the neighbouring pixels.
+    """
+    inner = halo[1:-1, 1:-1]
+    neighbours = halo[:-2, 1:-1] + halo[2:, 1:-1]
+    neighbours += halo[1:-1, :-2]
+    neighbours += halo[1:-1, 2:]
+    edges = 4 - neighbours
+    edges[inner == 0] = 0
+    return edges
+
+
+def _to_global(strip, offset):
+    """Map a strip of tile-local labels to global ids (background -> -1)."""
+    return np.where(strip > 0, strip.astype(np.int64) + offset, -1)
+
+
+def _seam_pairs(a, b):
+    """8-connected label pairs across a seam; a and b are the facing strips."""
+    pairs = [np.stack([a, b], axis=1)]
+    if len(a) > 1:
+        pairs.append(np.stack([a[:-1], b[1:]], axis=1))
+        pairs.append(np.stack([a[1:], b[:-1]], axis=1))
+    pairs = np.concatenate(pairs)
+    return pairs[(pairs[:, 0] >= 0) & (pairs[:, 1] >= 0)]
+
+
+def _find_roots(parent):
+    """Flatten a parent array so every entry points at its root."""
+    while True:
+        grandparent = parent[parent]
+        if np.array_equal(grandparent, parent):
+            return parent
+        parent = grandparent
+
+
+def _union_pairs(count, pairs):
+    """Union-find over global component ids; returns the root of each id."""
+    parent = np.arange(count, dtype=np.int64)
+    if len(pairs) == 0:
+        return parent
+    pairs = np.unique(np.sort(pairs, axis=1), axis=0)
+    for a, b in pairs:
+        ra, rb = a, b
+        while parent[ra] != ra:
+            ra = parent[ra]
+        while parent[rb] != rb:
+            rb = parent[rb]
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    return _find_roots(parent)
+
+
+def _trace_polygon(mask, patch, epsilon):
+    """
+    Trace the outer ring and holes of one patch on a crop of its bounding box.
+    Returns GeoJSON-style polygon coordinates in pixel space.
+    """
+    x0, y0, x1, y1 = patch['min_x'], patch['min_y'], patch['max_x'] + 1, patch['max_y'] + 1
+    crop = np.ascontiguousarray(mask[y0:y1, x0:x1])
+    contours, hierarchy = cv2.findContours(crop, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+    if hierarchy is None:
+        return []
+    hierarchy = hierarchy[0]
+    crop_rect = (0, 0, x1 - x0, y1 - y0)
+
+    # The patch is the outer contour spanning the whole crop; other components in
+    # the crop are disjoint from it and cannot span the same bounding box unless
+    # they interleave, in which case the larger one is the patch.
+    outer, outer_area = None, -1.0
+    for idx, contour in enumerate(contours):
+        if hierarchy[idx][3] != -1 or cv2.boundingRect(contour) != crop_rect:
+            continue
+        area = cv2.contourArea(contour)
+        if area > outer_area:
+            outer, outer_area = idx, area
+    if outer is None:
+        return []
+
+    rings = [contours[outer]]
+    child = hierarchy[outer][2]
+    while child != -1:
+        rings.append(contours[child])
+        child = hierarchy[child][0]
+
+    polygon = []
+    for ring in rings:
+        if epsilon > 0:
+            ring = cv2.approxPolyDP(ring, epsilon, True)
+        points = (ring.reshape(-1, 2) + (x0, y0)).tolist()
+        if len(points) < 3:
+            continue
+        points.append(points[0])
+        polygon.append(points)
+    return polygon
+
+
+def extract_damage_patches(mask, min_area=DEFAULT_MIN_PATCH_AREA, tile_size=DEFAULT_TILE_SIZE,
+                           with_polygons=True, epsilon=DEFAULT_POLYGON_EPSILON):
+    """
+    Extract connected damage patches (8-connectivity) from a binary mask.
+
+    Args:
+        mask: 2D boolean/uint8 damage mask (e.g. significant_change)
+        min_area: minimum patch area in pixels
+        tile_size: tile edge used for labelling
+        with_polygons: trace a simplified outline polygon for each patch
+        epsilon: polygon simplification tolerance in pixels (0 disables)
+
+    Returns:
+        List of patch dictionaries sorted by area (largest first). Coordinates
+        are in pixels; bounding boxes are inclusive and perimeter is the
+        crack length (number of pixel edges facing background).
+    """
+    mask = np.ascontiguousarray(mask)
+    mask = mask.view(np.uint8) if mask.dtype == bool else (mask > 0).astype(np.uint8)
+    height, width = mask.shape
+    row_starts, col_starts = tile_grid(height, width, tile_size)
+
+    # Facing strips of global labels per seam, assembled across the whole mosaic
+    # so diagonal connections at tile corners are seen as well.
+    v_left = np.full((len(col_starts), height), -1, dtype=np.int64)
+    v_right = np.full((len(col_starts), height), -1, dtype=np.int64)
+    h_top = np.full((len(row_starts), width), -1, dtype=np.int64)
+    h_bottom = np.full((len(row_starts), width), -1, dtype=np.int64)
+
+    areas, sum_x, sum_y = [], [], []
+    lefts, tops, rights, bottoms, perimeters = [], [], [], [], []
+    next_id = 0
+
+    for row, col, y0, y1, x0, x1 in iter_tiles(height, width, tile_size):
+        checkpoint()
+        tile = mask[y0:y1, x0:x1]
+        if not tile.any():
+            continue
+        count, labels, stats, centroids = cv2.connectedComponentsWithStats(
+            tile, connectivity=8, ltype=cv2.CV_32S
+        )
+        if count <= 1:
+            continue
+
+        edges = _boundary_edges(_halo(mask, y0, y1, x0, x1))
+        perimeter = np.bincount(labels.ravel(), weights=edges.ravel(), minlength=count)
+
+        stats, centroids, perimeter = stats[1:], centroids[1:], perimeter[1:]
+        area = stats[:, cv2.CC_STAT_AREA].astype(np.int64)
+        areas.append(area)
+        sum_x.append((centroids[:, 0] + x0) * area)
+        sum_y.append((centroids[:, 1] + y0) * area)
+        lefts.append(stats[:, cv2.CC_STAT_LEFT] + x0)
+        tops.append(stats[:, cv2.CC_STAT_TOP] + y0)
+        rights.append(stats[:, cv2.CC_STAT_LEFT] + stats[:, cv2.CC_STAT_WIDTH] - 1 + x0)
+        bottoms.append(stats[:, cv2.CC_STAT_TOP] + stats[:, cv2.CC_STAT_HEIGHT] - 1 + y0)
+        perimeters.append(perimeter)
+
+        # Local label l >= 1 becomes global id next_id + l - 1; background -> -1
+        offset = next_id - 1
+        v_left[col, y0:y1] = _to_global(labels[:, 0], offset)
+        v_right[col, y0:y1] = _to_global(labels[:, -1], offset)
+        h_top[row, x0:x1] = _to_global(labels[0, :], offset)
+        h_bottom[row, x0:x1] = _to_global(labels[-1, :], offset)
+        next_id += count - 1
+
+    if next_id == 0:
+        return []
+
+    pairs = [np.empty((0, 2), dtype=np.int64)]
+    for col in range(1, len(col_starts)):
+        pairs.append(_seam_pairs(v_right[col - 1], v_left[col]))
+    for row in range(1, len(row_starts)):
+        pairs.append(_seam_pairs(h_bottom[row - 1], h_top[row]))
+    roots = _union_pairs(next_id, np.concatenate(pairs))
+
+    patch_ids, inverse = np.unique(roots, return_inverse=True)
+    n = len(patch_ids)
+    area = np.bincount(inverse, weights=np.concatenate(areas), minlength=n)
+    cx = np.bincount(inverse, weights=np.concatenate(sum_x), minlength=n) / area
+    cy = np.bincount(inverse, weights=np.concatenate(sum_y), minlength=n) / area
+    perimeter = np.bincount(inverse, weights=np.concatenate(perimeters), minlength=n)
+    min_x = np.full(n, width, dtype=np.int64)
+    min_y = np.full(n, height, dtype=np.int64)
+    max_x = np.full(n, -1, dtype=np.int64)
+    max_y = np.full(n, -1, dtype=np.int64)
+    np.minimum.at(min_x, inverse, np.concatenate(lefts))
+    np.minimum.at(min_y, inverse, np.concatenate(tops))
+    np.maximum.at(max_x, inverse, np.concatenate(rights))
+    np.maximum.at(max_y, inverse, np.concatenate(bottoms))
+
+    patches = []
+    for idx in np.flatnonzero(area >= max(1, min_area)):
+        patches.append({
+            'area': int(area[idx]),
+            'perimeter': float(perimeter[idx]),
+            'centroid_x': round(float(cx[idx]), 2),
+            'centroid_y': round(float(cy[idx]), 2),
+            'min_x': int(min_x[idx]),
+            'min_y': int(min_y[idx]),
+            'max_x': int(max_x[idx]),
+            'max_y': int(max_y[idx]),
+        })
+    patches.sort(key=lambda patch: patch['area'], reverse=True)
+
+    if with_polygons:
+        for patch in patches:
+            patch['polygon'] = _trace_polygon(mask, patch, epsilon)
+    return patches
+
+
+def patches_to_geojson(patches):
+    """
+    Build a GeoJSON FeatureCollection (pixel coordinates) from patch dictionaries
+    or DamagePatch rows.
+    """
+    features = []
+    for patch in patches:
+        if not isinstance(patch, dict):
+            patch = patch.to_dict()
+        polygon = patch.get('polygon')
+        if isinstance(polygon, str):
+            polygon = json.loads(polygon)
+        properties = {key: value for key, value in patch.items() if key != 'polygon'}
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Polygon', 'coordinates': polygon} if polygon else None,
+            'properties': properties,
+        })
+    return {'type': 'FeatureCollection', 'features': features}
@@ -0,0 +1,238 @@
+"""
+Segmentation accuracy evaluation against ground-truth label maps.
+
+Label maps are either single-channel integer images (class ids 0-5) or RGB
+masks painted in the manuscript HEX palette, decoded through a 24-bit
+reverse lookup table in one vectorized pass. Each image contributes one
+np.bincount confusion matrix; matrices are summed across images (in
+parallel worker processes) into mIoU, per-class F1 and, for
+`<site>_pre`/`<site>_post` pairs, the damage-percentage error. Source image
+pairs run through the same stages as process_images (masking,
+normalization, change detection), so the damage scored is the one the
+application reports.
+
+A report can be compared with a stored baseline report so a change to the
+segmentation can be gated on not regressing the metrics.
+"""
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from app.utils.image_processing import (
+    CLASS_NAMES, CLASS_PALETTE, CLASS_UNLABELED, analyze_pair, calculate_damage, perform_segmentation,
+)
+from app.utils.pipeline_config import ProcessingConfig, DEFAULT_CONFIG
+
+NUM_CLASSES = 6
+# Manuscript palette indexed by class id
+PALETTE = CLASS_PALETTE
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.tif', '.tiff'}
+
+# Default allowed drop (absolute) before a metric counts as a regression
+DEFAULT_TOLERANCE = 0.005
+
+
+@functools.lru_cache(maxsize=1)
+def _reverse_palette_lut():
+    """24-bit packed RGB -> class id (unknown colors map to unlabeled); 16 MB, built once."""
+    lut = np.full(1 << 24, CLASS_UNLABELED, dtype=np.uint8)
+    for class_id, (r, g, b) in enumerate(PALETTE):
+        lut[(r << 16) | (g << 8) | b] = class_id
+    return lut
+
+
+def decode_label_map(mask_rgb):
+    """Convert an RGB mask painted in the manuscript palette to integer labels."""
+    packed = mask_rgb[..., 0].astype(np.uint32) << 16
+    packed |= mask_rgb[..., 1].astype(np.uint32) << 8
+    packed |= mask_rgb[..., 2]
+    return _reverse_palette_lut()[packed]
+
+
+def load_label_map(path):
+    """Read a label map from disk: integer class ids (single channel) or palette RGB."""
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError(f"Failed to decode label map: {path}")
+    if image.ndim == 2:
+        return image.astype(np.uint8)
+    return decode_label_map(cv2.cvtColor(image[..., :3], cv2.COLOR_BGR2RGB))
+
+
+def confusion_matrix(ground_truth, predicted):
+    """NUM_CLASSES x NUM_CLASSES confusion matrix (rows: ground truth, columns: prediction)."""
+    flat = ground_truth.ravel().astype(np.intp) * NUM_CLASSES + predicted.ravel()
+    return np.bincount(flat, minlength=NUM_CLASSES * NUM_CLASSES).reshape(NUM_CLASSES, NUM_CLASSES)
+
+
+def iou_per_class(matrix):
+    """Per-class intersection over union; NaN for classes absent from both maps."""
+    tp = np.diag(matrix).astype(np.float64)
+    denominator = matrix.sum(axis=0) + matrix.sum(axis=1) - tp
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator > 0, tp / denominator, np.nan)
+
+
+def f1_per_class(matrix):
+    """Per-class F1 (Dice) score; NaN for classes absent from both maps."""
+    tp = np.diag(matrix).astype(np.float64)
+    denominator = matrix.sum(axis=0) + matrix.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator > 0, 2 * tp / denominator, np.nan)
+
+
+def per_class_dict(values):
+    """Map per-class values to class names (NaN -> None) for JSON reports."""
+    return {name: (None if np.isnan(v) else round(float(v), 4)) for name, v in zip(CLASS_NAMES, values)}
+
+
+def summarize(matrix, damage_errors=()):
+    """Aggregate metrics of a summed confusion matrix."""
+    matrix = np.asarray(matrix)
+    iou, f1 = iou_per_class(matrix), f1_per_class(matrix)
+    total = matrix.sum()
+    return {
+        'pixels': int(total),
+        'pixel_accuracy': round(float(np.trace(matrix) / total), 4) if total else 0.0,
+        'miou': round(float(np.nanmean(iou)), 4) if not np.all(np.isnan(iou)) else 0.0,
+        'iou': per_class_dict(iou),
+        'f1': per_class_dict(f1),
+        'damage_error': round(float(np.mean(damage_errors)), 4) if len(damage_errors) else None,
+        'confusion_matrix': matrix.tolist(),
+    }
+
+
+def find_sample_file(directory, stem):
+    """Path of `stem` with any supported image extension in `directory`, or None."""
+    for ext in IMAGE_EXTENSIONS:
+        path = os.path.join(directory, stem + ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _work_units(stems):
+    """Group stems so each <site>_pre/<site>_post pair is evaluated in one task."""
+    stems = set(stems)
+    units = []
+    for stem in sorted(stems):
+        if stem.endswith('_post') and stem[:-5] + '_pre' in stems:
+            continue
+        if stem.endswith('_pre') and stem[:-4] + '_post' in stems:
+            units.append((stem, stem[:-4] + '_post'))
+        else:
+            units.append((stem,))
+    return units
+
+
+def _predict(unit, pred_dir, image_dir, config):
+    """
+    Predicted label maps of a unit and, for a pair, the predicted damage.
+
+    Source images go through the processing pipeline (analyze_pair): a pair
+    yields the pre segmentation and the refined post map process_images
+    stores, and the damage it reports. Stored label maps are used as they
+    are, the post map being the refined one.
+    """
+    if not image_dir:
+        predictions = [load_label_map(find_sample_file(pred_dir, stem)) for stem in unit]
+        damage = calculate_damage(*predictions)[2] if len(unit) == 2 else None
+        return predictions, damage
+    images = []
+    for stem in unit:
+        image = cv2.imread(find_sample_file(image_dir, stem))
+        if image is None:
+            raise ValueError(f"Failed to decode image for sample '{stem}'")
+        images.append(image)
+    if len(unit) == 1:
+        return [perform_segmentation(images[0], config)], None
+    if images[0].shape != images[1].shape:
+        raise ValueError(f"Pair '{unit[0][:-4]}': pre and post images differ in size")
+    result = analyze_pair(images, config)
+    return [result['segmented_pre'], result['refined_post']], result['damage_percentage']
+
+
+def _evaluate_unit(task):
+    """Worker: confusion matrix of each image of a unit, plus damage error for a pair."""
+    unit, gt_dir, pred_dir, image_dir, config = task
+    config = ProcessingConfig.from_dict(config)
+    predictions, predicted_damage = _predict(unit, pred_dir, image_dir, config)
+    matrix = np.zeros((NUM_CLASSES, NUM_CLASSES), dtype=np.int64)
+    truths = []
+    for stem, predicted in zip(unit, predictions):
+        truth = load_label_map(find_sample_file(gt_dir, stem))
+        if truth.shape != predicted.shape:
+            raise ValueError(f"Sample '{stem}': prediction {predicted.shape} and ground truth {truth.shape} differ in size")
+        matrix += confusion_matrix(truth, predicted)
+        truths.append(truth)
+
+    damage_error = None
+    if len(unit) == 2:
+        true_damage = calculate_damage(truths[0], truths[1])[2]
+        damage_error = abs(predicted_damage - true_damage)
+    return unit, matrix, damage_error
+
+
+def evaluate(gt_dir, pred_dir=None, image_dir=None, config=None, workers=None):
+    """
+    Evaluate predicted label maps (or the pipeline's output on `image_dir`) against ground truth.
+
+    Returns:
+        report dict: aggregate metrics plus per-image mIoU for spotting outliers
+    """
+    if not pred_dir and not image_dir:
+        raise ValueError("Either a predictions directory or an images directory is required")
+    source_dir = image_dir or pred_dir
+    stems = [
+        os.path.splitext(entry)[0] for entry in sorted(os.listdir(gt_dir))
+        if os.path.splitext(entry)[1].lower() in IMAGE_EXTENSIONS
+        and find_sample_file(source_dir, os.path.splitext(entry)[0])
+    ]
+    if not stems:
+        raise ValueError(f"No matching samples between {gt_dir} and {source_dir}")
+
+    config = (config or DEFAULT_CONFIG).to_dict()
+    tasks = [(unit, gt_dir, pred_dir, image_dir, config) for unit in _work_units(stems)]
+    total = np.zeros((NUM_CLASSES, NUM_CLASSES), dtype=np.int64)
+    damage_errors, per_image = [], {}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for unit, matrix, damage_error in executor.map(_evaluate_unit, tasks, chunksize=8):
+            total += matrix
+            if damage_error is not None:
+                damage_errors.append(damage_error)
+            per_image['+'.join(unit)] = round(float(np.nanmean(iou_per_class(matrix))), 4)
+
+    report = summarize(total, damage_errors)
+    report['samples'] = len(stems)
+    report['pairs'] = len(damage_errors)
+    report['config'] = config
+    report['per_image_miou'] = per_image
+    return report
+
+
+def compare_reports(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    List metric regressions of `current` against `baseline`: mIoU, per-class F1 and
+    pixel accuracy may not drop, and the damage error may not grow, by more than `tolerance`
+    (damage error tolerance is in percentage points, scaled by 100).
+    """
+    regressions = []
+
+    def check(name, now, before, higher_is_better=True, scale=1.0):
+        if now is None or before is None:
+            return
+        delta = (now - before) if higher_is_better else (before - now)
+        if delta < -tolerance * scale:
+            regressions.append({'metric': name, 'baseline': before, 'current': now})
+
+    check('miou', current['miou'], baseline['miou'])
+    check('pixel_accuracy', current['pixel_accuracy'], baseline['pixel_accuracy'])
+    for name in CLASS_NAMES:
+        check(f'f1.{name}', current['f1'].get(name), baseline['f1'].get(name))
+    check('damage_error', current.get('damage_error'), baseline.get('damage_error'),
+          higher_is_better=False, scale=100.0)
+    return regressions
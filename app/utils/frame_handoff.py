@@ -0,0 +1,177 @@
+"""
+Handoff of decoded frames to same-host worker processes through shared memory.
+
+The web process decodes a pre/post pair once and copies it into a shared
+memory segment together with empty output slots (label maps and HSV
+difference planes). That copy is the only one: cv2.imdecode cannot decode
+into caller-provided memory. A worker process attaches by segment name,
+computes straight into the output views and returns only a small status
+dict, and the caller reads the results in place, so neither the frames nor
+the results are pickled, written to disk, re-decoded or copied back. The
+pack is owned (and always unlinked) by the submitting process, when the
+job's buffer scope ends.
+
+Workers can be pre-forked with FramePool.start(): each runs warm_up() as it
+starts, so OpenCV's dispatch and the worker's buffer pool are ready before
+the first job, and every status carries the worker's buffer pool metrics.
+"""
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import resource_tracker
+
+import numpy as np
+
+from app.utils.buffer_pool import pool_metrics, worker_pool
+from app.utils.image_processing import hsv_difference, perform_segmentation
+from app.utils.pipeline_config import ProcessingConfig
+from app.utils.shared_arrays import SharedArrayPack, attach_arrays
+
+# Products a worker can compute for a pair
+SEGMENTATION = 'segmentation'
+HSV_DIFF = 'hsv_diff'
+
+
+# Frame size warmed by default (width, height)
+DEFAULT_WARM_SIZE = (1024, 1024)
+
+
+def parse_size(value):
+    """(width, height) from 'WIDTHxHEIGHT'; None for an empty value."""
+    if not value:
+        return None
+    try:
+        width, height = (int(part) for part in str(value).lower().split('x'))
+    except ValueError:
+        raise ValueError(f"Size must be WIDTHxHEIGHT, got {value!r}")
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Size must be positive, got {value!r}")
+    return width, height
+
+
+def warm_up(size=DEFAULT_WARM_SIZE):
+    """
+    Run segmentation and the HSV difference on a synthetic pair of `size`
+    (width, height) in the calling thread. The second pass is served from
+    the thread's buffer pool, which then holds the frames a job of that
+    size borrows.
+    """
+    width, height = size
+    rng = np.random.default_rng(0)
+    pre = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    post = pre[::-1].copy()
+    for _ in range(2):
+        perform_segmentation(pre)
+        with worker_pool().scope() as buffers:
+            hsv_difference(pre, post, buffers=buffers)
+
+
+def _ready():
+    return os.getpid()
+
+
+def _output_slots(shape, products):
+    slots = {}
+    if SEGMENTATION in products:
+        slots.update(seg_pre=(shape, 'uint8'), seg_post=(shape, 'uint8'))
+    if HSV_DIFF in products:
+        slots.update(h=(shape, 'uint8'), s=(shape, 'uint8'), v=(shape, 'uint8'))
+    return slots
+
+
+def _analyze(descriptor, config_dict, products):
+    """Worker: compute the requested products of the shared pair into its output slots."""
+    shm, arrays = attach_arrays(descriptor)
+    try:
+        pre, post, valid = arrays['pre'], arrays['post'], arrays.get('valid')
+        if SEGMENTATION in products:
+            config = ProcessingConfig.from_dict(config_dict)
+            arrays['seg_pre'][...] = perform_segmentation(pre, config, valid)
+            arrays['seg_post'][...] = perform_segmentation(post, config, valid)
+        if HSV_DIFF in products:
+            with worker_pool().scope() as buffers:
+                arrays['h'][...], arrays['s'][...], arrays['v'][...] = hsv_difference(pre, post, buffers=buffers)
+        return {'pid': os.getpid(), 'buffers': pool_metrics()}
+    finally:
+        del pre, post, valid, arrays
+        shm.close()
+
+
+class FramePool:
+    """Process pool that analyzes decoded pre/post pairs through shared memory."""
+
+    def __init__(self, workers=None, warm_size=None):
+        self.workers = workers or os.cpu_count()
+        self.warm_size = warm_size
+        # Latest buffer pool metrics reported by each worker process, by pid
+        self.worker_metrics = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                warm = (warm_up, (self.warm_size,)) if self.warm_size else (None, ())
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warm[0], initargs=warm[1])
+            return self._executor
+
+    def start(self):
+        """Fork (and warm) every worker now rather than on the first jobs."""
+        # Forked workers must share this process's tracker, or each would start its
+        # own and report the segments it attached to as leaked
+        resource_tracker.ensure_running()
+        executor = self._pool()
+        wait([executor.submit(_ready) for _ in range(self.workers)])
+
+    def analyze(self, pre_image, post_image, config, products=(SEGMENTATION, HSV_DIFF), valid=None, scope=None):
+        """
+        Compute `products` for an aligned BGR pair in a worker process.
+        `valid` is the pair's validity mask, shared along with the frames
+        (which are copied into the segment).
+
+        Returns:
+            dict with seg_pre/seg_post and/or h/s/v arrays. With `scope` (the
+            job's BufferScope) they are views into the segment, which is
+            unlinked when the scope ends; without one they are copied out and
+            the segment is unlinked before returning.
+        """
+        products = tuple(products)
+        inputs = {'pre': pre_image, 'post': post_image}
+        if valid is not None:
+            inputs['valid'] = valid
+        pack = SharedArrayPack(inputs, empty=_output_slots(pre_image.shape[:2], products))
+        try:
+            status = self._pool().submit(_analyze, pack.descriptor, config.to_dict(), products).result()
+            self.worker_metrics[status['pid']] = status['buffers']
+            views = pack.arrays()
+            if scope is not None:
+                scope.on_exit(pack.close)
+                return {key: views[key] for key in views if key not in inputs}
+            return {key: views[key].copy() for key in views if key not in inputs}
+        except BaseException:
+            pack.close()
+            raise
+        finally:
+            if scope is None:
+                pack.close()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def shared_frame_pool(workers, warm_size=None):
+    """Process-wide FramePool, created on first use and shut down at exit."""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = FramePool(workers, warm_size)
+            atexit.register(_shared_pool.shutdown)
+        return _shared_pool
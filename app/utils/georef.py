@@ -0,0 +1,186 @@
+"""
+Georeferencing of uploaded images.
+
+An assessment's georef maps pixel (column, row) to map coordinates in a
+projected CRS in metres, as a GDAL-style geotransform
+[x0, pixel_width, row_rotation, y0, column_rotation, pixel_height] where
+(x0, y0) is the outer corner of the top-left pixel:
+
+    X = x0 + col * pixel_width + row * row_rotation
+    Y = y0 + col * column_rotation + row * pixel_height
+
+It is read from GeoTIFF tags (ModelPixelScale/ModelTiepoint or
+ModelTransformation, EPSG from the GeoKey directory), from a world file
+next to the image (.jgw, .pgw, .tfw, .jpgw, .wld), or given explicitly
+through the API. Only the TIFF header and first IFD are read, never the
+pixels.
+"""
+import math
+import os
+import struct
+
+# TIFF tags
+_MODEL_PIXEL_SCALE = 33550
+_MODEL_TIEPOINT = 33922
+_MODEL_TRANSFORMATION = 34264
+_GEO_KEY_DIRECTORY = 34735
+# GeoKeys
+_RASTER_TYPE = 1025
+_RASTER_PIXEL_IS_POINT = 2
+_GEOGRAPHIC_TYPE = 2048
+_PROJECTED_CS_TYPE = 3072
+
+_TIFF_TYPES = {3: ('H', 2), 4: ('I', 4), 12: ('d', 8), 16: ('Q', 8)}
+
+
+def _geotransform(values):
+    try:
+        geotransform = [float(v) for v in values]
+    except (TypeError, ValueError):
+        raise ValueError("geotransform must be 6 numbers")
+    if len(geotransform) != 6 or not all(math.isfinite(v) for v in geotransform):
+        raise ValueError("geotransform must be 6 numbers")
+    if pixel_area(geotransform) == 0:
+        raise ValueError("geotransform is degenerate (zero pixel area)")
+    return geotransform
+
+
+def parse_world_file(text):
+    """Geotransform from world file text (A, D, B, E, C, F; C/F at the centre of the top-left pixel)."""
+    try:
+        a, d, b, e, c, f = (float(line) for line in str(text).split())
+    except ValueError:
+        raise ValueError("A world file has six numeric lines")
+    # Shift the reference from the pixel centre to its outer corner
+    return _geotransform([c - a / 2 - b / 2, a, b, f - d / 2 - e / 2, d, e])
+
+
+def parse_georef(data):
+    """
+    Validate and normalise a georef given as {'geotransform': [6 numbers]} or
+    {'world_file': text}, with an optional 'epsg' code.
+
+    Returns {'geotransform': [...], 'epsg': int or None}, or None when empty.
+    Raises ValueError on malformed input.
+    """
+    if not data:
+        return None
+    if not isinstance(data, dict) or set(data) - {'geotransform', 'world_file', 'epsg'}:
+        raise ValueError("Georef must be an object with geotransform or world_file, and epsg")
+    if data.get('geotransform') is not None:
+        geotransform = _geotransform(data['geotransform'])
+    elif data.get('world_file'):
+        geotransform = parse_world_file(data['world_file'])
+    else:
+        raise ValueError("Georef needs a geotransform or a world_file")
+    epsg = data.get('epsg')
+    if epsg is not None:
+        try:
+            epsg = int(epsg)
+        except (TypeError, ValueError):
+            raise ValueError("epsg must be an integer code")
+    return {'geotransform': geotransform, 'epsg': epsg}
+
+
+def pixel_area(geotransform):
+    """Ground area of one pixel in squared CRS units."""
+    _, a, b, _, d, e = geotransform
+    return abs(a * e - b * d)
+
+
+def pixel_size(geotransform):
+    """Ground (width, height) of one pixel."""
+    _, a, b, _, d, e = geotransform
+    return math.hypot(a, d), math.hypot(b, e)
+
+
+def pixel_to_world(geotransform, col, row):
+    """Map coordinates of pixel positions (scalars or numpy arrays; corners are integers)."""
+    x0, a, b, y0, d, e = geotransform
+    return x0 + col * a + row * b, y0 + col * d + row * e
+
+
+def _tiff_tags(f):
+    """{tag: values} of the first IFD of a classic (non-Big) TIFF, for the tags read here."""
+    order = f.read(2)
+    if order not in (b'II', b'MM'):
+        return None
+    endian = '<' if order == b'II' else '>'
+    magic, offset = struct.unpack(endian + 'HI', f.read(6))
+    if magic != 42:
+        return None
+    f.seek(offset)
+    (count,) = struct.unpack(endian + 'H', f.read(2))
+    entries = [struct.unpack(endian + 'HHII', f.read(12)) for _ in range(count)]
+    wanted = (_MODEL_PIXEL_SCALE, _MODEL_TIEPOINT, _MODEL_TRANSFORMATION, _GEO_KEY_DIRECTORY)
+    tags = {}
+    for tag, kind, n, value in entries:
+        if tag not in wanted or kind not in _TIFF_TYPES:
+            continue
+        code, size = _TIFF_TYPES[kind]
+        if n * size <= 4:
+            raw = struct.pack(endian + 'I', value)[:n * size]
+        else:
+            f.seek(value)
+            raw = f.read(n * size)
+        tags[tag] = struct.unpack(f"{endian}{n}{code}", raw)
+    return tags
+
+
+def _geo_keys(directory):
+    keys = {}
+    if directory and len(directory) >= 4:
+        for i in range(directory[3]):
+            key, location, _, value = directory[4 + 4 * i:8 + 4 * i]
+            if location == 0:  # Value stored inline
+                keys[key] = value
+    return keys
+
+
+def geotiff_georef(path):
+    """Georef from the GeoTIFF tags of `path`, or None if it has none (or is not a TIFF)."""
+    try:
+        with open(path, 'rb') as f:
+            tags = _tiff_tags(f)
+    except (OSError, struct.error):
+        return None
+    if not tags:
+        return None
+    keys = _geo_keys(tags.get(_GEO_KEY_DIRECTORY))
+    if _MODEL_TRANSFORMATION in tags:
+        m = tags[_MODEL_TRANSFORMATION]
+        geotransform = [m[3], m[0], m[1], m[7], m[4], m[5]]
+    elif _MODEL_PIXEL_SCALE in tags and _MODEL_TIEPOINT in tags:
+        scale_x, scale_y = tags[_MODEL_PIXEL_SCALE][:2]
+        i, j, _, x, y, _ = tags[_MODEL_TIEPOINT][:6]
+        geotransform = [x - i * scale_x, scale_x, 0.0, y + j * scale_y, 0.0, -scale_y]
+    else:
+        return None
+    if keys.get(_RASTER_TYPE) == _RASTER_PIXEL_IS_POINT:
+        # Tie points refer to pixel centres
+        geotransform[0] -= (geotransform[1] + geotransform[2]) / 2
+        geotransform[3] -= (geotransform[4] + geotransform[5]) / 2
+    epsg = keys.get(_PROJECTED_CS_TYPE) or keys.get(_GEOGRAPHIC_TYPE)
+    try:
+        return {'geotransform': _geotransform(geotransform), 'epsg': epsg}
+    except ValueError:
+        return None
+
+
+def world_file_georef(path):
+    """Georef from a world file next to `path` (e.g. photo.jgw or photo.jpgw), or None."""
+    stem, extension = os.path.splitext(path)
+    # First and last letter of the extension plus 'w' (.jgw, .pgw, .tfw), the extension plus 'w', or .wld
+    for candidate in (stem + extension[:2] + extension[-1:] + 'w', path + 'w', stem + '.wld'):
+        if os.path.isfile(candidate):
+            try:
+                with open(candidate) as f:
+                    return {'geotransform': parse_world_file(f.read()), 'epsg': None}
+            except (OSError, ValueError):
+                return None
+    return None
+
+
+def image_georef(path):
+    """Georef embedded in or next to an image: GeoTIFF tags first, then a world file."""
+    return geotiff_georef(path) or world_file_georef(path)
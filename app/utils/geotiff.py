@@ -0,0 +1,247 @@
+"""
+Tiled, compressed GeoTIFF export of label rasters.
+
+write_geotiff() writes a single-band uint8 raster (class labels or change
+codes) as a palette GeoTIFF that desktop GIS opens at any zoom without
+reading the whole file:
+
+  * 256x256 tiles, each deflate-compressed (TIFF compression 8);
+  * internal overviews (reduced-resolution IFDs at 1/2, 1/4, ... until the
+    image fits in one tile), sampled nearest-neighbour as labels must not
+    be blended;
+  * the palette of the label map as ColorMap, so classes show in their
+    usual colours;
+  * georeferencing from the assessment's geotransform: ModelPixelScale and
+    ModelTiepoint (ModelTransformation if rotated) and a GeoKey directory
+    with the EPSG code, PixelIsArea.
+
+Tiles are produced with tiling.iter_tiles, compressed on a thread pool a
+window at a time and appended to the file as they complete; the tile
+offsets and IFDs are written after the pixel data and the header is
+patched to point at them. Overview tiles are strided views of the source
+array, so no level is materialised: memory stays at the label map itself
+plus a window of compressed tiles. Classic (32-bit offset) TIFF.
+"""
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from app.utils.image_processing import CHANGE_INVALID, CHANGE_PALETTE, CLASS_PALETTE
+from app.utils.label_maps import read_label_map
+from app.utils.tiling import iter_tiles
+
+TILE_SIZE = 256
+DEFAULT_COMPRESSION = 6
+# Tiles compressed per round on the thread pool
+_WINDOW = 64
+
+# TIFF field types
+_SHORT, _LONG, _ASCII, _DOUBLE = 3, 4, 2, 12
+_TYPE_FORMATS = {_SHORT: 'H', _LONG: 'I', _DOUBLE: 'd'}
+
+# Exportable result layers: assessment attribute of the label map, palette, nodata value
+EXPORT_LAYERS = {
+    'pre': ('pre_vis_path', CLASS_PALETTE, None),
+    'post': ('post_vis_path', CLASS_PALETTE, None),
+    'change': ('change_vis_path', CHANGE_PALETTE, CHANGE_INVALID),
+}
+
+# GeoKeys
+_MODEL_TYPE, _RASTER_TYPE, _PROJECTED_CS_TYPE = 1024, 1025, 3072
+_MODEL_PROJECTED, _RASTER_PIXEL_IS_AREA = 1, 1
+
+
+def overview_factors(height, width, tile_size=TILE_SIZE):
+    """Reduction factors of the internal overviews (2, 4, ...) until one tile covers the image."""
+    factors = []
+    factor = 2
+    while max(-(-height // (factor // 2)), -(-width // (factor // 2))) > tile_size:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+def _geo_tags(georef):
+    """GeoTIFF tags [(tag, type, values)] for a {'geotransform', 'epsg'} georef."""
+    x0, a, b, y0, d, e = georef['geotransform']
+    if b == 0 and d == 0:
+        tags = [(33550, _DOUBLE, [a, -e, 0.0]),
+                (33922, _DOUBLE, [0.0, 0.0, 0.0, x0, y0, 0.0])]
+    else:
+        tags = [(34264, _DOUBLE, [a, b, 0.0, x0, d, e, 0.0, y0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 1.0])]
+    keys = [(_RASTER_TYPE, 0, 1, _RASTER_PIXEL_IS_AREA)]
+    if georef.get('epsg'):
+        keys = [(_MODEL_TYPE, 0, 1, _MODEL_PROJECTED)] + keys + [(_PROJECTED_CS_TYPE, 0, 1, int(georef['epsg']))]
+    directory = [1, 1, 0, len(keys)] + [value for key in keys for value in key]
+    tags.append((34735, _SHORT, directory))
+    return tags
+
+
+def _color_map(palette):
+    """TIFF ColorMap (all reds, then greens, then blues, 16-bit) of an RGB palette padded to 256 entries."""
+    colors = np.zeros((256, 3), dtype=np.uint16)
+    colors[:len(palette)] = np.array(palette, dtype=np.uint16) * 257
+    return colors.T.ravel().tolist()
+
+
+def _tiles(labels, factor, tile_size, fill):
+    """Full-size tiles (bytes) of `labels` reduced by `factor`, row-major; edge tiles are padded with `fill`."""
+    level = labels[::factor, ::factor] if factor > 1 else labels
+    height, width = level.shape
+    for _, _, y0, y1, x0, x1 in iter_tiles(height, width, tile_size):
+        tile = np.full((tile_size, tile_size), fill, dtype=np.uint8)
+        tile[:y1 - y0, :x1 - x0] = level[y0:y1, x0:x1]
+        yield tile.tobytes()
+
+
+def _ifd(tags, position, endian='<'):
+    """
+    Encode an IFD whose entries' out-of-line values follow it directly.
+
+    Args:
+        tags: [(tag, type, values)] (values a list, or bytes for ASCII)
+        position: absolute file offset where the IFD will start
+
+    Returns:
+        (bytes, position of the next-IFD offset field within them)
+    """
+    tags = sorted(tags)
+    header_size = 2 + 12 * len(tags) + 4
+    entries, extra = [], b''
+    for tag, kind, values in tags:
+        if kind == _ASCII:
+            raw = values + b'\0'
+            count = len(raw)
+        else:
+            count = len(values)
+            raw = struct.pack(f"{endian}{count}{_TYPE_FORMATS[kind]}", *values)
+        if len(raw) <= 4:
+            entries.append(struct.pack(f"{endian}HHI", tag, kind, count) + raw.ljust(4, b'\0'))
+        else:
+            offset = position + header_size + len(extra)
+            entries.append(struct.pack(f"{endian}HHII", tag, kind, count, offset))
+            extra += raw + (b'\0' if len(raw) % 2 else b'')  # Word alignment
+    body = struct.pack(f"{endian}H", len(tags)) + b''.join(entries)
+    return body + b'\0\0\0\0' + extra, len(body)
+
+
+def write_geotiff(path, labels, palette=None, georef=None, nodata=None, tile_size=TILE_SIZE,
+                  compression=DEFAULT_COMPRESSION, workers=4):
+    """
+    Write a uint8 label raster as a tiled, deflate-compressed GeoTIFF with internal overviews.
+
+    Args:
+        path: output file (written to a temporary name, then renamed)
+        labels: 2-D uint8 array (class labels or change codes)
+        palette: optional RGB tuples by label value, stored as the ColorMap
+        georef: optional {'geotransform': [...], 'epsg': ...} of the raster
+        nodata: optional label value GIS should treat as no data (also pads edge tiles)
+        compression: zlib level 1-9
+
+    Returns:
+        path
+    """
+    if labels.dtype != np.uint8 or labels.ndim != 2:
+        raise ValueError("GeoTIFF export expects a 2-D uint8 label raster")
+    height, width = labels.shape
+    fill = nodata if nodata is not None else 0
+    levels = [1] + overview_factors(height, width, tile_size)
+
+    def compress(tile):
+        return zlib.compress(tile, compression)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # A unique temporary name per writer: several threads may export the same layer at once
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f, ThreadPoolExecutor(max_workers=workers) as pool:
+            f.write(b'II' + struct.pack('<HI', 42, 0))  # First IFD offset is patched at the end
+            layouts = []
+            for factor in levels:
+                offsets, counts = [], []
+                tiles = _tiles(labels, factor, tile_size, fill)
+                while True:
+                    window = [tile for _, tile in zip(range(_WINDOW), tiles)]
+                    if not window:
+                        break
+                    for data in pool.map(compress, window):
+                        offsets.append(f.tell())
+                        counts.append(len(data))
+                        f.write(data)
+                if f.tell() > 0xFFFFFFFF:
+                    raise ValueError("Raster too large for a classic TIFF")
+                layouts.append((factor, offsets, counts))
+
+            # IFD chain: full resolution first, then each overview
+            if f.tell() % 2:
+                f.write(b'\0')
+            previous_next_field = 4  # Header field holding the first IFD offset
+            for factor, offsets, counts in layouts:
+                level_height, level_width = -(-height // factor), -(-width // factor)
+                tags = [
+                    (254, _LONG, [0 if factor == 1 else 1]),  # NewSubfileType: reduced resolution
+                    (256, _LONG, [level_width]),
+                    (257, _LONG, [level_height]),
+                    (258, _SHORT, [8]),
+                    (259, _SHORT, [8]),  # Deflate
+                    (262, _SHORT, [3 if palette else 1]),  # Palette or min-is-black
+                    (277, _SHORT, [1]),
+                    (284, _SHORT, [1]),
+                    (322, _LONG, [tile_size]),
+                    (323, _LONG, [tile_size]),
+                    (324, _LONG, offsets),
+                    (325, _LONG, counts),
+                    (339, _SHORT, [1]),
+                ]
+                if palette:
+                    tags.append((320, _SHORT, _color_map(palette)))
+                if factor == 1:
+                    if georef:
+                        tags.extend(_geo_tags(georef))
+                    if nodata is not None:
+                        tags.append((42113, _ASCII, str(nodata).encode('ascii')))  # GDAL_NODATA
+                position = f.tell()
+                data, next_field = _ifd(tags, position)
+                f.write(data)
+                if f.tell() % 2:
+                    f.write(b'\0')
+                # Link the previous IFD (or the header) to this one
+                end = f.tell()
+                f.seek(previous_next_field)
+                f.write(struct.pack('<I', position))
+                f.seek(end)
+                previous_next_field = position + next_field
+            if f.tell() > 0xFFFFFFFF:
+                raise ValueError("Raster too large for a classic TIFF")
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # Another writer of the same file renamed its copy first
+            if not os.path.exists(path):
+                raise
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def export_path(export_dir, source_path, georef):
+    """Cache path of a label map's GeoTIFF, keyed by the map and the georef it carries."""
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    key = hashlib.sha1(json.dumps(georef, sort_keys=True).encode('utf-8')).hexdigest()[:8]
+    return os.path.join(export_dir, f"{stem}_{key}.tif")
+
+
+def export_layer(layer, source_path, georef, export_dir):
+    """GeoTIFF of a stored result label map (written once, then reused); returns its path."""
+    _, palette, nodata = EXPORT_LAYERS[layer]
+    path = export_path(export_dir, source_path, georef)
+    if not os.path.exists(path):
+        write_geotiff(path, read_label_map(source_path, palette), palette, georef, nodata)
+    return path
@@ -0,0 +1,249 @@
+"""
+Site-wide damage summary on a fixed map grid.
+
+Each processed, georeferenced assessment is reduced to the areas it adds
+to square base cells of BASE_CELL_SIZE metres in its CRS: area analysed,
+vegetation before and after, and damaged vegetation. These contributions
+are stored per assessment (GridContribution), and their sums are kept in
+a quadtree of GridCell rows: a level L cell covers 2**L x 2**L base cells
+and holds the sum of its children. When an assessment is (re)processed,
+its old contributions are subtracted from every level and the new ones
+added, so the summary is updated incrementally and never rebuilt.
+
+Area queries and heatmaps then read cells, not images: a box is answered
+from the coarsest level that still resolves it into at most `max_cells`
+cells, with the cells on its edge prorated by their overlap. Overlapping
+flight blocks add up, like repeated flights over the same cells.
+
+Contributions are computed from the stored change and post label maps.
+Pixels are first summed over blocks a few times smaller than a base cell
+(np.add.reduceat), and each block is assigned to the cell under its
+centre, so the cost is one pass over the label maps.
+
+Updating cells is a read-modify-write shared by every assessment over the
+same area, so updates run inside grid_update(), which serializes them and
+their commit across the job threads of a process.
+"""
+import math
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+from app import db
+from app.models import GridCell, GridContribution
+from app.utils.georef import pixel_area, pixel_size, pixel_to_world
+
+# Edge of a level-0 cell in CRS units (metres)
+BASE_CELL_SIZE = 10.0
+# Levels 0..LEVELS-1 (10 m to 5.12 km cells)
+LEVELS = 10
+# Blocks assigned to one cell are at most this fraction of the cell edge
+BLOCK_FRACTION = 0.25
+DEFAULT_MAX_CELLS = 4096
+
+AREA_FIELDS = ('valid_area', 'vegetation_before', 'vegetation_after', 'damaged')
+SQUARE_METRES_PER_HECTARE = 10000.0
+
+# Codes of the change map (see image_processing.change_codes) and the vegetation class
+_CHANGE_VEGETATION, _CHANGE_DAMAGED, _CHANGE_INVALID = 1, 2, 3
+_CLASS_VEGETATION = 3
+
+_grid_lock = threading.RLock()
+
+
+def _block_sums(mask, block):
+    """Pixel counts of a boolean mask over block x block tiles (ragged at the edges)."""
+    rows = np.add.reduceat(mask.view(np.uint8), np.arange(0, mask.shape[0], block), axis=0, dtype=np.uint32)
+    return np.add.reduceat(rows, np.arange(0, mask.shape[1], block), axis=1)
+
+
+def cell_contributions(change_codes, post_labels, georef):
+    """
+    Areas a label map pair adds to each base cell.
+
+    Args:
+        change_codes: full-frame change map (CHANGE_* codes)
+        post_labels: full-frame refined post segmentation
+        georef: {'geotransform': [...], 'epsg': ...} of the frame
+
+    Returns:
+        dict (ix, iy) -> [valid_area, vegetation_before, vegetation_after, damaged]
+    """
+    geotransform = georef['geotransform']
+    height, width = change_codes.shape
+    block = max(1, int(BASE_CELL_SIZE * BLOCK_FRACTION / max(pixel_size(geotransform))))
+
+    valid = change_codes != _CHANGE_INVALID
+    vegetation_before = (change_codes == _CHANGE_VEGETATION) | (change_codes == _CHANGE_DAMAGED)
+    vegetation_after = (post_labels == _CLASS_VEGETATION) & valid
+    sums = [_block_sums(mask, block) for mask in (valid, vegetation_before, vegetation_after,
+                                                  change_codes == _CHANGE_DAMAGED)]
+
+    # Map coordinates of the block centres (pixel corners are integer positions)
+    row_starts, col_starts = np.arange(0, height, block), np.arange(0, width, block)
+    rows = (row_starts + np.minimum(row_starts + block, height)) / 2
+    cols = (col_starts + np.minimum(col_starts + block, width)) / 2
+    x, y = pixel_to_world(geotransform, cols[None, :], rows[:, None])
+    ix = np.floor(np.broadcast_to(x, sums[0].shape) / BASE_CELL_SIZE).astype(np.int64).ravel()
+    iy = np.floor(np.broadcast_to(y, sums[0].shape) / BASE_CELL_SIZE).astype(np.int64).ravel()
+
+    keep = sums[0].ravel() > 0
+    cells, inverse = np.unique(np.stack([ix[keep], iy[keep]]), axis=1, return_inverse=True)
+    area = pixel_area(geotransform)
+    totals = [np.bincount(inverse.ravel(), weights=s.ravel()[keep], minlength=cells.shape[1]) * area for s in sums]
+    return {
+        (int(cells[0, i]), int(cells[1, i])): [float(total[i]) for total in totals]
+        for i in range(cells.shape[1])
+    }
+
+
+@contextmanager
+def grid_update():
+    """
+    Hold the grid lock over a grid update and commit the session at the end, so
+    concurrent updates of shared cells neither lose a change nor insert a cell twice.
+    """
+    with _grid_lock:
+        yield
+        db.session.commit()
+
+
+def _apply(epsg, deltas, sign):
+    """Add (sign=1) or subtract (sign=-1) base-cell areas on every level. Caller commits."""
+    if not deltas:
+        return
+    for level in range(LEVELS):
+        merged = defaultdict(lambda: [0.0] * len(AREA_FIELDS))
+        for (ix, iy), values in deltas.items():
+            cell = merged[(ix >> level, iy >> level)]
+            for i, value in enumerate(values):
+                cell[i] += sign * value
+        xs, ys = [ix for ix, _ in merged], [iy for _, iy in merged]
+        existing = {
+            (cell.ix, cell.iy): cell for cell in GridCell.query.populate_existing().filter(
+                GridCell.epsg == epsg, GridCell.level == level,
+                GridCell.ix.between(min(xs), max(xs)), GridCell.iy.between(min(ys), max(ys)),
+            )
+        }
+        for key, values in merged.items():
+            cell = existing.get(key)
+            if cell is None:
+                cell = GridCell(epsg=epsg, level=level, ix=key[0], iy=key[1],
+                                **{field: 0.0 for field in AREA_FIELDS})
+                db.session.add(cell)
+            for field, value in zip(AREA_FIELDS, values):
+                setattr(cell, field, max(0.0, getattr(cell, field) + value))
+            if cell.valid_area <= 1e-6:
+                # Nothing left in the cell: drop it rather than keep zero rows
+                if cell.id is not None:
+                    db.session.delete(cell)
+                else:
+                    db.session.expunge(cell)
+
+
+def _stored_contributions(assessment_id):
+    by_epsg = defaultdict(dict)
+    for row in GridContribution.query.filter_by(assessment_id=assessment_id):
+        by_epsg[row.epsg][(row.ix, row.iy)] = [getattr(row, field) for field in AREA_FIELDS]
+    return by_epsg
+
+
+def remove_assessment_grid(assessment_id):
+    """Subtract an assessment's contributions from the grid and delete them. Run inside grid_update()."""
+    for epsg, deltas in _stored_contributions(assessment_id).items():
+        _apply(epsg, deltas, -1)
+    GridContribution.query.filter_by(assessment_id=assessment_id).delete()
+
+
+def update_assessment_grid(assessment_id, change_codes, post_labels, georef):
+    """
+    Replace an assessment's contributions to the grid (incrementally). Run inside grid_update().
+
+    Returns:
+        number of base cells the assessment covers
+    """
+    remove_assessment_grid(assessment_id)
+    if not georef:
+        return 0
+    epsg = georef.get('epsg') or 0
+    contributions = cell_contributions(change_codes, post_labels, georef)
+    db.session.add_all(
+        GridContribution(assessment_id=assessment_id, epsg=epsg, ix=ix, iy=iy,
+                         **dict(zip(AREA_FIELDS, values)))
+        for (ix, iy), values in contributions.items()
+    )
+    _apply(epsg, contributions, 1)
+    return len(contributions)
+
+
+def choose_level(bbox, max_cells=DEFAULT_MAX_CELLS):
+    """Finest level at which `bbox` (min_x, min_y, max_x, max_y) spans at most `max_cells` cells."""
+    min_x, min_y, max_x, max_y = bbox
+    for level in range(LEVELS):
+        size = BASE_CELL_SIZE * 2 ** level
+        count = (math.floor(max_x / size) - math.floor(min_x / size) + 1) * \
+                (math.floor(max_y / size) - math.floor(min_y / size) + 1)
+        if count <= max_cells:
+            return level
+    return LEVELS - 1
+
+
+def cells_in_bbox(bbox, level, epsg=0):
+    """GridCell rows of `level` intersecting `bbox`."""
+    min_x, min_y, max_x, max_y = bbox
+    size = BASE_CELL_SIZE * 2 ** level
+    return GridCell.query.filter(
+        GridCell.epsg == epsg, GridCell.level == level,
+        GridCell.ix.between(math.floor(min_x / size), math.floor(max_x / size)),
+        GridCell.iy.between(math.floor(min_y / size), math.floor(max_y / size)),
+    ).all()
+
+
+def cell_bounds(cell):
+    size = BASE_CELL_SIZE * 2 ** cell.level
+    return cell.ix * size, cell.iy * size, (cell.ix + 1) * size, (cell.iy + 1) * size
+
+
+def damage_index(vegetation_before, damaged):
+    """Share of the vegetation before the event that was damaged (0-1), or None without vegetation."""
+    return round(damaged / vegetation_before, 4) if vegetation_before > 0 else None
+
+
+def summarize_bbox(bbox, epsg=0, max_cells=DEFAULT_MAX_CELLS):
+    """
+    Total areas (hectares) inside a map box, from the coarsest level resolving
+    it into at most `max_cells` cells; edge cells are prorated by overlap.
+    """
+    min_x, min_y, max_x, max_y = bbox
+    level = choose_level(bbox, max_cells)
+    totals = dict.fromkeys(AREA_FIELDS, 0.0)
+    cells = cells_in_bbox(bbox, level, epsg)
+    for cell in cells:
+        x0, y0, x1, y1 = cell_bounds(cell)
+        overlap = (max(0.0, min(x1, max_x) - max(x0, min_x)) * max(0.0, min(y1, max_y) - max(y0, min_y))
+                   / ((x1 - x0) * (y1 - y0)))
+        for field in AREA_FIELDS:
+            totals[field] += getattr(cell, field) * overlap
+    summary = {f"{field}_ha": round(totals[field] / SQUARE_METRES_PER_HECTARE, 4) for field in AREA_FIELDS}
+    summary.update(level=level, cell_size=BASE_CELL_SIZE * 2 ** level, cells=len(cells),
+                   damage_index=damage_index(totals['vegetation_before'], totals['damaged']))
+    return summary
+
+
+def cells_to_geojson(cells):
+    """Heatmap cells as a GeoJSON FeatureCollection in the grid's CRS."""
+    features = []
+    for cell in cells:
+        x0, y0, x1, y1 = cell_bounds(cell)
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Polygon', 'coordinates': [[[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]]},
+            'properties': {
+                'level': cell.level, 'ix': cell.ix, 'iy': cell.iy,
+                **{f"{field}_ha": round(getattr(cell, field) / SQUARE_METRES_PER_HECTARE, 4) for field in AREA_FIELDS},
+                'damage_index': damage_index(cell.vegetation_before, cell.damaged),
+            },
+        })
+    return {'type': 'FeatureCollection', 'features': features}
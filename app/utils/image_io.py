@@ -0,0 +1,174 @@
+"""
+Image decoding for the pipeline.
+
+Files are read into memory and decoded with cv2.imdecode, which releases
+the GIL, so the pre and post images of a pair are decoded concurrently on a
+small thread pool. When a smaller size is wanted (a post image larger than
+its pre image, a preview), JPEGs are decoded with libjpeg's DCT scaling
+(IMREAD_REDUCED_COLOR_2/4/8) to the smallest scale still covering the
+target, and only the remaining factor is resized. Image dimensions are read
+from the file header, so the target of the post image is known before the
+pre image is decoded. prefetch() overlaps the decode of upcoming files with
+work on the current one.
+"""
+import io
+import os
+import struct
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# Scaled-decode flags by reduction factor, largest first
+REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+DECODE_WORKERS = 4
+
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _decode_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix='image-decode')
+        return _pool
+
+
+def _jpeg_size(f):
+    """(width, height) from the first SOF marker of a JPEG stream positioned after SOI."""
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        if code == 0xFF:  # Fill byte
+            f.seek(-1, os.SEEK_CUR)
+            continue
+        if code in (0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7):
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        if code in _JPEG_SOF:
+            header = f.read(5)
+            if len(header) < 5:
+                return None
+            height, width = struct.unpack('>HH', header[1:5])
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def _stream_info(f):
+    head = f.read(2)
+    if head == b'\xff\xd8':
+        size = _jpeg_size(f)
+        return ('jpeg', size) if size else (None, None)
+    head += f.read(22)
+    if head[:8] == _PNG_SIGNATURE and head[12:16] == b'IHDR':
+        return 'png', struct.unpack('>II', head[16:24])
+    return None, None
+
+
+def image_info(path):
+    """
+    Format and size of an image from its header, without decoding.
+
+    Returns:
+        ('jpeg'|'png', (width, height)), or (None, None) if the header is not recognised
+    """
+    try:
+        with open(path, 'rb') as f:
+            return _stream_info(f)
+    except OSError:
+        return None, None
+
+
+def data_size(data):
+    """(width, height) from the header of an encoded image in memory, or None."""
+    return _stream_info(io.BytesIO(data))[1]
+
+
+def image_size(path):
+    """(width, height) of an image from its header, or None."""
+    return image_info(path)[1]
+
+
+def reduction_factor(size, target_size):
+    """Largest libjpeg scale factor whose output still covers `target_size` (1 if none)."""
+    width, height = size
+    target_width, target_height = target_size
+    for factor, _ in REDUCED_FLAGS:
+        # libjpeg rounds scaled dimensions up
+        if -(-width // factor) >= target_width and -(-height // factor) >= target_height:
+            return factor
+    return 1
+
+
+def read_image(path, target_size=None, interpolation=cv2.INTER_LINEAR):
+    """
+    Decode a BGR image, optionally at `target_size` (width, height).
+
+    Like cv2.imread, returns None if the file is missing or cannot be decoded.
+    """
+    try:
+        data = np.fromfile(path, dtype=np.uint8)
+    except OSError:
+        return None
+    flags = cv2.IMREAD_COLOR
+    if target_size is not None:
+        kind, size = image_info(path)
+        if kind == 'jpeg' and tuple(size) != tuple(target_size):
+            factor = reduction_factor(size, target_size)
+            flags = dict(REDUCED_FLAGS).get(factor, cv2.IMREAD_COLOR)
+    image = cv2.imdecode(data, flags)
+    if image is not None and target_size is not None and (image.shape[1], image.shape[0]) != tuple(target_size):
+        image = cv2.resize(image, tuple(target_size), interpolation=interpolation)
+    return image
+
+
+def read_pair(pre_path, post_path):
+    """
+    Decode a pre/post pair concurrently, the post image at the pre image's size.
+
+    Returns:
+        (pre_image, post_image); either may be None if it could not be decoded
+    """
+    pool = _decode_pool()
+    pre_size = image_size(pre_path)
+    pre_future = pool.submit(read_image, pre_path)
+    if pre_size is not None:
+        post_image = pool.submit(read_image, post_path, pre_size).result()
+        return pre_future.result(), post_image
+    # Unknown header: decode both at full size, then match the post image to the pre image
+    post_image = pool.submit(read_image, post_path).result()
+    pre_image = pre_future.result()
+    if pre_image is not None and post_image is not None and pre_image.shape != post_image.shape:
+        post_image = cv2.resize(post_image, (pre_image.shape[1], pre_image.shape[0]))
+    return pre_image, post_image
+
+
+def prefetch(items, load, depth=2):
+    """
+    Yield (item, load(item)) in order while the next `depth` loads run on the decode pool.
+    """
+    pool = _decode_pool()
+    pending = deque()
+    iterator = iter(items)
+    for item in iterator:
+        pending.append((item, pool.submit(load, item)))
+        if len(pending) > depth:
+            break
+    while pending:
+        item, future = pending.popleft()
+        for upcoming in iterator:
+            pending.append((upcoming, pool.submit(load, upcoming)))
+            break
+        yield item, future.result()
@@ -8,6 +8,24 @@ import cv2
 import numpy as np
 import os
 import time
+import uuid
+
+from app.utils.buffer_pool import worker_pool
+from app.utils.change_detection import (
+    change_mask, change_tests, hsv_difference, index_drop, lab_delta_e, required_planes,
+)
+from app.utils.damage_patches import extract_damage_patches
+from app.utils.image_io import read_pair
+from app.utils.intermediates import IntermediateStore, file_fingerprint
+from app.utils.masking import pair_validity, valid_tiles
+from app.utils.radiometry import apply_luts, matching_luts
+from app.utils.regions import mask_bounds, rasterize_regions, regions_key
+from app.utils.scheduler import checkpoint
+from app.utils.tiling import DEFAULT_TILE_SIZE, iter_tiles
+from app.utils.label_maps import DEFAULT_COMPRESSION, DEFAULT_FORMAT, save_label_map_async
+from app.utils.pipeline_config import DEFAULT_CONFIG
+from app.utils.thresholding import bounded_threshold, plane_threshold
+from app.utils.vegetation_indices import IndexEngine
 
 # Six-class labels (manuscript order: Building, Land, Road, Vegetation, Water, Unlabeled)
 CLASS_BUILDING = 0
@@ -25,6 +43,13 @@ VEGETATION = "#FEDD3A"
 WATER = "#E2A929"
 UNLABELED = "#9B9B9B"
 
+# Change map codes, stored as a 2-bit indexed image
+CHANGE_NONE = 0
+CHANGE_VEGETATION = 1  # Vegetation before, not damaged
+CHANGE_DAMAGED = 2
+CHANGE_INVALID = 3  # Masked out (cloud, shadow, over-exposure)
+CHANGE_PALETTE = ((0, 0, 0), (0, 255, 0), (255, 0, 0), (128, 128, 128))
+
 def rgb_to_hex(rgb):
     """Convert RGB tuple to HEX string"""
     return '#{:02x}{:02x}{:02x}'.format(rgb[0], rgb[1], rgb[2])
@@ -34,169 +59,530 @@ def hex_to_rgb(hex_color):
     hex_color = hex_color.lstrip('#')
     return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
 
-def process_images(pre_image_path, post_image_path):
+# Manuscript palette indexed by class id, for indexed label map images
+CLASS_PALETTE = tuple(hex_to_rgb(color) for color in (BUILDING, LAND, ROAD, VEGETATION, WATER, UNLABELED))
+CLASS_NAMES = ('building', 'land', 'road', 'vegetation', 'water', 'unlabeled')
+
+def class_percentages(labels, valid=None):
+    """Share of pixels per class (percent, by class name) in one bincount, over `valid` pixels if given."""
+    values = labels.ravel() if valid is None else labels[valid]
+    counts = np.bincount(values, minlength=len(CLASS_NAMES))[:len(CLASS_NAMES)]
+    total = values.size or 1
+    return {name: round(float(count) / total * 100, 2) for name, count in zip(CLASS_NAMES, counts)}
+
+def change_codes(veg_pre, significant_change, valid=None, out=None):
+    """Change map (CHANGE_* codes) from the pre-vegetation, damage and validity masks."""
+    codes = np.zeros(veg_pre.shape, dtype=np.uint8) if out is None else out
+    if out is not None:
+        codes.fill(CHANGE_NONE)
+    codes[veg_pre] = CHANGE_VEGETATION
+    codes[significant_change] = CHANGE_DAMAGED
+    if valid is not None:
+        codes[~valid] = CHANGE_INVALID
+    return codes
+
+def _load_image_pair(pre_image_path, post_image_path):
+    """Decode the pre/post images concurrently, the post image at the pre image size."""
+    pre_image, post_image = read_pair(pre_image_path, post_image_path)
+    
+    # Check if images were loaded successfully
+    if pre_image is None:
+        raise ValueError(f"Failed to load pre-typhoon image from path: {pre_image_path}. Please check if the file exists and is a valid image.")
+    
+    if post_image is None:
+        raise ValueError(f"Failed to load post-typhoon image from path: {post_image_path}. Please check if the file exists and is a valid image.")
+    
+    return pre_image, post_image
+
+def detect_change(segmented_pre, segmented_post, h_diff, s_diff, v_diff, config=None, index_drop=None,
+                  valid=None, delta_e=None, buffers=None):
+    """
+    Change detection between pre/post segmentations, refined by the difference
+    planes of the configured change metrics (see change_detection): HSV shifts,
+    the drop of config.change_index (`index_drop`, see index_drop()) and the Lab
+    colour difference (`delta_e`). Pixels outside `valid` (clouds, shadows)
+    never count as vegetation or damage. With `buffers` (a BufferScope) the
+    masks and refined map are borrowed from the worker's pool.
+    
+    Returns:
+        (veg_pre, significant_change, refined_post): pre-vegetation mask, damage mask and
+        the post segmentation with damaged vegetation relabelled as land
+    """
+    config = config or DEFAULT_CONFIG
+
+    # Vegetation in pre that is no longer vegetation in post
+    out = buffers.borrow(segmented_pre.shape, np.bool_) if buffers is not None else None
+    veg_pre = np.equal(segmented_pre, CLASS_VEGETATION, out=out)
+    if valid is not None:
+        veg_pre &= valid
+    # Damaged = was vegetation, now not (by segmentation), or a large shift in
+    # pre-vegetation areas by any change metric
+    planes = {'h': h_diff, 's': s_diff, 'v': v_diff, 'drop': index_drop, 'delta_e': delta_e}
+    significant_change = change_mask(veg_pre, segmented_post, CLASS_VEGETATION, change_tests(planes, config), buffers)
+    if buffers is not None:
+        refined_post = buffers.borrow(segmented_post.shape, segmented_post.dtype)
+        np.copyto(refined_post, segmented_post)
+    else:
+        refined_post = segmented_post.copy()
+    refined_post[significant_change] = CLASS_LAND  # Damaged vegetation -> land (manuscript change detection)
+    return veg_pre, significant_change, refined_post
+
+def process_images(pre_image_path, post_image_path, config=None, cache_dir=None,
+                   result_format=DEFAULT_FORMAT, compression=DEFAULT_COMPRESSION, frame_pool=None, regions=None):
     """
     Process pre and post typhoon images to assess damage
     
     Args:
         pre_image_path: Path to pre-typhoon image
         post_image_path: Path to post-typhoon image
+        config: ProcessingConfig with the pipeline thresholds (defaults if None)
+        cache_dir: Optional directory where intermediate products (segmentation
+            masks, HSV difference planes, normalization tables) are persisted. When given, a rerun with
+            only downstream parameters changed skips decoding and segmentation.
+        result_format: 'png' (palettized) or 'webp' (lossless) for the result label maps
+        compression: zlib level (0-9) of PNG label maps
+        frame_pool: Optional FramePool; segmentation and HSV differences then run
+            in a worker process on the decoded pair handed over in shared memory
+        regions: Optional ROI/exclusion polygons (see regions.parse_regions); only
+            pixels inside them are processed and counted
         
     Returns:
         result_data: Dictionary containing assessment results
     """
-    # Load images
-    pre_image = cv2.imread(pre_image_path)
-    post_image = cv2.imread(post_image_path)
+    config = config or DEFAULT_CONFIG
+    store = None
+    if cache_dir:
+        # Cached products are cropped to the regions, so the store is bound to them as well
+        inputs = [file_fingerprint(pre_image_path), file_fingerprint(post_image_path)]
+        if regions:
+            inputs.append({'regions': regions_key(regions)})
+        store = IntermediateStore(cache_dir, inputs)
+    recomputed = []
     
-    # Check if images were loaded successfully
-    if pre_image is None:
-        raise ValueError(f"Failed to load pre-typhoon image from path: {pre_image_path}. Please check if the file exists and is a valid image.")
+    # Result label maps go under static/uploads; they are encoded on background
+    # threads while the remaining stages run. The random suffix keeps jobs
+    # started in the same second from writing to the same files.
+    timestamp = f"{int(time.time())}_{uuid.uuid4().hex[:8]}"
+    pre_vis_path = f"static/uploads/pre_vis_{timestamp}.{result_format}"
+    post_vis_path = f"static/uploads/post_vis_{timestamp}.{result_format}"
+    change_vis_path = f"static/uploads/change_vis_{timestamp}.{result_format}"
+    base_dir = os.path.normpath(os.path.join(os.path.dirname(pre_image_path), "..", ".."))
+    os.makedirs(os.path.join(base_dir, "static", "uploads"), exist_ok=True)
+    encodes = []
+    def encode(labels, path, palette):
+        encodes.append(save_label_map_async(labels, os.path.join(base_dir, path), palette, result_format, compression))
     
-    if post_image is None:
-        raise ValueError(f"Failed to load post-typhoon image from path: {post_image_path}. Please check if the file exists and is a valid image.")
+    # Region of interest: the pair is cropped to the bounding box of the rasterized
+    # regions, and `region` marks the pixels to process within the crop
+    region = bounds = frame_shape = None
+    if regions and store:
+        cached = store.load('region')
+        if cached is not None:
+            region, frame_shape = cached['mask'], tuple(int(v) for v in cached['shape'])
+            bounds = tuple(int(v) for v in cached['bounds'])
     
-    # Resize images if needed
-    if pre_image.shape != post_image.shape:
-        post_image = cv2.resize(post_image, (pre_image.shape[1], pre_image.shape[0]))
-    
-    # Convert to RGB for visualization
-    pre_image_rgb = cv2.cvtColor(pre_image, cv2.COLOR_BGR2RGB)
-    post_image_rgb = cv2.cvtColor(post_image, cv2.COLOR_BGR2RGB)
-    
-    # Perform image segmentation
-    segmented_pre = perform_segmentation(pre_image)
-    segmented_post = perform_segmentation(post_image)
-    
-    # Change detection: vegetation in pre that is no longer vegetation in post
-    veg_pre = (segmented_pre == CLASS_VEGETATION)
-    veg_post = (segmented_post == CLASS_VEGETATION)
-    # Damaged = was vegetation, now not (by segmentation)
-    damaged_by_seg = veg_pre & ~veg_post
-
-    # Refine with HSV: in pre-vegetation areas, large color shift suggests damage
-    pre_hsv = cv2.cvtColor(pre_image, cv2.COLOR_BGR2HSV)
-    post_hsv = cv2.cvtColor(post_image, cv2.COLOR_BGR2HSV)
-    h_diff = np.abs(pre_hsv[:, :, 0].astype(np.int32) - post_hsv[:, :, 0].astype(np.int32))
-    s_diff = np.abs(pre_hsv[:, :, 1].astype(np.int32) - post_hsv[:, :, 1].astype(np.int32))
-    v_diff = np.abs(pre_hsv[:, :, 2].astype(np.int32) - post_hsv[:, :, 2].astype(np.int32))
-    # Hue wrap-around: 179 and 0 are close
-    h_diff = np.minimum(h_diff, 180 - h_diff)
-    significant_hsv_change = (h_diff > 12) | (s_diff > 40) | (v_diff > 40)
-    damaged_by_hsv = veg_pre & significant_hsv_change
-
-    # Combined damage mask: lost vegetation by segmentation or strong HSV change
-    significant_change = damaged_by_seg | damaged_by_hsv
-    refined_post = segmented_post.copy()
-    refined_post[significant_change] = CLASS_LAND  # Damaged vegetation -> land (manuscript change detection)
-
-    # Damage and areas using refined comparison
-    forest_area_before, forest_area_after, damage_percentage = calculate_damage(
-        segmented_pre, refined_post
-    )
-
-    # Visualizations
-    pre_vis = visualize_segmentation(segmented_pre)
-    post_vis = visualize_segmentation(refined_post)
-    change_vis = np.zeros_like(pre_image_rgb)
-    change_vis[veg_pre] = [0, 255, 0]           # Green: was vegetation
-    change_vis[significant_change] = [255, 0, 0]  # Red: damaged
-    
-    # Save visualizations under static/uploads
-    timestamp = int(time.time())
-    pre_vis_path = f"static/uploads/pre_vis_{timestamp}.jpg"
-    post_vis_path = f"static/uploads/post_vis_{timestamp}.jpg"
-    change_vis_path = f"static/uploads/change_vis_{timestamp}.jpg"
-    base_dir = os.path.normpath(os.path.join(os.path.dirname(pre_image_path), "..", ".."))
-    upload_dir = os.path.join(base_dir, "static", "uploads")
-    os.makedirs(upload_dir, exist_ok=True)
-    full_pre_vis_path = os.path.join(base_dir, pre_vis_path)
-    full_post_vis_path = os.path.join(base_dir, post_vis_path)
-    full_change_vis_path = os.path.join(base_dir, change_vis_path)
+    # Images are decoded only if a stage actually needs them
+    def decode_images():
+        nonlocal region, bounds, frame_shape
+        pre_image, post_image = _load_image_pair(pre_image_path, post_image_path)
+        if regions:
+            if region is None:
+                frame_shape = pre_image.shape[:2]
+                mask = rasterize_regions(regions, *frame_shape)
+                bounds = mask_bounds(mask)
+                if bounds is None:
+                    raise ValueError("The regions do not cover any pixel of the images")
+                region = np.ascontiguousarray(mask[bounds[0]:bounds[1], bounds[2]:bounds[3]])
+                if store:
+                    store.save('region', mask=region, bounds=np.array(bounds), shape=np.array(frame_shape))
+            y0, y1, x0, x1 = bounds
+            pre_image = np.ascontiguousarray(pre_image[y0:y1, x0:x1])
+            post_image = np.ascontiguousarray(post_image[y0:y1, x0:x1])
+        return pre_image, post_image
+    
+    decoded = None
+    if regions and region is None:
+        decoded = decode_images()
+    
+    # Cached products, by the store entry and stage key each is saved under
+    preprocessing_key = config.stage_key('preprocessing')
+    stored = {
+        'validity': ('validity', preprocessing_key),
+        'luts': ('radiometry', preprocessing_key),
+        'segmentation': ('segmentation', config.stage_key('segmentation')),
+        'hsv_diff': ('hsv_diff', preprocessing_key),
+        'index_drop': ('index_drop', f"{config.change_index}_{preprocessing_key}"),
+        'lab_delta': ('lab_delta', preprocessing_key),
+    }
+    products = {}
+    if store:
+        needed = required_planes(config)
+        for name, wanted in (('validity', config.mask_invalid), ('luts', config.radiometric_normalization),
+                             ('segmentation', True), ('hsv_diff', 'h' in needed),
+                             ('index_drop', config.change_index), ('lab_delta', 'delta_e' in needed)):
+            cached = store.load(*stored[name]) if wanted else None
+            if cached is not None:
+                products[name] = PRODUCT_FIELDS[name](cached)
+    
+    def save_product(name, value):
+        recomputed.append(STAGE_NAMES.get(name, name))
+        if store:
+            store.save(*stored[name], **PRODUCT_ARRAYS[name](value))
+    
+    # Frame-sized temporaries from here on are borrowed from the worker's buffer pool
+    with worker_pool().scope() as buffers:
+        result = analyze_pair(decoded or decode_images, config, region, products, save_product, frame_pool, buffers)
+        recomputed.append('change')
+        segmented_pre, refined_post, valid = result['segmented_pre'], result['refined_post'], result['valid']
+    
+        def full_frame(labels, fill):
+            """Place a label map of the cropped region back into the full frame."""
+            if bounds is None:
+                return labels
+            y0, y1, x0, x1 = bounds
+            frame = buffers.borrow(frame_shape, labels.dtype, fill)
+            frame[y0:y1, x0:x1] = labels
+            return frame
+    
+        encode(full_frame(segmented_pre, CLASS_UNLABELED), pre_vis_path, CLASS_PALETTE)
+        encode(full_frame(refined_post, CLASS_UNLABELED), post_vis_path, CLASS_PALETTE)
+        codes = change_codes(result['veg_pre'], result['significant_change'], valid,
+                             out=buffers.borrow(segmented_pre.shape, np.uint8))
+        encode(full_frame(codes, CHANGE_INVALID), change_vis_path, CHANGE_PALETTE)
+        checkpoint()
     
-    cv2.imwrite(full_pre_vis_path, cv2.cvtColor(pre_vis, cv2.COLOR_RGB2BGR))
-    cv2.imwrite(full_post_vis_path, cv2.cvtColor(post_vis, cv2.COLOR_RGB2BGR))
-    cv2.imwrite(full_change_vis_path, cv2.cvtColor(change_vis, cv2.COLOR_RGB2BGR))
+        # Individual damaged regions (connected components of the change mask)
+        damage_patches = extract_damage_patches(full_frame(result['significant_change'], False),
+                                                min_area=config.min_patch_area)
+        recomputed.append('patches')
+    
+        class_statistics = {'pre': class_percentages(segmented_pre, valid), 'post': class_percentages(refined_post, valid)}
+    
+        # Wait for the label map encodes (raises if any failed) before their buffers go back to the pool
+        for future in encodes:
+            future.result()
     
     # Prepare result data
     result_data = {
-        'forest_area_before': round(forest_area_before, 2),
-        'forest_area_after': round(forest_area_after, 2),
-        'damage_percentage': round(damage_percentage, 2),
+        'forest_area_before': round(result['forest_area_before'], 2),
+        'forest_area_after': round(result['forest_area_after'], 2),
+        'damage_percentage': round(result['damage_percentage'], 2),
         'pre_vis_path': pre_vis_path,
         'post_vis_path': post_vis_path,
-        'change_vis_path': change_vis_path
+        'change_vis_path': change_vis_path,
+        'damage_patches': damage_patches,
+        'class_statistics': class_statistics,
+        'config': config.to_dict(),
+        'stages_recomputed': recomputed
     }
+    statistics = result_data['class_statistics']
+    if result['validity'] is not None:
+        processed = np.count_nonzero(region) if region is not None else valid.size
+        statistics['valid_percentage'] = round(float(np.count_nonzero(valid)) / max(processed, 1) * 100, 2)
+    if region is not None:
+        statistics['region_percentage'] = round(float(np.count_nonzero(region)) / (frame_shape[0] * frame_shape[1]) * 100, 2)
     
     return result_data
 
-def _normalize_uint8(arr):
-    """Scale array to 0-255 for consistent thresholds across images."""
-    if arr.size == 0:
-        return arr
-    min_val, max_val = arr.min(), arr.max()
-    if max_val <= min_val:
-        return np.zeros_like(arr, dtype=np.uint8)
-    return ((arr.astype(np.float32) - min_val) / (max_val - min_val) * 255).astype(np.uint8)
+# Products of analyze_pair() a caller may supply (e.g. from a cache), their
+# fields in an IntermediateStore entry and the stage names reported for them
+PRODUCT_FIELDS = {
+    'validity': lambda entry: entry['valid'],
+    'luts': lambda entry: entry['luts'],
+    'segmentation': lambda entry: (entry['pre'], entry['post']),
+    'hsv_diff': lambda entry: (entry['h'], entry['s'], entry['v']),
+    'index_drop': lambda entry: entry['drop'],
+    'lab_delta': lambda entry: entry['delta_e'],
+}
+PRODUCT_ARRAYS = {
+    'validity': lambda valid: {'valid': valid},
+    'luts': lambda luts: {'luts': luts},
+    'segmentation': lambda pair: {'pre': pair[0], 'post': pair[1]},
+    'hsv_diff': lambda planes: dict(zip('hsv', planes)),
+    'index_drop': lambda drop: {'drop': drop},
+    'lab_delta': lambda delta_e: {'delta_e': delta_e},
+}
+STAGE_NAMES = {'luts': 'normalization'}
 
+def analyze_pair(images, config=None, region=None, products=None, on_computed=None, frame_pool=None, buffers=None):
+    """
+    The stages of the damage pipeline on a decoded pair, in memory: validity
+    masking, radiometric normalization of the post image, segmentation, the
+    difference planes of the configured change metrics, change detection and
+    the damage statistics. process_images, estimate_damage, calibration and
+    evaluation all go through here, so they score the same pipeline.
+    
+    Args:
+        images: the (pre, post) BGR pair, of equal size, or a callable returning it
+            (only called if some product has to be computed)
+        config: ProcessingConfig (defaults if None)
+        region: optional mask of the pixels to process (ROI minus exclusions)
+        products: known products by name (see PRODUCT_FIELDS), which are not recomputed
+        on_computed: optional callback(name, value) for every product computed here
+        frame_pool: optional FramePool; segmentation and HSV differences then run
+            in a worker process (their results live in shared memory until `buffers` ends)
+        buffers: optional BufferScope the frame-sized temporaries are borrowed from
+    
+    Returns:
+        dict of the products plus valid, veg_pre, significant_change, refined_post
+        and the unrounded forest_area_before, forest_area_after and damage_percentage
+    """
+    config = config or DEFAULT_CONFIG
+    products = dict(products or {})
+    pair = []
+    
+    def raw():
+        if not pair:
+            pre_image, post_image = images() if callable(images) else images
+            if pre_image.shape != post_image.shape:
+                raise ValueError("The pre and post images differ in size")
+            pair.extend((pre_image, post_image))
+        return pair[0], pair[1]
+    
+    def product(name, compute):
+        if products.get(name) is None:
+            products[name] = compute()
+            if on_computed is not None:
+                on_computed(name, products[name])
+        return products[name]
+    
+    # Pixels that take part in segmentation thresholds, change detection and statistics
+    validity = product('validity', lambda: pair_validity(*raw(), config)) if config.mask_invalid else None
+    valid = validity
+    if region is not None:
+        valid = region if validity is None else validity & region
+    
+    def inputs():
+        """The pair the stages read: the post image histogram-matched to the pre image if enabled."""
+        pre_image, post_image = raw()
+        if not config.radiometric_normalization:
+            return pre_image, post_image
+        if len(pair) == 2:
+            luts = product('luts', lambda: matching_luts(pre_image, post_image, config.normalization_subsample, valid))
+            pair.append(apply_luts(post_image, luts))
+        return pre_image, pair[2]
+    
+    planes_needed = required_planes(config)
+    use_hsv = 'h' in planes_needed
+    missing = [name for name, needed in (('segmentation', True), ('hsv_diff', use_hsv))
+               if needed and products.get(name) is None]
+    if frame_pool is not None and missing:
+        remote = frame_pool.analyze(*inputs(), config, missing, valid, scope=buffers)
+        if 'seg_pre' in remote:
+            product('segmentation', lambda: (remote['seg_pre'], remote['seg_post']))
+        if 'h' in remote:
+            product('hsv_diff', lambda: (remote['h'], remote['s'], remote['v']))
+    
+    def segment():
+        pre_image, post_image = inputs()
+        segmented_pre = perform_segmentation(pre_image, config, valid)
+        checkpoint()
+        return segmented_pre, perform_segmentation(post_image, config, valid)
+    segmented_pre, segmented_post = product('segmentation', segment)
+    # Stage boundaries are preemption points for the job scheduler
+    checkpoint()
+    
+    h_diff = s_diff = v_diff = None
+    if use_hsv:
+        h_diff, s_diff, v_diff = product('hsv_diff', lambda: hsv_difference(*inputs(), buffers=buffers))
+    # Vegetation index decrease and Lab colour difference, when change detection uses them
+    drop = product('index_drop', lambda: index_drop(*inputs(), config.change_index)) if config.change_index else None
+    delta_e = product('lab_delta', lambda: lab_delta_e(*inputs())) if 'delta_e' in planes_needed else None
+    checkpoint()
+    
+    # Change detection: vegetation lost by segmentation or by a strong shift of any change metric
+    veg_pre, significant_change, refined_post = detect_change(
+        segmented_pre, segmented_post, h_diff, s_diff, v_diff, config, drop, valid, delta_e, buffers
+    )
+    forest_area_before, forest_area_after, damage_percentage = calculate_damage(segmented_pre, refined_post, valid)
+    products.update(
+        validity=validity, valid=valid, segmented_pre=segmented_pre, segmented_post=segmented_post,
+        veg_pre=veg_pre, significant_change=significant_change, refined_post=refined_post,
+        forest_area_before=forest_area_before, forest_area_after=forest_area_after,
+        damage_percentage=damage_percentage,
+    )
+    return products
 
-def perform_segmentation(image):
+def estimate_damage(pre_image, post_image, config=None, regions=None):
+    """
+    Quick damage estimate of a decoded (typically downscaled preview) pair,
+    without caching or writing result maps. The post image is resized to the
+    pre image; `regions` are in the pixel coordinates of the pair.
+    
+    Returns:
+        dict with forest_area_before, forest_area_after and damage_percentage
+    """
+    height, width = pre_image.shape[:2]
+    if post_image.shape[:2] != (height, width):
+        post_image = cv2.resize(post_image, (width, height), interpolation=cv2.INTER_AREA)
+    region = rasterize_regions(regions, height, width) if regions else None
+    result = analyze_pair((pre_image, post_image), config, region)
+    return {name: round(result[name], 2) for name in ('forest_area_before', 'forest_area_after', 'damage_percentage')}
+
+def perform_segmentation(image, config=None, valid=None):
     """
     Six-class semantic segmentation (manuscript: Building, Land, Road, Vegetation, Water, Unlabeled).
     Uses color indices and rules compatible with the manuscript's integer-encoded masks.
+    Thresholds come from `config` (a ProcessingConfig); defaults if None.
+    
+    With a validity mask (see masking.validity_mask), tiles without any valid
+    pixel are not processed, invalid pixels do not contribute to the index
+    range or the vegetation threshold and are labelled unlabeled.
     """
+    config = config or DEFAULT_CONFIG
+    if valid is None:
+        return _segment(image, config)
+    
     height, width = image.shape[:2]
-    b, g, r = (image[:, :, i].astype(np.float32) for i in (0, 1, 2))
-    intensity = (r + g + b) / 3
-
-    # Water (class 4): blue-dominant, relatively dark
-    water_mask = (b > r) & (b > g) & (intensity < 180)
-
-    # Vegetation (class 3): green-dominant (G > R and G > B) + Excess Green index
-    exg = 2.0 * g - r - b
-    green_dominant = (g > r) & (g > b)
-    exg_uint = _normalize_uint8(exg)
-    if np.any(green_dominant):
-        pct = np.percentile(exg_uint[green_dominant], 25)
-        veg_thresh = max(35, float(pct)) if np.isfinite(pct) else 70
+    tile_size = DEFAULT_TILE_SIZE
+    tiles = valid_tiles(valid, tile_size)
+    if not tiles:
+        return np.full((height, width), CLASS_UNLABELED, dtype=np.uint8)
+    if len(tiles) == len(list(iter_tiles(height, width, tile_size))) or config.adaptive_tile_size:
+        # Nothing to skip (or thresholds depend on spatial neighbours): segment in place
+        segmented = _segment(image, config, valid)
     else:
-        veg_thresh = 70
-    vegetation_mask = (exg_uint >= veg_thresh) & green_dominant
+        # The index range and threshold are global over the valid pixels, as in place;
+        # then each valid tile is classified where it lies
+        value_range, threshold = _index_statistics(image, config, valid, tiles)
+        segmented = np.full((height, width), CLASS_UNLABELED, dtype=np.uint8)
+        for y0, y1, x0, x1 in tiles:
+            segmented[y0:y1, x0:x1] = _segment(image[y0:y1, x0:x1], config, valid[y0:y1, x0:x1],
+                                               value_range, threshold)
+    segmented[~valid] = CLASS_UNLABELED
+    return segmented
 
-    # Road (class 2): light grey, similar R≈G≈B; exclude green so vegetation isn't stolen
-    neutral = np.abs(r.astype(np.int32) - g.astype(np.int32)) < 30
-    neutral &= np.abs(g.astype(np.int32) - b.astype(np.int32)) < 30
-    road_mask = neutral & (intensity >= 80) & (intensity <= 220) & ~green_dominant
+def _index_statistics(image, config, valid, tiles):
+    """
+    Quantization range of the vegetation index and vegetation threshold over the
+    valid pixels of `tiles`, equal to those _segment computes over the whole frame.
+    """
+    name = config.vegetation_index
+    with worker_pool().scope() as buffers:
+        engines = {}  # One per tile shape (edge tiles are smaller), so buffers are borrowed once
+        def load(y0, y1, x0, x1):
+            tile = image[y0:y1, x0:x1]
+            engine = engines.setdefault(tile.shape[:2], IndexEngine(buffers))
+            engine.load(tile)
+            return engine, tile, valid[y0:y1, x0:x1]
+        
+        low, high = np.inf, -np.inf
+        for bounds in tiles:
+            engine, _, tile_valid = load(*bounds)
+            tile_low, tile_high = engine.value_range(name, tile_valid)
+            low, high = min(low, tile_low), max(high, tile_high)
+        value_range = (np.float32(low), np.float32(high))
+        
+        # Histogram of the quantized index over valid green-dominant pixels
+        hist = np.zeros(256, dtype=np.int64)
+        for bounds in tiles:
+            engine, tile, tile_valid = load(*bounds)
+            index_uint = engine.quantized(name, value_range=value_range)
+            mask = np.greater(tile[..., 1], tile[..., 2])
+            mask &= np.greater(tile[..., 1], tile[..., 0])
+            mask &= tile_valid
+            hist += np.bincount(index_uint[mask], minlength=256)
+    threshold = bounded_threshold(hist, config.threshold_policy, config.exg_percentile,
+                                  config.exg_floor, config.exg_fallback)
+    return value_range, threshold
 
-    # Building (class 0): dark, non-green (avoid shadowed forest being labeled building)
-    building_mask = (intensity < 100) & ~water_mask & ~green_dominant
-    building_mask |= (intensity < 70) & ~water_mask & ~green_dominant
+def _segment(image, config, valid=None, value_range=None, veg_thresh=None):
+    """
+    Classification rules of perform_segmentation over a whole image (or a tile,
+    given the frame's index `value_range` and vegetation threshold).
+    """
+    height, width = image.shape[:2]
+    with worker_pool().scope() as buffers:
+        # Channel and index planes are borrowed too, through the engine
+        engine = IndexEngine(buffers)
+        b, g, r = engine.load(image)
+        # Masks and float planes are pooled buffers filled in place
+        def mask():
+            return buffers.borrow((height, width), np.bool_)
+        scratch = mask()
+        plane = buffers.borrow((height, width), np.float32)
+        intensity = buffers.borrow((height, width), np.float32)
+        np.add(r, g, out=intensity)
+        intensity += b
+        intensity /= 3
+
+        # Water (class 4): blue-dominant, relatively dark
+        water_mask = np.greater(b, r, out=mask())
+        water_mask &= np.greater(b, g, out=scratch)
+        water_mask &= np.less(intensity, config.water_max_intensity, out=scratch)
+
+        # Vegetation (class 3): green-dominant (G > R and G > B) + vegetation index (Excess Green by default)
+        green_dominant = np.greater(g, r, out=mask())
+        green_dominant &= np.greater(g, b, out=scratch)
+        not_green = np.logical_not(green_dominant, out=mask())
+        # Quantized over the valid pixels' range, so masked-out clouds do not stretch it
+        if value_range is None and valid is not None:
+            value_range = engine.value_range(config.vegetation_index, valid)
+        index_uint = engine.quantized(config.vegetation_index, value_range=value_range)
+        if veg_thresh is None:
+            # Threshold from masked histograms: percentile or Otsu, global or per region
+            histogram_mask = green_dominant if valid is None else np.logical_and(green_dominant, valid, out=scratch)
+            veg_thresh = plane_threshold(
+                index_uint, histogram_mask, policy=config.threshold_policy, q=config.exg_percentile,
+                floor=config.exg_floor, fallback=config.exg_fallback, local_tile_size=config.adaptive_tile_size
+            )
+        vegetation_mask = np.greater_equal(index_uint, veg_thresh, out=mask())
+        vegetation_mask &= green_dominant
 
-    # Land (class 1): red-dominant, brownish; exclude green so forest stays vegetation
-    land_mask = (r > g + 15) & (r > b + 15) & ~neutral & ~green_dominant
+        # Road (class 2): light grey, similar R≈G≈B; exclude green so vegetation isn't stolen
+        # (channels hold integer values, so float differences are exact)
+        neutral = np.less(np.abs(np.subtract(r, g, out=plane), out=plane), config.neutral_tolerance, out=mask())
+        neutral &= np.less(np.abs(np.subtract(g, b, out=plane), out=plane), config.neutral_tolerance, out=scratch)
+        road_mask = np.greater_equal(intensity, config.road_min_intensity, out=mask())
+        road_mask &= np.less_equal(intensity, config.road_max_intensity, out=scratch)
+        road_mask &= neutral
+        road_mask &= not_green
 
-    # Assign: vegetation and water take precedence so green/dark-green isn't overwritten by land/building
-    segmented = np.full((height, width), CLASS_UNLABELED, dtype=np.uint8)
-    segmented[land_mask] = CLASS_LAND
-    segmented[building_mask & ~land_mask] = CLASS_BUILDING
-    segmented[road_mask & ~building_mask & ~land_mask] = CLASS_ROAD
-    segmented[vegetation_mask & ~water_mask & ~road_mask] = CLASS_VEGETATION
-    segmented[water_mask] = CLASS_WATER
+        # Building (class 0): dark, non-green (avoid shadowed forest being labeled building)
+        building_mask = np.less(intensity, config.building_max_intensity, out=mask())
+        building_mask |= np.less(intensity, 70, out=scratch)
+        building_mask &= np.logical_not(water_mask, out=scratch)
+        building_mask &= not_green
+
+        # Land (class 1): red-dominant, brownish; exclude green so forest stays vegetation
+        land_mask = np.greater(r, np.add(g, config.land_margin, out=plane), out=mask())
+        land_mask &= np.greater(r, np.add(b, config.land_margin, out=plane), out=scratch)
+        land_mask &= np.logical_not(neutral, out=scratch)
+        land_mask &= not_green
+
+        # Assign: vegetation and water take precedence so green/dark-green isn't overwritten by land/building
+        segmented = np.full((height, width), CLASS_UNLABELED, dtype=np.uint8)
+        segmented[land_mask] = CLASS_LAND
+        not_land = np.logical_not(land_mask, out=land_mask)
+        segmented[np.logical_and(building_mask, not_land, out=scratch)] = CLASS_BUILDING
+        road_only = np.logical_and(road_mask, not_land, out=not_land)
+        road_only &= np.logical_not(building_mask, out=scratch)
+        segmented[road_only] = CLASS_ROAD
+        vegetation_mask &= np.logical_not(water_mask, out=scratch)
+        vegetation_mask &= np.logical_not(road_mask, out=scratch)
+        segmented[vegetation_mask] = CLASS_VEGETATION
+        segmented[water_mask] = CLASS_WATER
 
     return segmented
 
-def calculate_damage(segmented_pre, segmented_post):
+def calculate_damage(segmented_pre, segmented_post, valid=None):
     """
     Calculate forest damage as the fraction of pre-typhoon vegetation
     that is no longer classified as vegetation in the post image.
+    With a validity mask, areas and damage are relative to valid pixels only.
     """
-    total_pixels = segmented_pre.size
-    forest_pixels_before = np.sum(segmented_pre == CLASS_VEGETATION)
-    forest_pixels_after = np.sum(segmented_post == CLASS_VEGETATION)
+    veg_pre = segmented_pre == CLASS_VEGETATION
+    veg_post = segmented_post == CLASS_VEGETATION
+    if valid is not None:
+        veg_pre &= valid
+        veg_post &= valid
+        total_pixels = np.count_nonzero(valid)
+    else:
+        total_pixels = segmented_pre.size
+    forest_pixels_before = np.count_nonzero(veg_pre)
+    forest_pixels_after = np.count_nonzero(veg_post)
     # Pixels that were vegetation in both (intact)
-    vegetation_lost = forest_pixels_before - np.sum(
-        (segmented_pre == CLASS_VEGETATION) & (segmented_post == CLASS_VEGETATION)
-    )
+    vegetation_lost = forest_pixels_before - np.count_nonzero(veg_pre & veg_post)
 
     forest_area_before = (forest_pixels_before / total_pixels) * 100 if total_pixels else 0
     forest_area_after = (forest_pixels_after / total_pixels) * 100 if total_pixels else 0
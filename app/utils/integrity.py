@@ -0,0 +1,286 @@
+"""
+Consistency checks between the database and the files it references.
+
+Verifier.run() makes three passes, each resumable from a checkpoint:
+
+  artifacts    every live Artifact row: the file exists, has the recorded
+               size and (with verify_hash) the recorded SHA-256, and image
+               files have a readable header (or, with decode, pixels)
+  assessments  every assessment: the images and result maps it references
+               exist and are registered, and the result maps are not stale
+               (older than the images, or of another size)
+  temporary    leftover *.tmp files of interrupted writes
+
+Rows are read in id order in batches (keyset pagination), so memory stays
+flat however large the tables are, and the files of a batch are checked
+on a thread pool (stat, hashing and decoding release the GIL). After each
+batch the position is saved to the checkpoint file, so an interrupted pass
+over millions of files resumes where it stopped.
+
+Assessments whose uploads are sound but whose results are missing, stale
+or damaged are collected as repair candidates; reprocessing regenerates
+them. Needs an application context.
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import cv2
+from flask import current_app
+
+from app.models import Artifact, Assessment, Capture
+from app.utils.artifacts import INTERMEDIATE_KINDS, artifact_path
+from app.utils.image_io import image_info
+from app.utils.media import file_sha256, normalize_media_path
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_WORKERS = 8
+PHASES = ('artifacts', 'assessments', 'temporary')
+
+# Issue kinds
+MISSING = 'missing'  # Referenced or registered file does not exist
+PARTIAL = 'partial'  # Empty file, or a *.tmp left by an interrupted write
+SIZE_MISMATCH = 'size_mismatch'  # Size differs from the registry
+HASH_MISMATCH = 'hash_mismatch'  # SHA-256 differs from the registry
+UNREADABLE = 'unreadable'  # Image header (or pixels, with decode) cannot be read
+STALE = 'stale'  # Result map older than the images, or of another size
+UNTRACKED = 'untracked'  # Referenced file has no Artifact row
+
+# Kinds whose files are images
+_IMAGE_KINDS = ('upload', 'visualization')
+# Temporary files younger than this may still be being written
+TEMPORARY_GRACE_SECONDS = 3600
+
+
+def check_file(path, size=None, sha256=None, image=False, decode=False):
+    """
+    Problems with one file (thread-safe, no database access).
+
+    Returns:
+        (issues, info): issues is a list of (kind, detail); info has the
+        file's mtime and, for images, its (width, height) or None
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return [(MISSING, None)], None
+    except OSError as e:
+        return [(UNREADABLE, str(e))], None
+    if stat.st_size == 0:
+        return [(PARTIAL, 'empty file')], None
+    issues = []
+    info = {'mtime': stat.st_mtime, 'size': None}
+    if size and stat.st_size != size:
+        issues.append((SIZE_MISMATCH, f"{stat.st_size} bytes, registered {size}"))
+    if sha256:
+        digest = file_sha256(path)
+        if digest != sha256:
+            issues.append((HASH_MISMATCH, f"sha256 {digest[:12]}, registered {sha256[:12]}"))
+    if image:
+        fmt, dimensions = image_info(path)
+        if fmt is None and not cv2.haveImageReader(path):
+            issues.append((UNREADABLE, 'unrecognised image header'))
+        elif decode:
+            decoded = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+            if decoded is None:
+                issues.append((UNREADABLE, 'image does not decode'))
+            else:
+                dimensions = (decoded.shape[1], decoded.shape[0])
+        info['size'] = dimensions
+    return issues, info
+
+
+def _batches(query, column, after_id, batch_size):
+    """Rows of `query` with `column` > after_id, in id order, one batch (list) at a time."""
+    while True:
+        batch = query.filter(column > after_id).order_by(column).limit(batch_size).all()
+        if not batch:
+            return
+        yield batch
+        after_id = getattr(batch[-1], column.key)
+
+
+def _static_path(stored_path):
+    return os.path.join(current_app.static_folder, *normalize_media_path(stored_path).split('/'))
+
+
+class Checkpoint:
+    """Progress of a verification pass, saved as JSON (atomically) after each batch."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.state = {'phase': PHASES[0], 'last_id': 0, 'counts': {}, 'repair': [],
+                      'started_at': datetime.utcnow().isoformat()}
+
+    @classmethod
+    def load(cls, path):
+        checkpoint = cls(path)
+        if path and os.path.exists(path):
+            with open(path) as f:
+                checkpoint.state.update(json.load(f))
+        return checkpoint
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+    def advance(self, phase, last_id=0):
+        self.state.update(phase=phase, last_id=last_id)
+        self.save()
+
+    def count(self, kind):
+        counts = self.state['counts']
+        counts[kind] = counts.get(kind, 0) + 1
+
+    def add_repair(self, assessment_id):
+        if assessment_id not in self.state['repair']:
+            self.state['repair'].append(assessment_id)
+
+
+class Verifier:
+    """
+    One verification pass. `report` is called with each issue, a dict with
+    kind, path, assessment_id and detail.
+    """
+
+    def __init__(self, checkpoint=None, report=None, batch_size=DEFAULT_BATCH_SIZE, workers=DEFAULT_WORKERS,
+                 verify_hash=False, decode=False):
+        self.checkpoint = checkpoint or Checkpoint()
+        self.report = report or (lambda issue: None)
+        self.batch_size = batch_size
+        self.workers = workers
+        self.verify_hash = verify_hash
+        self.decode = decode
+
+    def run(self):
+        """Run (or resume) every phase; returns the checkpoint state (counts and repair candidates)."""
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='verify') as pool:
+            self._pool = pool
+            start = PHASES.index(self.checkpoint.state['phase']) if self.checkpoint.state['phase'] in PHASES \
+                else len(PHASES)
+            for phase in PHASES[start:]:
+                getattr(self, f"_verify_{phase}")(self.checkpoint.state['last_id'])
+                self.checkpoint.advance(PHASES[PHASES.index(phase) + 1] if phase != PHASES[-1] else 'done')
+        self.checkpoint.state['finished_at'] = datetime.utcnow().isoformat()
+        self.checkpoint.save()
+        return self.checkpoint.state
+
+    def _issue(self, kind, path, assessment_id=None, detail=None):
+        self.checkpoint.count(kind)
+        self.report({'kind': kind, 'path': path, 'assessment_id': assessment_id, 'detail': detail})
+
+    def _check_all(self, items):
+        """check_file() over (path, kwargs) items on the pool, in order."""
+        return list(self._pool.map(lambda item: check_file(item[0], **item[1]), items))
+
+    def _verify_artifacts(self, after_id):
+        query = Artifact.query.filter(Artifact.released_at.is_(None))
+        for batch in _batches(query, Artifact.id, after_id, self.batch_size):
+            items = []
+            for artifact in batch:
+                regenerable = artifact.kind in INTERMEDIATE_KINDS
+                items.append((artifact_path(artifact), {
+                    # Intermediates are rewritten in place and thumbnails are registered before they exist
+                    'size': artifact.size_bytes if not regenerable else None,
+                    'sha256': artifact.sha256 if self.verify_hash else None,
+                    'image': artifact.kind in _IMAGE_KINDS,
+                    'decode': self.decode,
+                }))
+            for artifact, (path, _), (issues, _) in zip(batch, items, self._check_all(items)):
+                for kind, detail in issues:
+                    if kind == MISSING and artifact.kind in INTERMEDIATE_KINDS:
+                        continue  # Caches; regenerated on demand
+                    self._issue(kind, path, artifact.assessment_id, detail)
+                    if artifact.kind == 'visualization' and artifact.assessment_id:
+                        self.checkpoint.add_repair(artifact.assessment_id)
+            self.checkpoint.advance('artifacts', batch[-1].id)
+
+    def _verify_assessments(self, after_id):
+        for batch in _batches(Assessment.query, Assessment.id, after_id, self.batch_size):
+            ids = [assessment.id for assessment in batch]
+            captures = {}
+            for capture in Capture.query.filter(Capture.assessment_id.in_(ids)):
+                captures.setdefault(capture.assessment_id, []).append(capture)
+
+            # (assessment, role, path) of every referenced file
+            references = []
+            for assessment in batch:
+                for role, stored in (('pre', assessment.pre_image), ('post', assessment.post_image)):
+                    if stored:
+                        references.append((assessment, role, _static_path(stored)))
+                if assessment.processed:
+                    for role, stored in (('pre_vis', assessment.pre_vis_path), ('post_vis', assessment.post_vis_path),
+                                         ('change_vis', assessment.change_vis_path)):
+                        if stored:
+                            references.append((assessment, role, _static_path(stored)))
+                        else:
+                            self._issue(MISSING, None, assessment.id, f"no {role} recorded for a processed assessment")
+                            self.checkpoint.add_repair(assessment.id)
+                for capture in captures.get(assessment.id, []):
+                    references.append((assessment, f"capture_{capture.sequence}", _static_path(capture.image_path)))
+
+            registered = {
+                artifact_path(artifact) for artifact in Artifact.query.filter(
+                    Artifact.assessment_id.in_(ids), Artifact.released_at.is_(None)
+                )
+            }
+            # Contents were checked in the artifacts pass; here only headers, for sizes and staleness
+            results = self._check_all([(path, {'image': True}) for _, _, path in references])
+            files = {}
+            for (assessment, role, path), (issues, info) in zip(references, results):
+                files[(assessment.id, role)] = info if not issues else None
+                if path not in registered and not any(kind == MISSING for kind, _ in issues):
+                    self._issue(UNTRACKED, path, assessment.id, role)
+                for kind, detail in issues:
+                    self._issue(kind, path, assessment.id, f"{role}: {detail}" if detail else role)
+                    if role.endswith('_vis'):
+                        self.checkpoint.add_repair(assessment.id)
+
+            for assessment in batch:
+                self._check_stale(assessment, files)
+            self.checkpoint.advance('assessments', batch[-1].id)
+
+    def _check_stale(self, assessment, files):
+        pre, post = files.get((assessment.id, 'pre')), files.get((assessment.id, 'post'))
+        if not assessment.processed:
+            return
+        if pre is None or post is None:
+            # Results of missing or damaged images cannot be regenerated
+            self.checkpoint.state['repair'] = [i for i in self.checkpoint.state['repair'] if i != assessment.id]
+            return
+        for role in ('pre_vis', 'post_vis', 'change_vis'):
+            result = files.get((assessment.id, role))
+            if result is None:
+                continue
+            path = _static_path(getattr(assessment, f"{role}_path"))
+            if result['mtime'] < max(pre['mtime'], post['mtime']):
+                self._issue(STALE, path, assessment.id,
+                            f"{role} is older than the uploaded images")
+                self.checkpoint.add_repair(assessment.id)
+            elif pre['size'] and result['size'] and pre['size'] != result['size']:
+                self._issue(STALE, path, assessment.id,
+                            f"{role} is {result['size'][0]}x{result['size'][1]}, "
+                            f"pre image {pre['size'][0]}x{pre['size'][1]}")
+                self.checkpoint.add_repair(assessment.id)
+
+    def _verify_temporary(self, after_id):
+        roots = (current_app.config['UPLOAD_FOLDER'], current_app.config['INTERMEDIATES_FOLDER'],
+                 os.path.join(current_app.instance_path, 'thumbnails'))
+        cutoff = time.time() - TEMPORARY_GRACE_SECONDS
+        for root in roots:
+            for directory, _, names in os.walk(root):
+                for name in names:
+                    if not name.endswith('.tmp'):
+                        continue
+                    path = os.path.join(directory, name)
+                    try:
+                        if os.path.getmtime(path) < cutoff:
+                            self._issue(PARTIAL, path, None, 'interrupted write')
+                    except OSError:
+                        pass
@@ -0,0 +1,90 @@
+"""
+Per-assessment store for intermediate pipeline products.
+
+Products are compressed .npz files under one directory per assessment. Each
+product name carries the stage key of the config that produced it (see
+ProcessingConfig.stage_key), and the whole store is bound to a fingerprint
+of the input images: if either upload changes, every cached product is
+discarded.
+"""
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def file_fingerprint(path):
+    """Cheap identity of an input file: resolved path, size and mtime."""
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class IntermediateStore:
+    """Compressed numpy intermediates for one assessment, invalidated when its inputs change."""
+
+    def __init__(self, root, inputs):
+        self.root = root
+        self.inputs = inputs
+        os.makedirs(root, exist_ok=True)
+        manifest_path = os.path.join(root, MANIFEST_NAME)
+        manifest = {}
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                manifest = {}
+        if manifest.get('inputs') != inputs:
+            self.clear()
+            self._write_manifest()
+
+    @classmethod
+    def for_images(cls, root, *image_paths):
+        return cls(root, [file_fingerprint(path) for path in image_paths])
+
+    def _write_manifest(self):
+        with open(os.path.join(self.root, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+            json.dump({'inputs': self.inputs}, f)
+
+    def _path(self, name, key=None):
+        return os.path.join(self.root, f"{name}_{key}.npz" if key else f"{name}.npz")
+
+    def load(self, name, key=None):
+        """Return the cached arrays as a dict, or None if the product is missing or unreadable."""
+        path = self._path(name, key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                return {k: data[k] for k in data.files}
+        except (OSError, ValueError):
+            return None
+
+    def save(self, name, key=None, **arrays):
+        """Atomically write arrays as a compressed product, replacing older keys of the same name."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp_path, self._path(name, key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        # Only the latest parameters are kept per product
+        keep = os.path.basename(self._path(name, key))
+        for entry in os.listdir(self.root):
+            if entry != keep and entry.startswith(f"{name}_") and entry.endswith('.npz'):
+                os.remove(os.path.join(self.root, entry))
+
+    def clear(self):
+        for entry in os.listdir(self.root):
+            path = os.path.join(self.root, entry)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
@@ -0,0 +1,232 @@
+"""
+Assessment processing, queued by the web form and the JSON API.
+
+process_assessment() runs the pipeline for one assessment and stores the
+results on it. The JobQueue runs it on a small thread pool; job state lives
+in the assessment's additional_data ('job'), so any worker process can
+report it, and waiters in the same process are woken as soon as a job
+finishes instead of polling the database. With PROCESSING_PREFORK the
+threads (and the frame pool's processes) are started and warmed up front.
+
+Every run is admitted by the queue's FairScheduler
+(app/utils/scheduler.py), costed from the image headers of the pair.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+
+from app import db
+from app.models import Assessment, DamagePatch
+from app.utils.artifacts import register_artifact, release_artifacts
+from app.utils.frame_handoff import parse_size, shared_frame_pool, warm_up
+from app.utils.georef import image_georef
+from app.utils.grid_summary import grid_update, remove_assessment_grid, update_assessment_grid
+from app.utils.image_processing import CHANGE_PALETTE, CLASS_PALETTE, process_images
+from app.utils.label_maps import read_label_map
+from app.utils.page_cache import page_cache
+from app.utils.media import normalize_media_path
+from app.utils.pipeline_config import load_processing_config
+from app.utils.scheduler import FairScheduler, Ticket, bound, estimate_pixels
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+PENDING_STATES = (JOB_QUEUED, JOB_RUNNING)
+
+DEFAULT_WORKERS = 2
+
+
+def _static_file(stored_path):
+    """Absolute path of a stored image path under the static folder."""
+    return os.path.join(current_app.static_folder, *normalize_media_path(stored_path).split('/'))
+
+
+def process_assessment(assessment, overrides=None):
+    """
+    Run the pipeline on an assessment's uploaded pair and store the results on it.
+
+    Args:
+        overrides: Mapping of ProcessingConfig parameters overriding the configured ones
+
+    The results are committed with the site grid update. Returns the process_images result.
+    """
+    config = load_processing_config(current_app.config.get('PROCESSING_CONFIG'), overrides)
+    pre_image_path = _static_file(assessment.pre_image)
+    post_image_path = _static_file(assessment.post_image)
+    # Cached intermediates mean only the stages downstream of a change rerun
+    cache_dir = os.path.join(current_app.config['INTERMEDIATES_FOLDER'], f"assessment_{assessment.id}")
+    result_data = process_images(pre_image_path, post_image_path, config=config, cache_dir=cache_dir,
+                                 result_format=current_app.config['RESULT_FORMAT'],
+                                 compression=current_app.config['RESULT_COMPRESSION'],
+                                 frame_pool=frame_pool(current_app), regions=assessment.regions)
+
+    # Update assessment with results
+    assessment.forest_area_before = result_data['forest_area_before']
+    assessment.forest_area_after = result_data['forest_area_after']
+    assessment.damage_percentage = result_data['damage_percentage']
+    assessment.pre_vis_path = result_data['pre_vis_path']
+    assessment.post_vis_path = result_data['post_vis_path']
+    assessment.change_vis_path = result_data['change_vis_path']
+    assessment.class_statistics = result_data['class_statistics']
+    assessment.processing_config = result_data['config']
+    assessment.processed_date = datetime.now()
+
+    # Replace any patches from a previous run
+    assessment.damage_patches.delete()
+    db.session.add_all(
+        DamagePatch.from_dict(assessment.id, patch) for patch in result_data['damage_patches']
+    )
+
+    # Register the new outputs; visualizations from the previous run and pruned
+    # cache entries are released for the artifact GC
+    outputs = [_static_file(result_data[key]) for key in ('pre_vis_path', 'post_vis_path', 'change_vis_path')]
+    for path in outputs:
+        register_artifact(path, 'visualization', assessment.id)
+    release_artifacts(assessment.id, kinds=('visualization',), keep_paths=outputs)
+    # Report thumbnails and GeoTIFF exports of the replaced maps
+    release_artifacts(assessment.id, kinds=('thumbnail', 'export'))
+    cached = [entry.path for entry in os.scandir(cache_dir) if entry.name.endswith('.npz')]
+    for path in cached:
+        register_artifact(path, 'intermediate', assessment.id)
+    release_artifacts(assessment.id, kinds=('intermediate',), keep_paths=cached, directory=cache_dir)
+    # Rendered pages showing the previous results
+    page_cache.invalidate_assessment(assessment.id, assessment.user_id)
+
+    # Georeference from the upload (GeoTIFF tags or a world file) unless one was set
+    if assessment.georef is None:
+        assessment.georef = image_georef(pre_image_path)
+    with grid_update():
+        refresh_grid(assessment)
+
+    return result_data
+
+
+def refresh_grid(assessment):
+    """Replace the assessment's site grid contributions from its stored label maps. Run inside grid_update()."""
+    if not assessment.georef or not assessment.change_vis_path:
+        remove_assessment_grid(assessment.id)
+        return 0
+    change_codes = read_label_map(_static_file(assessment.change_vis_path), CHANGE_PALETTE)
+    post_labels = read_label_map(_static_file(assessment.post_vis_path), CLASS_PALETTE)
+    return update_assessment_grid(assessment.id, change_codes, post_labels, assessment.georef)
+
+
+def _warm_size(app):
+    """Frame size workers are warmed on, in prefork mode only."""
+    return parse_size(app.config.get('PROCESSING_WARM_SIZE')) if app.config.get('PROCESSING_PREFORK') else None
+
+
+def frame_pool(app):
+    """The shared FramePool when PROCESSING_PROCESSES is set, else None."""
+    processes = app.config.get('PROCESSING_PROCESSES', 0)
+    if not processes:
+        return None
+    return shared_frame_pool(processes, _warm_size(app))
+
+
+def job_ticket(assessment):
+    """Scheduler ticket for processing an assessment, costed from its pre image header and ROI."""
+    role = assessment.author.role if assessment.author is not None else None
+    pixels = estimate_pixels(_static_file(assessment.pre_image), assessment.regions)
+    return Ticket(assessment.user_id, role, pixels, label=assessment.id)
+
+
+def mark_queued(assessment, overrides=None):
+    """Record a queued job on the assessment (caller commits, then calls JobQueue.submit)."""
+    assessment.job = {
+        'status': JOB_QUEUED,
+        'overrides': dict(overrides or {}),
+        'queued_at': datetime.utcnow().isoformat(),
+    }
+
+
+class JobQueue:
+    """Background processing of queued assessments on a thread pool."""
+
+    def __init__(self, app=None):
+        self._executor = None
+        self._lock = threading.Lock()
+        self._finished = threading.Condition()
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        # PROCESSING_WORKERS is the CPU budget: jobs running at once
+        self.scheduler = FairScheduler(app.config.get('PROCESSING_WORKERS', DEFAULT_WORKERS),
+                                       app.config.get('PROCESSING_MEMORY_BUDGET'))
+        app.extensions['job_queue'] = self
+
+    @property
+    def threads(self):
+        # A preempted job keeps its thread while paused, so there is one spare per slot
+        return 2 * self.scheduler.slots
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                warm_size = _warm_size(self.app)
+                self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='assessment-job',
+                                                    initializer=warm_up if warm_size else None,
+                                                    initargs=(warm_size,) if warm_size else ())
+            return self._executor
+
+    def start(self):
+        """Start (and warm) every worker thread and frame pool process now rather than on the first jobs."""
+        executor = self._pool()
+        # Tasks that wait for each other occupy distinct threads, so all of them are created
+        barrier = threading.Barrier(self.threads)
+        for future in [executor.submit(barrier.wait) for _ in range(self.threads)]:
+            future.result()
+        pool = frame_pool(self.app)
+        if pool is not None:
+            pool.start()
+
+    def submit(self, assessment_id):
+        """
+        Schedule a job already marked queued (and committed) for an assessment;
+        it is handed to the thread pool when the scheduler admits it.
+        """
+        ticket = job_ticket(db.session.get(Assessment, assessment_id))
+        return self.scheduler.submit(ticket, lambda ticket: self._pool().submit(self._run, assessment_id, ticket))
+
+    def _set_job(self, assessment, **changes):
+        job = dict(assessment.job or {})
+        job.update(changes)
+        assessment.job = job
+        db.session.commit()
+
+    def _run(self, assessment_id, ticket):
+        with self.app.app_context(), bound(ticket):
+            try:
+                assessment = db.session.get(Assessment, assessment_id)
+                if assessment is None or (assessment.job or {}).get('status') != JOB_QUEUED:
+                    return
+                self._set_job(assessment, status=JOB_RUNNING, started_at=datetime.utcnow().isoformat(),
+                              queue_wait=round(ticket.waited, 3))
+                try:
+                    process_assessment(assessment, (assessment.job or {}).get('overrides'))
+                    self._set_job(assessment, status=JOB_DONE, finished_at=datetime.utcnow().isoformat(),
+                                  preemptions=ticket.preemptions)
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.error(f"Processing job for assessment {assessment_id} failed: {str(e)}")
+                    assessment = db.session.get(Assessment, assessment_id)
+                    if assessment is not None:
+                        self._set_job(assessment, status=JOB_FAILED, error=str(e),
+                                      finished_at=datetime.utcnow().isoformat())
+            finally:
+                self.scheduler.finish(ticket)
+                db.session.remove()
+                with self._finished:
+                    self._finished.notify_all()
+
+    def wait(self, timeout):
+        """Block until any job finishes in this process, or `timeout` seconds pass."""
+        with self._finished:
+            self._finished.wait(timeout)
@@ -0,0 +1,220 @@
+"""
+Lossless storage of label maps (class ids, change codes) as indexed images.
+
+Label maps are written as palettized PNG: one palette index per pixel at
+the smallest bit depth that holds the palette (1, 2, 4 or 8 bits), so a
+six-class map is an 8-bit indexed image and a change map packs four pixels
+per byte. Browsers display them like any other image, and read_label_map()
+returns the integer array directly, so statistics and re-rendering never
+need the segmentation again. Lossless WebP (RGB, through OpenCV) is
+available as an alternative; its colors are mapped back to indices on read.
+
+Encoding is plain numpy + zlib, which releases the GIL, so save_label_map_async()
+can run encodes on a thread pool while the caller keeps computing.
+"""
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_COLOR_TYPE_PALETTE = 3
+
+FORMATS = ('png', 'webp')
+DEFAULT_FORMAT = 'png'
+# zlib level for PNG (0-9); 6 is a good size/speed trade-off for label maps
+DEFAULT_COMPRESSION = 6
+
+# Rows compressed per zlib call, bounding the temporary filtered buffer
+_ROWS_PER_BLOCK = 512
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def _bit_depth(palette_size):
+    for depth in (1, 2, 4):
+        if palette_size <= (1 << depth):
+            return depth
+    return 8
+
+
+def _chunk(tag, data):
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+
+def _pack_rows(indices, bit_depth):
+    """Pack each row of palette indices into PNG scanlines (without filter bytes)."""
+    if bit_depth == 8:
+        return indices
+    per_byte = 8 // bit_depth
+    height, width = indices.shape
+    padded = -width % per_byte
+    if padded:
+        indices = np.pad(indices, ((0, 0), (0, padded)))
+    groups = indices.reshape(height, -1, per_byte)
+    shifts = (bit_depth * np.arange(per_byte - 1, -1, -1)).astype(np.uint8)
+    return np.bitwise_or.reduce(groups << shifts, axis=2).astype(np.uint8)
+
+
+def _unpack_rows(scanlines, bit_depth, width):
+    if bit_depth == 8:
+        return scanlines[:, :width]
+    per_byte = 8 // bit_depth
+    shifts = (bit_depth * np.arange(per_byte - 1, -1, -1)).astype(np.uint8)
+    mask = np.uint8((1 << bit_depth) - 1)
+    unpacked = (scanlines[:, :, None] >> shifts) & mask
+    return unpacked.reshape(scanlines.shape[0], -1)[:, :width]
+
+
+def encode_indexed_png(indices, palette, compression=DEFAULT_COMPRESSION):
+    """
+    Palettized PNG bytes of a 2-D array of palette indices.
+
+    Args:
+        indices: uint8 array; every value must be < len(palette)
+        palette: sequence of (r, g, b) tuples
+        compression: zlib level 0-9
+    """
+    indices = np.ascontiguousarray(indices, dtype=np.uint8)
+    height, width = indices.shape
+    bit_depth = _bit_depth(len(palette))
+    scanlines = _pack_rows(indices, bit_depth)
+
+    compressor = zlib.compressobj(compression)
+    parts = []
+    for y0 in range(0, height, _ROWS_PER_BLOCK):
+        block = scanlines[y0:y0 + _ROWS_PER_BLOCK]
+        # Filter type 0 (None) on every row: indices do not benefit from prediction
+        filtered = np.zeros((block.shape[0], block.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 1:] = block
+        parts.append(compressor.compress(filtered.tobytes()))
+    parts.append(compressor.flush())
+
+    header = struct.pack('>IIBBBBB', width, height, bit_depth, PNG_COLOR_TYPE_PALETTE, 0, 0, 0)
+    plte = bytes(channel for color in palette for channel in color)
+    return b''.join((
+        PNG_SIGNATURE,
+        _chunk(b'IHDR', header),
+        _chunk(b'PLTE', plte),
+        _chunk(b'IDAT', b''.join(parts)),
+        _chunk(b'IEND', b''),
+    ))
+
+
+def decode_indexed_png(data):
+    """
+    (indices, palette) of a palettized PNG written by encode_indexed_png.
+    Returns None for PNGs this fast path does not handle (other color types,
+    interlacing or row filters), so callers can fall back to a full decoder.
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        return None
+    pos = len(PNG_SIGNATURE)
+    header, palette, idat = None, None, []
+    while pos < len(data):
+        length, tag = struct.unpack('>I4s', data[pos:pos + 8])
+        body = data[pos + 8:pos + 8 + length]
+        if tag == b'IHDR':
+            header = struct.unpack('>IIBBBBB', body)
+        elif tag == b'PLTE':
+            palette = [tuple(body[i:i + 3]) for i in range(0, len(body), 3)]
+        elif tag == b'IDAT':
+            idat.append(body)
+        elif tag == b'IEND':
+            break
+        pos += 12 + length
+    if header is None or palette is None:
+        return None
+    width, height, bit_depth, color_type, _, _, interlace = header
+    if color_type != PNG_COLOR_TYPE_PALETTE or interlace:
+        return None
+    row_bytes = (width * bit_depth + 7) // 8
+    raw = np.frombuffer(zlib.decompress(b''.join(idat)), dtype=np.uint8).reshape(height, row_bytes + 1)
+    if raw[:, 0].any():
+        return None
+    return np.ascontiguousarray(_unpack_rows(raw[:, 1:], bit_depth, width)), palette
+
+
+def _colors_to_indices(image_rgb, palette):
+    """Map exact palette colors back to indices (colors outside the palette map to the last entry)."""
+    packed = (image_rgb[..., 0].astype(np.uint32) << 16) | (image_rgb[..., 1].astype(np.uint32) << 8) | image_rgb[..., 2]
+    keys = np.array([(r << 16) | (g << 8) | b for r, g, b in palette], dtype=np.uint32)
+    order = np.argsort(keys)
+    position = np.clip(np.searchsorted(keys[order], packed), 0, len(keys) - 1)
+    indices = order[position].astype(np.uint8)
+    indices[keys[indices] != packed] = len(palette) - 1
+    return indices
+
+
+def save_label_map(indices, path, palette, fmt=DEFAULT_FORMAT, compression=DEFAULT_COMPRESSION):
+    """
+    Write a label map losslessly to `path` (atomically).
+
+    Args:
+        fmt: 'png' (palettized, smallest bit depth) or 'webp' (lossless RGB)
+        compression: zlib level 0-9 for PNG; ignored for WebP
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported label map format: {fmt}")
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if fmt == 'png':
+        data = encode_indexed_png(indices, palette, compression)
+    else:
+        lut = np.array(palette, dtype=np.uint8)[:, ::-1]  # BGR for OpenCV
+        ok, buffer = cv2.imencode('.webp', lut[indices], [cv2.IMWRITE_WEBP_QUALITY, 101])
+        if not ok:
+            raise ValueError(f"Failed to encode label map: {path}")
+        data = buffer.tobytes()
+    # A unique temporary name per writer: reprocessing, API batches and the web queue
+    # may write the same map at once
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def _encoder_pool():
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            _encoder = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1),
+                                          thread_name_prefix='label-map-encoder')
+        return _encoder
+
+
+def save_label_map_async(indices, path, palette, fmt=DEFAULT_FORMAT, compression=DEFAULT_COMPRESSION):
+    """Encode and write a label map on a background thread; returns a Future of the path."""
+    return _encoder_pool().submit(save_label_map, indices, path, palette, fmt, compression)
+
+
+def read_label_map(path, palette=None):
+    """
+    Integer label array of a stored label map.
+
+    Palettized PNGs are decoded directly to their indices. Anything else
+    (WebP, RGB PNG) is decoded to colors and mapped back through `palette`,
+    which is then required.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    decoded = decode_indexed_png(data)
+    if decoded is not None:
+        return decoded[0]
+    if palette is None:
+        raise ValueError(f"Label map {path} is not an indexed PNG; a palette is needed to decode it")
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"Failed to decode label map: {path}")
+    return _colors_to_indices(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), palette)
@@ -0,0 +1,58 @@
+"""
+Cloud, shadow and over-exposure masking on a downsampled level.
+
+Invalid pixels are detected on an image reduced by `downsample` (INTER_AREA),
+cleaned up with a small morphological opening, grown by one cell and scaled
+back up with nearest-neighbour interpolation. The resulting validity mask is
+cheap to compute even for large mosaics. Downstream stages use it to skip
+fully invalid tiles and to exclude invalid pixels from change detection
+and damage statistics.
+"""
+import cv2
+import numpy as np
+
+from app.utils.tiling import DEFAULT_TILE_SIZE, iter_tiles
+
+
+def invalid_mask_small(image, config):
+    """
+    Invalid-pixel mask (uint8 0/1) of `image` at the downsampled level.
+
+    Clouds are bright and unsaturated, shadows dark, and over-exposed pixels
+    have a clipped channel.
+    """
+    factor = max(1, int(config.mask_downsample))
+    height, width = image.shape[:2]
+    small = cv2.resize(image, (max(1, width // factor), max(1, height // factor)), interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    saturation, value = hsv[:, :, 1], hsv[:, :, 2]
+    cloud = (value >= config.cloud_min_value) & (saturation <= config.cloud_max_saturation)
+    shadow = value <= config.shadow_max_value
+    overexposed = small.max(axis=2) >= config.overexposed_value
+    invalid = (cloud | shadow | overexposed).astype(np.uint8)
+    kernel = np.ones((3, 3), np.uint8)
+    # Opening drops isolated bright/dark specks (e.g. a white roof); dilation covers soft edges
+    invalid = cv2.morphologyEx(invalid, cv2.MORPH_OPEN, kernel)
+    return cv2.dilate(invalid, kernel)
+
+
+def validity_mask(image, config):
+    """Full-resolution boolean mask of pixels usable for segmentation and change statistics."""
+    height, width = image.shape[:2]
+    invalid = cv2.resize(invalid_mask_small(image, config), (width, height), interpolation=cv2.INTER_NEAREST)
+    return invalid == 0
+
+
+def pair_validity(pre_image, post_image, config):
+    """Pixels valid in both captures of a pair."""
+    return validity_mask(pre_image, config) & validity_mask(post_image, config)
+
+
+def valid_tiles(valid, tile_size=DEFAULT_TILE_SIZE):
+    """Bounds (y0, y1, x0, x1) of the tiles containing at least one valid pixel."""
+    height, width = valid.shape
+    return [
+        (y0, y1, x0, x1)
+        for _, _, y0, y1, x0, x1 in iter_tiles(height, width, tile_size)
+        if valid[y0:y1, x0:x1].any()
+    ]
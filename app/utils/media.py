@@ -0,0 +1,95 @@
+"""
+Content-addressed URLs for uploads and result images.
+
+media_url() turns any stored image path (legacy 'static/uploads/x.jpg',
+'uploads/x.jpg', bare file names, Windows separators) into a stable
+/media/<digest>/<path> URL whose digest is a hash of the file contents. A URL
+therefore never changes meaning, so responses can be cached forever
+(Cache-Control: immutable), and the digest doubles as a strong ETag.
+Digests are cached in-process by (path, size, mtime) so a page view does not
+rehash files that have not changed.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Hex characters of the SHA-256 used in URLs and ETags
+DIGEST_LENGTH = 20
+
+# Upper bound of cached digests (entries are a few hundred bytes)
+_DIGEST_CACHE_SIZE = 4096
+_digest_cache = OrderedDict()
+_digest_lock = threading.Lock()
+
+_CHUNK_SIZE = 1 << 20
+
+
+def file_sha256(path):
+    """Full hex SHA-256 of a file, read in chunks."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def save_atomically(path, write):
+    """
+    Create or replace the file at `path` by calling write(f) on a temporary
+    file in the same directory and renaming it over `path`. The old file is
+    never written in place, so readers (and other names of it) see either the
+    old or the new contents.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def copy_atomically(source, path):
+    """Copy `source` to `path` through save_atomically()."""
+    with open(source, 'rb') as src:
+        save_atomically(path, lambda f: shutil.copyfileobj(src, f, _CHUNK_SIZE))
+
+
+def content_digest(path):
+    """Shortened content hash of a file, cached until its size or mtime changes."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        digest = _digest_cache.get(key)
+        if digest is not None:
+            _digest_cache.move_to_end(key)
+            return digest
+    digest = file_sha256(path)[:DIGEST_LENGTH]
+    with _digest_lock:
+        _digest_cache[key] = digest
+        while len(_digest_cache) > _DIGEST_CACHE_SIZE:
+            _digest_cache.popitem(last=False)
+    return digest
+
+
+def normalize_media_path(stored_path, default_dir='uploads'):
+    """
+    Path of a stored image relative to the static folder, with forward slashes.
+    Accepts every form the app has stored: 'uploads/x', 'static/uploads/x',
+    'app/static/uploads/x', backslashes, or a bare file name.
+    """
+    if not stored_path:
+        return None
+    path = stored_path.replace('\\', '/').lstrip('/')
+    for prefix in ('app/static/', 'static/'):
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+            break
+    if '/' not in path:
+        path = f"{default_dir}/{path}"
+    return path
@@ -0,0 +1,195 @@
+"""
+Cache of rendered page content for the assessment pages.
+
+The content block of a page (everything inside {% block content %}) is
+rendered once per version of what it shows and kept, keyed by the page's
+template, a hash of the template source and the data version: for an
+assessment page its id and updated_at, for a listing the user, the number
+of assessments and their latest updated_at. The layout (navigation, flash
+messages) is still rendered per request around the cached fragment:
+layout.html skips its content block when a page_fragment is given.
+
+Entries live in an in-process LRU and, when PAGE_CACHE_FOLDER is set, in
+files shared by all worker processes. Because keys change whenever the
+data does, a stale entry is never served; the process, reprocess and delete
+handlers still invalidate an assessment's and its owner's entries so they
+do not occupy the cache.
+
+Pages also carry an ETag derived from the same key, so a browser revisiting
+an unchanged page gets 304 Not Modified without anything being rendered.
+Pages with pending flash messages are sent uncacheable instead.
+"""
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from flask import current_app, make_response, render_template, request, session
+from flask_login import current_user
+from markupsafe import Markup
+
+DEFAULT_MAX_ENTRIES = 256
+
+
+def _digest(value):
+    return hashlib.sha1(repr(value).encode('utf-8')).hexdigest()
+
+
+def assessment_scope(assessment_id):
+    return f"assessment-{assessment_id}"
+
+
+def user_scope(user_id):
+    return f"user-{user_id}"
+
+
+class PageCache:
+    """LRU of rendered fragments by (scope, key), with an optional disk tier and hit counters."""
+
+    def __init__(self, app=None):
+        self._entries = OrderedDict()  # (scope, key digest) -> Markup
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._stats = {}
+        self.max_entries = DEFAULT_MAX_ENTRIES
+        self.folder = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_entries = app.config.get('PAGE_CACHE_SIZE', DEFAULT_MAX_ENTRIES)
+        self.folder = app.config.get('PAGE_CACHE_FOLDER')
+        app.extensions['page_cache'] = self
+
+    def template_version(self, name):
+        """Short hash of a template's source, recomputed when the loader reports it changed."""
+        cached = self._versions.get(name)
+        if cached is not None and cached[1]():
+            return cached[0]
+        source, _, uptodate = current_app.jinja_env.loader.get_source(current_app.jinja_env, name)
+        version = _digest(source)[:12]
+        self._versions[name] = (version, uptodate or (lambda: True))
+        return version
+
+    def _count(self, template_name, outcome):
+        with self._lock:
+            stats = self._stats.setdefault(template_name, dict.fromkeys(
+                ('hits', 'disk_hits', 'misses', 'not_modified'), 0))
+            stats[outcome] += 1
+
+    def _disk_path(self, scope, digest):
+        return os.path.join(self.folder, scope, f"{digest}.html")
+
+    def get(self, scope, digest):
+        """(fragment, tier) of a cached entry ('memory' or 'disk'), or (None, None)."""
+        with self._lock:
+            fragment = self._entries.get((scope, digest))
+            if fragment is not None:
+                self._entries.move_to_end((scope, digest))
+                return fragment, 'memory'
+        if self.folder:
+            try:
+                with open(self._disk_path(scope, digest), encoding='utf-8') as f:
+                    fragment = Markup(f.read())
+            except OSError:
+                return None, None
+            self._remember(scope, digest, fragment)
+            return fragment, 'disk'
+        return None, None
+
+    def _remember(self, scope, digest, fragment):
+        with self._lock:
+            self._entries[(scope, digest)] = fragment
+            self._entries.move_to_end((scope, digest))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, scope, digest, fragment):
+        self._remember(scope, digest, fragment)
+        if self.folder:
+            path = self._disk_path(scope, digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(str(fragment))
+            os.replace(tmp_path, path)
+
+    def invalidate(self, *scopes):
+        """Drop every entry of the given scopes, in memory and on disk."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] in scopes]:
+                del self._entries[key]
+        if self.folder:
+            for scope in scopes:
+                shutil.rmtree(os.path.join(self.folder, scope), ignore_errors=True)
+
+    def invalidate_assessment(self, assessment_id, user_id):
+        """Entries showing an assessment: its page and its owner's listings."""
+        self.invalidate(assessment_scope(assessment_id), user_scope(user_id))
+
+    def render(self, template_name, scope, version, load=dict, **context):
+        """
+        Response for a page whose content block is cached.
+
+        Args:
+            template_name: page template (extending layout.html)
+            scope: assessment_scope() or user_scope() the entry belongs to
+            version: hashable data version the content depends on
+            load: callable returning the extra context the content block needs,
+                only called when it has to be rendered
+            context: context of the whole page
+        """
+        key = (template_name, self.template_version(template_name), version)
+        digest = _digest(key)
+        pending_flashes = bool(session.get('_flashes'))
+        etag = None
+        if not pending_flashes:
+            # The layout around the content shows the user's name
+            etag = _digest((digest, self.template_version('layout.html'), current_user.get_id(),
+                            getattr(current_user, 'username', None)))
+            if request.if_none_match.contains(etag):
+                self._count(template_name, 'not_modified')
+                response = make_response('', 304)
+                response.set_etag(etag)
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+                return response
+
+        fragment, tier = self.get(scope, digest)
+        if fragment is None:
+            self._count(template_name, 'misses')
+            fragment = render_block(template_name, 'content', **context, **load())
+            self.put(scope, digest, fragment)
+        else:
+            self._count(template_name, 'hits' if tier == 'memory' else 'disk_hits')
+
+        response = make_response(render_template(template_name, page_fragment=fragment, **context))
+        response.cache_control.private = True
+        if etag:
+            response.set_etag(etag)
+            response.cache_control.no_cache = True
+        else:
+            response.cache_control.no_store = True
+        return response
+
+    def metrics(self):
+        """Entries held and, per template, hits/misses/304s and the hit ratio."""
+        with self._lock:
+            templates = {}
+            for name, stats in self._stats.items():
+                served = stats['hits'] + stats['disk_hits'] + stats['misses'] + stats['not_modified']
+                templates[name] = dict(stats, hit_ratio=round((served - stats['misses']) / served, 4) if served else None)
+            return {'entries': len(self._entries), 'max_entries': self.max_entries,
+                    'disk': bool(self.folder), 'templates': templates}
+
+
+def render_block(template_name, block, **context):
+    """Render one block of a template with the usual Flask context (as Markup)."""
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_or_select_template(template_name)
+    app.update_template_context(context)
+    return Markup(''.join(template.blocks[block](template.new_context(context))))
+
+
+page_cache = PageCache()
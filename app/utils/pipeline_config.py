@@ -0,0 +1,170 @@
+"""
+Versioned processing parameters for the damage assessment pipeline.
+
+Every tunable threshold of process_images/perform_segmentation lives in
+ProcessingConfig. Parameters are grouped by pipeline stage so cached
+intermediates can be keyed on exactly the parameters that produced them:
+changing a change-detection threshold reuses the cached segmentation masks,
+while changing a segmentation parameter invalidates them.
+"""
+import dataclasses
+import hashlib
+import json
+
+from app.utils.change_detection import METRICS, parse_metrics
+from app.utils.damage_patches import DEFAULT_MIN_PATCH_AREA
+from app.utils.thresholding import POLICIES
+from app.utils.vegetation_indices import INDICES
+
+# Bump when the meaning of a parameter or the output of a stage changes
+CONFIG_VERSION = 1
+
+# Pipeline stages in execution order, with the parameters each one consumes
+STAGES = ('preprocessing', 'segmentation', 'change', 'patches')
+STAGE_PARAMS = {
+    'preprocessing': (
+        'mask_invalid', 'mask_downsample', 'cloud_min_value', 'cloud_max_saturation', 'shadow_max_value',
+        'overexposed_value', 'radiometric_normalization', 'normalization_subsample',
+    ),
+    'segmentation': (
+        'exg_floor', 'exg_percentile', 'exg_fallback', 'water_max_intensity',
+        'neutral_tolerance', 'road_min_intensity', 'road_max_intensity',
+        'building_max_intensity', 'land_margin', 'vegetation_index',
+        'threshold_policy', 'adaptive_tile_size',
+    ),
+    'change': (
+        'change_metrics', 'hue_threshold', 'saturation_threshold', 'value_threshold', 'change_index',
+        'index_drop_threshold', 'lab_delta_threshold',
+    ),
+    'patches': ('min_patch_area',),
+}
+
+
+def _cast(field, value):
+    """Cast a raw value (possibly a form string) to the field's type."""
+    if field.type is str:
+        return str(value).strip().lower()
+    return field.type(float(value))
+
+
+@dataclasses.dataclass(frozen=True)
+class ProcessingConfig:
+    """Thresholds used by segmentation, change detection and patch extraction."""
+    # Preprocessing, validity masking (opt-in): cloud, shadow and clipped pixels, detected
+    # on a level downsampled by mask_downsample, are excluded from every statistic
+    mask_invalid: int = 0
+    mask_downsample: int = 8
+    cloud_min_value: int = 200
+    cloud_max_saturation: int = 40
+    shadow_max_value: int = 35
+    overexposed_value: int = 250
+    # Preprocessing, normalization (opt-in): match the post image's channel histograms to
+    # the pre image, with histograms taken over every normalization_subsample-th pixel
+    radiometric_normalization: int = 0
+    normalization_subsample: int = 4
+    # Segmentation: vegetation by an RGB index (see vegetation_indices.INDICES),
+    # floor/percentile on its per-image 0-255 scale
+    vegetation_index: str = 'exg'
+    # Vegetation threshold: 'percentile' (exg_percentile) or 'otsu', one global value
+    # or, with adaptive_tile_size > 0, a locally adaptive surface over tiles of that size
+    threshold_policy: str = 'percentile'
+    adaptive_tile_size: int = 0
+    exg_floor: float = 35
+    exg_percentile: float = 25
+    exg_fallback: float = 70
+    water_max_intensity: float = 180
+    neutral_tolerance: int = 30
+    road_min_intensity: float = 80
+    road_max_intensity: float = 220
+    building_max_intensity: float = 100
+    land_margin: float = 15
+    # Change detection: metrics (see change_detection.METRICS) evaluated on pre-vegetation pixels
+    change_metrics: str = 'hsv'
+    # HSV shift (OpenCV hue 0-179)
+    hue_threshold: int = 12
+    saturation_threshold: int = 40
+    value_threshold: int = 40
+    # Optional vegetation index whose pre->post drop (fixed 0-255 scale) also marks damage
+    change_index: str = ''
+    index_drop_threshold: int = 40
+    # CIE76 Lab colour difference
+    lab_delta_threshold: int = 25
+    # Damage patches
+    min_patch_area: int = DEFAULT_MIN_PATCH_AREA
+
+    def __post_init__(self):
+        # Normalise types so 35 and 35.0 hash to the same stage key
+        for field in dataclasses.fields(self):
+            object.__setattr__(self, field.name, _cast(field, getattr(self, field.name)))
+        for name in ('vegetation_index', 'change_index'):
+            value = getattr(self, name)
+            if value and value not in INDICES:
+                raise ValueError(f"Unknown vegetation index for {name}: {value}")
+        if not self.vegetation_index:
+            raise ValueError("vegetation_index is required")
+        metrics = parse_metrics(self.change_metrics)
+        for name in metrics:
+            if name not in METRICS:
+                raise ValueError(f"Unknown change metric: {name}")
+        if 'index' in metrics and not self.change_index:
+            raise ValueError("The 'index' change metric requires change_index")
+        object.__setattr__(self, 'change_metrics', ','.join(metrics))
+        if self.threshold_policy not in POLICIES:
+            raise ValueError(f"Unknown threshold policy: {self.threshold_policy}")
+
+    def to_dict(self):
+        data = dataclasses.asdict(self)
+        data['version'] = CONFIG_VERSION
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a config from a dict (or form data), ignoring unknown keys and casting values to the field type."""
+        data = dict(data or {})
+        version = int(data.pop('version', CONFIG_VERSION))
+        if version > CONFIG_VERSION:
+            raise ValueError(f"Processing config version {version} is newer than supported version {CONFIG_VERSION}")
+        values = {}
+        for field in dataclasses.fields(cls):
+            if field.name in data and data[field.name] not in (None, ''):
+                values[field.name] = _cast(field, data[field.name])
+        return cls(**values)
+
+    def replace(self, **changes):
+        return dataclasses.replace(self, **changes)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+
+    def stage_key(self, stage):
+        """
+        Hash of the parameters of `stage` and every stage upstream of it, so a
+        cached product is reused only if nothing that produced it has changed.
+        """
+        upstream = STAGES[:STAGES.index(stage) + 1]
+        params = {name: getattr(self, name) for s in upstream for name in STAGE_PARAMS[s]}
+        payload = json.dumps({'version': CONFIG_VERSION, 'params': params}, sort_keys=True)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+DEFAULT_CONFIG = ProcessingConfig()
+
+
+def load_processing_config(path=None, overrides=None):
+    """
+    Load the pipeline config from a JSON file (e.g. written by calibration),
+    falling back to the defaults, and apply optional per-run overrides.
+    """
+    config = ProcessingConfig.load(path) if path else DEFAULT_CONFIG
+    if overrides:
+        known = {field.name for field in dataclasses.fields(ProcessingConfig)}
+        merged = config.to_dict()
+        merged.update({key: value for key, value in overrides.items() if key in known})
+        config = ProcessingConfig.from_dict(merged)
+    return config
@@ -0,0 +1,70 @@
+"""
+Radiometric normalization of a post capture to its pre capture.
+
+A post flight under a different sun angle or exposure shifts every pixel,
+which the HSV change thresholds would read as damage. Histogram matching
+maps each channel of the post image so its distribution follows the pre
+image. The per-channel histograms are taken from a subsampled grid of
+pixels (a few percent of the frame is plenty for a 256-bin histogram), and
+the resulting 256-entry lookup tables are applied to all three channels in
+a single cv2.LUT pass. The tables are small enough to cache per assessment,
+so a reprocess only pays for the LUT pass.
+"""
+import cv2
+import numpy as np
+
+_BINS = 256
+
+
+def channel_histograms(image, subsample=4, mask=None):
+    """
+    256-bin histograms of each channel of a uint8 image over every
+    `subsample`-th row and column (strided views, no copy).
+
+    Returns:
+        int64 array of shape (channels, 256)
+    """
+    step = max(1, int(subsample))
+    view = image[::step, ::step]
+    mask_view = mask[::step, ::step].view(np.uint8) if mask is not None else None
+    return np.stack([
+        cv2.calcHist([view], [channel], mask_view, [_BINS], [0, _BINS]).ravel().astype(np.int64)
+        for channel in range(image.shape[2])
+    ])
+
+
+def matching_lut(source_hist, reference_hist):
+    """
+    uint8 table mapping source values onto the reference distribution: each
+    value goes to the first reference value whose CDF reaches its own CDF.
+    Identity when either histogram is empty.
+    """
+    source_total, reference_total = source_hist.sum(), reference_hist.sum()
+    if source_total == 0 or reference_total == 0:
+        return np.arange(_BINS, dtype=np.uint8)
+    source_cdf = np.cumsum(source_hist) / source_total
+    reference_cdf = np.cumsum(reference_hist) / reference_total
+    lut = np.searchsorted(reference_cdf, source_cdf, side='left')
+    return np.clip(lut, 0, _BINS - 1).astype(np.uint8)
+
+
+def matching_luts(reference_image, image, subsample=4, mask=None):
+    """
+    Per-channel tables matching `image` to `reference_image`.
+
+    Args:
+        mask: optional boolean mask of pixels to take statistics from (e.g. the
+            validity mask, so clouds do not skew the match)
+
+    Returns:
+        uint8 array of shape (channels, 256)
+    """
+    reference = channel_histograms(reference_image, subsample, mask)
+    source = channel_histograms(image, subsample, mask)
+    return np.stack([matching_lut(s, r) for s, r in zip(source, reference)])
+
+
+def apply_luts(image, luts):
+    """Apply per-channel tables from matching_luts() to a uint8 image in one pass."""
+    table = np.ascontiguousarray(luts.T).reshape(_BINS, 1, luts.shape[0])
+    return cv2.LUT(image, table)
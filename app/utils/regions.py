@@ -0,0 +1,108 @@
+"""
+Region-of-interest and exclusion polygons of an assessment.
+
+Regions are stored in pixel coordinates of the uploaded pair as
+{'roi': [ring, ...], 'exclude': [ring, ...]}, each ring a list of [x, y]
+points. They are rasterized once per run into a boolean mask (inside any
+ROI polygon, or the whole frame if there is none, and outside every
+exclusion polygon). process_images crops the pair to the mask's bounding
+box and skips the tiles inside it that the mask does not touch, so the
+cost of a run follows the ROI area rather than the image area.
+"""
+import hashlib
+import json
+
+import cv2
+import numpy as np
+
+KINDS = ('roi', 'exclude')
+
+
+def _rings(geometry):
+    """Outer rings of a GeoJSON Polygon/MultiPolygon/Feature(Collection), or a list of rings."""
+    if isinstance(geometry, dict):
+        kind = geometry.get('type')
+        if kind == 'FeatureCollection':
+            return [ring for feature in geometry.get('features') or [] for ring in _rings(feature)]
+        if kind == 'Feature':
+            return _rings(geometry.get('geometry'))
+        if kind == 'Polygon':
+            return (geometry.get('coordinates') or [])[:1]
+        if kind == 'MultiPolygon':
+            return [polygon[0] for polygon in geometry.get('coordinates') or [] if polygon]
+        raise ValueError(f"Unsupported region geometry: {kind}")
+    if isinstance(geometry, list):
+        return geometry
+    raise ValueError("Regions must be GeoJSON geometries or lists of [x, y] rings")
+
+
+def parse_regions(data):
+    """
+    Validate and normalise regions from a dict (or its JSON text).
+
+    Each of 'roi' and 'exclude' may be a list of rings or a GeoJSON geometry.
+    Returns None when no polygon is given. Raises ValueError on malformed input.
+    """
+    if isinstance(data, str):
+        if not data.strip():
+            return None
+        try:
+            data = json.loads(data)
+        except ValueError:
+            raise ValueError("Regions are not valid JSON")
+    if not data:
+        return None
+    if not isinstance(data, dict) or set(data) - set(KINDS):
+        raise ValueError(f"Regions must be an object with keys {', '.join(KINDS)}")
+    regions = {}
+    for kind in KINDS:
+        rings = []
+        for ring in _rings(data.get(kind) or []):
+            try:
+                points = [[round(float(x), 2), round(float(y), 2)] for x, y in ring]
+            except (TypeError, ValueError):
+                raise ValueError(f"Malformed {kind} polygon: points must be [x, y] pairs")
+            if len(points) < 3:
+                raise ValueError(f"Malformed {kind} polygon: at least 3 points are required")
+            rings.append(points)
+        regions[kind] = rings
+    if not regions['roi'] and not regions['exclude']:
+        return None
+    return regions
+
+
+def scale_regions(regions, factor):
+    """Regions in the pixel coordinates of the image resized by `factor` (e.g. a preview)."""
+    return {kind: [[[x * factor, y * factor] for x, y in ring] for ring in rings]
+            for kind, rings in regions.items()}
+
+
+def regions_key(regions):
+    """Short stable hash of normalised regions."""
+    payload = json.dumps(regions, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def rasterize_regions(regions, height, width):
+    """Boolean mask of the pixels to process."""
+    def polygons(kind):
+        return [np.round(np.asarray(ring)).astype(np.int32) for ring in regions.get(kind) or []]
+
+    # One fillPoly per ring: given several polygons it fills by the even-odd
+    # rule, which would turn overlaps between them into holes
+    roi = polygons('roi')
+    mask = np.zeros((height, width), dtype=np.uint8) if roi else np.ones((height, width), dtype=np.uint8)
+    for ring in roi:
+        cv2.fillPoly(mask, [ring], 1)
+    for ring in polygons('exclude'):
+        cv2.fillPoly(mask, [ring], 0)
+    return mask.view(bool)
+
+
+def mask_bounds(mask):
+    """Half-open bounding box (y0, y1, x0, x1) of the set pixels, or None if there are none."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(mask[rows[0]:rows[-1] + 1].any(axis=0))
+    return int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1
@@ -0,0 +1,347 @@
+"""
+DOCX/PDF reports built from stored assessment results.
+
+Nothing is reprocessed: a report is rendered from the metrics in the
+database and from thumbnails of the stored label maps. Rendering is split
+in two so it can run in worker processes:
+
+  * report_data() collects everything a document needs from the database
+    into a plain dict (in the web or CLI process, which has the session).
+  * render_report() / render_typhoon_report() turn those dicts into
+    document bytes with python-docx. Figures are downscaled thumbnails of
+    the label maps, cached on disk under a key of the map's path, size and
+    mtime, so each is made once per result and reused by later reports.
+
+build_archive() renders many documents on a process pool and yields a ZIP
+stream as documents complete, so the first bytes go out while the rest
+are still rendering. PDF output converts the DOCX with LibreOffice
+(soffice) when it is installed.
+"""
+import hashlib
+import io
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+
+from app import db
+from app.models import DamagePatch
+from app.utils.artifacts import register_artifact
+from app.utils.image_processing import CHANGE_PALETTE, CLASS_NAMES, CLASS_PALETTE
+from app.utils.label_maps import read_label_map
+from app.utils.media import normalize_media_path
+
+FORMATS = ('docx', 'pdf')
+DOCX_MIME = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+MIME_TYPES = {'docx': DOCX_MIME, 'pdf': 'application/pdf'}
+
+# Longest thumbnail edge in pixels (about 15 cm at 100 dpi)
+THUMBNAIL_EDGE = 600
+# Largest patches listed per assessment
+TOP_PATCHES = 10
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _report_pool(workers=None):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned, not forked: the web process has threads (and their locks) a fork would copy
+            _pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _discard_pool(pool):
+    """Forget a broken report pool, so the next render starts a new one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def thumbnail_path(thumbnail_dir, source_path, max_edge=THUMBNAIL_EDGE):
+    """Cache path of a label map's thumbnail, keyed by the map's path, size and mtime."""
+    stat = os.stat(source_path)
+    key = f"{os.path.abspath(source_path)}:{stat.st_size}:{stat.st_mtime_ns}:{max_edge}"
+    return os.path.join(thumbnail_dir, hashlib.sha1(key.encode('utf-8')).hexdigest()[:20] + '.png')
+
+
+def ensure_thumbnail(source_path, palette, path, max_edge=THUMBNAIL_EDGE):
+    """Write a colour thumbnail of a stored label map to `path` unless it exists; returns `path`."""
+    if os.path.exists(path):
+        return path
+    labels = read_label_map(source_path, palette)
+    image = np.array(palette, dtype=np.uint8)[:, ::-1][labels]  # BGR
+    height, width = labels.shape
+    scale = min(1.0, max_edge / max(height, width))
+    if scale < 1.0:
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode('.png', image)
+    if not ok:
+        raise ValueError(f"Failed to encode thumbnail of {source_path}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # A unique temporary name per writer, so concurrent renders of one thumbnail never share a file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(buffer.tobytes())
+        os.replace(tmp_path, path)
+    except BaseException as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        # Losing a rename race to another writer of the same thumbnail is fine
+        if not isinstance(e, OSError) or not os.path.exists(path):
+            raise
+    return path
+
+
+def report_data(assessment, static_folder, thumbnail_dir):
+    """
+    Picklable content of one assessment's report, with the thumbnail paths
+    of its stored label maps (registered as artifacts; rendering creates the
+    missing ones). Needs an application context; the caller commits.
+    """
+    figures = []
+    for caption, stored, palette in (('Segmentation before the typhoon', assessment.pre_vis_path, CLASS_PALETTE),
+                                     ('Segmentation after the typhoon', assessment.post_vis_path, CLASS_PALETTE),
+                                     ('Change map (green: intact forest, red: damaged)',
+                                      assessment.change_vis_path, CHANGE_PALETTE)):
+        source = os.path.join(static_folder, *normalize_media_path(stored).split('/')) if stored else None
+        if source and os.path.exists(source):
+            thumbnail = thumbnail_path(thumbnail_dir, source)
+            register_artifact(thumbnail, 'thumbnail', assessment.id)
+            figures.append((caption, source, palette, thumbnail))
+    patches = assessment.damage_patches.order_by(DamagePatch.area.desc())
+    return {
+        'id': assessment.id,
+        'title': assessment.title,
+        'location': assessment.location,
+        'description': assessment.description,
+        'typhoon_name': assessment.typhoon_name,
+        'typhoon_date': assessment.typhoon_date.isoformat() if assessment.typhoon_date else None,
+        'author': assessment.author.username if assessment.author is not None else None,
+        'processed_date': assessment.processed_date.strftime('%Y-%m-%d %H:%M') if assessment.processed_date else None,
+        'forest_area_before': assessment.forest_area_before,
+        'forest_area_after': assessment.forest_area_after,
+        'damage_percentage': assessment.damage_percentage,
+        'class_statistics': assessment.class_statistics or {},
+        'config_version': (assessment.processing_config or {}).get('version'),
+        'patch_count': patches.count(),
+        'patches': [
+            {'area': p.area, 'centroid_x': round(p.centroid_x, 1), 'centroid_y': round(p.centroid_y, 1)}
+            for p in patches.limit(TOP_PATCHES)
+        ],
+        'figures': figures,
+    }
+
+
+def collect_report_data(assessments, static_folder, thumbnail_root):
+    """report_data() of each assessment, with thumbnails under thumbnail_root/assessment_<id>. Commits."""
+    items = [report_data(assessment, static_folder, os.path.join(thumbnail_root, f"assessment_{assessment.id}"))
+             for assessment in assessments]
+    db.session.commit()
+    return items
+
+
+def render_one(job, workers=None):
+    """(filename, bytes) of one render job, rendered on the report process pool."""
+    pool = _report_pool(workers)
+    try:
+        return pool.submit(render_document, job).result()
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+
+
+def _percent(value):
+    return f"{value:.2f}%" if value is not None else '-'
+
+
+def _table(document, header, rows):
+    table = document.add_table(rows=1, cols=len(header))
+    table.style = 'Light Grid Accent 1'
+    for cell, text in zip(table.rows[0].cells, header):
+        cell.text = text
+    for row in rows:
+        for cell, text in zip(table.add_row().cells, row):
+            cell.text = str(text)
+    return table
+
+
+def _assessment_section(document, data, heading_level=1):
+    from docx.shared import Cm
+
+    document.add_heading(data['title'], level=heading_level)
+    details = [('Location', data['location']), ('Typhoon', data['typhoon_name']),
+               ('Typhoon date', data['typhoon_date']), ('Assessed by', data['author']),
+               ('Processed', data['processed_date'])]
+    _table(document, ('Field', 'Value'), [(name, value or '-') for name, value in details])
+    if data['description']:
+        document.add_paragraph(data['description'])
+
+    document.add_heading('Damage', level=heading_level + 1)
+    _table(document, ('Forest cover before', 'Forest cover after', 'Damage', 'Damage patches'), [(
+        _percent(data['forest_area_before']), _percent(data['forest_area_after']),
+        _percent(data['damage_percentage']), data['patch_count'],
+    )])
+    statistics = data['class_statistics']
+    if statistics.get('pre') and statistics.get('post'):
+        document.add_heading('Land cover', level=heading_level + 1)
+        _table(document, ('Class', 'Before', 'After'), [
+            (name.capitalize(), _percent(statistics['pre'].get(name)), _percent(statistics['post'].get(name)))
+            for name in CLASS_NAMES
+        ])
+    if data['patches']:
+        document.add_heading('Largest damage patches', level=heading_level + 1)
+        _table(document, ('Area (px)', 'Centroid x', 'Centroid y'),
+               [(p['area'], p['centroid_x'], p['centroid_y']) for p in data['patches']])
+
+    for caption, source, palette, thumbnail in data['figures']:
+        ensure_thumbnail(source, palette, thumbnail)
+        document.add_picture(thumbnail, width=Cm(15))
+        document.add_paragraph(caption, style='Caption')
+
+
+def _docx_bytes(document):
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def render_report(data):
+    """DOCX bytes of one assessment's report."""
+    from docx import Document
+
+    document = Document()
+    document.add_heading('Forest Damage Assessment', level=0)
+    _assessment_section(document, data)
+    return _docx_bytes(document)
+
+
+def render_typhoon_report(typhoon_name, items):
+    """DOCX bytes of a summary of every assessment for one typhoon, followed by each of them."""
+    from docx import Document
+
+    document = Document()
+    document.add_heading(f"Typhoon {typhoon_name}: Forest Damage Summary", level=0)
+    damages = [data['damage_percentage'] for data in items if data['damage_percentage'] is not None]
+    document.add_paragraph(
+        f"{len(items)} assessments; mean damage {_percent(sum(damages) / len(damages) if damages else None)}."
+    )
+    _table(document, ('Assessment', 'Location', 'Forest before', 'Forest after', 'Damage'), [
+        (data['title'], data['location'], _percent(data['forest_area_before']),
+         _percent(data['forest_area_after']), _percent(data['damage_percentage']))
+        for data in items
+    ])
+    for data in items:
+        document.add_page_break()
+        _assessment_section(document, data, heading_level=1)
+    return _docx_bytes(document)
+
+
+def docx_to_pdf(docx_bytes):
+    """Convert DOCX bytes to PDF with LibreOffice; raises RuntimeError if soffice is not installed."""
+    soffice = shutil.which('soffice') or shutil.which('libreoffice')
+    if soffice is None:
+        raise RuntimeError("PDF reports need LibreOffice (soffice) on the PATH")
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, 'report.docx')
+        with open(source, 'wb') as f:
+            f.write(docx_bytes)
+        # A private profile lets several conversions run at once
+        subprocess.run([soffice, f"-env:UserInstallation=file://{workdir}/profile", '--headless',
+                        '--convert-to', 'pdf', '--outdir', workdir, source],
+                       check=True, capture_output=True, timeout=300)
+        with open(os.path.join(workdir, 'report.pdf'), 'rb') as f:
+            return f.read()
+
+
+def render_document(job):
+    """Worker entry point: (filename, bytes) of a ('assessment', data) or ('typhoon', name, items) job."""
+    kind, name, fmt = job[0], job[1], job[-1]
+    if kind == 'typhoon':
+        content = render_typhoon_report(name, job[2])
+    else:
+        content = render_report(job[2])
+    if fmt == 'pdf':
+        content = docx_to_pdf(content)
+    return f"{name}.{fmt}", content
+
+
+def report_jobs(items, fmt='docx', per_assessment=True, per_typhoon=True):
+    """Render jobs for report_data() dicts: one document per assessment and/or per typhoon."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported report format: {fmt}")
+    jobs = []
+    if per_assessment:
+        jobs += [('assessment', f"assessment_{data['id']}", data, fmt) for data in items]
+    if per_typhoon:
+        by_typhoon = OrderedDict()
+        for data in items:
+            by_typhoon.setdefault(data['typhoon_name'] or 'unnamed', []).append(data)
+        jobs += [('typhoon', f"typhoon_{_slug(name)}", group, fmt) for name, group in by_typhoon.items()]
+    return jobs
+
+
+def _slug(name):
+    return ''.join(c if c.isalnum() else '_' for c in name).strip('_').lower() or 'unnamed'
+
+
+class _ZipStream(io.RawIOBase):
+    """Write-only sink handing out what zipfile wrote since the last drain."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+
+def build_archive(jobs, workers=None):
+    """
+    Render jobs on the report process pool and yield a ZIP archive in chunks,
+    one document per entry in job order. DOCX files are ZIPs already, so
+    entries are stored uncompressed. A document that fails to render is
+    replaced by a <name>.error.txt entry, since the download has started.
+    """
+    pool = _report_pool(workers)
+    futures = [(job, pool.submit(render_document, job)) for job in jobs]
+    sink = _ZipStream()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for job, future in futures:
+            try:
+                filename, content = future.result()
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    _discard_pool(pool)
+                filename, content = f"{job[1]}.error.txt", f"{job[1]}.{job[-1]} could not be rendered: {e}\n"
+            archive.writestr(filename, content)
+            yield sink.drain()
+    yield sink.drain()
@@ -0,0 +1,320 @@
+"""
+Fair-share admission of processing jobs.
+
+Every run of the pipeline gets a Ticket costed from the image headers
+(no decode): the pixels it will process, and from those the memory it will
+hold at its peak. The FairScheduler starts tickets while both budgets have
+room: CPU slots (jobs running at once) and bytes of memory. A ticket larger
+than the whole memory budget still runs, alone.
+
+Waiting tickets are ordered by weighted fair queuing across users. Each
+user's tickets get virtual start/finish tags (start-time fair queuing):
+a ticket starts at the later of the scheduler's virtual time and the
+finish of the user's previous ticket, and finishes its megapixels divided
+by the user's role weight later. The smallest finish tag runs first, so one
+user submitting fifty large mosaics only delays others by their fair share,
+and a user returning from idle cannot claim credit for the time away.
+
+When the next ticket has a higher role priority than a running one and
+only a CPU slot is missing, the running job is asked to yield. Jobs call
+checkpoint() between tiles and stages; a job asked to yield gives up its
+slot there (keeping its memory) and waits until the scheduler resumes it.
+
+Wait times are kept per user (see FairScheduler.stats).
+"""
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from app.utils.image_io import image_size
+
+# WFQ share by User.role; unknown roles get the 'user' weight
+ROLE_WEIGHTS = {'admin': 4.0, 'field_officer': 2.0, 'user': 1.0}
+# A waiting ticket may preempt running tickets of a lower priority
+ROLE_PRIORITY = {'admin': 2, 'field_officer': 1, 'user': 0}
+
+# Peak resident bytes per processed pixel (decoded pair, segmentation buffers,
+# change planes, label maps being encoded), measured on 3-12 MP pairs
+BYTES_PER_PIXEL = 72
+# Assumed size when the header cannot be read (e.g. TIFF)
+DEFAULT_PIXELS = 12_000_000
+
+QUEUED = 'queued'
+RUNNING = 'running'
+PAUSED = 'paused'
+
+
+def _roi_bounds_area(regions, width, height):
+    """Pixels in the bounding box of the ROI polygons, clipped to the frame (the crop process_images makes)."""
+    points = [point for ring in regions.get('roi') or [] for point in ring]
+    if not points:
+        return width * height
+    xs, ys = [x for x, _ in points], [y for _, y in points]
+    x0, x1 = max(0, int(min(xs))), min(width, int(max(xs)) + 1)
+    y0, y1 = max(0, int(min(ys))), min(height, int(max(ys)) + 1)
+    return max(0, x1 - x0) * max(0, y1 - y0)
+
+
+def estimate_pixels(pre_path, regions=None):
+    """
+    Pixels a run will process, from the pre image header (the post image is
+    decoded at the same size) and the ROI bounds.
+    """
+    size = image_size(pre_path)
+    if size is None:
+        return DEFAULT_PIXELS
+    width, height = size
+    if regions:
+        return _roi_bounds_area(regions, width, height)
+    return width * height
+
+
+def default_memory_budget():
+    """Half of physical memory, or 4 GB if it cannot be read."""
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 2
+    except (AttributeError, ValueError, OSError):
+        return 4 * 1024 ** 3
+
+
+class Ticket:
+    """One job waiting for, or holding, a share of the processing budget."""
+
+    def __init__(self, user_id, role, pixels, label=None):
+        self.user_id = user_id
+        self.role = role or 'user'
+        self.weight = ROLE_WEIGHTS.get(self.role, ROLE_WEIGHTS['user'])
+        self.priority = ROLE_PRIORITY.get(self.role, 0)
+        self.pixels = int(pixels)
+        self.memory = self.pixels * BYTES_PER_PIXEL
+        self.label = label
+        self.state = QUEUED
+        self.start_tag = self.finish_tag = 0.0
+        self.enqueued_at = time.monotonic()
+        # Seconds queued before the first start, and spent paused after preemptions
+        self.waited = None
+        self.paused_seconds = 0.0
+        self.preemptions = 0
+        self.scheduler = None
+        self._sequence = 0
+        self._start = None
+        self._resumed = threading.Event()
+        self._yield = False
+        self._claimant = None
+        self._paused_at = None
+
+    def __repr__(self):
+        return f"<Ticket {self.label} user={self.user_id} {self.state} {self.pixels}px>"
+
+
+class FairScheduler:
+    """Admission control and weighted fair ordering of Tickets (thread-safe)."""
+
+    def __init__(self, slots, memory_budget=None):
+        self.slots = max(1, int(slots))
+        self.memory_budget = int(memory_budget or default_memory_budget())
+        self._lock = threading.Lock()
+        self._waiting = []  # Queued and paused tickets
+        self._running = []
+        self._memory_used = 0  # Running and paused tickets
+        self._virtual_time = 0.0
+        self._last_finish = {}
+        self._sequence = itertools.count()
+        self._users = {}
+
+    def submit(self, ticket, start=None):
+        """
+        Queue a ticket. `start` is called (outside the scheduler lock) when it
+        is admitted; without one, the caller waits with wait_started().
+        """
+        with self._lock:
+            ticket.scheduler = self
+            ticket._start = start
+            ticket._sequence = next(self._sequence)
+            ticket.start_tag = max(self._virtual_time, self._last_finish.get(ticket.user_id, 0.0))
+            ticket.finish_tag = ticket.start_tag + ticket.pixels / 1e6 / ticket.weight
+            self._last_finish[ticket.user_id] = ticket.finish_tag
+            self._waiting.append(ticket)
+            self._user(ticket.user_id)['queued'] += 1
+            started = self._dispatch()
+        self._launch(started)
+        return ticket
+
+    def wait_started(self, ticket, timeout=None):
+        return ticket._resumed.wait(timeout)
+
+    def run(self, ticket, fn, *args, **kwargs):
+        """Run fn in the calling thread once the ticket is admitted, then release it."""
+        self.submit(ticket)
+        self.wait_started(ticket)
+        try:
+            with bound(ticket):
+                return fn(*args, **kwargs)
+        finally:
+            self.finish(ticket)
+
+    def finish(self, ticket):
+        """Release a ticket's slot and memory (a no-op for tickets never started)."""
+        with self._lock:
+            if ticket in self._running:
+                self._running.remove(ticket)
+                self._memory_used -= ticket.memory
+                self._user(ticket.user_id)['running'] -= 1
+            elif ticket in self._waiting:
+                self._waiting.remove(ticket)
+                if ticket.state == PAUSED:
+                    self._memory_used -= ticket.memory
+                else:
+                    self._user(ticket.user_id)['queued'] -= 1
+            ticket.state = None
+            started = self._dispatch()
+        self._launch(started)
+
+    def checkpoint(self, ticket):
+        """Yield the ticket's slot if a higher-priority ticket asked for it, and wait to be resumed."""
+        if not ticket._yield:
+            return
+        with self._lock:
+            ticket._yield = False
+            if ticket not in self._running or ticket._claimant is None or ticket._claimant.state != QUEUED:
+                ticket._claimant = None
+                return  # The claimant started meanwhile, or went away
+            self._running.remove(ticket)
+            self._user(ticket.user_id)['running'] -= 1
+            ticket.state = PAUSED
+            ticket.preemptions += 1
+            ticket._paused_at = time.monotonic()
+            ticket._resumed.clear()
+            self._waiting.append(ticket)
+            started = self._dispatch()
+        self._launch(started)
+        ticket._resumed.wait()
+
+    def _user(self, user_id):
+        return self._users.setdefault(user_id, {
+            'queued': 0, 'running': 0, 'jobs': 0, 'total_wait': 0.0, 'max_wait': 0.0, 'preemptions': 0,
+        })
+
+    def _eligible(self, ticket):
+        # A preempted ticket waits until the ticket it yielded to has started
+        claimant = ticket._claimant
+        return ticket.state != PAUSED or claimant is None or claimant.state != QUEUED
+
+    def _dispatch(self):
+        """
+        Start waiting tickets in fair order while the budgets allow.
+
+        Returns:
+            (ticket, start) pairs; start is the submit() callback on a first start, else None
+        """
+        started = []
+        while self._waiting and len(self._running) < self.slots:
+            candidates = [ticket for ticket in self._waiting if self._eligible(ticket)]
+            if not candidates:
+                break
+            ticket = min(candidates, key=lambda t: (t.finish_tag, t._sequence))
+            if ticket.state == QUEUED and self._memory_used and self._memory_used + ticket.memory > self.memory_budget:
+                # The head waits for memory; later tickets do not overtake it
+                break
+            self._waiting.remove(ticket)
+            self._running.append(ticket)
+            user = self._user(ticket.user_id)
+            user['running'] += 1
+            now = time.monotonic()
+            if ticket.state == PAUSED:
+                ticket.paused_seconds += now - ticket._paused_at
+                ticket._claimant = None
+                user['preemptions'] += 1
+            else:
+                self._memory_used += ticket.memory
+                ticket.waited = now - ticket.enqueued_at
+                user['queued'] -= 1
+                user['jobs'] += 1
+                user['total_wait'] += ticket.waited
+                user['max_wait'] = max(user['max_wait'], ticket.waited)
+                self._virtual_time = max(self._virtual_time, ticket.start_tag)
+            ticket.state = RUNNING
+            started.append((ticket, ticket._start))
+            ticket._start = None
+        self._request_preemption()
+        return started
+
+    def _request_preemption(self):
+        queued = [ticket for ticket in self._waiting if ticket.state == QUEUED]
+        if not queued or len(self._running) < self.slots:
+            return
+        head = min(queued, key=lambda t: (t.finish_tag, t._sequence))
+        if self._memory_used + head.memory > self.memory_budget:
+            return
+        if any(ticket._claimant is head for ticket in self._running + self._waiting):
+            return  # Already claimed a slot
+        paused = sum(1 for ticket in self._waiting if ticket.state == PAUSED)
+        if paused >= self.slots:
+            return
+        victims = [ticket for ticket in self._running if ticket.priority < head.priority and not ticket._yield]
+        if victims:
+            victim = min(victims, key=lambda t: (t.priority, -t.finish_tag))
+            victim._yield = True
+            victim._claimant = head
+
+    @staticmethod
+    def _launch(started):
+        for ticket, start in started:
+            if start is not None:
+                start(ticket)
+            else:
+                ticket._resumed.set()
+
+    def stats(self, user_ids=None):
+        """
+        Budget use and per-user queue statistics (wait = seconds from submit to first start).
+        Limited to `user_ids` when given.
+        """
+        now = time.monotonic()
+        with self._lock:
+            users = {}
+            for user_id, user in self._users.items():
+                if user_ids is not None and user_id not in user_ids:
+                    continue
+                waiting = [now - t.enqueued_at for t in self._waiting if t.user_id == user_id and t.state == QUEUED]
+                users[user_id] = {
+                    'queued': user['queued'],
+                    'running': user['running'],
+                    'jobs_started': user['jobs'],
+                    'mean_wait': round(user['total_wait'] / user['jobs'], 3) if user['jobs'] else None,
+                    'max_wait': round(user['max_wait'], 3),
+                    'oldest_queued': round(max(waiting), 3) if waiting else None,
+                    'preemptions': user['preemptions'],
+                }
+            return {
+                'slots': self.slots,
+                'slots_used': len(self._running),
+                'memory_budget': self.memory_budget,
+                'memory_used': self._memory_used,
+                'queued': sum(1 for t in self._waiting if t.state == QUEUED),
+                'paused': sum(1 for t in self._waiting if t.state == PAUSED),
+                'users': users,
+            }
+
+
+_local = threading.local()
+
+
+@contextmanager
+def bound(ticket):
+    """Make `ticket` the calling thread's current ticket, for checkpoint()."""
+    previous = getattr(_local, 'ticket', None)
+    _local.ticket = ticket
+    try:
+        yield ticket
+    finally:
+        _local.ticket = previous
+
+
+def checkpoint():
+    """Preemption point for pipeline code: yields if the current thread's ticket was asked to."""
+    ticket = getattr(_local, 'ticket', None)
+    if ticket is not None and ticket._yield:
+        ticket.scheduler.checkpoint(ticket)
@@ -0,0 +1,132 @@
+"""
+Numpy arrays packed into a single multiprocessing.shared_memory segment.
+
+The owner copies the arrays in once; worker processes attach by segment name
+and get zero-copy numpy views, so a sample set is decoded a single time no
+matter how many processes read it. Only the owner ever unlinks the segment.
+
+Segments are also unlinked when the owning pack is garbage collected or the
+interpreter exits, so an exception path can never leak one; live_segments()
+lists the segments this process currently owns.
+"""
+import threading
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Offsets are aligned so every view starts on a cache line
+_ALIGNMENT = 64
+
+
+# Names of segments created by this process and not yet unlinked
+_live = set()
+_live_lock = threading.Lock()
+
+
+def _aligned(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _release(shm):
+    """Close and unlink a segment (idempotent; also run by the pack's finalizer)."""
+    with _live_lock:
+        _live.discard(shm.name)
+    # Unlink first: the name must go even if views still pin the mapping
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+    try:
+        shm.close()
+    except BufferError:
+        # Views still exported; the mapping is released when they are collected
+        pass
+
+
+def live_segments():
+    """Names of the shared-memory segments owned by this process that are still allocated."""
+    with _live_lock:
+        return sorted(_live)
+
+
+class SharedArrayPack:
+    """
+    Owner side of a packed segment.
+
+    Args:
+        arrays: mapping of key -> numpy array to copy into shared memory
+
+    The picklable `descriptor` is what gets passed to workers, which call
+    attach_arrays(descriptor). Use as a context manager (or call close()) so
+    the segment is always unlinked.
+    """
+
+    def __init__(self, arrays=None, empty=None):
+        """
+        Args:
+            arrays: mapping of key -> array copied into the segment
+            empty: mapping of key -> (shape, dtype) of zero-filled slots, e.g.
+                output buffers a worker writes its results into
+        """
+        arrays = {key: np.asarray(array) for key, array in (arrays or {}).items()}
+        specs = [(key, array.shape, array.dtype) for key, array in arrays.items()]
+        specs += [(key, tuple(shape), np.dtype(dtype)) for key, (shape, dtype) in (empty or {}).items()]
+        layout, size = [], 0
+        for key, shape, dtype in specs:
+            offset = _aligned(size)
+            layout.append((key, offset, shape, dtype.str))
+            size = offset + int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        with _live_lock:
+            _live.add(self.shm.name)
+        self._finalizer = weakref.finalize(self, _release, self.shm)
+        try:
+            views = _views(self.shm, layout)
+            for key, array in arrays.items():
+                views[key][...] = array
+        except BaseException:
+            self.close()
+            raise
+        self.descriptor = (self.shm.name, tuple(layout))
+        self.nbytes = size
+
+    def arrays(self):
+        return _views(self.shm, self.descriptor[1])
+
+    def close(self):
+        """Unlink the segment. Views returned by arrays() must not be used afterwards."""
+        if self.shm is None:
+            return
+        self._finalizer()
+        self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _views(shm, layout):
+    return {
+        key: np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        for key, offset, shape, dtype in layout
+    }
+
+
+def attach_arrays(descriptor):
+    """
+    Attach to a packed segment from another process.
+
+    Returns:
+        (shm, arrays): keep `shm` referenced for as long as the views are used,
+        then call shm.close() (never unlink; the owner does that)
+    """
+    name, layout = descriptor
+    try:
+        # Python 3.13+: attaching must not register the segment for cleanup in this process
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+    return shm, _views(shm, layout)
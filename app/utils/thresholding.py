@@ -0,0 +1,151 @@
+"""
+Histogram-based thresholds for uint8 index planes.
+
+Thresholds are read from 256-bin histograms instead of sorting masked
+copies of the plane: per-tile histograms are built with cv2.calcHist
+(masked, no copy), merged in int64 and reduced to a percentile (exactly as
+np.percentile's default linear interpolation would) or an Otsu threshold.
+The same tile histograms give locally adaptive thresholds: each tile uses
+the histogram of its 3x3 tile neighbourhood, and the per-tile values are
+interpolated into a smooth threshold surface for mosaics with uneven
+lighting.
+"""
+import math
+
+import cv2
+import numpy as np
+
+from app.utils.tiling import DEFAULT_TILE_SIZE, iter_tiles, tile_grid
+
+POLICIES = ('percentile', 'otsu')
+
+# Neighbourhoods with fewer masked pixels than this fall back to the global threshold
+MIN_LOCAL_PIXELS = 1024
+
+_BINS = 256
+
+
+def tile_histograms(plane, mask=None, tile_size=DEFAULT_TILE_SIZE):
+    """
+    256-bin histograms of a uint8 plane per tile, counting only pixels where `mask` is set.
+
+    Returns:
+        int64 array of shape (tile rows, tile cols, 256)
+    """
+    height, width = plane.shape
+    row_starts, col_starts = tile_grid(height, width, tile_size)
+    histograms = np.zeros((len(row_starts), len(col_starts), _BINS), dtype=np.int64)
+    mask_u8 = mask.view(np.uint8) if mask is not None and mask.dtype == np.bool_ else mask
+    for row, col, y0, y1, x0, x1 in iter_tiles(height, width, tile_size):
+        tile_mask = mask_u8[y0:y1, x0:x1] if mask_u8 is not None else None
+        # calcHist counts in float32, exact per tile (far below 2**24 pixels)
+        hist = cv2.calcHist([plane[y0:y1, x0:x1]], [0], tile_mask, [_BINS], [0, _BINS])
+        histograms[row, col] = hist.ravel().astype(np.int64)
+    return histograms
+
+
+def histogram(plane, mask=None, tile_size=DEFAULT_TILE_SIZE):
+    """Global 256-bin histogram, merged from tile histograms."""
+    return tile_histograms(plane, mask, tile_size).sum(axis=(0, 1))
+
+
+def percentile_from_histogram(hist, q):
+    """
+    The q-th percentile of the values counted in `hist`, identical to
+    np.percentile (linear interpolation) on the underlying samples.
+    NaN for an empty histogram.
+    """
+    n = int(hist.sum())
+    if n == 0:
+        return math.nan
+    virtual = (n - 1) * (q / 100)
+    previous = math.floor(virtual)
+    gamma = virtual - previous
+    cumulative = np.cumsum(hist)
+    # Value of the sample at 0-based rank k: first bin whose cumulative count exceeds k
+    a = int(np.searchsorted(cumulative, previous, side='right'))
+    b = int(np.searchsorted(cumulative, min(previous + 1, n - 1), side='right'))
+    diff = float(b - a)
+    if gamma >= 0.5:
+        return b - diff * (1 - gamma)
+    return a + diff * gamma
+
+
+def otsu_from_histogram(hist):
+    """
+    Otsu threshold of the values counted in `hist`: the value t for which
+    `plane >= t` separates the classes with maximal between-class variance.
+    NaN for an empty histogram.
+    """
+    total = hist.sum()
+    if total == 0:
+        return math.nan
+    p = hist / total
+    omega = np.cumsum(p)
+    mu = np.cumsum(p * np.arange(len(hist)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (mu[-1] * omega - mu) ** 2 / (omega * (1 - omega))
+    between = np.nan_to_num(between, nan=-1.0, posinf=-1.0)
+    return float(np.argmax(between) + 1)
+
+
+def threshold_from_histogram(hist, policy='percentile', q=25):
+    if policy == 'percentile':
+        return percentile_from_histogram(hist, q)
+    if policy == 'otsu':
+        return otsu_from_histogram(hist)
+    raise ValueError(f"Unknown threshold policy: {policy}")
+
+
+def bounded_threshold(hist, policy='percentile', q=25, floor=None, fallback=None):
+    """Threshold of a histogram, at least `floor`; `fallback` if the histogram is empty."""
+    value = threshold_from_histogram(hist, policy, q)
+    if not np.isfinite(value):
+        return fallback
+    return max(floor, value) if floor is not None else value
+
+
+def _neighbourhood_sums(histograms):
+    """Sum of each tile's histogram with its (up to) 8 neighbours."""
+    padded = np.pad(histograms, ((1, 1), (1, 1), (0, 0)))
+    rows, cols = histograms.shape[:2]
+    total = np.zeros_like(histograms)
+    for dy in range(3):
+        for dx in range(3):
+            total += padded[dy:dy + rows, dx:dx + cols]
+    return total
+
+
+def plane_threshold(plane, mask, policy='percentile', q=25, floor=None, fallback=None,
+                    local_tile_size=0, tile_size=DEFAULT_TILE_SIZE):
+    """
+    Threshold for `plane >= threshold` over the pixels of `mask`.
+
+    Args:
+        floor: lower bound applied to every computed threshold
+        fallback: threshold used when no pixel is masked
+        local_tile_size: 0 for one global threshold; otherwise the tile edge of
+            locally adaptive thresholds
+
+    Returns:
+        a float (global) or a float32 threshold surface of plane.shape (local)
+    """
+    if not local_tile_size:
+        return bounded_threshold(histogram(plane, mask, tile_size), policy, q, floor, fallback)
+
+    histograms = tile_histograms(plane, mask, local_tile_size)
+    global_threshold = bounded_threshold(histograms.sum(axis=(0, 1)), policy, q, floor, fallback)
+    local = _neighbourhood_sums(histograms)
+    counts = local.sum(axis=2)
+    grid = np.empty(histograms.shape[:2], dtype=np.float32)
+    for row in range(grid.shape[0]):
+        for col in range(grid.shape[1]):
+            if counts[row, col] < MIN_LOCAL_PIXELS:
+                grid[row, col] = global_threshold
+            else:
+                grid[row, col] = bounded_threshold(local[row, col], policy, q, floor, fallback)
+    height, width = plane.shape
+    if grid.size == 1:
+        return np.full((height, width), grid[0, 0], dtype=np.float32)
+    # Tile values sit at tile centres; bilinear interpolation gives a seamless surface
+    return cv2.resize(grid, (width, height), interpolation=cv2.INTER_LINEAR)
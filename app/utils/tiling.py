@@ -0,0 +1,30 @@
+"""
+Tile iteration helpers for processing large mosaics in bounded memory.
+Tiles are produced in row-major order so callers can stream results and
+stitch seams between neighbouring tiles.
+"""
+
+# Square tile edge in pixels; 1024x1024 keeps per-tile temporaries to a few MB
+DEFAULT_TILE_SIZE = 1024
+
+
+def tile_grid(height, width, tile_size=DEFAULT_TILE_SIZE):
+    """Return the tile origins along each axis as (row_starts, col_starts)."""
+    tile_size = max(1, int(tile_size))
+    return list(range(0, height, tile_size)), list(range(0, width, tile_size))
+
+
+def iter_tiles(height, width, tile_size=DEFAULT_TILE_SIZE):
+    """
+    Yield tiles covering a height x width raster in row-major order.
+
+    Yields:
+        (row, col, y0, y1, x0, x1): tile grid indices and half-open pixel bounds
+    """
+    tile_size = max(1, int(tile_size))
+    row_starts, col_starts = tile_grid(height, width, tile_size)
+    for row, y0 in enumerate(row_starts):
+        y1 = min(y0 + tile_size, height)
+        for col, x0 in enumerate(col_starts):
+            x1 = min(x0 + tile_size, width)
+            yield row, col, y0, y1, x0, x1
@@ -0,0 +1,94 @@
+"""
+Multi-temporal (series) assessments: an ordered set of captures of one site.
+
+Each capture is segmented once and its integer label map cached as a
+compressed array, keyed on the segmentation parameters. Change statistics
+between any two captures come from a single 6x6 class transition matrix
+(one bincount over the two cached label maps), so adding a flight costs
+one segmentation plus two transition passes (against the previous capture
+and against the baseline) instead of reprocessing the history.
+"""
+import os
+import tempfile
+
+import numpy as np
+
+from app.utils.evaluation import confusion_matrix
+from app.utils.image_io import read_image
+from app.utils.image_processing import CLASS_VEGETATION, perform_segmentation
+from app.utils.pipeline_config import DEFAULT_CONFIG
+
+
+def capture_mask_path(cache_dir, capture_id, config=None):
+    """Cache file of a capture's label map for the segmentation parameters of `config`."""
+    config = config or DEFAULT_CONFIG
+    return os.path.join(cache_dir, f"capture_{capture_id}_{config.stage_key('segmentation')}.npz")
+
+
+def load_capture_labels(mask_path):
+    with np.load(mask_path) as data:
+        return data['labels']
+
+
+def segment_capture(image_path, mask_path, config=None, target_shape=None):
+    """
+    Segment one capture and cache its label map at `mask_path`.
+
+    Args:
+        target_shape: (height, width) of the series baseline; later captures are
+            resized to it so every label map of the series is pixel-aligned
+    """
+    # Decoded straight at the baseline size (scaled JPEG decode when it is smaller)
+    image = read_image(image_path, (target_shape[1], target_shape[0]) if target_shape is not None else None)
+    if image is None:
+        raise ValueError(f"Failed to load capture image from path: {image_path}. Please check if the file exists and is a valid image.")
+    labels = perform_segmentation(image, config)
+    os.makedirs(os.path.dirname(mask_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(mask_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, labels=labels)
+        os.replace(tmp_path, mask_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return labels
+
+
+def ensure_capture_labels(image_path, mask_path, config=None, target_shape=None):
+    """Cached label map of a capture, segmenting only if it is missing (or the parameters changed)."""
+    if os.path.exists(mask_path):
+        return load_capture_labels(mask_path)
+    return segment_capture(image_path, mask_path, config, target_shape)
+
+
+def transition_matrix(labels_from, labels_to):
+    """Pixel counts of every class transition (rows: from-class, columns: to-class) in one bincount."""
+    return confusion_matrix(labels_from, labels_to)
+
+
+def transition_statistics(matrix):
+    """
+    Forest cover and change metrics from a transition matrix, consistent with calculate_damage:
+    damage is the share of from-vegetation that is no longer vegetation, recovery the share of
+    from-non-vegetation that became vegetation.
+    """
+    matrix = np.asarray(matrix, dtype=np.int64)
+    total = matrix.sum()
+    veg_before = matrix[CLASS_VEGETATION, :].sum()
+    veg_after = matrix[:, CLASS_VEGETATION].sum()
+    veg_kept = matrix[CLASS_VEGETATION, CLASS_VEGETATION]
+    non_veg_before = total - veg_before
+    regained = veg_after - veg_kept
+    return {
+        'forest_area_before': round(float(veg_before / total * 100), 2) if total else 0.0,
+        'forest_area_after': round(float(veg_after / total * 100), 2) if total else 0.0,
+        'damage_percentage': round(float((veg_before - veg_kept) / veg_before * 100), 2) if veg_before else 0.0,
+        'recovery_percentage': round(float(regained / non_veg_before * 100), 2) if non_veg_before else 0.0,
+    }
+
+
+def forest_cover(labels):
+    """Vegetation cover of a single label map as a percentage of all pixels."""
+    return round(float(np.count_nonzero(labels == CLASS_VEGETATION) / labels.size * 100), 2) if labels.size else 0.0
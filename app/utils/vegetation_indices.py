@@ -0,0 +1,167 @@
+"""
+RGB vegetation indices computed together over one set of channel buffers.
+
+Supported indices (R, G, B are the raw 0-255 channels):
+
+    exg      Excess Green            2G - R - B
+    exr      Excess Red              1.4R - G
+    exg_exr  ExG minus ExR           3G - 2.4R - B
+    vari     Visible Atm. Resistant  (G - R) / (G + R - B), clipped to [-1, 1]
+    gli      Green Leaf Index        (2G - R - B) / (2G + R + B)
+    ngrdi    Normalized Green-Red    (G - R) / (G + R)
+
+An IndexEngine converts the channels to float32 once, derives shared
+intermediates (ExG, G - R, G + R, ...) only once per image, and quantizes
+each requested index to a uint8 plane. Its float buffers are borrowed from
+a BufferScope of the worker's buffer pool, so they go back to the (capped)
+pool when the caller's scope ends instead of staying with the thread.
+Quantization is either per image ('minmax', the original ExG behaviour) or
+over the index's fixed theoretical range ('fixed'), which keeps planes of
+different images comparable.
+"""
+import numpy as np
+
+from app.utils.buffer_pool import worker_pool
+
+INDICES = ('exg', 'exr', 'exg_exr', 'vari', 'gli', 'ngrdi')
+
+# Theoretical value range of each index for 'fixed' quantization
+INDEX_RANGES = {
+    'exg': (-510.0, 510.0),
+    'exr': (-255.0, 357.0),
+    'exg_exr': (-867.0, 765.0),
+    'vari': (-1.0, 1.0),
+    'gli': (-1.0, 1.0),
+    'ngrdi': (-1.0, 1.0),
+}
+
+QUANTIZE_MODES = ('minmax', 'fixed')
+
+
+def _ratio(numerator, denominator, out):
+    """numerator / denominator into `out`, 0 where the denominator is 0."""
+    out.fill(0)
+    np.divide(numerator, denominator, out=out, where=denominator != 0)
+    return out
+
+
+class IndexEngine:
+    """
+    Computes vegetation indices of images of one size, reusing its float32
+    buffers across calls. With `buffers` (a BufferScope) they are borrowed
+    from the worker's pool and valid until the scope ends; without one the
+    engine allocates and keeps its own. Not thread-safe.
+    """
+
+    def __init__(self, buffers=None):
+        self._scope = buffers
+        self._shape = None
+        self._buffers = {}
+        self._cache = {}
+
+    def _buffer(self, name):
+        buffer = self._buffers.get(name)
+        if buffer is None:
+            if self._scope is not None:
+                buffer = self._scope.borrow(self._shape, np.float32)
+            else:
+                buffer = np.empty(self._shape, dtype=np.float32)
+            self._buffers[name] = buffer
+        return buffer
+
+    def load(self, image):
+        """
+        Convert a BGR image to float32 channel buffers.
+
+        Returns:
+            (b, g, r): float32 views valid until the next load()
+        """
+        shape = image.shape[:2]
+        if shape != self._shape:
+            self._shape = shape
+            self._buffers = {}
+        self._cache = {}
+        b, g, r = self._buffer('b'), self._buffer('g'), self._buffer('r')
+        for channel, buffer in enumerate((b, g, r)):
+            np.copyto(buffer, image[:, :, channel], casting='unsafe')
+        return b, g, r
+
+    def _intermediate(self, name):
+        """Shared intermediates and raw index values, computed once per loaded image."""
+        if name in self._cache:
+            return self._cache[name]
+        b, g, r = self._buffers['b'], self._buffers['g'], self._buffers['r']
+        out = self._buffer(name)
+        if name == 'exg':
+            np.multiply(g, 2.0, out=out)
+            out -= r
+            out -= b
+        elif name == 'exr':
+            np.multiply(r, 1.4, out=out)
+            out -= g
+        elif name == 'exg_exr':
+            np.subtract(self._intermediate('exg'), self._intermediate('exr'), out=out)
+        elif name == 'g_minus_r':
+            np.subtract(g, r, out=out)
+        elif name == 'g_plus_r':
+            np.add(g, r, out=out)
+        elif name == 'vari':
+            denominator = np.subtract(self._intermediate('g_plus_r'), b, out=self._buffer('scratch'))
+            _ratio(self._intermediate('g_minus_r'), denominator, out)
+            np.clip(out, -1.0, 1.0, out=out)
+        elif name == 'gli':
+            denominator = np.add(self._intermediate('g_plus_r'), g, out=self._buffer('scratch'))
+            denominator += b
+            _ratio(self._intermediate('exg'), denominator, out)
+        elif name == 'ngrdi':
+            _ratio(self._intermediate('g_minus_r'), self._intermediate('g_plus_r'), out)
+        else:
+            raise ValueError(f"Unknown vegetation index: {name}")
+        self._cache[name] = out
+        return out
+
+    def raw(self, name):
+        """Float32 values of an index for the loaded image (a reused buffer; copy to keep)."""
+        if name not in INDICES:
+            raise ValueError(f"Unknown vegetation index: {name}")
+        return self._intermediate(name)
+
+    def value_range(self, name, mask=None):
+        """(min, max) of an index over the loaded image, or over the pixels of `mask`."""
+        values = self.raw(name)
+        if mask is None:
+            return values.min(), values.max()
+        return values.min(where=mask, initial=np.inf), values.max(where=mask, initial=-np.inf)
+
+    def quantized(self, name, quantize='minmax', value_range=None):
+        """
+        uint8 plane of an index for the loaded image. 'minmax' scales the
+        image's own range, or `value_range` (e.g. of a whole frame the image is a tile of).
+        """
+        values = self.raw(name)
+        if quantize == 'minmax':
+            low, high = value_range if value_range is not None else self.value_range(name)
+        elif quantize == 'fixed':
+            low, high = (np.float32(v) for v in INDEX_RANGES[name])
+        else:
+            raise ValueError(f"Unknown quantization: {quantize}")
+        if high <= low:
+            return np.zeros(self._shape, dtype=np.uint8)
+        scaled = self._buffer('scratch')
+        np.subtract(values, low, out=scaled)
+        np.divide(scaled, high - low, out=scaled)
+        np.multiply(scaled, 255, out=scaled)
+        if quantize == 'fixed':
+            np.clip(scaled, 0, 255, out=scaled)
+        return scaled.astype(np.uint8)
+
+    def compute(self, image, indices=('exg',), quantize='minmax'):
+        """Load `image` and return {index: uint8 plane} for the requested indices."""
+        self.load(image)
+        return {name: self.quantized(name, quantize) for name in indices}
+
+
+def index_planes(image, indices=('exg',), quantize='minmax'):
+    """uint8 planes of the requested indices of a BGR image (float buffers borrowed from the thread's pool)."""
+    with worker_pool().scope() as buffers:
+        return IndexEngine(buffers).compute(image, indices, quantize)
@@ -0,0 +1,207 @@
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from app.utils.change_detection import change_mask, change_tests, hsv_difference as kernel_hsv_difference
+from app.utils.frame_handoff import FramePool
+from app.utils.image_io import read_image, read_pair
+from app.utils.image_processing import CLASS_VEGETATION, hsv_difference, perform_segmentation, visualize_segmentation
+from app.utils.pipeline_config import DEFAULT_CONFIG
+from app.utils.shared_arrays import live_segments
+from app.utils.vegetation_indices import INDICES, IndexEngine
+
+
+def synthetic_pair(width, height, seed=0):
+    """JPEG bytes of a synthetic pre/post pair (vegetation-like noise with a cleared block)."""
+    rng = np.random.default_rng(seed)
+    pre = rng.integers(0, 90, (height, width, 3), dtype=np.uint8)
+    pre[..., 1] += rng.integers(60, 160, (height, width), dtype=np.uint8)
+    post = pre.copy()
+    post[height // 4:height // 2, width // 4:width // 2] = (90, 110, 130)
+    return [cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 92])[1].tobytes() for image in (pre, post)]
+
+
+def _disk_worker(pre_path, post_path, out_dir):
+    """Naive path: re-read and re-decode the uploads, then write JPEG results for the web process."""
+    pre, post = cv2.imread(pre_path), cv2.imread(post_path)
+    seg_pre = perform_segmentation(pre, DEFAULT_CONFIG)
+    seg_post = perform_segmentation(post, DEFAULT_CONFIG)
+    h, s, v = hsv_difference(pre, post)
+    change = ((h > DEFAULT_CONFIG.hue_threshold) * 255).astype(np.uint8)
+    paths = []
+    for name, image in (('pre', visualize_segmentation(seg_pre)), ('post', visualize_segmentation(seg_post)),
+                        ('change', change)):
+        path = os.path.join(out_dir, f"{name}_vis.jpg")
+        cv2.imwrite(path, image)
+        paths.append(path)
+    return paths
+
+
+def run_disk(executor, encoded, out_dir):
+    pre_path, post_path = os.path.join(out_dir, 'pre.jpg'), os.path.join(out_dir, 'post.jpg')
+    for path, data in ((pre_path, encoded[0]), (post_path, encoded[1])):
+        with open(path, 'wb') as f:
+            f.write(data)
+    paths = executor.submit(_disk_worker, pre_path, post_path, out_dir).result()
+    return [cv2.imread(path, cv2.IMREAD_UNCHANGED) for path in paths]
+
+
+def run_shared(pool, encoded):
+    pre, post = (cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR) for data in encoded)
+    return pool.analyze(pre, post, DEFAULT_CONFIG)
+
+
+def timed(func, repeat):
+    func()  # Warm-up (worker start, imports)
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(name, samples):
+    print(f"  {name:<22} median {statistics.median(samples):8.1f} ms   "
+          f"mean {statistics.mean(samples):8.1f} ms   min {min(samples):8.1f} ms")
+
+
+def bench_handoff(args):
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    encoded = synthetic_pair(width, height)
+    print(f"Handoff of a {width}x{height} pair, {args.repeat} runs per path:")
+    with tempfile.TemporaryDirectory() as out_dir, ProcessPoolExecutor(max_workers=1) as executor:
+        report('disk round-trip', timed(lambda: run_disk(executor, encoded, out_dir), args.repeat))
+    pool = FramePool(workers=1)
+    try:
+        report('shared memory', timed(lambda: run_shared(pool, encoded), args.repeat))
+    finally:
+        pool.shutdown()
+    print(f"  leaked segments: {len(live_segments())}")
+
+
+def _legacy_exg(image):
+    """ExG as perform_segmentation computed it before the index engine (fresh float copies)."""
+    b, g, r = (image[:, :, i].astype(np.float32) for i in (0, 1, 2))
+    exg = 2.0 * g - r - b
+    low, high = exg.min(), exg.max()
+    return ((exg.astype(np.float32) - low) / (high - low) * 255).astype(np.uint8)
+
+
+def bench_indices(args):
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    image = cv2.imdecode(np.frombuffer(synthetic_pair(width, height)[0], dtype=np.uint8), cv2.IMREAD_COLOR)
+    engine = IndexEngine()
+    print(f"Vegetation indices of a {width}x{height} image, {args.repeat} runs each ({args.quantize} quantization):")
+    report('exg (legacy)', timed(lambda: _legacy_exg(image), args.repeat))
+    report('channel load', timed(lambda: engine.load(image), args.repeat))
+    for name in INDICES:
+        report(name, timed(lambda: engine.compute(image, (name,), args.quantize), args.repeat))
+    report('all (shared pass)', timed(lambda: engine.compute(image, INDICES, args.quantize), args.repeat))
+
+
+def bench_decode(args):
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    pre, post = synthetic_pair(width, height)
+    large = cv2.imencode('.jpg', cv2.resize(cv2.imdecode(np.frombuffer(post, dtype=np.uint8), cv2.IMREAD_COLOR),
+                                            (width * 2, height * 2)), [cv2.IMWRITE_JPEG_QUALITY, 92])[1]
+    with tempfile.TemporaryDirectory() as directory:
+        pre_path, post_path, large_path = (os.path.join(directory, name) for name in ('pre.jpg', 'post.jpg', 'large.jpg'))
+        for path, data in ((pre_path, pre), (post_path, post), (large_path, large.tobytes())):
+            with open(path, 'wb') as f:
+                f.write(data)
+        print(f"Decode of a {width}x{height} pair, {args.repeat} runs per path:")
+        report('sequential imread', timed(lambda: (cv2.imread(pre_path), cv2.imread(post_path)), args.repeat))
+        report('concurrent pair', timed(lambda: read_pair(pre_path, post_path), args.repeat))
+        print(f"Post image at twice the size, matched to {width}x{height}:")
+        report('imread + resize', timed(lambda: cv2.resize(cv2.imread(large_path), (width, height)), args.repeat))
+        report('scaled decode', timed(lambda: read_image(large_path, (width, height)), args.repeat))
+        report('preview (1/8)', timed(lambda: read_image(large_path, (width // 4, height // 4)), args.repeat))
+
+
+def _legacy_change(pre, post, segmented_pre, segmented_post, config):
+    """HSV refinement as process_images computed it before the change-detection kernels (int32 planes)."""
+    pre_hsv = cv2.cvtColor(pre, cv2.COLOR_BGR2HSV)
+    post_hsv = cv2.cvtColor(post, cv2.COLOR_BGR2HSV)
+    h_diff = np.abs(pre_hsv[:, :, 0].astype(np.int32) - post_hsv[:, :, 0].astype(np.int32))
+    s_diff = np.abs(pre_hsv[:, :, 1].astype(np.int32) - post_hsv[:, :, 1].astype(np.int32))
+    v_diff = np.abs(pre_hsv[:, :, 2].astype(np.int32) - post_hsv[:, :, 2].astype(np.int32))
+    h_diff = np.minimum(h_diff, 180 - h_diff)
+    veg_pre = segmented_pre == CLASS_VEGETATION
+    veg_post = segmented_post == CLASS_VEGETATION
+    significant_hsv_change = ((h_diff > config.hue_threshold) | (s_diff > config.saturation_threshold)
+                              | (v_diff > config.value_threshold))
+    return (veg_pre & ~veg_post) | (veg_pre & significant_hsv_change)
+
+
+def _kernel_change(pre, post, segmented_pre, segmented_post, config):
+    h_diff, s_diff, v_diff = kernel_hsv_difference(pre, post)
+    veg_pre = segmented_pre == CLASS_VEGETATION
+    tests = change_tests({'h': h_diff, 's': s_diff, 'v': v_diff}, config)
+    return change_mask(veg_pre, segmented_post, CLASS_VEGETATION, tests)
+
+
+def peak_bytes(func):
+    """Peak of numpy/OpenCV allocations while running func (beyond what was live before)."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_change(args):
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    pre, post = (cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                 for data in synthetic_pair(width, height))
+    segmented_pre = perform_segmentation(pre, DEFAULT_CONFIG)
+    segmented_post = perform_segmentation(post, DEFAULT_CONFIG)
+    run_args = (pre, post, segmented_pre, segmented_post, DEFAULT_CONFIG)
+    identical = np.array_equal(_legacy_change(*run_args), _kernel_change(*run_args))
+    print(f"HSV change detection on a {width}x{height} pair, {args.repeat} runs each "
+          f"(outputs {'identical' if identical else 'DIFFER'}):")
+    pixels = width * height
+    for name, func in (('int32 (legacy)', _legacy_change), ('uint8 kernels', _kernel_change)):
+        report(name, timed(lambda: func(*run_args), args.repeat))
+        print(f"  {'':<22} peak allocations {peak_bytes(lambda: func(*run_args)) / pixels:6.1f} bytes/pixel")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for the processing pipeline')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    handoff = commands.add_parser('handoff', help='Worker handoff: disk round-trip vs shared memory')
+    handoff.add_argument('--size', default='4000x3000', help='Frame size WIDTHxHEIGHT')
+    handoff.add_argument('--repeat', type=int, default=5, help='Timed runs per path')
+    handoff.set_defaults(func=bench_handoff)
+
+    indices = commands.add_parser('indices', help='Cost of each vegetation index (channel load included)')
+    indices.add_argument('--size', default='4000x3000', help='Image size WIDTHxHEIGHT')
+    indices.add_argument('--repeat', type=int, default=5, help='Timed runs per index')
+    indices.add_argument('--quantize', choices=('minmax', 'fixed'), default='minmax', help='uint8 quantization')
+    indices.set_defaults(func=bench_indices)
+
+    decode = commands.add_parser('decode', help='Image decode: sequential vs concurrent, full vs scaled')
+    decode.add_argument('--size', default='4000x3000', help='Frame size WIDTHxHEIGHT')
+    decode.add_argument('--repeat', type=int, default=5, help='Timed runs per path')
+    decode.set_defaults(func=bench_decode)
+
+    change = commands.add_parser('change', help='HSV change detection: int32 arithmetic vs uint8 kernels')
+    change.add_argument('--size', default='4000x3000', help='Frame size WIDTHxHEIGHT')
+    change.add_argument('--repeat', type=int, default=5, help='Timed runs per path')
+    change.set_defaults(func=bench_change)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
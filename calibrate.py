@@ -0,0 +1,87 @@
+import argparse
+import json
+
+from app.utils.calibration import calibrate, grid_search_space, random_search_space
+from app.utils.pipeline_config import ProcessingConfig, load_processing_config
+
+
+def _grid_value(value):
+    """Numbers for numeric parameters, names (e.g. a vegetation index) otherwise"""
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def parse_grid(values):
+    """Parse name=v1,v2,... arguments into a grid dictionary"""
+    grid = {}
+    for item in values or []:
+        name, _, choices = item.partition('=')
+        grid[name] = [_grid_value(v) for v in choices.split(',') if v]
+    return grid
+
+
+def parse_ranges(values):
+    """Parse name=low:high arguments into a range dictionary"""
+    ranges = {}
+    for item in values or []:
+        name, _, bounds = item.partition('=')
+        low, high = bounds.split(':')
+        ranges[name] = (float(low), float(high))
+    return ranges
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibrate segmentation and change-detection thresholds on a labelled sample set')
+    parser.add_argument('samples', help='Directory with images/ and masks/ (manuscript HEX palette)')
+    parser.add_argument('--grid', action='append', metavar='NAME=V1,V2,...', help='Grid values for a parameter (repeatable)')
+    parser.add_argument('--range', action='append', metavar='NAME=LOW:HIGH', help='Random-search range for a parameter (repeatable)')
+    parser.add_argument('--trials', type=int, default=50, help='Number of random-search trials')
+    parser.add_argument('--seed', type=int, default=None, help='Random-search seed')
+    parser.add_argument('--base-config', help='Starting ProcessingConfig JSON (defaults otherwise)')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    parser.add_argument('--damage-weight', type=float, default=1.0, help='Weight of the damage-percentage error in the score')
+    parser.add_argument('--output', default='calibrated_config.json', help='Where to write the best ProcessingConfig')
+    parser.add_argument('--report', help='Optional JSON file for the full trial report')
+    args = parser.parse_args()
+
+    valid = set(ProcessingConfig().to_dict()) - {'version'}
+    grid, ranges = parse_grid(args.grid), parse_ranges(args.range)
+    unknown = (set(grid) | set(ranges)) - valid
+    if unknown:
+        parser.error(f"Unknown parameter(s): {', '.join(sorted(unknown))}. Valid: {', '.join(sorted(valid))}")
+    if not grid and not ranges:
+        parser.error('Provide at least one --grid or --range parameter')
+
+    space = grid_search_space(grid) if grid else [{}]
+    if ranges:
+        space = [dict(g, **r) for g in space for r in random_search_space(ranges, args.trials, args.seed)]
+
+    print(f"Evaluating {len(space)} parameter sets on {args.samples}")
+    report = calibrate(args.samples, space, workers=args.workers, damage_weight=args.damage_weight,
+                       base_config=load_processing_config(args.base_config))
+
+    best = report['best']
+    print(f"\nSamples: {report['samples']} ({report['pairs']} pre/post pairs)")
+    print(f"Best parameters: {best['params']}")
+    print(f"  mIoU: {best['miou']}, damage error: {best['damage_error']}, score: {best['score']}")
+    print("  Per-class IoU:")
+    for name, value in best['iou'].items():
+        print(f"    - {name}: {value}")
+    print("  Confusion matrix (rows: ground truth, columns: predicted):")
+    for name, row in zip(report['classes'], best['confusion_matrix']):
+        print(f"    {name:>10}: {row}")
+
+    report['best_config'].save(args.output)
+    print(f"\nBest config written to {args.output} (load with PROCESSING_CONFIG={args.output})")
+
+    if args.report:
+        report['best_config'] = report['best_config'].to_dict()
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Full report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
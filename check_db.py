@@ -3,6 +3,9 @@ import sqlite3
 from app import app, db
 from app.models import User, Assessment
 
+# Rows fetched per round trip when listing tables
+BATCH_SIZE = 500
+
 def find_database():
     """Find the database file location"""
     possible_paths = [
@@ -23,16 +26,14 @@ def find_database():
 def list_database_contents():
     """List all data in the database"""
     with app.app_context():
-        # List users
-        users = User.query.all()
-        print(f"\nUsers ({len(users)}):")
-        for user in users:
+        # List users (streamed in batches rather than loaded at once)
+        print(f"\nUsers ({User.query.count()}):")
+        for user in User.query.order_by(User.id).yield_per(BATCH_SIZE):
             print(f"  - ID: {user.id}, Username: {user.username}, Email: {user.email}")
         
         # List assessments
-        assessments = Assessment.query.all()
-        print(f"\nAssessments ({len(assessments)}):")
-        for assessment in assessments:
+        print(f"\nAssessments ({Assessment.query.count()}):")
+        for assessment in Assessment.query.order_by(Assessment.id).yield_per(BATCH_SIZE):
             print(f"  - ID: {assessment.id}, Name: {assessment.name}, Location: {assessment.location}, User ID: {assessment.user_id}")
             print(f"    Processed: {assessment.processed}, Damage: {assessment.damage_percentage}%")
 
@@ -95,4 +96,4 @@ if __name__ == "__main__":
     # List database contents
     list_database_contents()
     
-    print("\nDatabase check completed") 
\ No newline at end of file
+    print("\nDatabase check completed (run verify_storage.py to check the stored files)") 
\ No newline at end of file
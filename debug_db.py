@@ -96,14 +96,12 @@ def create_test_data():
         
         # Verify the test data
         print("\nVerifying test data:")
-        users = User.query.all()
-        print(f"Users: {len(users)}")
-        for user in users:
+        print(f"Users: {User.query.count()}")
+        for user in User.query.order_by(User.id).yield_per(500):
             print(f"  - {user.username} ({user.email})")
         
-        assessments = Assessment.query.all()
-        print(f"Assessments: {len(assessments)}")
-        for assessment in assessments:
+        print(f"Assessments: {Assessment.query.count()}")
+        for assessment in Assessment.query.order_by(Assessment.id).yield_per(500):
             print(f"  - {assessment.name} ({assessment.location})")
 
 if __name__ == "__main__":
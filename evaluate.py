@@ -0,0 +1,53 @@
+import argparse
+import json
+import sys
+
+from app.utils.evaluation import DEFAULT_TOLERANCE, compare_reports, evaluate
+from app.utils.pipeline_config import load_processing_config
+
+
+def print_report(report):
+    """Print the aggregate metrics of an evaluation report"""
+    print(f"\nSamples: {report['samples']} ({report['pairs']} pre/post pairs), pixels: {report['pixels']}")
+    print(f"  mIoU: {report['miou']}, pixel accuracy: {report['pixel_accuracy']}, damage error: {report['damage_error']}")
+    print("  Per-class IoU / F1:")
+    for name in report['iou']:
+        print(f"    - {name}: {report['iou'][name]} / {report['f1'][name]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate segmentation label maps against ground truth')
+    parser.add_argument('ground_truth', help='Directory of ground-truth label maps (class ids or manuscript palette)')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--predictions', help='Directory of predicted label maps with matching file names')
+    source.add_argument('--images', help='Directory of source images to run through the processing pipeline')
+    parser.add_argument('--config', help='ProcessingConfig JSON used with --images (defaults otherwise)')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    parser.add_argument('--baseline', help='Baseline JSON report; exit with status 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='Allowed metric drop before failing')
+    args = parser.parse_args()
+
+    report = evaluate(args.ground_truth, pred_dir=args.predictions, image_dir=args.images,
+                      config=load_processing_config(args.config), workers=args.workers)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_reports(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressions against {args.baseline}:")
+            for item in regressions:
+                print(f"  - {item['metric']}: {item['baseline']} -> {item['current']}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import argparse
+from datetime import timedelta
+
+from app import app, db
+from app.utils.artifacts import (
+    DEFAULT_BATCH_SIZE, INTERMEDIATE_KINDS, adopt_untracked_files, collect_garbage, reclaimable_report
+)
+
+
+def format_bytes(size):
+    """Human-readable byte count"""
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report and delete unreferenced assessment files')
+    parser.add_argument('--dry-run', action='store_true', help='Only report reclaimable space')
+    parser.add_argument('--adopt', action='store_true',
+                        help='Register files in the upload folder that predate the artifact registry (one-off)')
+    parser.add_argument('--drop-intermediates', type=float, metavar='DAYS', default=None,
+                        help='Retention policy: also delete cached intermediates older than DAYS (metrics are kept)')
+    parser.add_argument('--grace-minutes', type=float, default=10, help='Keep released files at least this long')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Files deleted per transaction')
+    args = parser.parse_args()
+
+    options = {'grace_period': timedelta(minutes=args.grace_minutes)}
+    if args.drop_intermediates is not None:
+        options.update(drop_kinds=INTERMEDIATE_KINDS, drop_after=timedelta(days=args.drop_intermediates))
+
+    with app.app_context():
+        db.create_all()
+        if args.adopt:
+            adopted, released = adopt_untracked_files()
+            print(f"Adopted {adopted} untracked files ({released} unreferenced)")
+
+        report = reclaimable_report(**options)
+        print(f"Reclaimable: {report['files']} files, {format_bytes(report['bytes'])}")
+        for kind, item in sorted(report['by_kind'].items()):
+            print(f"  - {kind}: {item['files']} files, {format_bytes(item['bytes'])}")
+
+        if not args.dry_run:
+            deleted, reclaimed = collect_garbage(batch_size=args.batch_size, **options)
+            print(f"Deleted {deleted} files, reclaimed {format_bytes(reclaimed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import argparse
+import os
+import time
+
+from app import app, db
+from app.models import Assessment, User
+from app.utils.reports import FORMATS, build_archive, collect_report_data, report_jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render DOCX/PDF reports of processed assessments into a ZIP')
+    parser.add_argument('--out', default='reports.zip', help='Output ZIP path')
+    parser.add_argument('--format', choices=FORMATS, default='docx')
+    parser.add_argument('--typhoon', help='Only assessments for this typhoon')
+    parser.add_argument('--user', help='Only assessments of this username')
+    parser.add_argument('--workers', type=int, default=None, help='Rendering processes (default: one per CPU)')
+    parser.add_argument('--no-summaries', action='store_true', help='Skip the per-typhoon summary reports')
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        query = Assessment.query.filter(Assessment.damage_percentage.isnot(None))
+        if args.typhoon:
+            query = query.filter_by(typhoon_name=args.typhoon)
+        if args.user:
+            query = query.join(User).filter(User.username == args.user)
+        assessments = query.order_by(Assessment.typhoon_name, Assessment.id).all()
+        if not assessments:
+            print("No processed assessments match")
+            return
+
+        started = time.monotonic()
+        items = collect_report_data(assessments, app.static_folder, os.path.join(app.instance_path, 'thumbnails'))
+        jobs = report_jobs(items, args.format, per_typhoon=not args.no_summaries)
+        with open(args.out, 'wb') as f:
+            for chunk in build_archive(jobs, args.workers):
+                f.write(chunk)
+        print(f"Wrote {len(jobs)} reports to {args.out} in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
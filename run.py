@@ -2,9 +2,15 @@
 import os
 os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')  # 0=all, 1=no INFO, 2=no INFO/WARNING
 
-from app import app, db
+from app import app, db, job_queue
+from app.utils.artifacts import start_background_gc
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+    # Only start the collector in the serving process, not the debug reloader's parent
+    if app.config['ARTIFACT_GC_INTERVAL'] and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_gc(app, app.config['ARTIFACT_GC_INTERVAL'])
+    if app.config['PROCESSING_PREFORK'] and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        job_queue.start()
     app.run(debug=True) 
\ No newline at end of file
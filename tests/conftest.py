@@ -0,0 +1,158 @@
+"""
+Shared test setup. The app is configured when `app` is first imported, so
+the database is pointed at a scratch directory here, before any test module
+imports it.
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pytest
+
+SCRATCH = tempfile.mkdtemp(prefix='forest-assessment-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(SCRATCH, 'test.db')
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(SCRATCH, ignore_errors=True)
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+def synthetic_pair(height=240, width=320, seed=0):
+    """
+    A BGR pre/post pair with forest, a grey road strip and water. In the post
+    image a block of the forest has turned brown (blowdown), and a smaller one
+    is still green but brighter and yellower, which only the change
+    thresholds flag as damage.
+    """
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(-12, 13, (height, width, 3))
+    pre = np.clip(np.array([40, 140, 50]) + noise, 0, 255).astype(np.uint8)
+    road = (slice(None), slice(0, width // 5))
+    water = (slice(height * 3 // 4, None), slice(width // 5, width // 2))
+    pre[road] = np.clip(np.array([150, 150, 150]) + noise[road], 0, 255)
+    pre[water] = np.clip(np.array([150, 90, 40]) + noise[water], 0, 255)
+    post = pre.copy()
+    damage = (slice(height // 6, height * 7 // 12), slice(width * 3 // 8, width * 13 // 16))
+    post[damage] = np.clip(np.array([60, 110, 150]) + noise[damage], 0, 255)
+    stressed = (slice(height * 5 // 8, height * 3 // 4), slice(width * 5 // 8, width * 7 // 8))
+    post[stressed] = np.clip(np.array([30, 200, 110]) + noise[stressed], 0, 255)
+    return pre, post
+
+
+@pytest.fixture
+def image_pair(tmp_path):
+    """Paths of a synthetic pair under tmp_path/static/uploads, where process_images expects uploads."""
+    import cv2
+
+    uploads = tmp_path / 'static' / 'uploads'
+    uploads.mkdir(parents=True)
+    paths = []
+    for name, image in zip(('pre.png', 'post.png'), synthetic_pair()):
+        path = str(uploads / name)
+        cv2.imwrite(path, image)
+        paths.append(path)
+    return tuple(paths)
+
+
+def wait_for_jobs(flask_app, timeout=60):
+    """Block until the app's processing queue has no queued, paused or running job."""
+    import time
+
+    scheduler = flask_app.extensions['job_queue'].scheduler
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = scheduler.stats()
+        if not (stats['queued'] or stats['paused'] or stats['slots_used']):
+            return
+        flask_app.extensions['job_queue'].wait(0.05)
+    raise TimeoutError("Processing jobs did not finish")
+
+
+@pytest.fixture
+def app(tmp_path):
+    """
+    The application on an empty database, with its instance folder under
+    tmp_path. Files a test adds to the upload folder are removed afterwards.
+    """
+    from app import app as flask_app, db
+    from app.utils.page_cache import page_cache
+
+    saved = flask_app.instance_path, dict(flask_app.config)
+    flask_app.instance_path = str(tmp_path / 'instance')
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False,
+                            INTERMEDIATES_FOLDER=os.path.join(flask_app.instance_path, 'intermediates'))
+    uploads = flask_app.config['UPLOAD_FOLDER']
+    existing = set(os.listdir(uploads))
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+    page_cache._entries.clear()
+    try:
+        yield flask_app
+    finally:
+        wait_for_jobs(flask_app)
+        for name in set(os.listdir(uploads)) - existing:
+            os.remove(os.path.join(uploads, name))
+        flask_app.instance_path = saved[0]
+        flask_app.config.clear()
+        flask_app.config.update(saved[1])
+
+
+def login(flask_app, email='forester@example.com', password='pw', role=None):
+    """A test client logged in as a new user (created with `role` if given)."""
+    from app import db
+    from app.models import User
+
+    client = flask_app.test_client()
+    client.post('/register', data={'username': email.split('@')[0], 'email': email, 'password': password})
+    if role:
+        with flask_app.app_context():
+            User.query.filter_by(email=email).update({'role': role})
+            db.session.commit()
+    response = client.post('/login', data={'email': email, 'password': password})
+    assert response.status_code == 302
+    return client
+
+
+@pytest.fixture
+def client(app):
+    return login(app)
+
+
+def create_assessment(client, name='Site'):
+    """Create an assessment through the web form; returns its id."""
+    response = client.post('/assessment/new', data={'name': name, 'location': 'Leyte', 'description': ''})
+    return int(response.headers['Location'].split('/')[-2])
+
+
+def encoded(image, ext='.png'):
+    import io
+
+    import cv2
+
+    ok, buffer = cv2.imencode(ext, image)
+    assert ok
+    return io.BytesIO(buffer.tobytes())
+
+
+def upload_pair(client, assessment_id, pair=None, names=('pre.png', 'post.png'), **form):
+    """Upload a (synthetic) pair through the web form."""
+    pre, post = pair or synthetic_pair()
+    data = dict(form, pre_image=(encoded(pre), names[0]), post_image=(encoded(post), names[1]))
+    return client.post(f'/assessment/{assessment_id}/upload', data=data, content_type='multipart/form-data')
+
+
+@pytest.fixture
+def processed(app, client):
+    """Id of an assessment of the synthetic pair, uploaded and processed through the web form."""
+    assessment_id = create_assessment(client)
+    upload_pair(client, assessment_id)
+    client.get(f'/assessment/{assessment_id}/process')
+    wait_for_jobs(app)
+    return assessment_id
@@ -0,0 +1,111 @@
+import base64
+import os
+
+import cv2
+import pytest
+
+from app import db
+from app.models import Assessment, IdempotencyKey
+
+from conftest import encoded, login, synthetic_pair
+
+
+@pytest.fixture
+def api(app):
+    """A test client sending HTTP Basic credentials, as API clients do."""
+    login(app, 'api@example.com', 'secret').get('/logout')
+    client = app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = 'Basic ' + base64.b64encode(b'api@example.com:secret').decode()
+    return client
+
+
+@pytest.fixture
+def import_root(app, tmp_path):
+    """A directory of by-reference images listed in API_IMPORT_ROOTS."""
+    root = tmp_path / 'captures'
+    root.mkdir()
+    for name, image in zip(('pre.png', 'post.png'), synthetic_pair()):
+        cv2.imwrite(str(root / name), image)
+    app.config['API_IMPORT_ROOTS'] = [str(root)]
+    return root
+
+
+def count(app, model):
+    with app.app_context():
+        return model.query.count()
+
+
+def test_requests_without_credentials_get_401(app):
+    response = app.test_client().post('/api/assessments', json={'name': 'A', 'location': 'L'})
+    assert response.status_code == 401 and 'Basic' in response.headers['WWW-Authenticate']
+
+
+def test_retries_with_an_idempotency_key_are_replayed(app, api):
+    headers = {'Idempotency-Key': 'create-1'}
+    first = api.post('/api/assessments', json={'name': 'A', 'location': 'L'}, headers=headers)
+    retry = api.post('/api/assessments', json={'name': 'A', 'location': 'L'}, headers=headers)
+    assert first.status_code == retry.status_code == 201
+    assert retry.get_json() == first.get_json() and retry.headers['Idempotent-Replayed'] == 'true'
+    assert count(app, Assessment) == 1
+
+    other = api.post(f"/api/assessments/{first.get_json()['id']}/process", headers=headers)
+    assert other.status_code == 422
+
+
+def test_failed_requests_release_their_key(app, api):
+    headers = {'Idempotency-Key': 'create-2'}
+    assert api.post('/api/assessments', json={'name': 'A'}, headers=headers).status_code == 400
+    assert count(app, IdempotencyKey) == 0
+    assert api.post('/api/assessments', json={'name': 'A', 'location': 'L'}, headers=headers).status_code == 201
+
+
+def test_upload_process_and_long_poll(app, api):
+    assessment_id = api.post('/api/assessments', json={'name': 'A', 'location': 'L'}).get_json()['id']
+    pre, post = synthetic_pair()
+    response = api.post(f'/api/assessments/{assessment_id}/images', content_type='multipart/form-data',
+                        data={'pre_image': (encoded(pre), 'pre.png'), 'post_image': (encoded(post), 'post.png')})
+    assert response.get_json()['status'] == 'uploaded'
+
+    queued = api.post(f'/api/assessments/{assessment_id}/process', json={'hue_threshold': 10})
+    assert queued.status_code == 202 and queued.headers['Location'].endswith(f'/api/assessments/{assessment_id}')
+    data = api.get(f'/api/assessments/{assessment_id}?wait=30').get_json()
+    assert data['status'] == 'done' and data['error'] is None
+    assert data['results']['processing_config']['hue_threshold'] == 10
+    assert 0 < data['results']['damage_percentage'] < 100
+    assert all(url.startswith('/media/') for url in data['results']['label_maps'].values())
+
+
+def test_other_users_assessments_are_not_found(app, api):
+    owner = login(app, 'owner@example.com')
+    owner.post('/assessment/new', data={'name': 'Mine', 'location': 'L'})
+    assert api.get('/api/assessments/1').status_code == 404
+
+
+def test_imports_by_reference_are_confined_to_the_roots(app, api, import_root):
+    assessment_id = api.post('/api/assessments', json={'name': 'A', 'location': 'L'}).get_json()['id']
+    outside = api.post(f'/api/assessments/{assessment_id}/images',
+                       json={'pre_path': '/etc/hostname', 'post_path': str(import_root / 'post.png')})
+    assert outside.status_code == 403
+
+    response = api.post(f'/api/assessments/{assessment_id}/images',
+                        json={'pre_path': str(import_root / 'pre.png'), 'post_path': str(import_root / 'post.png')})
+    assert response.status_code == 200
+    with app.app_context():
+        stored = os.path.join(app.static_folder, db.session.get(Assessment, assessment_id).pre_image)
+    # A copy, so the upload never changes with the source
+    assert os.stat(stored).st_nlink == 1 and not os.path.samefile(stored, import_root / 'pre.png')
+
+
+def test_batch_is_all_or_nothing(app, api, import_root):
+    pair = {'pre_path': str(import_root / 'pre.png'), 'post_path': str(import_root / 'post.png')}
+    uploads = set(os.listdir(app.config['UPLOAD_FOLDER']))
+    bad = api.post('/api/batch', json={'items': [dict(pair, name='A', location='L'),
+                                                 dict(name='B', location='L', pre_path=pair['pre_path'])]})
+    assert bad.status_code == 400
+    assert count(app, Assessment) == 0 and set(os.listdir(app.config['UPLOAD_FOLDER'])) == uploads
+
+    response = api.post('/api/batch', json={'items': [dict(pair, name='A', location='L'),
+                                                      dict(pair, name='B', location='L')]})
+    assert response.status_code == 202
+    for item in response.get_json()['items']:
+        assert api.get(f"/api/assessments/{item['id']}?wait=30").get_json()['status'] == 'done'
@@ -0,0 +1,105 @@
+import os
+from datetime import timedelta
+
+from sqlalchemy import event
+
+from app import db
+from app.models import Artifact, Assessment
+from app.utils.artifacts import (
+    INTERMEDIATE_KINDS, adopt_untracked_files, artifact_path, collect_garbage, reclaimable_report,
+)
+
+from conftest import wait_for_jobs
+
+NO_GRACE = timedelta(0)
+
+
+def live(assessment_id):
+    return Artifact.query.filter_by(assessment_id=assessment_id, released_at=None)
+
+
+def test_processing_registers_every_file(app, processed):
+    with app.app_context():
+        kinds = {artifact.kind for artifact in live(processed)}
+        assert {'upload', 'visualization', 'intermediate'} <= kinds
+        for artifact in Artifact.query:
+            assert os.path.getsize(artifact_path(artifact)) == artifact.size_bytes
+
+
+def test_reprocessing_releases_replaced_visualizations(app, client, processed):
+    with app.app_context():
+        before = {artifact.path for artifact in live(processed).filter_by(kind='visualization')}
+    client.post(f'/assessment/{processed}/process', data={'hue_threshold': '20'})
+    wait_for_jobs(app)
+    with app.app_context():
+        assessment = db.session.get(Assessment, processed)
+        current = {artifact.path for artifact in live(processed).filter_by(kind='visualization')}
+        assert current.isdisjoint(before) and len(current) == 3
+        assert ('uploads/' + os.path.basename(assessment.pre_vis_path)) in current
+
+        # Within the grace period nothing goes; afterwards exactly the released files
+        assert collect_garbage() == (0, 0)
+        report = reclaimable_report(grace_period=NO_GRACE)
+        assert report['by_kind']['visualization']['files'] == 3
+        stale = [artifact_path(artifact) for artifact in Artifact.query.filter(Artifact.released_at.isnot(None))]
+        deleted, reclaimed = collect_garbage(grace_period=NO_GRACE, batch_size=2)
+        assert deleted == len(stale) and reclaimed == report['bytes']
+        assert not any(os.path.exists(path) for path in stale)
+        assert all(os.path.exists(artifact_path(artifact)) for artifact in Artifact.query)
+
+
+def test_deleting_an_assessment_releases_all_its_files(app, client, processed):
+    client.post(f'/assessment/{processed}/delete')
+    with app.app_context():
+        assert live(processed).count() == 0
+        paths = [artifact_path(artifact) for artifact in Artifact.query]
+        collect_garbage(grace_period=NO_GRACE)
+        assert Artifact.query.count() == 0
+        assert not any(os.path.exists(path) for path in paths)
+
+
+def test_deleting_an_assessment_keeps_foreign_keys_valid(app, client, processed):
+    def enforce(connection, record):
+        connection.execute('PRAGMA foreign_keys=ON')
+
+    with app.app_context():
+        engine = db.engine
+        event.listen(engine, 'connect', enforce)
+        engine.dispose()
+    try:
+        # Reprocessing leaves released rows of the assessment waiting for the GC
+        client.post(f'/assessment/{processed}/process', data={'hue_threshold': '20'})
+        wait_for_jobs(app)
+        response = client.post(f'/assessment/{processed}/delete')
+        assert response.status_code == 302
+        with app.app_context():
+            assert db.session.get(Assessment, processed) is None
+            assert Artifact.query.count() and not Artifact.query.filter_by(assessment_id=processed).count()
+            collect_garbage(grace_period=NO_GRACE)
+            assert Artifact.query.count() == 0
+    finally:
+        event.remove(engine, 'connect', enforce)
+        engine.dispose()
+
+
+def test_retention_drops_regenerable_intermediates_only(app, processed):
+    with app.app_context():
+        report = reclaimable_report(drop_kinds=INTERMEDIATE_KINDS, drop_after=NO_GRACE)
+        assert set(report['by_kind']) <= set(INTERMEDIATE_KINDS) and report['files']
+        collect_garbage(drop_kinds=INTERMEDIATE_KINDS, drop_after=NO_GRACE)
+        assert {artifact.kind for artifact in Artifact.query} == {'upload', 'visualization'}
+        assert db.session.get(Assessment, processed).damage_percentage is not None
+
+
+def test_adopting_registers_untracked_uploads(app, processed):
+    orphan = os.path.join(app.config['UPLOAD_FOLDER'], 'pre_vis_orphan.png')
+    with open(orphan, 'wb') as f:
+        f.write(b'left behind')
+    with app.app_context():
+        tracked = Artifact.query.count()
+        adopted, released = adopt_untracked_files()
+        # The folder may also hold files of the development database; ours is among the released
+        artifact = Artifact.query.filter_by(path='uploads/pre_vis_orphan.png').one()
+        assert artifact.released_at is not None and artifact.kind == 'visualization'
+        assert Artifact.query.count() == tracked + adopted and released >= 1
+        assert adopt_untracked_files() == (0, 0)
@@ -0,0 +1,89 @@
+import threading
+
+import numpy as np
+import pytest
+
+from app.utils.buffer_pool import BufferPool, pool_metrics, worker_pool
+from app.utils.image_processing import analyze_pair
+from conftest import synthetic_pair
+
+
+def test_returned_arrays_are_reused_by_shape_and_dtype():
+    pool = BufferPool()
+    a = pool.borrow((4, 5), np.uint8)
+    pool.give_back(a)
+    assert pool.borrow((4, 5), np.uint8) is a
+    assert pool.borrow((4, 5), np.uint8) is not a
+    assert pool.borrow((4, 5), np.float32).dtype == np.float32
+    assert (pool.borrow(3, np.int16, fill=7) == 7).all()
+    metrics = pool.metrics()
+    assert metrics['requests'] == 5 and metrics['hits'] == 1 and metrics['hit_rate'] == 0.2
+
+
+def test_foreign_arrays_are_ignored():
+    pool = BufferPool()
+    pool.give_back(np.zeros(10))
+    assert pool.metrics()['pooled_bytes'] == 0
+
+
+def test_pooled_bytes_are_capped_dropping_the_least_recently_used():
+    pool = BufferPool(max_pooled_bytes=250)
+    a, b, c = pool.borrow(100, np.uint8), pool.borrow(100, np.uint8), pool.borrow(50, np.uint16)
+    pool.give_back(a)
+    pool.give_back(c)
+    pool.give_back(b)
+    assert pool.pooled_bytes == 200
+    # The 100-byte size was used last, so the 50 x uint16 entry went
+    assert pool.borrow(50, np.uint16) is not c
+    reused = pool.borrow(100, np.uint8)
+    assert reused is a or reused is b
+
+
+def test_scope_returns_borrowed_arrays_and_runs_callbacks_last_first():
+    pool = BufferPool()
+    calls = []
+    with pool.scope() as scope:
+        a = scope.borrow((8, 8), np.bool_)
+        scope.on_exit(lambda: calls.append(1))
+        scope.on_exit(lambda: calls.append(2))
+        assert pool.in_use_bytes == 64
+    assert calls == [2, 1]
+    assert pool.in_use_bytes == 0 and pool.pooled_bytes == 64
+    assert pool.borrow((8, 8), np.bool_) is a
+
+
+def test_scope_drops_arrays_when_the_block_raises():
+    pool = BufferPool()
+    with pytest.raises(RuntimeError):
+        with pool.scope() as scope:
+            scope.borrow(16, np.uint8)
+            raise RuntimeError
+    assert pool.in_use_bytes == 0 and pool.pooled_bytes == 0
+
+
+def test_pools_are_per_thread_and_summed():
+    pools = []
+
+    def work():
+        worker_pool().borrow(1, np.uint8)
+        pools.append(worker_pool())
+
+    thread = threading.Thread(target=work)
+    thread.start()
+    thread.join()
+    assert pools[0] is not worker_pool()
+    assert worker_pool() is worker_pool()
+    assert pool_metrics()['requests'] >= 1
+
+
+def test_pipeline_results_do_not_depend_on_pooling():
+    pre, post = synthetic_pair()
+    plain = analyze_pair((pre, post))
+    pool = BufferPool()
+    for _ in range(2):
+        with pool.scope() as buffers:
+            pooled = analyze_pair((pre, post), buffers=buffers)
+            assert np.array_equal(pooled['significant_change'], plain['significant_change'])
+            assert np.array_equal(pooled['refined_post'], plain['refined_post'])
+            assert pooled['damage_percentage'] == plain['damage_percentage']
+    assert pool.hits > 0
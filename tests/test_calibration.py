@@ -0,0 +1,76 @@
+import cv2
+import numpy as np
+import pytest
+
+from app.utils.calibration import calibrate, grid_search_space, load_sample_set, random_search_space
+from app.utils.image_processing import CLASS_PALETTE, analyze_pair
+from app.utils.pipeline_config import DEFAULT_CONFIG, ProcessingConfig
+
+from conftest import synthetic_pair
+
+
+def paint(labels):
+    """A label map painted in the manuscript palette, as BGR for cv2.imwrite."""
+    return np.array(CLASS_PALETTE, dtype=np.uint8)[:, ::-1][labels]
+
+
+@pytest.fixture
+def sample_set(tmp_path):
+    """A pre/post pair whose masks are the default pipeline's own maps."""
+    (tmp_path / 'images').mkdir()
+    (tmp_path / 'masks').mkdir()
+    pre, post = synthetic_pair()
+    result = analyze_pair((pre, post), DEFAULT_CONFIG)
+    for name, image, labels in (('site_pre', pre, result['segmented_pre']),
+                                ('site_post', post, result['refined_post'])):
+        cv2.imwrite(str(tmp_path / 'images' / f'{name}.png'), image)
+        cv2.imwrite(str(tmp_path / 'masks' / f'{name}.png'), paint(labels))
+    return str(tmp_path)
+
+
+def test_grid_search_space_is_the_cartesian_product():
+    space = grid_search_space({'hue_threshold': [6, 12], 'exg_percentile': [20.0, 25.0, 30.0]})
+    assert len(space) == 6
+    assert {'hue_threshold': 6, 'exg_percentile': 30.0} in space
+
+
+def test_random_search_space_is_seeded_and_typed():
+    ranges = {'hue_threshold': (4, 20), 'exg_percentile': (10.0, 40.0)}
+    space = random_search_space(ranges, 20, seed=1)
+    assert space == random_search_space(ranges, 20, seed=1)
+    for params in space:
+        assert isinstance(params['hue_threshold'], int) and 4 <= params['hue_threshold'] <= 20
+        assert 10.0 <= params['exg_percentile'] <= 40.0
+
+
+def test_sample_set_pairs_and_labels(sample_set):
+    names, images, labels, pairs = load_sample_set(sample_set)
+    assert names == ['site_post', 'site_pre']
+    assert pairs == [(1, 0)]
+    assert labels[1].shape == images[1].shape[:2]
+
+
+def test_missing_mask_is_an_error(sample_set, tmp_path):
+    cv2.imwrite(str(tmp_path / 'images' / 'orphan.png'), np.zeros((8, 8, 3), np.uint8))
+    with pytest.raises(ValueError, match="orphan"):
+        load_sample_set(sample_set)
+
+
+def test_calibration_recovers_the_parameters_of_the_ground_truth(sample_set):
+    space = grid_search_space({'exg_percentile': [5.0, DEFAULT_CONFIG.exg_percentile, 60.0]})
+    report = calibrate(sample_set, space, workers=2)
+    assert report['samples'] == 2 and report['pairs'] == 1
+    assert report['best']['params'] == {'exg_percentile': DEFAULT_CONFIG.exg_percentile}
+    assert report['best']['miou'] == 1.0
+    assert isinstance(report['best_config'], ProcessingConfig)
+    scores = [trial['score'] for trial in report['trials']]
+    assert scores == sorted(scores, reverse=True)
+    matrix = np.array(report['best']['confusion_matrix'])
+    assert np.count_nonzero(matrix - np.diag(np.diag(matrix))) == 0
+
+
+def test_pairs_score_the_change_thresholds(sample_set):
+    space = [{}, {'hue_threshold': 90, 'saturation_threshold': 255, 'value_threshold': 255}]
+    report = calibrate(sample_set, space, workers=1)
+    errors = [trial['damage_error'] for trial in report['trials']]
+    assert report['best']['params'] == {} and errors[0] == 0.0 < errors[1]
@@ -0,0 +1,84 @@
+import cv2
+import numpy as np
+import pytest
+
+from app.utils.buffer_pool import BufferPool
+from app.utils.change_detection import (
+    active_metrics, change_mask, change_tests, hsv_difference, index_drop, lab_delta_e, parse_metrics,
+    required_planes,
+)
+from app.utils.image_processing import CLASS_LAND, CLASS_VEGETATION, detect_change
+from app.utils.pipeline_config import DEFAULT_CONFIG
+from app.utils.vegetation_indices import index_planes
+
+
+@pytest.fixture
+def pair(rng):
+    pre = rng.integers(0, 256, (60, 80, 3), dtype=np.uint8)
+    post = rng.integers(0, 256, (60, 80, 3), dtype=np.uint8)
+    return pre, post
+
+
+def reference_hsv(pre, post):
+    """The int32 HSV differences the uint8 kernels replace."""
+    a = cv2.cvtColor(pre, cv2.COLOR_BGR2HSV).astype(np.int32)
+    b = cv2.cvtColor(post, cv2.COLOR_BGR2HSV).astype(np.int32)
+    h = np.abs(a[:, :, 0] - b[:, :, 0])
+    return np.minimum(h, 180 - h), np.abs(a[:, :, 1] - b[:, :, 1]), np.abs(a[:, :, 2] - b[:, :, 2])
+
+
+def test_hsv_difference_matches_the_int32_reference(pair):
+    expected = reference_hsv(*pair)
+    with BufferPool().scope() as buffers:
+        for planes in (hsv_difference(*pair), hsv_difference(*pair, buffers=buffers)):
+            for plane, reference in zip(planes, expected):
+                assert plane.dtype == np.uint8
+                assert np.array_equal(plane, reference)
+    assert hsv_difference(*pair)[0].max() <= 90
+
+
+def test_lab_delta_and_index_drop(pair):
+    pre, post = pair
+    a = cv2.cvtColor(pre, cv2.COLOR_BGR2LAB).astype(np.float64)
+    b = cv2.cvtColor(post, cv2.COLOR_BGR2LAB).astype(np.float64)
+    d = a - b
+    d[:, :, 0] *= 100 / 255
+    expected = np.clip(np.sqrt((d ** 2).sum(axis=2)), 0, 255)
+    assert np.abs(lab_delta_e(pre, post).astype(float) - expected).max() <= 1
+    drop = index_drop(pre, post, 'exg')
+    planes = [index_planes(image, ('exg',), quantize='fixed')['exg'].astype(np.int32) for image in pair]
+    assert np.array_equal(drop, np.clip(planes[0] - planes[1], 0, 255))
+
+
+def test_change_mask_matches_the_int32_reference(rng, pair):
+    seg_pre = rng.integers(0, 6, pair[0].shape[:2]).astype(np.uint8)
+    seg_post = rng.integers(0, 6, pair[0].shape[:2]).astype(np.uint8)
+    h, s, v = hsv_difference(*pair)
+    veg_pre, change, refined = detect_change(seg_pre, seg_post, h, s, v, DEFAULT_CONFIG)
+    rh, rs, rv = reference_hsv(*pair)
+    expected = (seg_pre == CLASS_VEGETATION) & (
+        (seg_post != CLASS_VEGETATION) | (rh > DEFAULT_CONFIG.hue_threshold)
+        | (rs > DEFAULT_CONFIG.saturation_threshold) | (rv > DEFAULT_CONFIG.value_threshold)
+    )
+    assert np.array_equal(change, expected)
+    assert (refined[change] == CLASS_LAND).all()
+    assert np.array_equal(refined[~change], seg_post[~change])
+    with BufferPool().scope() as buffers:
+        scoped = change_mask(veg_pre, seg_post, CLASS_VEGETATION, change_tests({'h': h, 's': s, 'v': v},
+                                                                              DEFAULT_CONFIG), buffers)
+        assert np.array_equal(scoped, expected)
+
+
+def test_metrics_are_parsed_and_planes_required():
+    assert parse_metrics(' hsv, lab,hsv,,') == ('hsv', 'lab')
+    config = DEFAULT_CONFIG.replace(change_metrics='lab', change_index='exg')
+    assert active_metrics(config) == ('lab', 'index')
+    assert required_planes(config) == {'delta_e', 'drop'}
+
+
+def test_missing_planes_are_an_error(pair):
+    config = DEFAULT_CONFIG.replace(change_metrics='hsv,lab')
+    h, s, v = hsv_difference(*pair)
+    with pytest.raises(ValueError, match='delta_e'):
+        change_tests({'h': h, 's': s, 'v': v}, config)
+    assert len(change_tests({'h': h, 's': s, 'v': v, 'delta_e': lab_delta_e(*pair)}, config)) == 4
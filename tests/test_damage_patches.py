@@ -0,0 +1,81 @@
+import cv2
+import numpy as np
+import pytest
+
+from app.utils.damage_patches import extract_damage_patches, patches_to_geojson
+
+
+def reference_patches(mask, min_area=1):
+    """Patch statistics of the whole mask labelled in one piece by OpenCV."""
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(mask.astype(np.uint8), connectivity=8)
+    padded = np.pad(mask.astype(np.int32), 1)
+    edges = 4 - (padded[:-2, 1:-1] + padded[2:, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:])
+    perimeter = np.bincount(labels.ravel(), weights=np.where(mask, edges, 0).ravel(), minlength=count)
+    patches = []
+    for label in range(1, count):
+        left, top, width, height, area = stats[label]
+        if area < min_area:
+            continue
+        patches.append({
+            'area': int(area),
+            'perimeter': float(perimeter[label]),
+            'centroid_x': round(float(centroids[label][0]), 2),
+            'centroid_y': round(float(centroids[label][1]), 2),
+            'min_x': int(left), 'min_y': int(top),
+            'max_x': int(left + width - 1), 'max_y': int(top + height - 1),
+        })
+    return patches
+
+
+def sort_key(patch):
+    return patch['area'], patch['min_y'], patch['min_x'], patch['max_y'], patch['max_x']
+
+
+@pytest.mark.parametrize('tile_size', [7, 16, 37, 1024])
+@pytest.mark.parametrize('density', [0.2, 0.45, 0.6])
+def test_tiled_labelling_matches_whole_image_components(rng, tile_size, density):
+    mask = rng.random((97, 131)) < density
+    patches = extract_damage_patches(mask, min_area=1, tile_size=tile_size, with_polygons=False)
+    expected = reference_patches(mask)
+    assert sorted(patches, key=sort_key) == sorted(expected, key=sort_key)
+    assert sum(patch['area'] for patch in patches) == mask.sum()
+
+
+def test_diagonal_touch_at_tile_corner_is_one_patch():
+    mask = np.zeros((8, 8), dtype=bool)
+    mask[3, 3] = mask[4, 4] = True  # 8-connected across the corner of four 4x4 tiles
+    patches = extract_damage_patches(mask, min_area=1, tile_size=4, with_polygons=False)
+    assert len(patches) == 1
+    assert patches[0]['area'] == 2
+    assert (patches[0]['min_x'], patches[0]['max_x']) == (3, 4)
+
+
+def test_min_area_drops_speckle_and_orders_by_area():
+    mask = np.zeros((40, 40), dtype=np.uint8)
+    mask[2:4, 2:4] = 1
+    mask[10:20, 10:30] = 1
+    mask[30:35, 30:35] = 255
+    patches = extract_damage_patches(mask, min_area=10, tile_size=16, with_polygons=False)
+    assert [patch['area'] for patch in patches] == [200, 25]
+
+
+def test_empty_mask_has_no_patches():
+    assert extract_damage_patches(np.zeros((32, 32), dtype=bool), tile_size=8) == []
+
+
+def test_polygon_outlines_patch_with_hole():
+    mask = np.zeros((30, 30), dtype=np.uint8)
+    mask[5:25, 5:25] = 1
+    mask[12:18, 12:18] = 0
+    patch, = extract_damage_patches(mask, min_area=1, tile_size=16, epsilon=0)
+    outer, hole = patch['polygon']
+    assert outer[0] == outer[-1] and hole[0] == hole[-1]
+    xs, ys = [x for x, _ in outer], [y for _, y in outer]
+    assert (min(xs), min(ys), max(xs), max(ys)) == (5, 5, 24, 24)
+    assert patch['area'] == 400 - 36
+
+    collection = patches_to_geojson([patch])
+    feature, = collection['features']
+    assert feature['geometry']['type'] == 'Polygon'
+    assert feature['geometry']['coordinates'] == patch['polygon']
+    assert 'polygon' not in feature['properties']
@@ -0,0 +1,94 @@
+import cv2
+import numpy as np
+import pytest
+
+from app.utils.evaluation import (
+    CLASS_UNLABELED, NUM_CLASSES, PALETTE, compare_reports, confusion_matrix, decode_label_map, evaluate,
+    f1_per_class, iou_per_class, load_label_map, summarize,
+)
+from app.utils.image_processing import analyze_pair, calculate_damage
+from app.utils.pipeline_config import DEFAULT_CONFIG
+
+from conftest import synthetic_pair
+
+
+def paint(labels):
+    return np.array(PALETTE, dtype=np.uint8)[:, ::-1][labels]
+
+
+def test_confusion_matrix_counts_every_pixel_pair(rng):
+    truth = rng.integers(0, NUM_CLASSES, (50, 70)).astype(np.uint8)
+    predicted = rng.integers(0, NUM_CLASSES, (50, 70)).astype(np.uint8)
+    expected = np.zeros((NUM_CLASSES, NUM_CLASSES), dtype=np.int64)
+    for t, p in zip(truth.ravel(), predicted.ravel()):
+        expected[t, p] += 1
+    assert np.array_equal(confusion_matrix(truth, predicted), expected)
+
+
+def test_iou_and_f1_per_class():
+    matrix = np.zeros((NUM_CLASSES, NUM_CLASSES), dtype=np.int64)
+    matrix[0, 0], matrix[0, 1], matrix[1, 1] = 6, 2, 4
+    iou, f1 = iou_per_class(matrix), f1_per_class(matrix)
+    assert iou[0] == pytest.approx(6 / 8) and iou[1] == pytest.approx(4 / 6)
+    assert f1[0] == pytest.approx(12 / 14) and f1[1] == pytest.approx(8 / 10)
+    assert np.isnan(iou[2:]).all() and np.isnan(f1[2:]).all()
+
+    report = summarize(matrix, damage_errors=[1.0, 3.0])
+    assert report['pixels'] == 12 and report['pixel_accuracy'] == pytest.approx(10 / 12, abs=1e-4)
+    assert report['miou'] == pytest.approx((6 / 8 + 4 / 6) / 2, abs=1e-4)
+    assert report['iou']['road'] is None and report['damage_error'] == 2.0
+
+
+def test_palette_decoding_round_trip(rng, tmp_path):
+    labels = rng.integers(0, NUM_CLASSES, (20, 30)).astype(np.uint8)
+    rgb = np.array(PALETTE, dtype=np.uint8)[labels]
+    assert np.array_equal(decode_label_map(rgb), labels)
+    rgb[0, 0] = (1, 2, 3)
+    assert decode_label_map(rgb)[0, 0] == CLASS_UNLABELED
+
+    cv2.imwrite(str(tmp_path / 'painted.png'), paint(labels))
+    cv2.imwrite(str(tmp_path / 'ids.png'), labels)
+    assert np.array_equal(load_label_map(str(tmp_path / 'painted.png')), labels)
+    assert np.array_equal(load_label_map(str(tmp_path / 'ids.png')), labels)
+
+
+@pytest.fixture
+def evaluation_set(tmp_path):
+    """Ground truth painted from the default pipeline's maps of the synthetic pair, plus the source images."""
+    for name in ('gt', 'images', 'predictions'):
+        (tmp_path / name).mkdir()
+    pre, post = synthetic_pair()
+    result = analyze_pair((pre, post), DEFAULT_CONFIG)
+    for stem, image, labels in (('site_pre', pre, result['segmented_pre']),
+                                ('site_post', post, result['refined_post'])):
+        cv2.imwrite(str(tmp_path / 'images' / f'{stem}.png'), image)
+        cv2.imwrite(str(tmp_path / 'gt' / f'{stem}.png'), paint(labels))
+    return tmp_path, result
+
+
+def test_source_pairs_are_scored_with_the_pipeline_damage(evaluation_set):
+    root, result = evaluation_set
+    report = evaluate(str(root / 'gt'), image_dir=str(root / 'images'), workers=1)
+    assert report['samples'] == 2 and report['pairs'] == 1
+    assert report['miou'] == 1.0 and report['pixel_accuracy'] == 1.0
+    # The pipeline's damage counts the stressed block the label maps alone do not show
+    map_damage = calculate_damage(result['segmented_pre'], result['refined_post'])[2]
+    assert report['damage_error'] == pytest.approx(abs(result['damage_percentage'] - map_damage), abs=1e-4)
+
+
+def test_predicted_maps_and_regression_gate(evaluation_set):
+    root, result = evaluation_set
+    for stem, labels in (('site_pre', result['segmented_pre']), ('site_post', result['refined_post'])):
+        cv2.imwrite(str(root / 'predictions' / f'{stem}.png'), labels)
+    baseline = evaluate(str(root / 'gt'), pred_dir=str(root / 'predictions'), workers=1)
+    assert baseline['miou'] == 1.0 and baseline['damage_error'] == 0.0
+    assert compare_reports(baseline, baseline) == []
+
+    worse = dict(baseline, miou=baseline['miou'] - 0.01, damage_error=1.0)
+    metrics = {regression['metric'] for regression in compare_reports(worse, baseline)}
+    assert metrics == {'miou', 'damage_error'}
+
+
+def test_evaluate_needs_a_source():
+    with pytest.raises(ValueError):
+        evaluate('gt')
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from app.utils.buffer_pool import BufferPool
+from app.utils.change_detection import hsv_difference
+from app.utils.frame_handoff import HSV_DIFF, SEGMENTATION, FramePool, parse_size
+from app.utils.image_processing import perform_segmentation
+from app.utils.pipeline_config import DEFAULT_CONFIG
+from app.utils.shared_arrays import SharedArrayPack, attach_arrays, live_segments
+from conftest import synthetic_pair
+
+
+@pytest.fixture(scope='module')
+def frame_pool():
+    pool = FramePool(workers=1)
+    pool.start()
+    yield pool
+    pool.shutdown()
+
+
+def test_parse_size():
+    assert parse_size('640x480') == (640, 480)
+    assert parse_size('') is None
+    for value in ('640', '0x480', 'axb'):
+        with pytest.raises(ValueError):
+            parse_size(value)
+
+
+def test_pack_round_trip_and_aligned_layout(rng):
+    a = rng.integers(0, 256, (7, 5, 3), dtype=np.uint8)
+    b = rng.random((3, 4))
+    with SharedArrayPack({'a': a, 'b': b}, empty={'out': ((7, 5), 'uint8')}) as pack:
+        assert pack.shm.name in live_segments()
+        for _, offset, _, _ in pack.descriptor[1]:
+            assert offset % 64 == 0
+        shm, views = attach_arrays(pack.descriptor)
+        try:
+            assert np.array_equal(views['a'], a)
+            assert np.array_equal(views['b'], b)
+            assert not views['out'].any()
+            views['out'][...] = 9
+            assert (pack.arrays()['out'] == 9).all()
+        finally:
+            del views
+            shm.close()
+    assert live_segments() == []
+
+
+def test_pack_is_unlinked_when_collected():
+    pack = SharedArrayPack({'a': np.zeros(4)})
+    name = pack.shm.name
+    del pack
+    assert name not in live_segments()
+
+
+def test_worker_matches_in_thread_path(frame_pool):
+    pre, post = synthetic_pair(seed=3)
+    result = frame_pool.analyze(pre, post, DEFAULT_CONFIG)
+    assert np.array_equal(result['seg_pre'], perform_segmentation(pre, DEFAULT_CONFIG))
+    assert np.array_equal(result['seg_post'], perform_segmentation(post, DEFAULT_CONFIG))
+    for plane, expected in zip('hsv', hsv_difference(pre, post)):
+        assert np.array_equal(result[plane], expected)
+    assert live_segments() == []
+    assert frame_pool.worker_metrics
+
+
+def test_scoped_results_live_until_the_scope_ends(frame_pool):
+    pre, post = synthetic_pair(seed=4)
+    with BufferPool().scope() as scope:
+        result = frame_pool.analyze(pre, post, DEFAULT_CONFIG, products=(HSV_DIFF,), scope=scope)
+        assert set(result) == {'h', 's', 'v'}
+        assert len(live_segments()) == 1
+        del result
+    assert live_segments() == []
+
+
+def test_worker_failure_does_not_leak_a_segment(frame_pool):
+    pre, post = synthetic_pair(seed=5)
+    with pytest.raises(Exception):
+        frame_pool.analyze(pre, post[:10], DEFAULT_CONFIG, products=(SEGMENTATION, HSV_DIFF))
+    assert live_segments() == []
@@ -0,0 +1,108 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from app.utils.geotiff import export_path, overview_factors, write_geotiff
+from app.utils.georef import geotiff_georef
+from app.utils.image_processing import CLASS_PALETTE
+
+GEOREF = {'geotransform': [500000.0, 0.5, 0.0, 1200000.0, 0.0, -0.5], 'epsg': 32651}
+
+
+@pytest.fixture
+def labels(rng):
+    return rng.integers(0, len(CLASS_PALETTE), (700, 900)).astype(np.uint8)
+
+
+def read_levels(path):
+    ok, levels = cv2.imreadmulti(path, flags=cv2.IMREAD_UNCHANGED)
+    assert ok
+    return levels
+
+
+def test_overview_factors():
+    assert overview_factors(256, 256) == []
+    assert overview_factors(700, 900) == [2, 4]
+    assert overview_factors(257, 10) == [2]
+
+
+def test_round_trip_with_nearest_neighbour_overviews(tmp_path, labels):
+    path = write_geotiff(str(tmp_path / 'labels.tif'), labels)
+    levels = read_levels(path)
+    assert [level.shape for level in levels] == [(700, 900), (350, 450), (175, 225)]
+    for factor, level in zip((1, 2, 4), levels):
+        assert np.array_equal(level, labels[::factor, ::factor])
+
+
+def test_palette_is_stored_as_the_colour_map(tmp_path, labels):
+    path = write_geotiff(str(tmp_path / 'labels.tif'), labels, CLASS_PALETTE)
+    bgr = np.array(CLASS_PALETTE, dtype=np.uint8)[:, ::-1]
+    assert np.array_equal(read_levels(path)[0], bgr[labels])
+
+
+@pytest.mark.parametrize('georef', [
+    GEOREF,
+    {'geotransform': [500000.0, 0.4, 0.3, 1200000.0, 0.3, -0.4], 'epsg': 32651},
+    {'geotransform': [120.5, 0.001, 0.0, 11.2, 0.0, -0.001], 'epsg': None},
+])
+def test_georeferencing_round_trips(tmp_path, georef):
+    path = write_geotiff(str(tmp_path / 'labels.tif'), np.zeros((40, 60), np.uint8), georef=georef)
+    assert geotiff_georef(path) == georef
+
+
+def test_only_2d_uint8_rasters(tmp_path):
+    with pytest.raises(ValueError):
+        write_geotiff(str(tmp_path / 'a.tif'), np.zeros((4, 4), np.int32))
+    with pytest.raises(ValueError):
+        write_geotiff(str(tmp_path / 'a.tif'), np.zeros((4, 4, 3), np.uint8))
+    assert os.listdir(tmp_path) == []
+
+
+def test_concurrent_writers_of_one_file(tmp_path, labels):
+    path = str(tmp_path / 'labels.tif')
+    errors = []
+
+    def export():
+        try:
+            write_geotiff(path, labels, CLASS_PALETTE, GEOREF)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=export) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == [] and os.listdir(tmp_path) == ['labels.tif']
+    assert read_levels(path)[0].shape == (700, 900, 3)
+
+
+def test_export_route_caches_per_georef(app, client, processed):
+    assert client.put(f'/api/assessments/{processed}/georef', json=GEOREF).status_code == 200
+    response = client.get(f'/assessment/{processed}/export/change.tif')
+    assert response.status_code == 200 and response.mimetype == 'image/tiff'
+    path = os.path.join(app.instance_path, 'tmp.tif')
+    with open(path, 'wb') as f:
+        f.write(response.data)
+    assert geotiff_georef(path) == GEOREF
+    export_dir = os.path.join(app.instance_path, 'exports', f'assessment_{processed}')
+    [cached] = os.listdir(export_dir)
+    mtime = os.stat(os.path.join(export_dir, cached)).st_mtime_ns
+    client.get(f'/assessment/{processed}/export/change.tif')
+    assert os.stat(os.path.join(export_dir, cached)).st_mtime_ns == mtime
+
+    moved = dict(GEOREF, geotransform=[500100.0] + GEOREF['geotransform'][1:])
+    client.put(f'/api/assessments/{processed}/georef', json=moved)
+    client.get(f'/assessment/{processed}/export/change.tif')
+    assert len(os.listdir(export_dir)) == 2
+    assert client.get(f'/assessment/{processed}/export/ndvi.tif').status_code == 404
+
+
+def test_export_paths_depend_on_the_georef(tmp_path):
+    a = export_path(str(tmp_path), '/x/change_vis_1.png', GEOREF)
+    assert a == export_path(str(tmp_path), '/x/change_vis_1.png', dict(GEOREF))
+    assert os.path.basename(a).startswith('change_vis_1_') and a.endswith('.tif')
+    assert a != export_path(str(tmp_path), '/x/change_vis_1.png', None)
@@ -0,0 +1,160 @@
+import math
+import threading
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+from app import db
+from app.models import GridCell, GridContribution
+from app.utils.grid_summary import (
+    AREA_FIELDS, BASE_CELL_SIZE, LEVELS, cell_contributions, choose_level, grid_update, remove_assessment_grid,
+    summarize_bbox, update_assessment_grid,
+)
+
+# 0.5 m pixels, north-up, with the frame's corner on a cell corner
+GEOREF = {'geotransform': [500000.0, 0.5, 0.0, 1200000.0, 0.0, -0.5], 'epsg': 32651}
+EXTENT = (500000.0, 1199900.0, 500150.0, 1200000.0)  # 300 x 200 pixels
+
+
+def label_maps(rng, shape=(200, 300)):
+    change = rng.choice(np.array([0, 1, 2, 3], dtype=np.uint8), size=shape, p=[0.3, 0.4, 0.2, 0.1])
+    post = np.where(change == 1, 3, rng.integers(0, 3, shape)).astype(np.uint8)
+    return change, post
+
+
+def expected_contributions(change, post, georef):
+    """Per-pixel reference: each pixel goes to the cell under its centre."""
+    x0, a, _, y0, _, e = georef['geotransform']
+    rows, cols = np.indices(change.shape)
+    ix = np.floor((x0 + (cols + 0.5) * a) / BASE_CELL_SIZE).astype(int)
+    iy = np.floor((y0 + (rows + 0.5) * e) / BASE_CELL_SIZE).astype(int)
+    valid = change != 3
+    masks = (valid, (change == 1) | (change == 2), (post == 3) & valid, change == 2)
+    cells = defaultdict(lambda: [0.0] * 4)
+    for i, mask in enumerate(masks):
+        for x, y in zip(ix[mask], iy[mask]):
+            cells[(x, y)][i] += abs(a * e)
+    return {key: values for key, values in cells.items() if values[0] > 0}
+
+
+def grid_state():
+    """{(level, ix, iy): areas} of the stored grid."""
+    return {(cell.level, cell.ix, cell.iy): [getattr(cell, field) for field in AREA_FIELDS]
+            for cell in GridCell.query.all()}
+
+
+def rebuilt_state():
+    """The grid summed from scratch from the stored contributions."""
+    state = defaultdict(lambda: [0.0] * 4)
+    for row in GridContribution.query.all():
+        for level in range(LEVELS):
+            cell = state[(level, row.ix >> level, row.iy >> level)]
+            for i, field in enumerate(AREA_FIELDS):
+                cell[i] += getattr(row, field)
+    return {key: values for key, values in state.items() if values[0] > 1e-6}
+
+
+def assert_states_equal(actual, expected):
+    assert set(actual) == set(expected)
+    for key in expected:
+        assert actual[key] == pytest.approx(expected[key], abs=1e-6)
+
+
+def test_contributions_match_the_per_pixel_reference(rng):
+    change, post = label_maps(rng)
+    contributions = cell_contributions(change, post, GEOREF)
+    assert len(contributions) == 15 * 10
+    expected = expected_contributions(change, post, GEOREF)
+    assert set(contributions) == set(expected)
+    for key in expected:
+        assert contributions[key] == pytest.approx(expected[key])
+
+
+def test_blocks_straddling_cells_keep_the_totals(rng):
+    change, post = label_maps(rng, (203, 307))
+    georef = {'geotransform': [500003.3, 0.5, 0.0, 1199996.1, 0.0, -0.5], 'epsg': 32651}
+    totals = np.sum(list(cell_contributions(change, post, georef).values()), axis=0)
+    assert totals == pytest.approx(np.sum(list(expected_contributions(change, post, georef).values()), axis=0))
+
+
+def test_incremental_updates_equal_a_rebuild(app, rng):
+    with app.app_context():
+        first, second, replaced = label_maps(rng), label_maps(rng), label_maps(rng)
+        update_assessment_grid(1, *first, GEOREF)
+        update_assessment_grid(2, *second, GEOREF)
+        db.session.commit()
+        assert_states_equal(grid_state(), rebuilt_state())
+        update_assessment_grid(1, *replaced, GEOREF)
+        db.session.commit()
+        assert_states_equal(grid_state(), rebuilt_state())
+        remove_assessment_grid(2)
+        db.session.commit()
+        assert_states_equal(grid_state(), rebuilt_state())
+        remove_assessment_grid(1)
+        db.session.commit()
+        assert GridCell.query.count() == 0 and GridContribution.query.count() == 0
+
+
+def test_concurrent_updates_of_shared_cells(app, rng):
+    maps = [label_maps(rng) for _ in range(8)]
+    shifted = dict(GEOREF, geotransform=[500020.0] + GEOREF['geotransform'][1:])
+    start = threading.Barrier(2)
+    errors = []
+
+    def update(assessment_id, georef):
+        try:
+            with app.app_context():
+                for change, post in maps:
+                    start.wait(5)
+                    with grid_update():
+                        update_assessment_grid(assessment_id, change, post, georef)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=update, args=args) for args in ((1, GEOREF), (2, shifted))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    with app.app_context():
+        assert_states_equal(grid_state(), rebuilt_state())
+
+
+def test_summaries_read_the_coarsest_resolving_level(app, rng):
+    with app.app_context():
+        change, post = label_maps(rng)
+        update_assessment_grid(1, change, post, GEOREF)
+        db.session.commit()
+        area = 0.25 / 10000
+        whole = summarize_bbox(EXTENT, 32651)
+        assert whole['valid_area_ha'] == pytest.approx(np.count_nonzero(change != 3) * area, abs=1e-4)
+        assert whole['damaged_ha'] == pytest.approx(np.count_nonzero(change == 2) * area, abs=1e-4)
+        assert whole['level'] == 0 and whole['cells'] == 150
+        # A box on coarse cell edges is answered exactly from few cells
+        size = BASE_CELL_SIZE * 2 ** choose_level(EXTENT, 4)
+        aligned = (math.floor(EXTENT[0] / size) * size, math.floor(EXTENT[1] / size) * size,
+                   math.ceil(EXTENT[2] / size) * size, math.ceil(EXTENT[3] / size) * size)
+        coarse = summarize_bbox(aligned, 32651, max_cells=4)
+        assert coarse['level'] > 0 and coarse['cells'] <= 4
+        assert coarse['valid_area_ha'] == whole['valid_area_ha']
+        assert coarse['damage_index'] == whole['damage_index']
+        left = summarize_bbox((EXTENT[0], EXTENT[1], EXTENT[0] + 50, EXTENT[3]), 32651)
+        assert left['valid_area_ha'] == pytest.approx(np.count_nonzero(change[:, :100] != 3) * area, abs=1e-4)
+        assert summarize_bbox(EXTENT, 4326)['cells'] == 0
+
+
+def test_grid_api(app, client, rng):
+    with app.app_context():
+        update_assessment_grid(1, *label_maps(rng), GEOREF)
+        db.session.commit()
+    bbox = ','.join(str(v) for v in EXTENT)
+    summary = client.get(f'/api/grid/summary?bbox={bbox}&epsg=32651').get_json()
+    assert summary['cells'] == 150 and 0 < summary['damage_index'] < 1
+    cells = client.get(f'/api/grid/cells?bbox={bbox}&epsg=32651&level=2').get_json()
+    assert cells['type'] == 'FeatureCollection'
+    assert sum(f['properties']['valid_area_ha'] for f in cells['features']) == \
+        pytest.approx(summary['valid_area_ha'], abs=1e-3)
+    assert client.get('/api/grid/summary?bbox=1,1,0,0').status_code == 400
+    assert client.get(f'/api/grid/cells?bbox={bbox}&level={LEVELS}').status_code == 400
@@ -0,0 +1,84 @@
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from app.utils.image_io import data_size, image_info, prefetch, read_image, read_pair, reduction_factor
+from conftest import synthetic_pair
+
+
+def write(path, image, *params):
+    assert cv2.imwrite(str(path), image, list(params))
+    return str(path)
+
+
+@pytest.fixture
+def photo():
+    pre, _ = synthetic_pair(height=600, width=800)
+    return pre
+
+
+@pytest.mark.parametrize('name, params, kind', [
+    ('a.jpg', (), 'jpeg'),
+    ('b.jpg', (cv2.IMWRITE_JPEG_PROGRESSIVE, 1), 'jpeg'),
+    ('c.png', (), 'png'),
+])
+def test_header_sizes_match_the_decoded_images(tmp_path, photo, name, params, kind):
+    path = write(tmp_path / name, photo[:590, :790], *params)
+    assert image_info(path) == (kind, (790, 590))
+    with open(path, 'rb') as f:
+        assert data_size(f.read()) == (790, 590)
+
+
+def test_unrecognised_or_missing_files(tmp_path, photo):
+    assert image_info(write(tmp_path / 'a.bmp', photo)) == (None, None)
+    assert image_info(str(tmp_path / 'missing.jpg')) == (None, None)
+    assert data_size(b'\xff\xd8\xff') is None
+    assert read_image(str(tmp_path / 'missing.jpg')) is None
+
+
+def test_reduction_factor_still_covers_the_target():
+    assert reduction_factor((4000, 3000), (500, 375)) == 8
+    assert reduction_factor((4000, 3000), (501, 375)) == 4
+    assert reduction_factor((4001, 3000), (501, 375)) == 8  # libjpeg rounds 500.125 up
+    assert reduction_factor((1000, 800), (999, 800)) == 1
+
+
+def test_reduced_jpeg_decode(tmp_path, photo):
+    path = write(tmp_path / 'a.jpg', photo, cv2.IMWRITE_JPEG_QUALITY, 95)
+    reduced = read_image(path, (200, 150))
+    assert reduced.shape == (150, 200, 3)
+    assert np.array_equal(reduced, cv2.imread(path, cv2.IMREAD_REDUCED_COLOR_4))
+    resized = read_image(path, (300, 200))
+    assert resized.shape == (200, 300, 3)
+    reference = cv2.resize(cv2.imread(path), (300, 200), interpolation=cv2.INTER_AREA)
+    assert np.abs(resized.astype(int) - reference).mean() < 3
+
+
+def test_pair_decodes_the_post_image_at_the_pre_size(tmp_path, photo):
+    pre = write(tmp_path / 'pre.png', photo[:300, :400])
+    post = write(tmp_path / 'post.jpg', photo)
+    pre_image, post_image = read_pair(pre, post)
+    assert np.array_equal(pre_image, photo[:300, :400])
+    assert post_image.shape == (300, 400, 3)
+    unknown = write(tmp_path / 'pre.bmp', photo[:300, :400])
+    assert read_pair(unknown, post)[1].shape == (300, 400, 3)
+    assert read_pair(pre, str(tmp_path / 'missing.jpg'))[1] is None
+
+
+def test_prefetch_yields_in_order_and_loads_ahead():
+    started = []
+    lock = threading.Lock()
+
+    def load(item):
+        with lock:
+            started.append(item)
+        return item * 2
+
+    results = []
+    for item, value in prefetch(range(10), load, depth=2):
+        with lock:
+            assert len(started) <= item + 4
+        results.append((item, value))
+    assert results == [(i, i * 2) for i in range(10)]
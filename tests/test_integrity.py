@@ -0,0 +1,119 @@
+import os
+import time
+
+import cv2
+import pytest
+
+from app import db
+from app.models import Assessment
+from app.utils.integrity import (
+    HASH_MISMATCH, MISSING, PARTIAL, SIZE_MISMATCH, STALE, TEMPORARY_GRACE_SECONDS, UNREADABLE, Checkpoint,
+    Verifier, check_file,
+)
+from app.utils.media import file_sha256, normalize_media_path
+from conftest import create_assessment, synthetic_pair, upload_pair
+
+
+def static_path(app, stored):
+    return os.path.join(app.static_folder, *normalize_media_path(stored).split('/'))
+
+
+def verify(app, checkpoint=None, **options):
+    issues = []
+    with app.app_context():
+        state = Verifier(checkpoint, issues.append, batch_size=1, workers=2, **options).run()
+    return state, issues
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = str(tmp_path / 'image.png')
+    cv2.imwrite(path, synthetic_pair()[0])
+    return path
+
+
+def test_check_file(tmp_path, image):
+    size = os.path.getsize(image)
+    assert check_file(image, size, file_sha256(image), image=True, decode=True) == \
+        ([], {'mtime': os.path.getmtime(image), 'size': (320, 240)})
+    assert check_file(str(tmp_path / 'missing.png'))[0] == [(MISSING, None)]
+    assert [kind for kind, _ in check_file(image, size + 1, '0' * 64)[0]] == [SIZE_MISMATCH, HASH_MISMATCH]
+    empty = tmp_path / 'empty.png'
+    empty.write_bytes(b'')
+    assert check_file(str(empty))[0][0][0] == PARTIAL
+    text = tmp_path / 'text.png'
+    text.write_bytes(b'not an image')
+    assert check_file(str(text), image=True)[0][0][0] == UNREADABLE
+
+
+def test_truncated_pixels_need_decode_to_show(tmp_path, image):
+    data = open(image, 'rb').read()
+    truncated = tmp_path / 'truncated.png'
+    truncated.write_bytes(data[:len(data) // 2])
+    assert check_file(str(truncated), image=True)[0] == []
+    assert check_file(str(truncated), image=True, decode=True)[0][0][0] == UNREADABLE
+
+
+def test_sound_storage_has_no_issues(app, processed):
+    state, issues = verify(app, verify_hash=True, decode=True)
+    assert issues == [] and state['repair'] == [] and state['phase'] == 'done'
+
+
+def test_damaged_results_are_repair_candidates(app, processed):
+    with app.app_context():
+        assessment = db.session.get(Assessment, processed)
+        change, post_vis = static_path(app, assessment.change_vis_path), static_path(app, assessment.post_vis_path)
+    with open(change, 'r+b') as f:
+        f.truncate(100)
+    os.remove(post_vis)
+    state, issues = verify(app)
+    kinds = {(issue['kind'], issue['path']) for issue in issues}
+    assert (SIZE_MISMATCH, change) in kinds and (MISSING, post_vis) in kinds
+    assert state['repair'] == [processed]
+
+
+def test_results_older_than_the_images_are_stale(app, processed):
+    with app.app_context():
+        pre = static_path(app, db.session.get(Assessment, processed).pre_image)
+    later = time.time() + 60
+    os.utime(pre, (later, later))
+    state, issues = verify(app)
+    assert sum(issue['kind'] == STALE for issue in issues) == 3
+    assert state['repair'] == [processed]
+
+
+def test_missing_uploads_are_not_repairable(app, processed):
+    with app.app_context():
+        pre = static_path(app, db.session.get(Assessment, processed).pre_image)
+    os.remove(pre)
+    state, issues = verify(app)
+    assert any(issue['kind'] == MISSING and issue['path'] == pre for issue in issues)
+    assert state['repair'] == []
+
+
+def test_passes_resume_from_the_checkpoint(app, client, tmp_path):
+    ids = []
+    for name in ('First', 'Second'):
+        ids.append(create_assessment(client, name))
+        upload_pair(client, ids[-1])
+    with app.app_context():
+        for assessment_id in ids:
+            os.remove(static_path(app, db.session.get(Assessment, assessment_id).post_image))
+    path = str(tmp_path / 'verify.json')
+    checkpoint = Checkpoint(path)
+    checkpoint.state.update(phase='assessments', last_id=ids[0])
+    _, issues = verify(app, checkpoint)
+    assert {issue['assessment_id'] for issue in issues} == {ids[1]}
+    assert Checkpoint.load(path).state['phase'] == 'done'
+    assert verify(app, Checkpoint.load(path))[1] == []
+
+
+def test_old_temporary_files_are_reported(app, processed):
+    folder = app.config['INTERMEDIATES_FOLDER']
+    old, fresh = os.path.join(folder, 'old.tmp'), os.path.join(folder, 'fresh.tmp')
+    for path in (old, fresh):
+        open(path, 'wb').close()
+    past = time.time() - TEMPORARY_GRACE_SECONDS - 10
+    os.utime(old, (past, past))
+    _, issues = verify(app)
+    assert [(issue['kind'], issue['path']) for issue in issues] == [(PARTIAL, old)]
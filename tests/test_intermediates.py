@@ -0,0 +1,80 @@
+import os
+
+import cv2
+import numpy as np
+
+from app.utils.image_processing import process_images
+from app.utils.intermediates import IntermediateStore, file_fingerprint
+from app.utils.label_maps import read_label_map
+from app.utils.pipeline_config import DEFAULT_CONFIG
+
+
+def results(data, base_dir):
+    """The outputs of a process_images run that must not depend on the cache."""
+    maps = [read_label_map(os.path.join(base_dir, data[key]))
+            for key in ('pre_vis_path', 'post_vis_path', 'change_vis_path')]
+    scalars = {key: data[key] for key in ('forest_area_before', 'forest_area_after', 'damage_percentage',
+                                           'damage_patches', 'class_statistics')}
+    return scalars, maps
+
+
+def assert_same(a, b):
+    assert a[0] == b[0]
+    for x, y in zip(a[1], b[1]):
+        assert np.array_equal(x, y)
+
+
+def test_store_round_trip_and_latest_key_only(tmp_path):
+    store = IntermediateStore(str(tmp_path / 'cache'), [{'input': 1}])
+    store.save('segmentation', 'a', pre=np.arange(6).reshape(2, 3))
+    store.save('segmentation', 'b', pre=np.ones((2, 3)))
+    assert store.load('segmentation', 'a') is None
+    assert np.array_equal(store.load('segmentation', 'b')['pre'], np.ones((2, 3)))
+    assert not [name for name in os.listdir(store.root) if name.endswith('.tmp')]
+
+
+def test_store_is_cleared_when_inputs_change(tmp_path):
+    root = str(tmp_path / 'cache')
+    IntermediateStore(root, [{'input': 1}]).save('hsv_diff', 'k', h=np.zeros(3))
+    assert IntermediateStore(root, [{'input': 1}]).load('hsv_diff', 'k') is not None
+    assert IntermediateStore(root, [{'input': 2}]).load('hsv_diff', 'k') is None
+
+
+def test_unreadable_product_is_a_miss(tmp_path):
+    store = IntermediateStore(str(tmp_path / 'cache'), [])
+    with open(os.path.join(store.root, 'validity_k.npz'), 'wb') as f:
+        f.write(b'not an npz')
+    assert store.load('validity', 'k') is None
+
+
+def test_change_parameters_reuse_segmentation_and_planes(image_pair, tmp_path):
+    cache = str(tmp_path / 'cache')
+    base_dir = str(tmp_path)
+    first = process_images(*image_pair, cache_dir=cache)
+    assert first['stages_recomputed'] == ['segmentation', 'hsv_diff', 'change', 'patches']
+
+    config = DEFAULT_CONFIG.replace(hue_threshold=6, min_patch_area=10)
+    warm = process_images(*image_pair, config=config, cache_dir=cache)
+    assert warm['stages_recomputed'] == ['change', 'patches']
+    cold = process_images(*image_pair, config=config)
+    assert_same(results(warm, base_dir), results(cold, base_dir))
+
+
+def test_segmentation_parameters_keep_difference_planes(image_pair, tmp_path):
+    cache = str(tmp_path / 'cache')
+    process_images(*image_pair, cache_dir=cache)
+    data = process_images(*image_pair, config=DEFAULT_CONFIG.replace(exg_percentile=40), cache_dir=cache)
+    assert data['stages_recomputed'] == ['segmentation', 'change', 'patches']
+
+
+def test_changed_upload_invalidates_every_product(image_pair, tmp_path):
+    cache = str(tmp_path / 'cache')
+    process_images(*image_pair, cache_dir=cache)
+    pre_path, post_path = image_pair
+    before = file_fingerprint(post_path)
+    cv2.imwrite(post_path, cv2.flip(cv2.imread(post_path), 1))
+    os.utime(post_path, ns=(before['mtime_ns'] + 10 ** 9, before['mtime_ns'] + 10 ** 9))
+    data = process_images(pre_path, post_path, cache_dir=cache)
+    assert data['stages_recomputed'] == ['segmentation', 'hsv_diff', 'change', 'patches']
+    cold = process_images(pre_path, post_path)
+    assert_same(results(data, str(tmp_path)), results(cold, str(tmp_path)))
@@ -0,0 +1,93 @@
+import os
+import struct
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from app.utils.image_processing import CHANGE_PALETTE, CLASS_PALETTE
+from app.utils.label_maps import (
+    decode_indexed_png, encode_indexed_png, read_label_map, save_label_map, save_label_map_async,
+)
+
+
+def palette_of(size):
+    return [(i, (i * 37) % 256, 255 - i) for i in range(size)]
+
+
+@pytest.mark.parametrize('size, depth', [(2, 1), (4, 2), (6, 4), (16, 4), (17, 8), (256, 8)])
+@pytest.mark.parametrize('width', [1, 7, 64, 333])
+def test_png_round_trip_at_the_smallest_bit_depth(rng, size, depth, width):
+    indices = rng.integers(0, size, (45, width)).astype(np.uint8)
+    data = encode_indexed_png(indices, palette_of(size), compression=1)
+    assert struct.unpack('>B', data[24:25])[0] == depth
+    decoded, palette = decode_indexed_png(data)
+    assert np.array_equal(decoded, indices)
+    assert palette == palette_of(size)
+
+    # Any PNG decoder shows the palette colors
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    assert np.array_equal(image, np.array(palette_of(size), dtype=np.uint8)[:, ::-1][indices])
+
+
+def test_tall_maps_span_several_compression_blocks(rng):
+    indices = rng.integers(0, 6, (1300, 9)).astype(np.uint8)
+    assert np.array_equal(decode_indexed_png(encode_indexed_png(indices, CLASS_PALETTE))[0], indices)
+
+
+def test_foreign_pngs_fall_back_to_the_full_decoder(rng, tmp_path):
+    indices = rng.integers(0, len(CLASS_PALETTE), (20, 30)).astype(np.uint8)
+    path = str(tmp_path / 'rgb.png')
+    cv2.imwrite(path, np.array(CLASS_PALETTE, dtype=np.uint8)[:, ::-1][indices])
+    assert decode_indexed_png(open(path, 'rb').read()) is None
+    assert np.array_equal(read_label_map(path, CLASS_PALETTE), indices)
+    with pytest.raises(ValueError):
+        read_label_map(path)
+
+
+@pytest.mark.parametrize('fmt', ['png', 'webp'])
+@pytest.mark.parametrize('palette', [CLASS_PALETTE, CHANGE_PALETTE])
+def test_saved_label_maps_read_back_losslessly(rng, tmp_path, fmt, palette):
+    indices = rng.integers(0, len(palette), (64, 48)).astype(np.uint8)
+    path = str(tmp_path / 'maps' / f'labels.{fmt}')
+    assert save_label_map_async(indices, path, palette, fmt).result() == path
+    assert np.array_equal(read_label_map(path, palette), indices)
+
+
+def test_concurrent_writers_of_one_map(rng, tmp_path):
+    indices = rng.integers(0, len(CLASS_PALETTE), (600, 800)).astype(np.uint8)
+    path = str(tmp_path / 'labels.png')
+    start = threading.Barrier(4)
+    errors = []
+
+    def write():
+        try:
+            for _ in range(5):
+                start.wait(5)
+                save_label_map(indices, path, CLASS_PALETTE)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == [] and os.listdir(tmp_path) == ['labels.png']
+    assert np.array_equal(read_label_map(path), indices)
+
+
+def test_change_maps_are_smaller_than_jpeg(tmp_path):
+    indices = np.zeros((400, 400), dtype=np.uint8)
+    indices[100:300, 50:250] = 1
+    indices[150:200, 100:150] = 2
+    path = str(tmp_path / 'change.png')
+    save_label_map(indices, path, CHANGE_PALETTE)
+    jpeg = cv2.imencode('.jpg', np.array(CHANGE_PALETTE, dtype=np.uint8)[:, ::-1][indices])[1]
+    assert len(open(path, 'rb').read()) < len(jpeg)
+
+
+def test_unknown_format_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        save_label_map(np.zeros((2, 2), np.uint8), str(tmp_path / 'x.jpg'), CLASS_PALETTE, fmt='jpeg')
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from app.utils.image_processing import CLASS_UNLABELED, CLASS_VEGETATION, _segment, calculate_damage, perform_segmentation
+from app.utils.masking import invalid_mask_small, pair_validity, valid_tiles, validity_mask
+from app.utils.pipeline_config import DEFAULT_CONFIG
+from conftest import synthetic_pair
+
+CONFIG = DEFAULT_CONFIG.replace(mask_invalid=1)
+
+
+def test_clouds_shadows_and_clipped_pixels_are_invalid():
+    image, _ = synthetic_pair()
+    image[:80, :80] = 220     # cloud: bright, unsaturated
+    image[160:, 200:] = 10    # shadow
+    image[:80, 240:, 2] = 255  # clipped red channel
+    valid = validity_mask(image, CONFIG)
+    assert valid.shape == image.shape[:2] and valid.dtype == bool
+    assert not valid[:72, :72].any()
+    assert not valid[168:, 208:].any()
+    assert not valid[:72, 248:].any()
+    assert valid[100:140, 100:180].all()
+
+
+def test_isolated_specks_are_opened_away():
+    image, _ = synthetic_pair()
+    image[100:104, 100:104] = 255  # smaller than one downsampled cell
+    assert not invalid_mask_small(image, CONFIG).any()
+    assert validity_mask(image, CONFIG).all()
+
+
+def test_pair_validity_needs_both_captures():
+    pre, post = synthetic_pair()
+    pre[:80, :80] = 220
+    post[160:, 200:] = 10
+    valid = pair_validity(pre, post, CONFIG)
+    assert np.array_equal(valid, validity_mask(pre, CONFIG) & validity_mask(post, CONFIG))
+    assert not valid[:72, :72].any() and not valid[168:, 208:].any()
+
+
+def test_valid_tiles_skip_fully_invalid_tiles():
+    valid = np.zeros((300, 500), dtype=bool)
+    valid[10, 10] = True
+    valid[299, 499] = True
+    assert valid_tiles(valid, tile_size=128) == [(0, 128, 0, 128), (256, 300, 384, 500)]
+
+
+def test_tiled_segmentation_equals_segmenting_in_place():
+    pre, _ = synthetic_pair(height=1100, width=2100, seed=1)
+    valid = np.ones(pre.shape[:2], dtype=bool)
+    valid[:, 1024:] = False  # Two of the three tile columns are skipped
+    valid[500:520, 300:700] = False
+    tiled = perform_segmentation(pre, CONFIG, valid)
+    in_place = _segment(pre, CONFIG, valid)
+    in_place[~valid] = CLASS_UNLABELED
+    assert np.array_equal(tiled, in_place)
+    assert (tiled[:, 1024:] == CLASS_UNLABELED).all()
+
+
+def test_damage_is_relative_to_valid_pixels():
+    pre, post = synthetic_pair()
+    seg_pre = perform_segmentation(pre)
+    seg_post = perform_segmentation(post)
+    valid = np.zeros(pre.shape[:2], dtype=bool)
+    valid[:, :120] = True  # left of the damaged block
+    before, _, damage = calculate_damage(seg_pre, seg_post, valid)
+    assert damage == 0.0
+    assert before == pytest.approx(100 * np.count_nonzero((seg_pre == CLASS_VEGETATION) & valid) / np.count_nonzero(valid))
@@ -0,0 +1,79 @@
+import os
+import re
+
+import pytest
+
+from app.utils.media import content_digest, normalize_media_path
+
+
+@pytest.fixture
+def upload(app):
+    """Name of a file in the upload folder."""
+    name = 'media_test.jpg'
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], name), 'wb') as f:
+        f.write(bytes(range(256)) * 8)
+    return name
+
+
+def media_url(app, stored_path):
+    with app.test_request_context():
+        return app.jinja_env.globals['media_url'](stored_path)
+
+
+@pytest.mark.parametrize('stored', ['uploads/x.png', 'static/uploads/x.png', 'app/static/uploads/x.png',
+                                    'static\\uploads\\x.png', 'x.png', '/uploads/x.png'])
+def test_every_stored_path_form_normalizes_alike(stored):
+    assert normalize_media_path(stored) == 'uploads/x.png'
+
+
+def test_digest_follows_the_content(tmp_path):
+    path = tmp_path / 'a.bin'
+    path.write_bytes(b'one')
+    first = content_digest(str(path))
+    path.write_bytes(b'two!')
+    assert content_digest(str(path)) != first
+
+
+def test_media_responses_are_immutable_with_strong_etag(app, client, upload):
+    url = media_url(app, f'uploads/{upload}')
+    digest = url.split('/')[2]
+    response = client.get(url)
+    assert response.status_code == 200 and len(response.data) == 2048
+    assert response.headers['ETag'] == f'"{digest}"'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'max-age=31536000' in response.headers['Cache-Control']
+
+    assert client.get(url, headers={'If-None-Match': f'"{digest}"'}).status_code == 304
+
+    partial = client.get(url, headers={'Range': 'bytes=10-19'})
+    assert partial.status_code == 206 and partial.data == bytes(range(10, 20))
+
+
+def test_stale_digest_redirects_to_the_current_version(app, client, upload):
+    url = media_url(app, f'uploads/{upload}')
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], upload), 'ab') as f:
+        f.write(b'more')
+    response = client.get(url)
+    assert response.status_code == 302
+    assert response.headers['Location'] == media_url(app, f'uploads/{upload}') != url
+    assert client.get(response.headers['Location']).status_code == 200
+
+
+def test_missing_media_is_not_found(client):
+    assert client.get('/media/0123456789abcdef0123/uploads/missing.png').status_code == 404
+    assert client.get('/media/0123456789abcdef0123/../app.db').status_code == 404
+
+
+def test_legacy_upload_urls_redirect_to_media(app, client, upload):
+    response = client.get(f'/uploads/{upload}')
+    assert response.status_code == 302
+    assert response.headers['Location'] == media_url(app, f'uploads/{upload}')
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert client.get('/uploads/missing.png').status_code == 404
+
+
+def test_result_page_links_media_urls(app, client, processed):
+    page = client.get(f'/assessment/{processed}/view').get_data(as_text=True)
+    images = re.findall(r'(?:src|href)="([^"]*uploads/[^"]*)"', page)
+    assert len(images) >= 5
+    assert all(url.startswith('/media/') for url in images)
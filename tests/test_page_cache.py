@@ -0,0 +1,85 @@
+import os
+
+from app.utils.page_cache import assessment_scope, page_cache, user_scope
+from conftest import create_assessment, login, wait_for_jobs
+
+
+def counts(template):
+    stats = page_cache.metrics()['templates'].get(template, {})
+    return {key: stats.get(key, 0) for key in ('hits', 'disk_hits', 'misses', 'not_modified')}
+
+
+def scopes():
+    return {scope for scope, _ in page_cache._entries}
+
+
+def settled(client):
+    """The client, with the flash messages of registering and logging in shown."""
+    client.get('/')
+    return client
+
+
+def test_pages_are_rendered_once_per_version(app, client, processed):
+    before = counts('assessment_view.html')
+    first = settled(client).get(f'/assessment/{processed}/view')
+    second = client.get(f'/assessment/{processed}/view')
+    assert first.status_code == second.status_code == 200
+    assert first.data == second.data
+    after = counts('assessment_view.html')
+    assert after['misses'] - before['misses'] == 1 and after['hits'] - before['hits'] == 1
+    assert first.headers['ETag'] and 'no-cache' in first.headers['Cache-Control']
+
+
+def test_unchanged_pages_are_not_modified(app, client, processed):
+    etag = settled(client).get(f'/assessment/{processed}/view').headers['ETag']
+    before = counts('assessment_view.html')
+    response = client.get(f'/assessment/{processed}/view', headers={'If-None-Match': etag})
+    assert response.status_code == 304 and response.data == b''
+    assert counts('assessment_view.html')['not_modified'] == before['not_modified'] + 1
+    # The layout shows the user, so another user never shares the tag
+    other = login(app, 'other@example.com')
+    create_assessment(other)
+    own = settled(other).get('/assessments').headers['ETag']
+    assert own != client.get('/assessments').headers['ETag']
+
+
+def test_pages_with_flash_messages_are_not_cached_by_the_browser(app, client):
+    create_assessment(client)  # Flashes "Assessment created"
+    response = client.get('/assessments')
+    assert 'ETag' not in response.headers and 'no-store' in response.headers['Cache-Control']
+    assert 'ETag' in client.get('/assessments').headers
+
+
+def test_new_data_gets_a_new_key(app, client):
+    client.get('/assessments')
+    etag = client.get('/assessments').headers['ETag']
+    create_assessment(client, 'Another')
+    client.get('/assessments')
+    page = client.get('/assessments')
+    assert page.headers['ETag'] != etag and 'Another' in page.get_data(as_text=True)
+
+
+def test_reprocessing_and_deleting_invalidate_entries(app, client, processed):
+    client.get(f'/assessment/{processed}/view')
+    client.get('/assessments')
+    assert {assessment_scope(processed), user_scope(1)} <= scopes()
+    client.post(f'/assessment/{processed}/process')
+    wait_for_jobs(app)
+    assert assessment_scope(processed) not in scopes() and user_scope(1) not in scopes()
+    client.get(f'/assessment/{processed}/view')
+    client.post(f'/assessment/{processed}/delete')
+    assert assessment_scope(processed) not in scopes()
+
+
+def test_disk_tier_is_shared_between_processes(app, client, processed, monkeypatch):
+    folder = os.path.join(app.instance_path, 'pages')
+    monkeypatch.setattr(page_cache, 'folder', folder)
+    first = settled(client).get(f'/assessment/{processed}/view')
+    assert os.listdir(os.path.join(folder, assessment_scope(processed)))
+    page_cache._entries.clear()  # As in another worker process
+    before = counts('assessment_view.html')
+    second = client.get(f'/assessment/{processed}/view')
+    assert counts('assessment_view.html')['disk_hits'] == before['disk_hits'] + 1
+    assert second.data == first.data
+    page_cache.invalidate_assessment(processed, 1)
+    assert not os.path.exists(os.path.join(folder, assessment_scope(processed)))
@@ -0,0 +1,70 @@
+import cv2
+import numpy as np
+
+from app.utils.image_processing import analyze_pair
+from app.utils.pipeline_config import DEFAULT_CONFIG
+from app.utils.radiometry import apply_luts, channel_histograms, matching_lut, matching_luts
+from conftest import synthetic_pair
+
+NORMALIZED = DEFAULT_CONFIG.replace(radiometric_normalization=1)
+
+
+def exposed(image, gain=0.75, offset=30):
+    """The same scene under a different exposure."""
+    return cv2.convertScaleAbs(image, alpha=gain, beta=offset)
+
+
+def test_subsampled_histograms_count_the_strided_pixels(rng):
+    image = rng.integers(0, 256, (50, 70, 3), dtype=np.uint8)
+    hist = channel_histograms(image, subsample=4)
+    assert hist.shape == (3, 256)
+    for channel in range(3):
+        assert np.array_equal(hist[channel], np.bincount(image[::4, ::4, channel].ravel(), minlength=256))
+    mask = np.zeros(image.shape[:2], dtype=bool)
+    assert not channel_histograms(image, 4, mask).any()
+
+
+def test_lut_maps_onto_the_reference_distribution(rng):
+    reference = rng.integers(0, 256, 10000)
+    source = reference // 2 + 40
+    lut = matching_lut(np.bincount(source, minlength=256), np.bincount(reference, minlength=256))
+    assert abs(np.percentile(lut[source], 50) - np.percentile(reference, 50)) <= 2
+    assert np.all(np.diff(lut.astype(int)) >= 0)
+    empty = np.zeros(256, dtype=np.int64)
+    assert np.array_equal(matching_lut(empty, np.bincount(reference)), np.arange(256))
+
+
+def test_luts_are_applied_per_channel_in_one_pass(rng):
+    image = rng.integers(0, 256, (30, 40, 3), dtype=np.uint8)
+    luts = rng.integers(0, 256, (3, 256), dtype=np.uint8)
+    expected = np.stack([luts[c][image[:, :, c]] for c in range(3)], axis=2)
+    assert np.array_equal(apply_luts(image, luts), expected)
+
+
+def test_matching_undoes_an_exposure_change():
+    pre, _ = synthetic_pair()
+    post = exposed(pre)
+    matched = apply_luts(post, matching_luts(pre, post, subsample=2))
+    assert np.abs(matched.astype(int) - pre).mean() < np.abs(post.astype(int) - pre).mean() / 4
+    assert np.array_equal(apply_luts(pre, matching_luts(pre, pre, subsample=1)), pre)
+
+
+def test_normalization_removes_false_damage():
+    pre, _ = synthetic_pair()
+    post = exposed(pre)
+    raw = analyze_pair((pre, post), DEFAULT_CONFIG)
+    normalized = analyze_pair((pre, post), NORMALIZED)
+    assert normalized['damage_percentage'] < raw['damage_percentage']
+    assert normalized['damage_percentage'] < 5
+
+
+def test_cached_luts_are_not_recomputed():
+    pre, post = synthetic_pair()
+    computed = {}
+    first = analyze_pair((pre, post), NORMALIZED, on_computed=computed.__setitem__)
+    assert computed['luts'].shape == (3, 256)
+    recomputed = []
+    second = analyze_pair((pre, post), NORMALIZED, products={'luts': computed['luts']},
+                          on_computed=lambda name, value: recomputed.append(name))
+    assert 'luts' not in recomputed
+    assert second['damage_percentage'] == first['damage_percentage']
@@ -0,0 +1,84 @@
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+from app.utils.image_processing import analyze_pair, process_images
+from app.utils.regions import mask_bounds, parse_regions, rasterize_regions, regions_key, scale_regions
+from conftest import synthetic_pair
+
+SQUARE = [[40, 30], [200, 30], [200, 150], [40, 150]]
+
+
+def test_parse_rings_and_geojson():
+    assert parse_regions({'roi': [SQUARE]}) == {'roi': [SQUARE], 'exclude': []}
+    polygon = {'type': 'Polygon', 'coordinates': [SQUARE + [SQUARE[0]], [[0, 0], [1, 0], [1, 1]]]}
+    feature = {'type': 'Feature', 'geometry': {'type': 'MultiPolygon', 'coordinates': [[SQUARE]]}}
+    collection = {'type': 'FeatureCollection', 'features': [feature]}
+    assert parse_regions({'roi': polygon})['roi'] == [SQUARE + [SQUARE[0]]]
+    assert parse_regions({'exclude': collection})['exclude'] == [SQUARE]
+    assert parse_regions('{"roi": [[[0.123, 1], [5, 1], [5, 5]]]}')['roi'] == [[[0.12, 1], [5, 1], [5, 5]]]
+
+
+@pytest.mark.parametrize('data', ['', None, {}, {'roi': [], 'exclude': []}])
+def test_empty_regions_are_none(data):
+    assert parse_regions(data) is None
+
+
+@pytest.mark.parametrize('data', [
+    '{roi', {'mask': [SQUARE]}, {'roi': [[[0, 0], [1, 1]]]}, {'roi': [[['a', 0], [1, 1], [2, 2]]]},
+    {'roi': {'type': 'Point', 'coordinates': [0, 0]}}, {'roi': 'square'},
+])
+def test_malformed_regions_are_rejected(data):
+    with pytest.raises(ValueError):
+        parse_regions(data)
+
+
+def test_rasterize_roi_minus_exclusions():
+    hole = [[100, 60], [140, 60], [140, 100], [100, 100]]
+    mask = rasterize_regions({'roi': [SQUARE], 'exclude': [hole]}, 240, 320)
+    expected = np.zeros((240, 320), dtype=np.uint8)
+    cv2.fillPoly(expected, [np.array(SQUARE)], 1)
+    cv2.fillPoly(expected, [np.array(hole)], 0)
+    assert mask.dtype == bool and np.array_equal(mask, expected.astype(bool))
+    assert mask_bounds(mask) == (30, 151, 40, 201)
+    assert rasterize_regions({'exclude': [hole]}, 240, 320).sum() == 240 * 320 - 41 * 41
+    assert mask_bounds(np.zeros((4, 4), dtype=bool)) is None
+
+
+def test_overlapping_and_nested_polygons_are_united():
+    def box(x0, y0, x1, y1):
+        return [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]
+
+    def filled(*rings):
+        expected = np.zeros((240, 320), dtype=bool)
+        for x0, y0, x1, y1 in rings:
+            expected[y0:y1 + 1, x0:x1 + 1] = True
+        return expected
+
+    regions = {'roi': [box(10, 10, 100, 100), box(60, 60, 160, 160), box(20, 20, 40, 40)],
+               'exclude': [box(200, 0, 260, 239), box(230, 0, 300, 239)]}
+    mask = rasterize_regions(regions, 240, 320)
+    # Overlapping and nested ROI polygons stay inside the mask
+    assert np.array_equal(mask, filled((10, 10, 100, 100), (60, 60, 160, 160)))
+    everything_but = rasterize_regions({'exclude': regions['exclude']}, 240, 320)
+    # Overlapping exclusions stay out of it
+    assert np.array_equal(everything_but, ~filled((200, 0, 300, 239)))
+
+
+def test_scaled_regions_and_stable_keys():
+    regions = parse_regions({'roi': [SQUARE]})
+    assert scale_regions(regions, 0.5)['roi'][0][1] == [100, 15]
+    assert regions_key(regions) == regions_key(parse_regions(json.dumps(regions)))
+    assert regions_key(regions) != regions_key(scale_regions(regions, 2))
+
+
+def test_cropped_run_scores_the_region(image_pair):
+    regions = parse_regions({'roi': [[[100, 20], [300, 20], [300, 180], [100, 180]]],
+                             'exclude': [[[250, 100], [300, 100], [300, 180], [250, 180]]]})
+    data = process_images(*image_pair, regions=regions)
+    pre, post = synthetic_pair()
+    expected = analyze_pair((pre, post), region=rasterize_regions(regions, *pre.shape[:2]))
+    assert data['damage_percentage'] == round(expected['damage_percentage'], 2)
+    assert data['damage_percentage'] > process_images(*image_pair)['damage_percentage']
@@ -0,0 +1,103 @@
+import importlib.util
+import io
+import os
+import zipfile
+
+import cv2
+import numpy as np
+import pytest
+
+from app import db
+from app.models import Artifact, Assessment
+from app.utils.artifacts import artifact_path
+from app.utils.image_processing import CLASS_PALETTE
+from app.utils.label_maps import save_label_map
+from app.utils.reports import (
+    build_archive, collect_report_data, ensure_thumbnail, report_jobs, thumbnail_path,
+)
+
+HAS_DOCX = importlib.util.find_spec('docx') is not None
+
+
+@pytest.fixture
+def label_map(tmp_path, rng):
+    path = str(tmp_path / 'labels.png')
+    labels = rng.integers(0, len(CLASS_PALETTE), (300, 1200)).astype(np.uint8)
+    save_label_map(labels, path, CLASS_PALETTE)
+    return path
+
+
+def item(assessment_id, typhoon):
+    return {'id': assessment_id, 'typhoon_name': typhoon}
+
+
+def test_thumbnail_key_follows_the_map(tmp_path, label_map):
+    path = thumbnail_path(str(tmp_path / 'thumbs'), label_map)
+    assert thumbnail_path(str(tmp_path / 'thumbs'), label_map) == path
+    assert thumbnail_path(str(tmp_path / 'thumbs'), label_map, max_edge=300) != path
+    os.utime(label_map, ns=(0, 0))
+    assert thumbnail_path(str(tmp_path / 'thumbs'), label_map) != path
+
+
+def test_thumbnails_are_downscaled_once(tmp_path, label_map):
+    path = thumbnail_path(str(tmp_path / 'thumbs'), label_map)
+    assert ensure_thumbnail(label_map, CLASS_PALETTE, path) == path
+    thumbnail = cv2.imread(path)
+    assert thumbnail.shape == (150, 600, 3)
+    mtime = os.stat(path).st_mtime_ns
+    ensure_thumbnail(label_map, CLASS_PALETTE, path)
+    assert os.stat(path).st_mtime_ns == mtime
+    assert [name for name in os.listdir(tmp_path / 'thumbs') if name.endswith('.tmp')] == []
+
+
+def test_jobs_per_assessment_and_per_typhoon():
+    items = [item(1, 'Haiyan'), item(2, None), item(3, 'Haiyan')]
+    jobs = report_jobs(items, 'pdf')
+    assert [job[1] for job in jobs] == ['assessment_1', 'assessment_2', 'assessment_3',
+                                        'typhoon_haiyan', 'typhoon_unnamed']
+    assert all(job[-1] == 'pdf' for job in jobs)
+    assert [data['id'] for data in jobs[3][2]] == [1, 3]
+    assert len(report_jobs(items, per_typhoon=False)) == 3
+    with pytest.raises(ValueError):
+        report_jobs(items, 'odt')
+
+
+def test_failed_documents_become_error_entries():
+    jobs = [('assessment', 'broken', None, 'docx'), ('typhoon', 'typhoon_empty', [], 'docx')]
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(build_archive(jobs, workers=1))))
+    names = archive.namelist()
+    assert names[0] == 'broken.error.txt'
+    assert b'broken.docx could not be rendered' in archive.read(names[0])
+    assert names[1] == ('typhoon_empty.docx' if HAS_DOCX else 'typhoon_empty.error.txt')
+
+
+def test_report_data_registers_thumbnails(app, client, processed):
+    with app.app_context():
+        assessment = db.session.get(Assessment, processed)
+        [data] = collect_report_data([assessment], app.static_folder, os.path.join(app.instance_path, 'thumbnails'))
+        assert len(data['figures']) == 3
+        assert data['damage_percentage'] == assessment.damage_percentage
+        thumbnails = {os.path.abspath(figure[3]) for figure in data['figures']}
+        registered = {os.path.abspath(artifact_path(row))
+                      for row in Artifact.query.filter_by(kind='thumbnail', assessment_id=processed)}
+        assert thumbnails == registered
+
+
+def test_report_download(app, client, processed):
+    response = client.get(f'/assessment/{processed}/report.docx')
+    if HAS_DOCX:
+        assert response.status_code == 200 and response.data[:2] == b'PK'
+    else:
+        assert response.status_code == 302
+        assert response.headers['Location'].endswith(f'/assessment/{processed}/view')
+    assert client.get(f'/assessment/{processed}/report.odt').status_code == 404
+
+
+def test_archive_download_streams_every_document(app, client, processed):
+    app.config['REPORT_PROCESSES'] = 1
+    response = client.get('/reports.zip')
+    assert response.mimetype == 'application/zip'
+    names = zipfile.ZipFile(io.BytesIO(response.data)).namelist()
+    suffix = '.docx' if HAS_DOCX else '.error.txt'
+    assert names == [f'assessment_{processed}{suffix}', f'typhoon_unnamed{suffix}']
+    assert client.get('/reports.zip?format=odt').status_code == 400
@@ -0,0 +1,142 @@
+import threading
+
+import cv2
+import numpy as np
+
+from app.utils.scheduler import (
+    BYTES_PER_PIXEL, DEFAULT_PIXELS, PAUSED, QUEUED, RUNNING, FairScheduler, Ticket, checkpoint, estimate_pixels,
+)
+from conftest import create_assessment, upload_pair, wait_for_jobs
+
+
+def recorder(order):
+    return lambda ticket: order.append(ticket.label)
+
+
+def drain(scheduler, order):
+    """Finish started tickets one by one until none is left."""
+    finished = set()
+    while len(finished) < len(order):
+        label = order[len(finished)]
+        ticket = next(t for t in scheduler._running if t.label == label)
+        finished.add(label)
+        scheduler.finish(ticket)
+
+
+def test_users_share_the_queue_fairly():
+    scheduler = FairScheduler(slots=1, memory_budget=10 ** 12)
+    order = []
+    scheduler.submit(Ticket(0, 'user', 1e6, 'blocker'), recorder(order))
+    for i in range(4):
+        scheduler.submit(Ticket(1, 'user', 1e6, f'a{i}'), recorder(order))
+    scheduler.submit(Ticket(2, 'user', 1e6, 'b0'), recorder(order))
+    assert scheduler.stats()['queued'] == 5
+    drain(scheduler, order)
+    # b0 does not wait behind all of a's backlog
+    assert order == ['blocker', 'a0', 'b0', 'a1', 'a2', 'a3']
+    assert scheduler.stats({2})['users'][2]['jobs_started'] == 1
+
+
+def test_role_weights_scale_the_share():
+    scheduler = FairScheduler(slots=1, memory_budget=10 ** 12)
+    order = []
+    scheduler.submit(Ticket(0, 'user', 1e6, 'blocker'), recorder(order))
+    for i in range(2):
+        scheduler.submit(Ticket(1, 'user', 1e6, f'u{i}'), recorder(order))
+    for i in range(4):
+        scheduler.submit(Ticket(2, 'field_officer', 1e6, f'f{i}'), recorder(order))
+    drain(scheduler, order)
+    assert order == ['blocker', 'f0', 'u0', 'f1', 'f2', 'u1', 'f3']
+
+
+def test_memory_budget_admits_tickets_that_fit():
+    scheduler = FairScheduler(slots=4, memory_budget=100 * BYTES_PER_PIXEL)
+    order = []
+    first = scheduler.submit(Ticket(1, 'user', 80, 'first'), recorder(order))
+    second = scheduler.submit(Ticket(2, 'user', 50, 'second'), recorder(order))
+    assert order == ['first'] and second.state == QUEUED
+    assert scheduler.stats()['memory_used'] == 80 * BYTES_PER_PIXEL
+    scheduler.finish(first)
+    assert order == ['first', 'second']
+    scheduler.finish(second)
+    # Larger than the whole budget: runs, alone
+    huge = scheduler.submit(Ticket(1, 'user', 500, 'huge'), recorder(order))
+    assert huge.state == RUNNING
+    assert scheduler.submit(Ticket(2, 'user', 1, 'small')).state == QUEUED
+    scheduler.finish(huge)
+    assert scheduler.stats()['slots_used'] == 1
+
+
+def test_cancelled_tickets_release_their_place():
+    scheduler = FairScheduler(slots=1, memory_budget=10 ** 12)
+    running = scheduler.submit(Ticket(1, 'user', 1e6, 'running'), lambda ticket: None)
+    queued = scheduler.submit(Ticket(1, 'user', 1e6, 'queued'))
+    scheduler.finish(queued)
+    scheduler.finish(running)
+    stats = scheduler.stats()
+    assert (stats['queued'], stats['slots_used'], stats['memory_used']) == (0, 0, 0)
+    assert stats['users'][1]['queued'] == 0
+
+
+def test_higher_priority_ticket_preempts_at_a_checkpoint():
+    scheduler = FairScheduler(slots=1, memory_budget=10 ** 12)
+    low = Ticket(1, 'user', 1e6, 'low')
+    release = threading.Event()
+
+    def job():
+        while not release.is_set():
+            checkpoint()
+            release.wait(0.01)
+        return 'done'
+
+    result = []
+    worker = threading.Thread(target=lambda: result.append(scheduler.run(low, job)))
+    worker.start()
+    assert scheduler.wait_started(low, 5)
+    started = threading.Event()
+    high = scheduler.submit(Ticket(2, 'admin', 1e6, 'high'), lambda ticket: started.set())
+    assert started.wait(5)
+    assert low.state == PAUSED and high.state == RUNNING
+    assert scheduler.stats()['paused'] == 1
+    release.set()
+    scheduler.finish(high)
+    worker.join(5)
+    assert result == ['done']
+    assert low.preemptions == 1 and low.paused_seconds > 0
+    assert scheduler.stats()['users'][1]['preemptions'] == 1
+    assert scheduler.stats()['slots_used'] == 0
+
+
+def test_ticket_costs_come_from_the_header(tmp_path):
+    path = str(tmp_path / 'pre.png')
+    cv2.imwrite(path, np.zeros((80, 100, 3), dtype=np.uint8))
+    assert estimate_pixels(path) == 8000
+    assert estimate_pixels(path, {'roi': [[[10, 10], [49.5, 10], [49.5, 30]]]}) == 40 * 21
+    assert estimate_pixels(path, {'roi': [[[-5, -5], [500, -5], [500, 500]]]}) == 8000
+    assert estimate_pixels(str(tmp_path / 'missing.tif')) == DEFAULT_PIXELS
+
+
+def test_web_processing_is_queued_behind_a_status_page(app, client):
+    assessment_id = create_assessment(client)
+    upload_pair(client, assessment_id)
+    response = client.get(f'/assessment/{assessment_id}/process')
+    assert response.headers['Location'].endswith(f'/assessment/{assessment_id}/status')
+    wait_for_jobs(app)
+    response = client.get(f'/assessment/{assessment_id}/status')
+    assert response.headers['Location'].endswith(f'/assessment/{assessment_id}/view')
+    stats = app.extensions['job_queue'].scheduler.stats()
+    assert any(user['jobs_started'] for user in stats['users'].values())
+
+
+def test_status_page_shows_pending_jobs(app, client):
+    from app import db
+    from app.models import Assessment
+    from app.utils.jobs import mark_queued
+
+    assessment_id = create_assessment(client)
+    with app.app_context():
+        mark_queued(db.session.get(Assessment, assessment_id), {})
+        db.session.commit()
+    page = client.get(f'/assessment/{assessment_id}/status')
+    assert page.status_code == 200
+    assert 'Processing' in page.get_data(as_text=True)
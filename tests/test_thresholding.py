@@ -0,0 +1,79 @@
+import math
+
+import cv2
+import numpy as np
+import pytest
+
+from app.utils.thresholding import (
+    bounded_threshold, histogram, otsu_from_histogram, percentile_from_histogram, plane_threshold,
+    threshold_from_histogram, tile_histograms,
+)
+
+
+@pytest.fixture
+def plane(rng):
+    return rng.integers(0, 256, (300, 410), dtype=np.uint8)
+
+
+@pytest.fixture
+def mask(rng):
+    return rng.random((300, 410)) < 0.6
+
+
+def test_tile_histograms_merge_to_the_masked_histogram(plane, mask):
+    tiles = tile_histograms(plane, mask, tile_size=128)
+    assert tiles.shape == (3, 4, 256)
+    assert np.array_equal(tiles.sum(axis=(0, 1)), np.bincount(plane[mask], minlength=256))
+    assert np.array_equal(histogram(plane, tile_size=128), np.bincount(plane.ravel(), minlength=256))
+
+
+@pytest.mark.parametrize('q', [0, 1, 25, 50, 73.5, 99, 100])
+def test_percentile_matches_numpy(plane, mask, q):
+    assert percentile_from_histogram(histogram(plane, mask), q) == pytest.approx(np.percentile(plane[mask], q))
+
+
+def test_percentile_of_few_samples(rng):
+    for size in (1, 2, 3, 7):
+        values = rng.integers(0, 256, size)
+        hist = np.bincount(values, minlength=256)
+        for q in (0, 10, 25, 50, 90, 100):
+            assert percentile_from_histogram(hist, q) == pytest.approx(np.percentile(values, q))
+
+
+def test_otsu_matches_opencv(rng):
+    plane = np.concatenate([rng.normal(60, 15, 5000), rng.normal(170, 20, 3000)])
+    plane = np.clip(plane, 0, 255).astype(np.uint8).reshape(80, 100)
+    t, _ = cv2.threshold(plane, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # cv2 keeps plane > t; ours is the first value of the upper class
+    assert otsu_from_histogram(histogram(plane)) == t + 1
+
+
+def test_empty_histograms_fall_back():
+    empty = np.zeros(256, dtype=np.int64)
+    assert math.isnan(percentile_from_histogram(empty, 25))
+    assert math.isnan(otsu_from_histogram(empty))
+    assert bounded_threshold(empty, fallback=7) == 7
+    with pytest.raises(ValueError):
+        threshold_from_histogram(empty, policy='mean')
+
+
+def test_floor_bounds_the_threshold(plane):
+    assert bounded_threshold(histogram(plane), q=1, floor=200) == 200
+
+
+def test_local_thresholds_follow_uneven_lighting(rng):
+    gradient = np.tile(np.linspace(40, 200, 512), (256, 1))
+    plane = np.clip(gradient + rng.normal(0, 5, gradient.shape), 0, 255).astype(np.uint8)
+    mask = np.ones(plane.shape, dtype=bool)
+    surface = plane_threshold(plane, mask, q=50, local_tile_size=64)
+    assert surface.shape == plane.shape and surface.dtype == np.float32
+    assert surface[:, -10:].mean() > surface[:, :10].mean() + 100
+    global_threshold = plane_threshold(plane, mask, q=50)
+    assert global_threshold == pytest.approx(np.percentile(plane, 50))
+
+
+def test_sparse_neighbourhoods_use_the_global_threshold(plane):
+    mask = np.zeros(plane.shape, dtype=bool)
+    mask[:4, :4] = True
+    surface = plane_threshold(plane, mask, local_tile_size=64)
+    assert np.allclose(surface, np.percentile(plane[mask], 25))
@@ -0,0 +1,56 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from app.utils.evaluation import NUM_CLASSES
+from app.utils.image_processing import CLASS_LAND, CLASS_VEGETATION, calculate_damage
+from app.utils.pipeline_config import DEFAULT_CONFIG
+from app.utils.time_series import (
+    capture_mask_path, ensure_capture_labels, forest_cover, transition_matrix, transition_statistics,
+)
+
+from conftest import synthetic_pair
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_transition_statistics_agree_with_calculate_damage(seed):
+    rng = np.random.default_rng(seed)
+    before = rng.integers(0, NUM_CLASSES, (40, 60)).astype(np.uint8)
+    after = np.where(rng.random((40, 60)) < 0.7, before, rng.integers(0, NUM_CLASSES, (40, 60))).astype(np.uint8)
+    statistics = transition_statistics(transition_matrix(before, after))
+    expected = [round(value, 2) for value in calculate_damage(before, after)]
+    assert [statistics['forest_area_before'], statistics['forest_area_after'],
+            statistics['damage_percentage']] == expected
+    assert statistics['forest_area_after'] == forest_cover(after)
+
+
+def test_recovery_is_the_share_of_non_vegetation_that_regrew():
+    before = np.array([[CLASS_VEGETATION, CLASS_LAND, CLASS_LAND, CLASS_LAND]], dtype=np.uint8)
+    after = np.array([[CLASS_LAND, CLASS_VEGETATION, CLASS_LAND, CLASS_LAND]], dtype=np.uint8)
+    statistics = transition_statistics(transition_matrix(before, after))
+    assert statistics['damage_percentage'] == 100.0
+    assert statistics['recovery_percentage'] == pytest.approx(100 / 3, abs=0.01)
+
+
+def test_empty_matrix_has_zero_statistics():
+    assert set(transition_statistics(np.zeros((NUM_CLASSES, NUM_CLASSES))).values()) == {0.0}
+
+
+def test_capture_cache_key_follows_segmentation_parameters_only(tmp_path):
+    path = capture_mask_path(str(tmp_path), 7)
+    assert capture_mask_path(str(tmp_path), 7, DEFAULT_CONFIG.replace(hue_threshold=3)) == path
+    assert capture_mask_path(str(tmp_path), 7, DEFAULT_CONFIG.replace(exg_percentile=40)) != path
+
+
+def test_captures_are_segmented_once_at_the_baseline_size(tmp_path):
+    image_path = str(tmp_path / 'capture.png')
+    cv2.imwrite(image_path, cv2.resize(synthetic_pair()[1], (640, 480)))
+    mask_path = capture_mask_path(str(tmp_path / 'cache'), 1)
+    labels = ensure_capture_labels(image_path, mask_path, target_shape=(240, 320))
+    assert labels.shape == (240, 320)
+    assert os.listdir(tmp_path / 'cache') == [os.path.basename(mask_path)]
+
+    os.remove(image_path)  # A cached capture is never decoded again
+    assert np.array_equal(ensure_capture_labels(image_path, mask_path, target_shape=(240, 320)), labels)
@@ -0,0 +1,112 @@
+import hashlib
+import os
+
+import numpy as np
+import pytest
+
+from app import db
+from app.models import Assessment
+from app.utils.media import copy_atomically, save_atomically
+from conftest import create_assessment, encoded, login, synthetic_pair, upload_pair
+
+
+def sha256(image):
+    return hashlib.sha256(encoded(image).getvalue()).hexdigest()
+
+
+def stored_path(app, assessment_id, role):
+    with app.app_context():
+        stored = getattr(db.session.get(Assessment, assessment_id), f'{role}_image')
+    return os.path.join(app.static_folder, *stored.split('/'))
+
+
+def test_atomic_saves_never_write_the_old_file_in_place(tmp_path):
+    path, other_name = str(tmp_path / 'a.bin'), str(tmp_path / 'b.bin')
+    save_atomically(path, lambda f: f.write(b'old'))
+    os.link(path, other_name)
+    save_atomically(path, lambda f: f.write(b'new'))
+    assert open(path, 'rb').read() == b'new' and open(other_name, 'rb').read() == b'old'
+
+    def fail(f):
+        f.write(b'partial')
+        raise OSError('disk full')
+
+    with pytest.raises(OSError):
+        save_atomically(path, fail)
+    assert open(path, 'rb').read() == b'new'
+    copy_atomically(other_name, path)
+    assert open(path, 'rb').read() == b'old'
+    assert sorted(os.listdir(tmp_path)) == ['a.bin', 'b.bin']
+
+
+def test_blob_lookup_is_per_user(app, client):
+    pre, post = synthetic_pair()
+    upload_pair(client, create_assessment(client))
+    found = client.get(f'/blobs/{sha256(pre).upper()}')
+    assert found.status_code == 200
+    assert found.get_json() == {'exists': True, 'bytes': len(encoded(pre).getvalue()), 'width': 320, 'height': 240}
+    assert client.get(f'/blobs/{"0" * 64}').status_code == 404
+    assert client.get('/blobs/abc').status_code == 404
+    assert login(app, 'other@example.com').get(f'/blobs/{sha256(pre)}').status_code == 404
+
+
+def test_known_blobs_are_copied_not_uploaded(app, client):
+    pre, post = synthetic_pair()
+    first = create_assessment(client, 'First')
+    upload_pair(client, first)
+    second = create_assessment(client, 'Second')
+    response = client.post(f'/assessment/{second}/upload', data={
+        'pre_sha256': sha256(pre), 'pre_name': 'pre.png', 'post_sha256': sha256(post), 'post_name': 'post.png',
+    })
+    assert response.headers['Location'].endswith(f'/assessment/{second}/process')
+    for role in ('pre', 'post'):
+        copy, source = stored_path(app, second, role), stored_path(app, first, role)
+        assert open(copy, 'rb').read() == open(source, 'rb').read()
+        assert os.stat(copy).st_nlink == 1 and not os.path.samefile(copy, source)
+
+
+def test_unknown_blobs_must_be_uploaded(app, client):
+    assessment_id = create_assessment(client)
+    response = client.post(f'/assessment/{assessment_id}/upload', data={
+        'pre_sha256': 'f' * 64, 'pre_name': 'pre.png', 'post_sha256': 'e' * 64, 'post_name': 'post.png',
+    }, follow_redirects=True)
+    assert 'no longer on the server' in response.get_data(as_text=True)
+    with app.app_context():
+        assert db.session.get(Assessment, assessment_id).pre_image is None
+
+
+def previews(pre, post, **form):
+    return dict(form, pre_preview=(encoded(pre), 'pre.png'), post_preview=(encoded(post), 'post.png'))
+
+
+def test_estimate_from_previews_is_scheduled(app, client):
+    assessment_id = create_assessment(client)
+    pre, post = synthetic_pair()
+    response = client.post(f'/assessment/{assessment_id}/estimate', data=previews(pre, post[::2, ::2], scale=0.5),
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    estimate = response.get_json()
+    assert (estimate['width'], estimate['height']) == (320, 240)
+    assert estimate['damage_percentage'] > 10
+    users = app.extensions['job_queue'].scheduler.stats()['users']
+    assert any(user['jobs_started'] for user in users.values())
+
+
+@pytest.mark.parametrize('pre_shape, message', [((1100, 40), 'larger than 1024'), (None, 'missing')])
+def test_estimate_rejects_large_or_missing_previews(app, client, pre_shape, message):
+    assessment_id = create_assessment(client)
+    _, post = synthetic_pair()
+    data = previews(np.zeros(pre_shape + (3,), np.uint8) if pre_shape else post, post)
+    if pre_shape is None:
+        del data['pre_preview']
+    response = client.post(f'/assessment/{assessment_id}/estimate', data=data, content_type='multipart/form-data')
+    assert response.status_code == 400 and message in response.get_json()['error']
+
+
+def test_estimates_are_for_the_owner(app, client):
+    assessment_id = create_assessment(client)
+    pre, post = synthetic_pair()
+    other = login(app, 'other@example.com')
+    response = other.post(f'/assessment/{assessment_id}/estimate', data=previews(pre, post),
+                          content_type='multipart/form-data')
+    assert response.status_code == 403
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from app.utils.buffer_pool import BufferPool
+from app.utils.vegetation_indices import INDEX_RANGES, INDICES, IndexEngine, index_planes
+
+
+def reference(image, name):
+    """Index values straight from the formulas in float64."""
+    b, g, r = (image[:, :, i].astype(np.float64) for i in range(3))
+
+    def ratio(n, d):
+        return np.divide(n, d, out=np.zeros_like(n), where=d != 0)
+
+    return {
+        'exg': lambda: 2 * g - r - b,
+        'exr': lambda: 1.4 * r - g,
+        'exg_exr': lambda: 3 * g - 2.4 * r - b,
+        'vari': lambda: np.clip(ratio(g - r, g + r - b), -1, 1),
+        'gli': lambda: ratio(2 * g - r - b, 2 * g + r + b),
+        'ngrdi': lambda: ratio(g - r, g + r),
+    }[name]()
+
+
+@pytest.fixture
+def image(rng):
+    image = rng.integers(0, 256, (40, 50, 3), dtype=np.uint8)
+    image[0, :3] = 0  # zero denominators
+    return image
+
+
+@pytest.mark.parametrize('name', INDICES)
+def test_raw_values_match_the_formulas(image, name):
+    engine = IndexEngine()
+    engine.load(image)
+    values = engine.raw(name)
+    assert values.dtype == np.float32
+    assert np.allclose(values, reference(image, name), atol=1e-3)
+    low, high = INDEX_RANGES[name]
+    assert low <= values.min() and values.max() <= high
+
+
+@pytest.mark.parametrize('name', INDICES)
+def test_minmax_quantization_spans_the_image_range(image, name):
+    plane = index_planes(image, (name,))[name]
+    expected = reference(image, name)
+    expected = ((expected - expected.min()) / (expected.max() - expected.min()) * 255).astype(np.uint8)
+    assert plane.dtype == np.uint8
+    assert np.abs(plane.astype(int) - expected).max() <= 1
+
+
+def test_fixed_quantization_is_comparable_across_images(image):
+    engine = IndexEngine()
+    whole = engine.compute(image, ('exg',), quantize='fixed')['exg']
+    part = engine.compute(image[:10].copy(), ('exg',), quantize='fixed')['exg']
+    assert np.array_equal(part, whole[:10])
+
+
+def test_value_range_over_a_mask(image):
+    engine = IndexEngine()
+    engine.load(image)
+    mask = np.zeros(image.shape[:2], dtype=bool)
+    mask[5:10, 5:10] = True
+    low, high = engine.value_range('exg', mask)
+    region = reference(image, 'exg')[5:10, 5:10]
+    assert (low, high) == (region.min(), region.max())
+
+
+def test_buffers_are_borrowed_from_the_scope(image):
+    pool = BufferPool()
+    with pool.scope() as scope:
+        IndexEngine(scope).compute(image, INDICES)
+        assert pool.metrics()['in_use_bytes'] > 0
+    metrics = pool.metrics()
+    assert metrics['in_use_bytes'] == 0 and metrics['pooled_bytes'] > 0
+
+
+def test_flat_image_and_unknown_names(image):
+    flat = np.full((4, 4, 3), 100, dtype=np.uint8)
+    assert not index_planes(flat)['exg'].any()
+    engine = IndexEngine()
+    engine.load(image)
+    with pytest.raises(ValueError):
+        engine.raw('ndvi')
+    with pytest.raises(ValueError):
+        engine.quantized('exg', quantize='log')
@@ -0,0 +1,85 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from app import app, db, job_queue
+from app.models import Assessment
+from app.utils.integrity import DEFAULT_BATCH_SIZE, DEFAULT_WORKERS, Checkpoint, Verifier
+from app.utils.jobs import JOB_DONE, PENDING_STATES, mark_queued
+
+
+def requeue(assessment_ids):
+    """Queue reprocessing of the assessments and wait for the jobs to finish; returns (done, failed)."""
+    queued = []
+    for assessment_id in assessment_ids:
+        assessment = db.session.get(Assessment, assessment_id)
+        if assessment is None or (assessment.job or {}).get('status') in PENDING_STATES:
+            continue
+        mark_queued(assessment)
+        queued.append(assessment_id)
+    db.session.commit()
+    for assessment_id in queued:
+        job_queue.submit(assessment_id)
+    while True:
+        db.session.expire_all()
+        states = [(db.session.get(Assessment, i).job or {}).get('status') for i in queued]
+        if not any(state in PENDING_STATES for state in states):
+            break
+        job_queue.wait(5)
+    failed = sum(1 for state in states if state != JOB_DONE)
+    return len(queued) - failed, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that stored files match the database, and optionally repair')
+    parser.add_argument('--checkpoint', default=os.path.join(app.instance_path, 'verify_checkpoint.json'),
+                        help='Progress file; an interrupted pass resumes from it')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start a new pass')
+    parser.add_argument('--hash', action='store_true', help='Also compare SHA-256 of files with a recorded hash')
+    parser.add_argument('--decode', action='store_true', help='Decode every image instead of reading headers')
+    parser.add_argument('--repair', action='store_true',
+                        help='Reprocess assessments whose results are missing, stale or damaged')
+    parser.add_argument('--report', help='Also write every issue as a JSON line to this file')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows read per query')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Threads checking files')
+    args = parser.parse_args()
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    report_file = open(args.report, 'a') if args.report else None
+
+    def report(issue):
+        where = f" (assessment {issue['assessment_id']})" if issue['assessment_id'] else ''
+        detail = f": {issue['detail']}" if issue['detail'] else ''
+        print(f"  - {issue['kind']}{where} {issue['path'] or ''}{detail}")
+        if report_file:
+            report_file.write(json.dumps(issue) + '\n')
+
+    with app.app_context():
+        db.create_all()
+        checkpoint = Checkpoint.load(args.checkpoint)
+        if checkpoint.state['phase'] == 'done':
+            print("The last pass is complete; use --restart for a new one")
+        elif checkpoint.state['last_id'] or checkpoint.state['phase'] != 'artifacts':
+            print(f"Resuming at {checkpoint.state['phase']} after id {checkpoint.state['last_id']}")
+
+        started = time.monotonic()
+        state = Verifier(checkpoint, report, batch_size=args.batch_size, workers=args.workers,
+                         verify_hash=args.hash, decode=args.decode).run()
+        if report_file:
+            report_file.close()
+        print(f"Checked in {time.monotonic() - started:.1f}s")
+        for kind, count in sorted(state['counts'].items()):
+            print(f"  {kind}: {count}")
+        print(f"Repairable assessments: {len(state['repair'])}")
+
+        if args.repair and state['repair']:
+            done, failed = requeue(state['repair'])
+            print(f"Reprocessed {done} assessments ({failed} failed)")
+    sys.exit(1 if state['counts'] else 0)
+
+
+if __name__ == "__main__":
+    main()